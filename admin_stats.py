@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+System-wide numbers for the operators' dashboard (/admin/stats).
+
+Everything on the dashboard comes from aggregate queries over whole tables
+(entries per day, signups, the users with the longest histories, database
+page counts), too slow to run on a page view once there are many users. A
+background job (jobs.py) runs them every ADMIN_STATS_INTERVAL seconds and
+stores the snapshot as its result; the page only reads the newest snapshot
+back from the job table, which holds nothing but unexpired jobs. A snapshot
+lives as long as any job result (JOB_RESULT_TTL_SECONDS), so keep the
+interval shorter than that.
+
+With sharding, each shard is queried in turn and the numbers added up:
+users live on one shard each, so distinct-user counts add up too.
+
+To print a snapshot without the job queue:
+
+Usage: python admin_stats.py [--days 30] [--top 10]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import case, distinct, func, select, text
+from sqlalchemy.exc import OperationalError
+
+import jobs
+import sharding
+from models import db, EntryYearBlob, Job, MoodEntry, User
+
+ADMIN_STATS_JOB = 'admin_stats'
+# Tables listed per database, largest first.
+TOP_TABLES = 8
+
+jobs.every(ADMIN_STATS_JOB, 'ADMIN_STATS_INTERVAL')
+
+
+def _day(value):
+    # date() comes back as a string from SQLite and a date from Postgres.
+    return value if isinstance(value, str) else value.isoformat()
+
+
+def _entry_counts(today, days):
+    """Entries and distinct writers per entry date over the last `days` days, and active-user counts."""
+    first = today - timedelta(days=days - 1)
+    per_day = {}
+    active = {'active_today': 0, 'active_week': 0, 'active_period': 0}
+    total = 0
+    for shard in sharding.shards():
+        with sharding.use_shard(shard):
+            total += db.session.execute(select(func.count()).select_from(MoodEntry)).scalar()
+            rows = db.session.execute(
+                select(MoodEntry.entry_date, func.count(), func.count(distinct(MoodEntry.user_id)))
+                .where(MoodEntry.entry_date.between(first, today))
+                .group_by(MoodEntry.entry_date))
+            for entry_date, entries, users in rows:
+                counts = per_day.setdefault(entry_date, [0, 0])
+                counts[0] += entries
+                counts[1] += users
+            row = db.session.execute(
+                select(*(func.count(distinct(case((MoodEntry.entry_date >= today - timedelta(days=window - 1),
+                                                   MoodEntry.user_id))))
+                         for window in (1, 7, days)))
+                .where(MoodEntry.entry_date.between(first, today))).one()
+            for name, count in zip(active, row):
+                active[name] += count
+    entries_per_day = []
+    for offset in range(days):
+        day = first + timedelta(days=offset)
+        entries, users = per_day.get(day, (0, 0))
+        entries_per_day.append({'date': day.isoformat(), 'entries': entries, 'users': users})
+    return total, entries_per_day, active
+
+
+def _signups(today, days):
+    """Users in all, and signups per day over the last `days` days."""
+    first = today - timedelta(days=days - 1)
+    total = db.session.execute(select(func.count()).select_from(User)).scalar()
+    per_day = {_day(day): count for day, count in db.session.execute(
+        select(func.date(User.created_at), func.count())
+        .where(User.created_at >= datetime.combine(first, datetime.min.time()))
+        .group_by(func.date(User.created_at)))}
+    return total, [{'date': (first + timedelta(days=offset)).isoformat(),
+                    'signups': per_day.get((first + timedelta(days=offset)).isoformat(), 0)}
+                   for offset in range(days)]
+
+
+def _heaviest_users(top):
+    """The `top` users with the most entries: their history size, span and packed-history bytes."""
+    heaviest = []
+    for shard in sharding.shards():
+        with sharding.use_shard(shard):
+            rows = db.session.execute(
+                select(MoodEntry.user_id, func.count().label('entries'),
+                       func.min(MoodEntry.entry_date), func.max(MoodEntry.entry_date))
+                .group_by(MoodEntry.user_id).order_by(func.count().desc()).limit(top)).all()
+            packed = dict(db.session.execute(
+                select(EntryYearBlob.user_id, func.sum(func.length(EntryYearBlob.data)))
+                .where(EntryYearBlob.user_id.in_([row.user_id for row in rows]))
+                .group_by(EntryYearBlob.user_id)).all()) if rows else {}
+            heaviest.extend({
+                'user_id': user_id, 'entries': entries, 'first': first.isoformat(), 'last': last.isoformat(),
+                'years': round((last - first).days / 365.25, 1), 'packed_bytes': packed.get(user_id, 0),
+                'shard': shard,
+            } for user_id, entries, first, last in rows)
+    heaviest = sorted(heaviest, key=lambda user: (-user['entries'], user['user_id']))[:top]
+    names = dict(db.session.execute(
+        select(User.id, User.username).where(User.id.in_([user['user_id'] for user in heaviest]))).all())
+    for user in heaviest:
+        user['username'] = names.get(user['user_id'])
+    return heaviest
+
+
+def _database(name, engine):
+    """Size and page statistics of one database."""
+    stats = {'name': name, 'dialect': engine.dialect.name}
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            page_size = conn.execute(text('PRAGMA page_size')).scalar()
+            page_count = conn.execute(text('PRAGMA page_count')).scalar()
+            freelist = conn.execute(text('PRAGMA freelist_count')).scalar()
+            stats.update(page_size=page_size, page_count=page_count, freelist_count=freelist,
+                         bytes=page_size * page_count, free_bytes=page_size * freelist)
+            path = engine.url.database
+            if path and path != ':memory:' and os.path.exists(f'{path}-wal'):
+                stats['wal_bytes'] = os.path.getsize(f'{path}-wal')
+            try:
+                stats['tables'] = [{'name': table, 'bytes': size} for table, size in conn.execute(text(
+                    "SELECT name, sum(pgsize) AS size FROM dbstat GROUP BY name ORDER BY size DESC LIMIT :top"),
+                    {'top': TOP_TABLES})]
+            except OperationalError:
+                stats['tables'] = []  # SQLite built without the dbstat table
+        elif engine.dialect.name == 'postgresql':
+            stats['bytes'] = conn.execute(text('SELECT pg_database_size(current_database())')).scalar()
+            stats['tables'] = [{'name': table, 'bytes': size} for table, size in conn.execute(text(
+                "SELECT relname, pg_total_relation_size(relid) AS size FROM pg_statio_user_tables "
+                "ORDER BY size DESC LIMIT :top"), {'top': TOP_TABLES})]
+    return stats
+
+
+def _databases():
+    names = {None: 'main'}
+    names.update({sharding.bind_key(shard): f'shard {shard}' for shard in sharding.shards() if shard is not None})
+    # The main database first, then the other binds by name.
+    return [_database(names.get(key, key), engine)
+            for key, engine in sorted(db.engines.items(), key=lambda item: (item[0] is not None, str(item[0])))]
+
+
+def collect(days=None, top=None, today=None):
+    """Compute a snapshot of the system-wide numbers (a JSON-serialisable dict)."""
+    config = current_app.config
+    days = days or config['ADMIN_STATS_DAYS']
+    top = top or config['ADMIN_STATS_TOP_USERS']
+    today = today or date.today()
+    started = time.perf_counter()
+    entries, entries_per_day, active = _entry_counts(today, days)
+    users, signups_per_day = _signups(today, days)
+    snapshot = {
+        'computed_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'days': days,
+        'users': dict(total=users, signups=sum(day['signups'] for day in signups_per_day), **active),
+        'entries': {'total': entries, 'recent': sum(day['entries'] for day in entries_per_day)},
+        'entries_per_day': entries_per_day,
+        'signups_per_day': signups_per_day,
+        'heaviest_users': _heaviest_users(top),
+        'databases': _databases(),
+    }
+    snapshot['seconds'] = round(time.perf_counter() - started, 3)
+    return snapshot
+
+
+@jobs.handler(ADMIN_STATS_JOB)
+def admin_stats_job(job):
+    return json.dumps(collect())
+
+
+def latest():
+    """The newest snapshot a job stored, or None if there isn't one yet."""
+    result = db.session.execute(
+        select(Job.result).where(Job.status == jobs.SUCCEEDED, Job.kind == ADMIN_STATS_JOB)
+        .order_by(Job.id.desc()).limit(1)).scalar()
+    return json.loads(result) if result else None
+
+
+def refresh():
+    """Queue a snapshot ahead of the timer (at most one per minute). Returns the job. The caller commits."""
+    return jobs.enqueue(ADMIN_STATS_JOB, key=f'{ADMIN_STATS_JOB}:refresh:{int(time.time() // 60)}',
+                        priority=jobs.PRIORITY_INTERACTIVE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the system-wide numbers the admin dashboard shows")
+    parser.add_argument('--days', type=int, help="Days of entries and signups (default ADMIN_STATS_DAYS)")
+    parser.add_argument('--top', type=int, help="Heaviest users listed (default ADMIN_STATS_TOP_USERS)")
+    args = parser.parse_args()
+
+    from app import create_app
+
+    app = create_app({'JOB_WORKER_THREADS': 0})
+    with app.app_context():
+        print(json.dumps(collect(args.days, args.top), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
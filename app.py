@@ -1,99 +1,150 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, abort
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, Response, current_app, render_template, request, redirect, url_for, jsonify, flash, abort
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
 from datetime import datetime, date
-from plotly.utils import PlotlyJSONEncoder
-import plotly.graph_objects as go
+from functools import wraps
+import hmac
+import logging
+import threading
+import weakref
 import json
 import os
-import logging
-from logging.handlers import RotatingFileHandler
-import sys
+from logging_setup import setup_logging
+from models import db, User, Medication, MoodEntry, MoodEntryMedication
+import admin_stats
+import archive
+import changelog
+import entry_store
+import entry_stats
+import heatmap
+import history
+import idempotency
+import jobs
+import sync
+import request_logging
+import metrics
+import profiling
+import ratelimit
+import replicas
+import search
+import sharding
+import slow_queries
 
 # Import configuration
 try:
-    from config import *
+    import config as default_config
 except ImportError:
-    # Fallback configuration if config.py doesn't exist
-    BETA_CODE = "moodtracker2024"
-    SECRET_KEY = 'your-secret-key-here'
-    DATABASE_URI = 'sqlite:///mood_tracker.db'
-    MIN_PASSWORD_LENGTH = 6
-
-# Create logs directory if it doesn't exist
-if not os.path.exists('logs'):
-    os.makedirs('logs')
-
-# Configure logging
-def setup_logging():
-    """Setup logging configuration"""
-    # Create formatters
-    file_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    console_formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s'
-    )
-    
-    # Setup file handler with rotation
-    file_handler = RotatingFileHandler(
-        'logs/mood_tracker.log', 
-        maxBytes=10240000,  # 10MB
-        backupCount=5
-    )
-    file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(file_formatter)
-    
-    # Setup console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(console_formatter)
-    
-    # Setup error file handler
-    error_handler = RotatingFileHandler(
-        'logs/errors.log',
-        maxBytes=10240000,  # 10MB
-        backupCount=5
-    )
-    error_handler.setLevel(logging.ERROR)
-    error_handler.setFormatter(file_formatter)
-    
-    # Configure root logger
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
-    root_logger.addHandler(error_handler)
-    
-    # Create application logger
-    app_logger = logging.getLogger('mood_tracker')
-    app_logger.setLevel(logging.INFO)
-    
-    return app_logger
+    default_config = None
 
-# Setup logging
-logger = setup_logging()
+# Used for any setting config.py doesn't define (or if it doesn't exist)
+FALLBACK_SETTINGS = {
+    'BETA_CODE': "moodtracker2024",
+    'SECRET_KEY': 'your-secret-key-here',
+    'DATABASE_URI': 'sqlite:///mood_tracker.db',
+    'MIN_PASSWORD_LENGTH': 6,
+    'API_MAX_BATCH_SIZE': 366,
+    'IDEMPOTENCY_KEY_TTL_HOURS': 24,
+    'SYNC_PAGE_SIZE': 500,
+    'SEARCH_PAGE_SIZE': 50,
+    'HEATMAP_CACHE_SIZE': 1024,
+    'ANOMALY_Z_THRESHOLD': 2.0,
+    'ANOMALY_MIN_ENTRIES': 14,
+    'CHANGELOG_RETENTION_DAYS': 90,
+    'LOG_DIR': 'logs',
+    'LOG_QUEUE_SIZE': 10000,
+    'LOG_OVERFLOW_POLICY': 'drop_new',
+    'LOG_CONSOLE': True,
+    'LOG_ROTATION': 'size',
+    'REQUEST_LOG_ENABLED': True,
+    'REQUEST_LOG_SAMPLE_RATE': 1.0,
+    'ADMIN_USERNAMES': [],
+    'METRICS_ENABLED': True,
+    'METRICS_DIR': 'logs/metrics',
+    'METRICS_FLUSH_INTERVAL': 5.0,
+    'METRICS_TOKEN': None,
+    'PROFILE_ENABLED': True,
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'PROFILE_DIR': 'logs/profiles',
+    'PROFILE_MAX_FILES': 200,
+    'PROFILE_RETENTION_DAYS': 7,
+    'SLOW_QUERY_ENABLED': True,
+    'SLOW_QUERY_THRESHOLD_MS': 100,
+    'SLOW_QUERY_CAPTURE_PLANS': True,
+    'CREATE_TABLES': True,
+    'PREWARM_PLOTLY': True,
+    'COLUMNAR_HISTORY': False,
+    'SHARD_COUNT': 1,
+    'SHARD_URI_TEMPLATE': 'sqlite:///mood_tracker_shard{shard}.db',
+    'REPLICA_DATABASE_URI': None,
+    'REPLICA_MAX_LAG_SECONDS': 10.0,
+    'REPLICA_LAG_CHECK_INTERVAL': 1.0,
+    'REPLICA_SYNC_INTERVAL': 2.0,
+    'JOB_WORKER_THREADS': 1,
+    'JOB_POLL_INTERVAL': 1.0,
+    'JOB_LEASE_SECONDS': 60,
+    'JOB_MAX_ATTEMPTS': 3,
+    'JOB_RESULT_TTL_SECONDS': 3600,
+    'ADMIN_STATS_INTERVAL': 300,
+    'ADMIN_STATS_DAYS': 30,
+    'ADMIN_STATS_TOP_USERS': 10,
+    'ARCHIVE_AFTER_DAYS': 0,
+    'ARCHIVE_INTERVAL': 86400,
+    'RATE_LIMIT_WINDOW': 300,
+    'LOGIN_LIMIT_PER_IP': 30,
+    'LOGIN_LIMIT_PER_USERNAME': 10,
+    'REGISTER_LIMIT_PER_IP': 10,
+    'RATE_LIMIT_MAX_KEYS': 100000,
+    'RATE_LIMIT_STORE': 'memory',
+    'TRUSTED_PROXY_HOPS': 0,
+}
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
-app.secret_key = SECRET_KEY
-db = SQLAlchemy(app)
+logger = logging.getLogger('mood_tracker')
 
-# Log application startup
-logger.info("Mood Tracker application starting up...")
-logger.info(f"Database URI: {DATABASE_URI}")
-
-# Initialize Flask-Login
+# Initialize Flask-Login (bound to each app in create_app)
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
 login_manager.login_message_category = 'warning'
 
+# Views declared with @route are registered on every app create_app() builds.
+# Endpoint names are the function names, exactly as with @app.route.
+_views = []
+
+# Apps built in this process, so a forked worker can drop their connection pools.
+_apps = weakref.WeakSet()
+
+def route(rule, **options):
+    """Declare a view; used like @app.route."""
+    def decorator(view):
+        _views.append((rule, view, options))
+        return view
+    return decorator
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user = User.query.get(int(user_id))
+    if user is not None:
+        # Every request that reads user data loads the user first.
+        sharding.bind_user(user.id)
+    return user
+
+def is_admin(user):
+    """Check whether a user may access operator-only pages."""
+    return user.is_authenticated and user.username in current_app.config['ADMIN_USERNAMES']
+
+def admin_required(view):
+    """Restrict a view to users listed in ADMIN_USERNAMES."""
+    @wraps(view)
+    @login_required
+    def wrapped(*args, **kwargs):
+        if not is_admin(current_user):
+            logger.warning("Admin-only page %s denied for user: %s", request.path, current_user.username)
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapped
 
 # Notification settings file
 NOTIFICATION_SETTINGS_FILE = 'notification_settings.json'
@@ -128,66 +179,137 @@ class NotificationSettings:
     def save(self):
         save_notification_settings(self.settings)
 
-# Global notification settings instance
-notification_settings = NotificationSettings()
+def get_notification_settings():
+    """The notification settings shared by the current app's requests."""
+    return current_app.extensions['notification_settings']
 
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(200), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    is_active = db.Column(db.Boolean, default=True)
-    
-    # Relationship to mood entries
-    mood_entries = db.relationship('MoodEntry', backref='user', lazy=True, cascade='all, delete-orphan')
-    
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-    
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-
-class Medication(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), unique=True, nullable=False)
-    active = db.Column(db.Boolean, default=True)  # For soft delete
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    user = db.relationship('User', backref='medications')
-    
-class MoodEntryMedication(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    mood_entry_id = db.Column(db.Integer, db.ForeignKey('mood_entry.id'), nullable=False)
-    medication_id = db.Column(db.Integer, db.ForeignKey('medication.id'), nullable=False)
-    taken = db.Column(db.Boolean, default=False)
-    
-    medication = db.relationship('Medication')
-
-class MoodEntry(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    entry_date = db.Column(db.Date, nullable=False)
-    mood_level = db.Column(db.Integer, nullable=False)
-    hours_slept = db.Column(db.Float, nullable=False)
-    anxiety = db.Column(db.Integer, nullable=False)
-    energy_level = db.Column(db.Integer, nullable=False)
-    irritability = db.Column(db.Integer, nullable=False)
-    alcohol_drugs = db.Column(db.Boolean, default=False)
-    exercise = db.Column(db.Boolean, default=False)
-    menstruation = db.Column(db.Boolean, default=False)
-    stressful_event = db.Column(db.Boolean, default=False)
-    weight = db.Column(db.Float)  # Optional weight field
-    notes = db.Column(db.Text)
-    medications = db.relationship('MoodEntryMedication', backref='mood_entry', cascade='all, delete-orphan')
-    
-    # Add unique constraint for user_id and entry_date combination
-    __table_args__ = (db.UniqueConstraint('user_id', 'entry_date', name='_user_date_uc'),)
+def create_app(config=None):
+    """
+    Build a configured Mood Tracker app.
+    Settings come from config.py, then from the optional config mapping.
+    Nothing touches the database or log files until this is called.
+    """
+    app = Flask(__name__)
+    app.config.from_mapping(FALLBACK_SETTINGS)
+    if default_config is not None:
+        app.config.from_object(default_config)
+    if config:
+        app.config.update(config)
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', app.config['DATABASE_URI'])
+    app.secret_key = app.config['SECRET_KEY']
+    if app.config['TRUSTED_PROXY_HOPS']:
+        # request.remote_addr (and the rate limits keyed on it) becomes the client's address.
+        hops = app.config['TRUSTED_PROXY_HOPS']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
 
-with app.app_context():
-    db.create_all()
+    setup_logging(app.config['LOG_DIR'], app.config['LOG_QUEUE_SIZE'],
+                  app.config['LOG_OVERFLOW_POLICY'], app.config['LOG_CONSOLE'],
+                  app.config['LOG_ROTATION'])
+    sharding.configure(app)
+    replicas.configure(app)
+    db.init_app(app)
+    login_manager.init_app(app)
+    request_logging.init_app(app)
+    metrics.init_app(app, db)
+    slow_queries.init_app(app)
+    profiling.init_app(app, is_admin)
+    ratelimit.init_app(app)
+    for rule, view, options in _views:
+        app.add_url_rule(rule, view_func=view, **options)
 
-@app.route('/register', methods=['GET', 'POST'])
+    for hook in STARTUP_HOOKS:
+        hook(app)
+    _apps.add(app)
+    return app
+
+def create_tables(app):
+    """Startup hook: create missing tables (skipped when CREATE_TABLES is off)."""
+    if app.config['CREATE_TABLES']:
+        with app.app_context():
+            if sharding.is_sharded(app):
+                sharding.create_all(app)
+            else:
+                # Only the default bind: shard binds other apps registered are not this app's.
+                db.create_all(bind_key=None)
+            for engine in search.engines(app):
+                search.install(engine)
+                # create_all() leaves existing tables alone; add indexes declared on them since.
+                for index in MoodEntryMedication.__table__.indexes:
+                    index.create(engine, checkfirst=True)
+            for shard in sharding.shards():
+                with sharding.use_shard(shard):
+                    changelog.backfill()
+            db.session.commit()
+
+def load_settings(app):
+    """Startup hook: load the notification settings once per app."""
+    app.extensions['notification_settings'] = NotificationSettings()
+
+def log_startup(app):
+    """Startup hook: record which database this app uses."""
+    logger.info("Mood Tracker application starting up...")
+    logger.info("Database URI: %s", app.config['SQLALCHEMY_DATABASE_URI'])
+
+def start_prewarm(app):
+    """
+    Startup hook: load plotly in a background thread once the app has served
+    its first request, so the first /visualize doesn't pay for it.
+    """
+    if not app.config['PREWARM_PLOTLY']:
+        return
+    started = {'pid': None}
+
+    @app.before_request
+    def prewarm_after_first_request():
+        # Checked per pid: each forked worker warms its own copy.
+        if started['pid'] == os.getpid():
+            return
+        started['pid'] = os.getpid()
+        threading.Thread(target=prewarm_plotly, name='prewarm-plotly', daemon=True).start()
+
+def start_job_workers(app):
+    """
+    Startup hook: run JOB_WORKER_THREADS background job threads in each
+    process that serves requests (started on its first request, so forked
+    workers get their own).
+    """
+    threads = app.config['JOB_WORKER_THREADS']
+    if not threads:
+        return
+    started = {'pid': None}
+
+    @app.before_request
+    def start_job_workers_in_this_process():
+        if started['pid'] == os.getpid():
+            return
+        started['pid'] = os.getpid()
+        app.extensions['job_workers'] = jobs.WorkerPool(app, threads).start()
+
+# Run in order by create_app() once the app is fully configured.
+STARTUP_HOOKS = [create_tables, load_settings, log_startup, start_prewarm, start_job_workers]
+
+def dispose_engines_after_fork():
+    """
+    Drop connection pools inherited from the parent process.
+    Forked WSGI workers (gunicorn --preload) must not share the parent's
+    SQLite connections; close=False leaves the parent's connections alone.
+    """
+    for app in list(_apps):
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=dispose_engines_after_fork)
+
+def too_many_attempts(template, wait, **context):
+    """The form again with a 429 once a rate limit (ratelimit.py) refuses an attempt."""
+    flash(f'Too many attempts. Please try again in {wait} seconds.', 'error')
+    return render_template(template, **context), 429, {'Retry-After': str(wait)}
+
+@route('/register', methods=['GET', 'POST'])
 def register():
+    min_password_length = current_app.config['MIN_PASSWORD_LENGTH']
     if request.method == 'POST':
         username = request.form['username']
         email = request.form['email']
@@ -195,102 +317,117 @@ def register():
         confirm_password = request.form['confirm_password']
         beta_code = request.form['beta_code']
         
-        logger.info(f"Registration attempt for username: {username}, email: {email}")
+        logger.info("Registration attempt for username: %s, email: %s", username, email)
+        
+        wait = ratelimit.attempt(ratelimit.REGISTER_IP, request.remote_addr)
+        if wait:
+            logger.warning("Registration refused - too many attempts from %s", request.remote_addr)
+            return too_many_attempts('register.html', wait, min_password_length=min_password_length)
         
         # Validation
         if not username or not email or not password:
-            logger.warning(f"Registration failed - missing required fields for username: {username}")
+            logger.warning("Registration failed - missing required fields for username: %s", username)
             flash('All fields are required.', 'error')
-            return render_template('register.html', min_password_length=MIN_PASSWORD_LENGTH)
+            return render_template('register.html', min_password_length=min_password_length)
         
         if password != confirm_password:
-            logger.warning(f"Registration failed - password mismatch for username: {username}")
+            logger.warning("Registration failed - password mismatch for username: %s", username)
             flash('Passwords do not match.', 'error')
-            return render_template('register.html', min_password_length=MIN_PASSWORD_LENGTH)
+            return render_template('register.html', min_password_length=min_password_length)
         
-        if len(password) < MIN_PASSWORD_LENGTH:
-            logger.warning(f"Registration failed - password too short for username: {username}")
-            flash(f'Password must be at least {MIN_PASSWORD_LENGTH} characters long.', 'error')
-            return render_template('register.html', min_password_length=MIN_PASSWORD_LENGTH)
+        if len(password) < min_password_length:
+            logger.warning("Registration failed - password too short for username: %s", username)
+            flash(f'Password must be at least {min_password_length} characters long.', 'error')
+            return render_template('register.html', min_password_length=min_password_length)
         
         # Check if user already exists
         if User.query.filter_by(username=username).first():
-            logger.warning(f"Registration failed - username already exists: {username}")
+            logger.warning("Registration failed - username already exists: %s", username)
             flash('Username already exists.', 'error')
-            return render_template('register.html', min_password_length=MIN_PASSWORD_LENGTH)
+            return render_template('register.html', min_password_length=min_password_length)
         
         if User.query.filter_by(email=email).first():
-            logger.warning(f"Registration failed - email already registered: {email}")
+            logger.warning("Registration failed - email already registered: %s", email)
             flash('Email already registered.', 'error')
-            return render_template('register.html', min_password_length=MIN_PASSWORD_LENGTH)
+            return render_template('register.html', min_password_length=min_password_length)
         
         # Check beta code
-        if beta_code != BETA_CODE:
-            logger.warning(f"Registration failed - invalid beta code for username: {username}, provided code: {beta_code}")
+        if beta_code != current_app.config['BETA_CODE']:
+            logger.warning("Registration failed - invalid beta code for username: %s, provided code: %s", username, beta_code)
             flash('Invalid beta code.', 'error')
-            return render_template('register.html', min_password_length=MIN_PASSWORD_LENGTH)
+            return render_template('register.html', min_password_length=min_password_length)
         
         # Create new user
         try:
             user = User(username=username, email=email)
             user.set_password(password)
             db.session.add(user)
+            db.session.flush()
+            sharding.assign_shard(user.id)
             db.session.commit()
             
-            logger.info(f"User registration successful - username: {username}, email: {email}, user_id: {user.id}")
+            logger.info("User registration successful - username: %s, email: %s, user_id: %s", username, email, user.id)
             flash('Registration successful! Please log in.', 'success')
             return redirect(url_for('login'))
         except Exception as e:
-            logger.error(f"Registration failed - database error for username: {username}, error: {str(e)}")
+            logger.error("Registration failed - database error for username: %s, error: %s", username, e)
             db.session.rollback()
             flash('Registration failed. Please try again.', 'error')
-            return render_template('register.html', min_password_length=MIN_PASSWORD_LENGTH)
+            return render_template('register.html', min_password_length=min_password_length)
     
     logger.info("Registration page accessed")
-    return render_template('register.html', min_password_length=MIN_PASSWORD_LENGTH)
+    return render_template('register.html', min_password_length=min_password_length)
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        logger.info(f"User already logged in, redirecting: {current_user.username}")
+        logger.info("User already logged in, redirecting: %s", current_user.username)
         return redirect(url_for('index'))
     
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         
-        logger.info(f"Login attempt for username: {username}")
+        logger.info("Login attempt for username: %s", username)
+        
+        # Checked before the user lookup and the password hash they protect.
+        wait = (ratelimit.attempt(ratelimit.LOGIN_IP, request.remote_addr)
+                or ratelimit.retry_after(ratelimit.LOGIN_USERNAME, username))
+        if wait:
+            logger.warning("Login refused - too many attempts for username: %s from %s", username, request.remote_addr)
+            return too_many_attempts('login.html', wait)
         
         user = User.query.filter_by(username=username).first()
         
         if user and user.check_password(password):
             login_user(user)
-            logger.info(f"Login successful - username: {username}, user_id: {user.id}")
+            logger.info("Login successful - username: %s, user_id: %s", username, user.id)
             flash('Logged in successfully!', 'success')
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('index'))
         else:
-            logger.warning(f"Login failed - invalid credentials for username: {username}")
+            logger.warning("Login failed - invalid credentials for username: %s", username)
+            ratelimit.attempt(ratelimit.LOGIN_USERNAME, username)
             flash('Invalid username or password.', 'error')
     
     logger.info("Login page accessed")
     return render_template('login.html')
 
-@app.route('/logout')
+@route('/logout')
 @login_required
 def logout():
     username = current_user.username
     user_id = current_user.id
     logout_user()
-    logger.info(f"User logged out - username: {username}, user_id: {user_id}")
+    logger.info("User logged out - username: %s, user_id: %s", username, user_id)
     flash('You have been logged out.', 'info')
     return redirect(url_for('login'))
 
-@app.route('/')
+@route('/')
 @login_required
 def index():
     """Main page with mood entry form."""
-    logger.info(f"Index page accessed by user: {current_user.username}")
+    logger.info("Index page accessed by user: %s", current_user.username)
     today_date = datetime.now().strftime('%Y-%m-%d')
     medications = Medication.query.filter_by(active=True, user_id=current_user.id).all()
     settings = NotificationSettings()
@@ -316,67 +453,54 @@ def index():
                          gender=gender,
                          weight_needed=weight_needed)
 
-@app.route('/submit', methods=['POST'])
+@route('/submit', methods=['POST'])
 @login_required
 def submit_entry():
-    logger.info(f"Mood entry submission attempt by user: {current_user.username}")
+    # Read before the commit expires current_user, which would cost another SELECT to log it.
+    username = current_user.username
+    logger.info("Mood entry submission attempt by user: %s", username)
     data = request.form
     entry_date = datetime.strptime(data['date'], '%Y-%m-%d').date()
     today = datetime.now().date()
     
     # Check if entry is for a future date
     if entry_date > today:
-        logger.warning(f"Future date entry attempt by user: {current_user.username}, date: {entry_date}")
+        logger.warning("Future date entry attempt by user: %s, date: %s", current_user.username, entry_date)
         flash('Cannot create entries for future dates. Please select today\'s date or a past date.', 'warning')
         return redirect(url_for('index'))
-    
-    # Check if entry already exists for this date for this user
-    existing_entry = MoodEntry.query.filter_by(entry_date=entry_date, user_id=current_user.id).first()
-    if existing_entry:
-        logger.warning(f"Duplicate entry attempt by user: {current_user.username}, date: {entry_date}")
-        flash('An entry already exists for this date. Please edit the existing entry instead.', 'warning')
-        return redirect(url_for('manage_entries'))
+
+    # Out-of-range levels are refused here rather than failing the write
+    try:
+        values = entry_store.entry_values_from_form(data)
+    except ValueError as e:
+        logger.warning("Invalid entry from user: %s, %s", username, e)
+        flash(f'Invalid entry: {e}.', 'warning')
+        return redirect(url_for('index'))
     
     try:
-        new_entry = MoodEntry(
-            user_id=current_user.id,
-            entry_date=entry_date,
-            mood_level=int(data['mood']),
-            hours_slept=float(data['hours_slept']),
-            anxiety=int(data['anxiety']),
-            energy_level=int(data['energy']),
-            irritability=int(data['irritability']),
-            alcohol_drugs=data.get('alcohol_drugs') == 'on',
-            exercise=data.get('exercise') == 'on',
-            menstruation=data.get('menstruation') == 'on',
-            stressful_event=data.get('stressful_event') == 'on',
-            weight=float(data['weight']) if data.get('weight') else None,
-            notes=data.get('notes', '')
-        )
-        db.session.add(new_entry)
-        db.session.flush()  # Get new_entry.id before commit
-
-        # Save medications taken
-        taken_ids = data.getlist('medications_taken')
-        for med in Medication.query.filter(Medication.id.in_(taken_ids), Medication.user_id == current_user.id).all():
-            mem = MoodEntryMedication(mood_entry_id=new_entry.id, medication_id=med.id, taken=True)
-            db.session.add(mem)
-        
+        outcome, entry_id = entry_store.save_entry(
+            current_user.id, entry_date, values, data.getlist('medications_taken'), mode='insert')
+        if outcome == entry_store.EXISTS:
+            logger.warning("Duplicate entry attempt by user: %s, date: %s", current_user.username, entry_date)
+            flash('An entry already exists for this date. Please edit the existing entry instead.', 'warning')
+            return redirect(url_for('manage_entries'))
+
         db.session.commit()
-        logger.info(f"Mood entry created successfully - user: {current_user.username}, entry_id: {new_entry.id}, date: {entry_date}")
+        logger.info("Mood entry created successfully - user: %s, entry_id: %s, date: %s", username, entry_id, entry_date)
         flash('Entry added successfully!', 'success')
         return redirect(url_for('index'))
     except Exception as e:
-        logger.error(f"Mood entry creation failed - user: {current_user.username}, error: {str(e)}")
+        logger.error("Mood entry creation failed - user: %s, error: %s", username, e)
         db.session.rollback()
         flash('Failed to create entry. Please try again.', 'error')
         return redirect(url_for('index'))
 
-@app.route('/manage')
+@route('/manage')
 @login_required
+@replicas.read_only
 def manage_entries():
     """Manage existing entries."""
-    logger.info(f"Manage entries page accessed by user: {current_user.username}")
+    logger.info("Manage entries page accessed by user: %s", current_user.username)
     entries = MoodEntry.query.filter_by(user_id=current_user.id).order_by(MoodEntry.entry_date.desc()).all()
     medications = Medication.query.filter_by(active=True, user_id=current_user.id).order_by(Medication.name).all()
     today_date = datetime.now().strftime('%Y-%m-%d')
@@ -385,16 +509,18 @@ def manage_entries():
     gender = settings.get('gender', 'female')
     return render_template('manage.html', 
                          entries=entries, 
+                         archived_months=archive.summary(current_user.id),
+                         unusual=entry_stats.flagged_days(current_user.id),
                          medications=medications, 
                          today_date=today_date,
                          edit_medication_id=edit_medication_id,
                          gender=gender)
 
-@app.route('/edit/<int:entry_id>', methods=['POST'])
+@route('/edit/<int:entry_id>', methods=['POST'])
 @login_required
 def edit_entry(entry_id):
-    logger.info(f"Entry edit attempt by user: {current_user.username}, entry_id: {entry_id}")
-    entry = MoodEntry.query.filter_by(id=entry_id, user_id=current_user.id).first_or_404()
+    username = current_user.username  # As in submit_entry(): read before the commit
+    logger.info("Entry edit attempt by user: %s, entry_id: %s", username, entry_id)
     data = request.form
     
     new_date = datetime.strptime(data['date'], '%Y-%m-%d').date()
@@ -402,65 +528,71 @@ def edit_entry(entry_id):
     
     # Check if entry is for a future date
     if new_date > today:
-        logger.warning(f"Future date edit attempt by user: {current_user.username}, entry_id: {entry_id}, date: {new_date}")
+        logger.warning("Future date edit attempt by user: %s, entry_id: %s, date: %s", current_user.username, entry_id, new_date)
         flash('Cannot edit entries to future dates. Please select today\'s date or a past date.', 'warning')
         return redirect(url_for('manage_entries'))
+
+    try:
+        values = entry_store.entry_values_from_form(data)
+    except ValueError as e:
+        logger.warning("Invalid edit from user: %s, entry_id: %s, %s", username, entry_id, e)
+        flash(f'Invalid entry: {e}.', 'warning')
+        return redirect(url_for('manage_entries'))
     
-    # Check if the new date conflicts with another entry for this user
-    if new_date != entry.entry_date:
-        existing_entry = MoodEntry.query.filter_by(entry_date=new_date, user_id=current_user.id).first()
-        if existing_entry and existing_entry.id != entry_id:
-            logger.warning(f"Date conflict edit attempt by user: {current_user.username}, entry_id: {entry_id}, date: {new_date}")
+    try:
+        # One guarded UPDATE; the unique (user_id, entry_date) constraint catches date clashes.
+        outcome = entry_store.edit_entry(entry_id, current_user.id, new_date, values)
+        if outcome == entry_store.NOT_FOUND:
+            abort(404)
+        if outcome == entry_store.CONFLICT:
+            logger.warning("Date conflict edit attempt by user: %s, entry_id: %s, date: %s", current_user.username, entry_id, new_date)
             flash('An entry already exists for this date.', 'warning')
             return redirect(url_for('manage_entries'))
-    
-    try:
-        entry.entry_date = new_date
-        entry.mood_level = int(data['mood'])
-        entry.hours_slept = float(data['hours_slept'])
-        entry.anxiety = int(data['anxiety'])
-        entry.energy_level = int(data['energy'])
-        entry.irritability = int(data['irritability'])
-        entry.alcohol_drugs = data.get('alcohol_drugs') == 'on'
-        entry.exercise = data.get('exercise') == 'on'
-        entry.menstruation = data.get('menstruation') == 'on'
-        entry.stressful_event = data.get('stressful_event') == 'on'
-        entry.weight = float(data['weight']) if data.get('weight') else None
-        entry.notes = data.get('notes', '')
-        
+
         db.session.commit()
-        logger.info(f"Entry edited successfully - user: {current_user.username}, entry_id: {entry_id}")
+        logger.info("Entry edited successfully - user: %s, entry_id: %s", username, entry_id)
         flash('Entry updated successfully!', 'success')
         return redirect(url_for('manage_entries'))
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Entry edit failed - user: {current_user.username}, entry_id: {entry_id}, error: {str(e)}")
+        logger.error("Entry edit failed - user: %s, entry_id: %s, error: %s", username, entry_id, e)
         db.session.rollback()
         flash('Failed to update entry. Please try again.', 'error')
         return redirect(url_for('manage_entries'))
 
-@app.route('/delete/<int:entry_id>', methods=['POST'])
+@route('/delete/<int:entry_id>', methods=['POST'])
 @login_required
 def delete_entry(entry_id):
-    logger.info(f"Entry deletion attempt by user: {current_user.username}, entry_id: {entry_id}")
+    logger.info("Entry deletion attempt by user: %s, entry_id: %s", current_user.username, entry_id)
     entry = MoodEntry.query.filter_by(id=entry_id, user_id=current_user.id).first_or_404()
     try:
+        # Its entry_score row references it, so the statistics go first (as archive._archive_year does).
+        entry_stats.record(current_user.id, deleted=[entry_id])
         db.session.delete(entry)
+        changelog.record(current_user.id, changelog.ENTRY, [entry_id], changelog.DELETE)
+        history.update_days(current_user.id, cleared=[entry.entry_date])
         db.session.commit()
-        logger.info(f"Entry deleted successfully - user: {current_user.username}, entry_id: {entry_id}")
+        logger.info("Entry deleted successfully - user: %s, entry_id: %s", current_user.username, entry_id)
         flash('Entry deleted successfully!', 'success')
         return redirect(url_for('manage_entries'))
     except Exception as e:
-        logger.error(f"Entry deletion failed - user: {current_user.username}, entry_id: {entry_id}, error: {str(e)}")
+        logger.error("Entry deletion failed - user: %s, entry_id: %s, error: %s", current_user.username, entry_id, e)
         db.session.rollback()
         flash('Failed to delete entry. Please try again.', 'error')
         return redirect(url_for('manage_entries'))
 
-@app.route('/data')
+@route('/data')
 @login_required
+@replicas.read_only
 def get_data():
-    logger.info(f"Data API accessed by user: {current_user.username}")
+    logger.info("Data API accessed by user: %s", current_user.username)
+    archived = archive.read(current_user.id)
+    data = columns_data(archived) if archived is not None else []
+    if history.is_enabled():
+        return jsonify(data + history_data(current_user.id))
     entries = MoodEntry.query.filter_by(user_id=current_user.id).all()
-    data = [{
+    data += [{
         'date': entry.entry_date.strftime('%Y-%m-%d'),
         'mood': entry.mood_level,
         'hours_slept': entry.hours_slept,
@@ -471,200 +603,563 @@ def get_data():
     } for entry in entries]
     return jsonify(data)
 
-@app.route('/visualize')
+def history_data(user_id):
+    """/data's records built from the columnar history instead of MoodEntry rows."""
+    return columns_data(history.read(user_id))
+
+def columns_data(columns):
+    """/data's records from history.read()-style columns."""
+    weights = columns['weight'].tolist()
+    return [{
+        'date': day,
+        'mood': mood,
+        'hours_slept': hours_slept,
+        'anxiety': anxiety,
+        'energy': energy,
+        'irritability': irritability,
+        'weight': weight if weight == weight and weight else None,  # NaN: not given
+    } for day, mood, hours_slept, anxiety, energy, irritability, weight in zip(
+        columns['date'].astype(str).tolist(), columns['mood_level'].tolist(), columns['hours_slept'].tolist(),
+        columns['anxiety'].tolist(), columns['energy_level'].tolist(), columns['irritability'].tolist(), weights)]
+
+@route('/api/entries/batch', methods=['POST'])
 @login_required
-def visualize():
-    logger.info(f"Visualization page accessed by user: {current_user.username}")
-    entries = MoodEntry.query.filter_by(user_id=current_user.id).all()
+def batch_entries():
+    """
+    Write many days in one request (mobile/offline clients).
+    Body: {"entries": [{"date": "YYYY-MM-DD", "mood": 5, ...}], "on_conflict": "update" | "skip"}.
+    Every entry is validated first and nothing is saved unless all are valid.
+    An Idempotency-Key header makes retrying the same upload safe.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('entries'), list):
+        return jsonify(error='Expected a JSON object with an "entries" list.'), 400
+    items = payload['entries']
+    max_batch_size = current_app.config['API_MAX_BATCH_SIZE']
+    if len(items) > max_batch_size:
+        logger.warning("Oversized batch from user: %s, entries: %s", current_user.username, len(items))
+        return jsonify(error=f'At most {max_batch_size} entries per batch.', max_batch_size=max_batch_size), 413
+    mode = {'update': 'update', 'skip': 'insert'}.get(payload.get('on_conflict', 'update'))
+    if mode is None:
+        return jsonify(error='on_conflict must be "update" or "skip".'), 400
+
+    key = request.headers.get('Idempotency-Key')
+    ttl_hours = current_app.config['IDEMPOTENCY_KEY_TTL_HOURS']
+    if key is not None:
+        if not key or len(key) > idempotency.MAX_KEY_LENGTH:
+            return jsonify(error=f'Idempotency-Key must be 1-{idempotency.MAX_KEY_LENGTH} characters.'), 400
+        payload_hash = idempotency.request_hash(payload)
+        try:
+            stored = idempotency.lookup(current_user.id, key, payload_hash, ttl_hours)
+        except idempotency.KeyReused:
+            logger.warning("Idempotency key reused with a different body by user: %s", current_user.username)
+            return jsonify(error='This Idempotency-Key was already used for a different request.'), 422
+        if stored is not None:
+            logger.info("Batch upload replayed for user: %s, key: %s", current_user.username, key)
+            return replayed_response(stored)
+
+    # Validate the whole batch before writing anything.
+    today = datetime.now().date()
+    parsed, errors, dates = [], [], set()
+    for item in items:
+        entry, item_errors = entry_store.entry_from_json(item, today)
+        if entry is not None and entry[0] in dates:
+            entry, item_errors = None, ['another entry in this batch has the same date']
+        if entry is not None:
+            dates.add(entry[0])
+        parsed.append(entry)
+        errors.append(item_errors)
+    owned = entry_store.owned_medication_ids(
+        current_user.id, [m for entry in parsed if entry is not None for m in entry[2]])
+    for entry, item_errors in zip(parsed, errors):
+        if entry is not None:
+            unknown = sorted(set(entry[2]) - owned)
+            if unknown:
+                item_errors.append(f'unknown medication ids: {unknown}')
+
+    if any(errors):
+        logger.warning("Batch upload rejected for user: %s, invalid entries: %s",
+                       current_user.username, sum(1 for e in errors if e))
+        return jsonify(error='Some entries are invalid; nothing was saved.', results=[
+            {'index': index, 'status': 'invalid', 'errors': item_errors} if item_errors
+            else {'index': index, 'status': 'ok'}
+            for index, item_errors in enumerate(errors)
+        ]), 422
+
+    try:
+        outcomes = entry_store.save_entries(current_user.id, parsed, mode=mode)
+        body = {'results': [
+            {'index': index, 'date': entry[0].isoformat(), 'status': outcome, 'id': entry_id}
+            for index, (entry, (outcome, entry_id)) in enumerate(zip(parsed, outcomes))
+        ]}
+        for outcome in (entry_store.INSERTED, entry_store.UPDATED, entry_store.EXISTS):
+            body[outcome] = sum(1 for o, _ in outcomes if o == outcome)
+        if key is not None and not idempotency.store(current_user.id, key, payload_hash, 200, body, ttl_hours):
+            # A concurrent retry with the same key committed first; answer as it did.
+            db.session.rollback()
+            return replayed_response(idempotency.lookup(current_user.id, key, payload_hash, ttl_hours))
+        db.session.commit()
+    except Exception as e:
+        logger.error("Batch upload failed - user: %s, error: %s", current_user.username, e)
+        db.session.rollback()
+        return jsonify(error='Failed to save entries. Please retry.'), 500
+
+    logger.info("Batch upload by user: %s - inserted: %s, updated: %s, unchanged: %s", current_user.username,
+                body[entry_store.INSERTED], body[entry_store.UPDATED], body[entry_store.EXISTS])
+    return jsonify(body)
+
+def replayed_response(stored):
+    """Response for a request whose Idempotency-Key has been seen before."""
+    status_code, body = stored
+    response = jsonify(body)
+    response.status_code = status_code
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+@route('/api/sync')
+@login_required
+def sync_changes():
+    """
+    Changes since ?cursor=N (entries/medications written since, deleted entry ids),
+    at most ?limit= changes per page. 410 means the cursor is too old: fetch
+    /api/sync/snapshot and continue from its cursor.
+    """
+    cursor = request.args.get('cursor', 0, type=int)
+    page_size = current_app.config['SYNC_PAGE_SIZE']
+    limit = request.args.get('limit', page_size, type=int)
+    if not 1 <= limit <= page_size:
+        return jsonify(error=f'limit must be between 1 and {page_size}.'), 400
+    try:
+        body = sync.changes_since(current_user.id, cursor, limit)
+    except sync.CursorExpired:
+        logger.info("Sync cursor %s expired for user: %s", cursor, current_user.username)
+        return jsonify(error='Cursor is too old; a full resync is required.', full_resync=True,
+                       snapshot=url_for('sync_snapshot')), 410
+    return jsonify(body)
+
+@route('/api/sync/snapshot')
+@login_required
+def sync_snapshot():
+    """Everything the user has, with the cursor to pass to /api/sync next."""
+    logger.info("Sync snapshot requested by user: %s", current_user.username)
+    return jsonify(sync.snapshot(current_user.id))
+
+@route('/api/search')
+@login_required
+@replicas.read_only
+def search_notes():
+    """
+    The user's entries whose notes match ?q=, best match first, optionally
+    limited to ?from=/?to= (YYYY-MM-DD). Pass the next_cursor of one page as
+    ?cursor= to get the next.
+    """
+    if not search.is_available(db.session.get_bind(mapper=MoodEntry)):
+        return jsonify(error='Search needs an SQLite database.'), 501
+    match = search.fts_query(request.args.get('q', ''))
+    if match is None:
+        return jsonify(error='q must contain a word to search for.'), 400
+    page_size = current_app.config['SEARCH_PAGE_SIZE']
+    limit = request.args.get('limit', 20, type=int)
+    if not 1 <= limit <= page_size:
+        return jsonify(error=f'limit must be between 1 and {page_size}.'), 400
+    try:
+        start, end = (datetime.strptime(request.args[name], '%Y-%m-%d').date() if request.args.get(name) else None
+                      for name in ('from', 'to'))
+    except ValueError:
+        return jsonify(error='from and to must be dates like 2024-03-01.'), 400
+    try:
+        body = search.search(current_user.id, match, start, end, request.args.get('cursor'), limit)
+    except search.InvalidCursor:
+        return jsonify(error='Invalid cursor.'), 400
+    logger.info("Notes search by user: %s, %d result(s)", current_user.username, len(body['results']))
+    return jsonify(body)
+
+MOOD_GRAPH_JOB = 'mood_graph'
+
+def prewarm_plotly():
+    """Load plotly and the trace/layout validators /visualize uses."""
+    import plotly.graph_objects as go
+    from plotly.utils import PlotlyJSONEncoder
+
+    fig = go.Figure([go.Scatter(x=[0], y=[0], mode='lines+markers'), go.Bar(x=[0], y=[0])])
+    fig.update_layout(yaxis2=dict(overlaying='y', side='right'),
+                      yaxis3=dict(overlaying='y', side='right', position=0.95))
+    json.dumps(fig.to_dict(), cls=PlotlyJSONEncoder)
+
+def _unusual_days(user_id):
+    return {day.strftime('%Y-%m-%d'): flags for day, flags in entry_stats.flagged_days(user_id).items()}
+
+def build_mood_graph_json(entries, archived=None):
+    """
+    Build the Plotly figure for a user's entries and return it as JSON.
+    `archived` adds the days from archived_graph_columns() before them.
+    """
+    return mood_graph_json(*_after_archived(archived, (
+        [entry.entry_date.strftime('%Y-%m-%d') for entry in entries],  # Remove time
+        {
+            'mood': [entry.mood_level for entry in entries],
+            'hours_slept': [entry.hours_slept for entry in entries],
+            'anxiety': [entry.anxiety for entry in entries],
+            'energy': [entry.energy_level for entry in entries],
+            'irritability': [entry.irritability for entry in entries],
+            'weight': [entry.weight for entry in entries],
+        },
+        [[mem.medication.name for mem in entry.medications if mem.taken] for entry in entries],
+    )), _unusual_days(entries[0].user_id) if entries else None)
+
+def _graph_columns(columns):
+    """(dates, metric lists keyed by trace) from history.read()-style columns."""
+    weights = columns['weight'].tolist()
+    return columns['date'].astype(str).tolist(), {
+        'mood': columns['mood_level'].tolist(),
+        'hours_slept': columns['hours_slept'].tolist(),
+        'anxiety': columns['anxiety'].tolist(),
+        'energy': columns['energy_level'].tolist(),
+        'irritability': columns['irritability'].tolist(),
+        'weight': [None if weight != weight else weight for weight in weights],  # NaN: not given
+    }
+
+def archived_graph_columns(user_id):
+    """mood_graph_json()'s dates, metrics and medication names for the user's archived entries, or None."""
+    archived = archive.read(user_id, details=True)
+    if archived is None:
+        return None
+    dates, metrics = _graph_columns(archived)
+    names = dict(db.session.execute(select(Medication.id, Medication.name).where(Medication.user_id == user_id)).all())
+    return dates, metrics, [[names[med] for med in taken if med in names] for taken in archived['medications']]
+
+def _after_archived(archived, hot):
+    """The archived (dates, metrics, medications) columns followed by the hot ones."""
+    if archived is None:
+        return hot
+    return (archived[0] + hot[0], {name: archived[1][name] + values for name, values in hot[1].items()},
+            archived[2] + hot[2])
+
+def build_mood_graph_json_from_history(user_id, archived=None):
+    """The same figure from the columnar history; None if the user has no entries."""
+    columns = history.read(user_id)
+    if not len(columns['date']) and archived is None:
+        return None
+    dates, metrics = _graph_columns(columns)
+    taken = {}
+    for entry_date, name in db.session.execute(
+            select(MoodEntry.entry_date, Medication.name)
+            .join(MoodEntryMedication, MoodEntryMedication.mood_entry_id == MoodEntry.id)
+            .join(Medication, Medication.id == MoodEntryMedication.medication_id)
+            .where(MoodEntry.user_id == user_id, MoodEntryMedication.taken.is_(True))
+            .order_by(MoodEntryMedication.id)):
+        taken.setdefault(entry_date.isoformat(), []).append(name)
+    return mood_graph_json(*_after_archived(archived, (dates, metrics, [taken.get(day, []) for day in dates])),
+                           _unusual_days(user_id))
+
+def mood_graph_json(dates, metrics, medications, unusual=None):
+    """
+    Build the Plotly figure from per-day columns: dates ('YYYY-MM-DD'), metric
+    lists keyed by trace (weight None when not given) and the names of the
+    medications taken each day. `unusual` maps dates flagged by entry_stats
+    to what was unusual about them.
+    """
+    # Only this page needs plotly, so it is imported on first use rather than
+    # by every process that imports app (see prewarm_plotly()).
+    import plotly.graph_objects as go
+    from plotly.utils import PlotlyJSONEncoder
+
+    mood = metrics['mood']
+    hours_slept = metrics['hours_slept']
+    anxiety = metrics['anxiety']
+    energy = metrics['energy']
+    irritability = metrics['irritability']
+    weight = [value for value in metrics['weight'] if value is not None]
+    weight_dates = [day for day, value in zip(dates, metrics['weight']) if value is not None]
     
-    if entries:
-        logger.info(f"Generating visualization for user: {current_user.username}, entries count: {len(entries)}")
-        dates = [entry.entry_date.strftime('%Y-%m-%d') for entry in entries]  # Remove time
-        mood = [entry.mood_level for entry in entries]
-        hours_slept = [entry.hours_slept for entry in entries]
-        anxiety = [entry.anxiety for entry in entries]
-        energy = [entry.energy_level for entry in entries]
-        irritability = [entry.irritability for entry in entries]
-        weight = [entry.weight for entry in entries if entry.weight is not None]
-        weight_dates = [entry.entry_date.strftime('%Y-%m-%d') for entry in entries if entry.weight is not None]
-        
-        # Get all unique medications for consistent colors
-        all_medications = set()
-        for entry in entries:
-            for mem in entry.medications:
-                if mem.taken:
-                    all_medications.add(mem.medication.name)
-        
-        # Create color map for medications
-        colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
-        medication_colors = {med: colors[i % len(colors)] for i, med in enumerate(all_medications)}
-        
-        # Create subplot with secondary y-axis for medications
-        fig = go.Figure()
-        
-        # Add main metrics traces
-        fig.add_trace(go.Scatter(
-            x=dates,
-            y=mood,
-            name='Mood',
-            mode='lines+markers'
-        ))
-        
+    # Get all unique medications for consistent colors
+    all_medications = set()
+    for meds_taken in medications:
+        all_medications.update(meds_taken)
+    
+    # Create color map for medications
+    colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+    medication_colors = {med: colors[i % len(colors)] for i, med in enumerate(all_medications)}
+    
+    # Create subplot with secondary y-axis for medications
+    fig = go.Figure()
+    
+    # Add main metrics traces
+    fig.add_trace(go.Scatter(
+        x=dates,
+        y=mood,
+        name='Mood',
+        mode='lines+markers'
+    ))
+    
+    fig.add_trace(go.Scatter(
+        x=dates,
+        y=hours_slept,
+        name='Hours Slept',
+        mode='lines+markers',
+        yaxis='y2'
+    ))
+    
+    fig.add_trace(go.Scatter(
+        x=dates,
+        y=anxiety,
+        name='Anxiety',
+        mode='lines+markers'
+    ))
+    
+    fig.add_trace(go.Scatter(
+        x=dates,
+        y=energy,
+        name='Energy',
+        mode='lines+markers'
+    ))
+    
+    fig.add_trace(go.Scatter(
+        x=dates,
+        y=irritability,
+        name='Irritability',
+        mode='lines+markers'
+    ))
+    
+    # Add weight trace if there's weight data
+    if weight:
         fig.add_trace(go.Scatter(
-            x=dates,
-            y=hours_slept,
-            name='Hours Slept',
+            x=weight_dates,
+            y=weight,
+            name='Weight',
             mode='lines+markers',
-            yaxis='y2'
+            yaxis='y3'
         ))
-        
-        fig.add_trace(go.Scatter(
-            x=dates,
-            y=anxiety,
-            name='Anxiety',
-            mode='lines+markers'
-        ))
-        
-        fig.add_trace(go.Scatter(
-            x=dates,
-            y=energy,
-            name='Energy',
-            mode='lines+markers'
-        ))
-        
+    
+    # Circle unusual days on the mood line
+    if unusual:
+        flagged = [i for i, day in enumerate(dates) if day in unusual]
         fig.add_trace(go.Scatter(
-            x=dates,
-            y=irritability,
-            name='Irritability',
-            mode='lines+markers'
+            x=[dates[i] for i in flagged],
+            y=[mood[i] for i in flagged],
+            name='Unusual day',
+            mode='markers',
+            marker=dict(symbol='circle-open', size=14, color='#d62728', line=dict(width=2)),
+            hovertext=[', '.join(unusual[dates[i]]) for i in flagged],
+            hoverinfo='text'
         ))
-        
-        # Add weight trace if there's weight data
-        if weight:
-            fig.add_trace(go.Scatter(
-                x=weight_dates,
-                y=weight,
-                name='Weight',
-                mode='lines+markers',
-                yaxis='y3'
-            ))
-        
-        # Add medication blocks at the bottom
-        for i, entry in enumerate(entries):
-            meds_taken = []
-            for mem in entry.medications:
-                if mem.taken:
-                    meds_taken.append(mem.medication.name)
-            
-            if meds_taken:
-                # Create a stacked bar for multiple medications
-                for j, med in enumerate(meds_taken):
-                    fig.add_trace(go.Bar(
-                        x=[dates[i]],
-                        y=[1],
-                        name=med,
-                        marker_color=medication_colors[med],
-                        showlegend=False if i > 0 else True,  # Only show legend for first occurrence
-                        yaxis='y4',
-                        opacity=0.8,
-                        width=0.8
-                    ))
-        
-        # Update layout with four y-axes
-        layout_updates = {
-            'title': 'Mood Tracker Over Time',
-            'xaxis_title': 'Date',
-            'yaxis_title': 'Level (0-10)',
-            'yaxis': dict(range=[0, 10]),
-            'yaxis2': dict(
-                title='Hours Slept',
-                overlaying='y',
-                side='right',
-                range=[0, 12]
-            ),
-            'yaxis4': dict(
-                title='Medications',
-                overlaying='y',
-                side='right',
-                position=0.02,
-                range=[0, 1],
-                showticklabels=False,
-                showgrid=False
-            ),
-            'hovermode': 'x unified',
-            'height': 800,  # Increase height to accommodate medication section
-            'margin': dict(b=80, t=80),  # Add margins
-            'barmode': 'stack'  # Stack medication bars
-        }
-        
-        # Add third y-axis for weight if there's weight data
-        if weight:
-            layout_updates['yaxis3'] = dict(
-                title='Weight (lbs)',
-                overlaying='y',
-                side='right',
-                position=0.95,
-                range=[min(weight) - 5, max(weight) + 5] if weight else [0, 200]
-            )
-        
-        fig.update_layout(**layout_updates)
-        
-        graphJSON = json.dumps(fig.to_dict(), cls=PlotlyJSONEncoder)
-        return render_template('visualize.html', graphJSON=graphJSON)
-    return render_template('visualize.html', graphJSON=None)
 
-@app.route('/add_medication', methods=['POST'])
+    # Add medication blocks at the bottom
+    for i, meds_taken in enumerate(medications):
+        if meds_taken:
+            # Create a stacked bar for multiple medications
+            for j, med in enumerate(meds_taken):
+                fig.add_trace(go.Bar(
+                    x=[dates[i]],
+                    y=[1],
+                    name=med,
+                    marker_color=medication_colors[med],
+                    showlegend=False if i > 0 else True,  # Only show legend for first occurrence
+                    yaxis='y4',
+                    opacity=0.8,
+                    width=0.8
+                ))
+    
+    # Update layout with four y-axes
+    layout_updates = {
+        'title': 'Mood Tracker Over Time',
+        'xaxis_title': 'Date',
+        'yaxis_title': 'Level (0-10)',
+        'yaxis': dict(range=[0, 10]),
+        'yaxis2': dict(
+            title='Hours Slept',
+            overlaying='y',
+            side='right',
+            range=[0, 12]
+        ),
+        'yaxis4': dict(
+            title='Medications',
+            overlaying='y',
+            side='right',
+            position=0.02,
+            range=[0, 1],
+            showticklabels=False,
+            showgrid=False
+        ),
+        'hovermode': 'x unified',
+        'height': 800,  # Increase height to accommodate medication section
+        'margin': dict(b=80, t=80),  # Add margins
+        'barmode': 'stack'  # Stack medication bars
+    }
+    
+    # Add third y-axis for weight if there's weight data
+    if weight:
+        layout_updates['yaxis3'] = dict(
+            title='Weight (lbs)',
+            overlaying='y',
+            side='right',
+            position=0.95,
+            range=[min(weight) - 5, max(weight) + 5] if weight else [0, 200]
+        )
+    
+    fig.update_layout(**layout_updates)
+    
+    return json.dumps(fig.to_dict(), cls=PlotlyJSONEncoder)
+
+@jobs.handler(MOOD_GRAPH_JOB)
+def mood_graph_job(job):
+    """Background job: the /visualize figure for a user, or null without entries."""
+    archived = archived_graph_columns(job.user_id)
+    if history.is_enabled():
+        job.progress(0.2)
+        with profiling.section('build_figure'):
+            return build_mood_graph_json_from_history(job.user_id, archived) or 'null'
+    # Eager: the figure lists each entry's medications by name.
+    entries = MoodEntry.query.filter_by(user_id=job.user_id).options(
+        selectinload(MoodEntry.medications).joinedload(MoodEntryMedication.medication)).all()
+    job.progress(0.2)
+    if not entries and archived is None:
+        return 'null'
+    logger.info("Generating visualization for user id: %s, entries count: %s", job.user_id, len(entries))
+    with profiling.section('build_figure'):
+        return build_mood_graph_json(entries, archived)
+
+@route('/visualize')
+@login_required
+def visualize():
+    """
+    Charts page. The figure is built by a background job keyed by the user's
+    change-log version, so it is only rebuilt after their data changes; until
+    it is ready the page polls the job. Not read_only: queuing the job writes.
+    A profiled request has its job profiled too.
+    """
+    logger.info("Visualization page accessed by user: %s", current_user.username)
+    if heatmap.years(current_user.id) is None:
+        return render_template('visualize.html', graphJSON=None)
+    version, _ = changelog.sync_state(current_user.id)
+    heatmap_metrics = [(name, label) for name, (label, *_) in heatmap.METRICS.items()]
+    job = jobs.enqueue(MOOD_GRAPH_JOB, user_id=current_user.id, priority=jobs.PRIORITY_INTERACTIVE,
+                       key=f'{MOOD_GRAPH_JOB}:{current_user.id}:{version}',
+                       params={profiling.PROFILE_JOB_PARAM: True} if profiling.requested() else None)
+    db.session.commit()
+    # A figure already built for this version is a cache hit.
+    metrics.record_cache(MOOD_GRAPH_JOB, job.status == jobs.SUCCEEDED)
+    if job.status == jobs.SUCCEEDED:
+        return render_template('visualize.html', graphJSON=None if job.result == 'null' else job.result,
+                               heatmap_metrics=heatmap_metrics)
+    return render_template('visualize.html', graphJSON=None, job_id=job.id, heatmap_metrics=heatmap_metrics)
+
+@route('/api/heatmap')
+@login_required
+@replicas.read_only
+def heatmap_grid():
+    """
+    One year of one metric as a calendar grid (see heatmap.py): ?metric=
+    (default mood_level, also 'medications' or 'medication-<id>') and ?year=
+    (default the last year with entries). The ETag changes with the user's data.
+    """
+    metric = request.args.get('metric', 'mood_level')
+    year = request.args.get('year', type=int)
+    if year is None:
+        span = heatmap.years(current_user.id)
+        year = span[1] if span else date.today().year
+    if not heatmap.MIN_YEAR <= year <= heatmap.MAX_YEAR:
+        return jsonify(error=f'year must be between {heatmap.MIN_YEAR} and {heatmap.MAX_YEAR}.'), 400
+    try:
+        body = heatmap.grid(current_user.id, year, metric)
+    except heatmap.UnknownMetric:
+        return jsonify(error=f'Unknown metric {metric!r}.'), 400
+    response = jsonify(body)
+    response.set_etag(f"heatmap-{current_user.id}-{year}-{metric}-{body['version']}")
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+@route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    """Status and progress of one of the user's background jobs."""
+    job = jobs.get_job(job_id, current_user.id)
+    if job is None:
+        abort(404)
+    body = jobs.job_to_json(job)
+    if job.status == jobs.SUCCEEDED:
+        body['result_url'] = url_for('job_result', job_id=job.id)
+    return jsonify(body)
+
+@route('/jobs/<int:job_id>/result')
+@login_required
+def job_result(job_id):
+    """A finished job's result (JSON); 409 until it has succeeded."""
+    job = jobs.get_job(job_id, current_user.id)
+    if job is None:
+        abort(404)
+    if job.status != jobs.SUCCEEDED:
+        return jsonify(error=f'Job is {job.status}.', status=job.status), 409
+    return Response(job.result, mimetype='application/json')
+
+@route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    """Cancel a queued or running job of the user's."""
+    if jobs.get_job(job_id, current_user.id) is None:
+        abort(404)
+    jobs.cancel(job_id)
+    db.session.commit()
+    logger.info("Job %s cancelled by user: %s", job_id, current_user.username)
+    return jsonify(jobs.job_to_json(jobs.get_job(job_id))), 202
+
+@route('/add_medication', methods=['POST'])
 @login_required
 def add_medication():
     name = request.form.get('medication_name', '').strip()
-    logger.info(f"Medication addition attempt by user: {current_user.username}, medication: {name}")
+    logger.info("Medication addition attempt by user: %s, medication: %s", current_user.username, name)
     
     if name:
         existing = Medication.query.filter_by(name=name, user_id=current_user.id).first()
         if existing:
             if not existing.active:
                 existing.active = True
+                changelog.record(current_user.id, changelog.MEDICATION, [existing.id])
                 db.session.commit()
-                logger.info(f"Medication reactivated by user: {current_user.username}, medication: {name}")
+                logger.info("Medication reactivated by user: %s, medication: %s", current_user.username, name)
                 flash(f'Medication "{name}" reactivated.', 'success')
             else:
-                logger.warning(f"Duplicate medication attempt by user: {current_user.username}, medication: {name}")
+                logger.warning("Duplicate medication attempt by user: %s, medication: %s", current_user.username, name)
                 flash(f'Medication "{name}" already exists.', 'warning')
         else:
             try:
                 med = Medication(name=name, user_id=current_user.id)
                 db.session.add(med)
+                db.session.flush()
+                changelog.record(current_user.id, changelog.MEDICATION, [med.id])
                 db.session.commit()
-                logger.info(f"Medication added successfully by user: {current_user.username}, medication: {name}, med_id: {med.id}")
+                logger.info("Medication added successfully by user: %s, medication: %s, med_id: %s", current_user.username, name, med.id)
                 flash(f'Medication "{name}" added.', 'success')
             except Exception as e:
-                logger.error(f"Medication addition failed - user: {current_user.username}, medication: {name}, error: {str(e)}")
+                logger.error("Medication addition failed - user: %s, medication: %s, error: %s", current_user.username, name, e)
                 db.session.rollback()
                 flash('Failed to add medication. Please try again.', 'error')
     else:
-        logger.warning(f"Empty medication name attempt by user: {current_user.username}")
+        logger.warning("Empty medication name attempt by user: %s", current_user.username)
         flash('Medication name cannot be empty.', 'danger')
     return redirect(url_for('manage_entries'))
 
-@app.route('/deactivate_medication/<int:med_id>', methods=['POST'])
+@route('/deactivate_medication/<int:med_id>', methods=['POST'])
 @login_required
 def deactivate_medication(med_id):
     med = Medication.query.filter_by(id=med_id, user_id=current_user.id).first_or_404()
     med.active = False
+    changelog.record(current_user.id, changelog.MEDICATION, [med.id])
     db.session.commit()
     flash(f'Medication "{med.name}" deactivated.', 'info')
     return redirect(url_for('manage_entries'))
 
-@app.route('/activate_medication/<int:med_id>', methods=['POST'])
+@route('/activate_medication/<int:med_id>', methods=['POST'])
 @login_required
 def activate_medication(med_id):
     med = Medication.query.filter_by(id=med_id, user_id=current_user.id).first_or_404()
     med.active = True
+    changelog.record(current_user.id, changelog.MEDICATION, [med.id])
     db.session.commit()
     flash(f'Medication "{med.name}" activated.', 'success')
     return redirect(url_for('manage_entries'))
 
-@app.route('/edit_medication/<int:med_id>', methods=['POST'])
+@route('/edit_medication/<int:med_id>', methods=['POST'])
 @login_required
 def edit_medication(med_id):
     med = Medication.query.filter_by(id=med_id, user_id=current_user.id).first_or_404()
@@ -677,26 +1172,111 @@ def edit_medication(med_id):
         flash('A medication with that name already exists.', 'warning')
         return redirect(url_for('manage_entries', edit_medication_id=med_id))
     med.name = new_name
+    changelog.record(current_user.id, changelog.MEDICATION, [med.id])
     db.session.commit()
     flash('Medication name updated.', 'success')
     return redirect(url_for('manage_entries'))
 
-@app.route('/admin')
+@route('/admin')
 @login_required
 def admin():
     """Admin panel for testing and system management."""
-    logger.info(f"Admin panel accessed by user: {current_user.username}")
+    logger.info("Admin panel accessed by user: %s", current_user.username)
+    show_admin_tools = is_admin(current_user)
+    notification_settings = get_notification_settings()
     return render_template('admin.html', 
                          enabled=notification_settings.get('enabled', True),
                          time=notification_settings.get('time', '15:00'),
                          timezone=notification_settings.get('timezone', 'US/Eastern'),
                          duration=notification_settings.get('duration', 10),
-                         gender=notification_settings.get('gender', 'female'))
+                         gender=notification_settings.get('gender', 'female'),
+                         show_admin_tools=show_admin_tools,
+                         slow_queries_enabled=slow_queries.is_enabled(),
+                         slow_query_threshold=current_app.config['SLOW_QUERY_THRESHOLD_MS'],
+                         slow_query_stats=slow_queries.summary(limit=10) if show_admin_tools else [])
+
+@route('/admin/slow_queries.json')
+@admin_required
+def export_slow_queries():
+    """Download everything the slow query recorder has captured."""
+    logger.info("Slow query export requested by user: %s", current_user.username)
+    response = jsonify(slow_queries.export())
+    response.headers['Content-Disposition'] = 'attachment; filename=slow_queries.json'
+    return response
+
+@route('/admin/slow_queries/reset', methods=['POST'])
+@admin_required
+def reset_slow_queries():
+    """Clear the recorded slow queries."""
+    slow_queries.reset()
+    logger.info("Slow query statistics reset by user: %s", current_user.username)
+    flash('Slow query statistics cleared.', 'info')
+    return redirect(url_for('admin'))
+
+@route('/admin/stats')
+@admin_required
+def admin_stats_page():
+    """System-wide numbers from the newest background snapshot (never computed here)."""
+    logger.info("Admin dashboard accessed by user: %s", current_user.username)
+    return render_template('admin_stats.html', stats=admin_stats.latest(),
+                           interval=current_app.config['ADMIN_STATS_INTERVAL'])
+
+@route('/admin/stats.json')
+@admin_required
+def admin_stats_json():
+    """The newest snapshot as JSON; 404 until the first one is taken."""
+    stats = admin_stats.latest()
+    if stats is None:
+        return jsonify({'error': 'no snapshot yet'}), 404
+    return jsonify(stats)
+
+@route('/admin/stats/refresh', methods=['POST'])
+@admin_required
+def refresh_admin_stats():
+    """Queue a snapshot now rather than at the next interval."""
+    admin_stats.refresh()
+    db.session.commit()
+    logger.info("Admin dashboard refresh requested by user: %s", current_user.username)
+    flash('Refreshing the numbers; reload the page in a moment.', 'info')
+    return redirect(url_for('admin_stats_page'))
+
+@route('/admin/profiles')
+@admin_required
+def admin_profiles():
+    """List recently captured request profiles."""
+    logger.info("Profile list accessed by user: %s", current_user.username)
+    return render_template('profiles.html', profiles=profiling.list_profiles(), profile=None)
+
+@route('/admin/profiles/<name>')
+@admin_required
+def admin_profile_detail(name):
+    """Show the top functions of a captured request profile."""
+    sort = request.args.get('sort', 'cumulative')
+    profile = profiling.load_profile(name, sort=sort)
+    if profile is None:
+        abort(404)
+    return render_template('profiles.html', profiles=None, profile=profile, sort=sort)
+
+@route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics, merged across all worker processes."""
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    token = current_app.config['METRICS_TOKEN']
+    # Scrapers cannot log in, so they may present METRICS_TOKEN instead.
+    auth_header = request.headers.get('Authorization', '')
+    token_ok = bool(token) and hmac.compare_digest(auth_header, f'Bearer {token}')
+    if not token_ok:
+        if not current_user.is_authenticated:
+            return login_manager.unauthorized()
+        if not is_admin(current_user):
+            abort(403)
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
-@app.route('/test_notification', methods=['POST'])
+@route('/test_notification', methods=['POST'])
 def test_notification():
     """Send a test notification."""
-    logger.info(f"Test notification requested by user: {current_user.username if current_user.is_authenticated else 'anonymous'}")
+    logger.info("Test notification requested by user: %s", current_user.username if current_user.is_authenticated else 'anonymous')
     try:
         from win10toast import ToastNotifier
         toaster = ToastNotifier()
@@ -709,15 +1289,16 @@ def test_notification():
         logger.info("Test notification sent successfully")
         flash('Test notification sent successfully!', 'success')
     except Exception as e:
-        logger.error(f"Test notification failed: {str(e)}")
+        logger.error("Test notification failed: %s", e)
         flash(f'Error sending notification: {str(e)}', 'danger')
     
     return redirect(url_for('admin'))
 
-@app.route('/update_notification_settings', methods=['POST'])
+@route('/update_notification_settings', methods=['POST'])
 def update_notification_settings():
     """Update notification settings."""
-    logger.info(f"Notification settings update requested by user: {current_user.username if current_user.is_authenticated else 'anonymous'}")
+    logger.info("Notification settings update requested by user: %s", current_user.username if current_user.is_authenticated else 'anonymous')
+    notification_settings = get_notification_settings()
     try:
         notification_settings.settings['enabled'] = 'enabled' in request.form
         notification_settings.settings['time'] = request.form.get('time', '15:00')
@@ -728,13 +1309,14 @@ def update_notification_settings():
         logger.info("Notification settings updated successfully")
         flash('Notification settings updated successfully!', 'success')
     except Exception as e:
-        logger.error(f"Notification settings update failed: {str(e)}")
+        logger.error("Notification settings update failed: %s", e)
         flash('Failed to update notification settings.', 'error')
     return redirect(url_for('admin'))
 
 if __name__ == '__main__':
+    app = create_app()
     logger.info("Starting Mood Tracker application...")
-    logger.info(f"Beta code: {BETA_CODE}")
-    logger.info(f"Database: {DATABASE_URI}")
+    logger.info("Beta code: %s", app.config['BETA_CODE'])
+    logger.info("Database: %s", app.config['SQLALCHEMY_DATABASE_URI'])
     logger.info("Application ready to serve requests")
-    app.run(debug=True) 
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+Cold storage for old entries (ARCHIVE_AFTER_DAYS).
+
+Long-lived accounts keep every day they ever logged in mood_entry and
+mood_entry_medication, so the per-user scans behind /manage, /data and the
+charts, and the tables' indexes, keep growing. A background job (every
+ARCHIVE_INTERVAL seconds) moves each user's years that ended more than
+ARCHIVE_AFTER_DAYS ago out of those tables, one entry_archive row per user
+and year:
+
+    data        the year's columns in history.py's blob layout, zlib-compressed
+    details     zlib-compressed JSON lists, in date order, of what the blob
+                leaves out: entry ids, notes, medication links as
+                [medication id, taken] pairs, and flags that were NULL
+
+and leaves monthly rollups in entry_rollup (count, total, lowest and
+highest of each metric) for summaries that don't need the days. Before a
+year's rows are deleted its archive is unpacked again and compared with
+them; a year that doesn't come back identical stays hot.
+
+Reads merge the tiers: /data, the charts, the year view and sync snapshots
+add the archived years; /manage lists the hot entries and sums up archived
+months from the rollups. Notes search only covers hot entries. Whole years
+move, so a year is either hot or archived: writing an entry dated in an
+archived year first restores that year (entry_store.py calls
+restore_dates()), and the job archives it again later.
+
+Archived entries leave the running statistics (entry_stats.py) and the
+columnar history. The change log is not touched, so sync clients keep the
+entries they have under the same ids; a restored entry gets its id back
+unless another row took it meanwhile, and then clients are told about the
+change. Ids are per shard, so archives moved to another shard drop them.
+
+Usage: python archive.py [--archive [--after-days N]] [--verify] [--restore YEAR] [--user-id ID]
+"""
+
+import argparse
+import json
+import logging
+import math
+import sys
+import zlib
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, select
+
+import changelog
+import entry_stats
+import history
+import jobs
+import sharding
+from models import db, EntryArchive, EntryRollup, EntryYearBlob, MoodEntry, MoodEntryMedication
+
+ARCHIVE_JOB = 'archive'
+MEDICATIONS = 'medications'  # Rollup of medications taken per day
+
+logger = logging.getLogger('mood_tracker')
+_entries = MoodEntry.__table__
+_links = MoodEntryMedication.__table__
+
+jobs.every(ARCHIVE_JOB, 'ARCHIVE_INTERVAL')
+
+
+class RoundTripError(ValueError):
+    """An archive doesn't unpack to the entries it was made from."""
+
+
+def cutoff_year(today=None, after_days=None):
+    """Years before this one are old enough to archive; None when archiving is off."""
+    after_days = current_app.config['ARCHIVE_AFTER_DAYS'] if after_days is None else after_days
+    if not after_days:
+        return None
+    return ((today or date.today()) - timedelta(days=after_days)).year
+
+
+def _pack(year, entries):
+    """(data, details) for a year's entries: (row, links) pairs in date order."""
+    columns = history.empty_year()
+    details = {'ids': [], 'notes': [], 'medications': [], 'nulls': {}}
+    for position, (row, links) in enumerate(entries):
+        history.set_day(columns, history.day_of_year(row['entry_date']), row)
+        details['ids'].append(row['id'])
+        details['notes'].append(row['notes'])
+        details['medications'].append([list(link) for link in links])
+        for name in history.FLAGS:
+            if row[name] is None:
+                details['nulls'].setdefault(name, []).append(position)
+    return (zlib.compress(history.encode(year, columns)),
+            zlib.compress(json.dumps(details, separators=(',', ':')).encode()))
+
+
+def _unpack(user_id, year, data, details):
+    """The entries of an archive as (row, links) pairs in date order; see _pack()."""
+    import numpy as np
+
+    columns = history.decode(zlib.decompress(data))
+    details = json.loads(zlib.decompress(details))
+    days = np.flatnonzero(columns['present']).tolist()
+    if len(days) != len(details['ids']):
+        raise RoundTripError(f"{year}: {len(days)} days but {len(details['ids'])} entries")
+    first = date(year, 1, 1).toordinal()
+    levels = {name: columns[name].tolist() for name in history.LEVELS + history.FLAGS}
+    hours_slept, weights = columns['hours_slept'].tolist(), columns['weight'].tolist()
+    entries = []
+    for position, day in enumerate(days):
+        row = {'id': details['ids'][position], 'user_id': user_id, 'entry_date': date.fromordinal(first + day)}
+        for name in history.LEVELS + history.FLAGS:
+            row[name] = levels[name][day]
+        row['hours_slept'] = hours_slept[day]
+        row['weight'] = None if weights[day] != weights[day] else weights[day]  # NaN: not given
+        row['notes'] = details['notes'][position]
+        entries.append((row, [tuple(link) for link in details['medications'][position]]))
+    for name, positions in details['nulls'].items():
+        for position in positions:
+            entries[position][0][name] = None
+    return entries
+
+
+def _rollups(user_id, entries):
+    """entry_rollup rows for (row, links) entries: one per month and metric with values."""
+    rollups = {}
+    for row, links in entries:
+        month = row['entry_date'].replace(day=1)
+        values = {name: row[name] for name in history.COLUMNS}
+        values[MEDICATIONS] = sum(1 for _, taken in links if taken)
+        for metric, value in values.items():
+            if value is None:
+                continue
+            value = float(value)
+            rollup = rollups.get((month, metric))
+            if rollup is None:
+                rollup = rollups[month, metric] = {'user_id': user_id, 'month': month, 'metric': metric,
+                                                   'count': 0, 'total': 0.0, 'low': value, 'high': value}
+            rollup['count'] += 1
+            rollup['total'] += value
+            rollup['low'] = min(rollup['low'], value)
+            rollup['high'] = max(rollup['high'], value)
+    return list(rollups.values())
+
+
+def _in_year(year):
+    return EntryRollup.month.between(date(year, 1, 1), date(year, 12, 31))
+
+
+def _archive_year(user_id, year, rows):
+    """Move one year of the user's hot rows into its archive. Returns the entries archived."""
+    links = {}
+    for entry_id, medication_id, taken in db.session.execute(
+            select(_links.c.mood_entry_id, _links.c.medication_id, _links.c.taken)
+            .where(_links.c.mood_entry_id.in_([row['id'] for row in rows])).order_by(_links.c.id)):
+        links.setdefault(entry_id, []).append((medication_id, taken))
+    hot = [(dict(row), links.get(row['id'], [])) for row in rows]
+    entries = hot
+
+    existing = db.session.execute(
+        select(EntryArchive.data, EntryArchive.details)
+        .where(EntryArchive.user_id == user_id, EntryArchive.year == year).with_for_update()).one_or_none()
+    if existing is not None:
+        # Entries written into an archived year by a write that raced the archiver: the hot row wins.
+        dates = {row['entry_date'] for row, _ in hot}
+        entries = sorted([entry for entry in _unpack(user_id, year, *existing) if entry[0]['entry_date'] not in dates]
+                         + hot, key=lambda entry: entry[0]['entry_date'])
+
+    try:
+        data, details = _pack(year, entries)
+        same = _unpack(user_id, year, data, details) == entries
+    except (OverflowError, TypeError, ValueError):  # A value the blob layout can't hold
+        same = False
+    if not same:
+        logger.warning("Not archiving %s for user id %s: the archive doesn't round-trip", year, user_id)
+        return 0
+
+    ids = [row['id'] for row, _ in hot]
+    db.session.execute(delete(EntryArchive).where(EntryArchive.user_id == user_id, EntryArchive.year == year))
+    db.session.execute(insert(EntryArchive).values(user_id=user_id, year=year, entries=len(entries), data=data,
+                                                   details=details, archived_at=datetime.utcnow()))
+    db.session.execute(delete(EntryRollup).where(EntryRollup.user_id == user_id, _in_year(year)))
+    db.session.execute(insert(EntryRollup), _rollups(user_id, entries))
+    entry_stats.record(user_id, deleted=ids)
+    db.session.execute(delete(_links).where(_links.c.mood_entry_id.in_(ids)))
+    db.session.execute(delete(_entries).where(_entries.c.id.in_(ids)))
+    db.session.execute(delete(EntryYearBlob).where(EntryYearBlob.user_id == user_id, EntryYearBlob.year == year))
+    return len(hot)
+
+
+def archive_user(user_id, before_year):
+    """
+    Archive the user's entries dated before 1 January of before_year, a year
+    at a time. Returns the number of entries moved. The caller commits.
+    """
+    # Never the current year: the write paths only look for archives of past years.
+    before_year = min(before_year, date.today().year)
+    rows = db.session.execute(
+        select(_entries).where(_entries.c.user_id == user_id, _entries.c.entry_date < date(before_year, 1, 1))
+        .order_by(_entries.c.entry_date)).mappings().all()
+    if not rows:
+        return 0
+    # SQLite gives a new row the highest id + 1, so archiving the row that
+    # holds it would let a new entry take an archived id. It waits a run.
+    newest = db.session.execute(select(func.max(_entries.c.id))).scalar()
+    years = {}
+    for row in rows:
+        years.setdefault(row['entry_date'].year, []).append(row)
+    return sum(_archive_year(user_id, year, year_rows) for year, year_rows in sorted(years.items())
+               if all(row['id'] != newest for row in year_rows))
+
+
+def restore(user_id, year):
+    """
+    Move an archived year back into the hot tables. Returns the number of
+    entries restored (0 if the year isn't archived). The caller commits.
+    """
+    found = db.session.execute(
+        select(EntryArchive.data, EntryArchive.details)
+        .where(EntryArchive.user_id == user_id, EntryArchive.year == year).with_for_update()).one_or_none()
+    if found is None:
+        return 0
+    entries = _unpack(user_id, year, *found)
+    ids = [row['id'] for row, _ in entries if row['id'] is not None]
+    taken = set(db.session.execute(select(_entries.c.id).where(_entries.c.id.in_(ids))).scalars()) if ids else set()
+
+    restored, renumbered = [], {}
+    for row, links in entries:
+        if row['id'] is None or row['id'] in taken:
+            values = {name: value for name, value in row.items() if name != 'id'}
+            entry_id = db.session.execute(insert(_entries).values(values).returning(_entries.c.id)).scalar()
+            if row['id'] is not None:
+                renumbered[row['id']] = entry_id
+        else:
+            db.session.execute(insert(_entries).values(row))
+            entry_id = row['id']
+        restored.append((entry_id, row, links))
+    link_rows = [{'mood_entry_id': entry_id, 'medication_id': medication_id, 'taken': was_taken}
+                 for entry_id, _, links in restored for medication_id, was_taken in links]
+    if link_rows:
+        db.session.execute(insert(_links), link_rows)
+
+    db.session.execute(delete(EntryArchive).where(EntryArchive.user_id == user_id, EntryArchive.year == year))
+    db.session.execute(delete(EntryRollup).where(EntryRollup.user_id == user_id, _in_year(year)))
+    # Entries under a new id are new to clients, which also need the current
+    # state of whatever entry now holds the old id.
+    changelog.record(user_id, changelog.ENTRY,
+                     list(renumbered) + [entry_id for entry_id, row, _ in restored if row['id'] != entry_id])
+    entry_stats.record(user_id, {entry_id: row for entry_id, row, _ in restored},
+                       inserted=[entry_id for entry_id, _, _ in restored])
+    history.update_days(user_id, {row['entry_date']: row for _, row, _ in restored})
+    return len(restored)
+
+
+def restore_dates(user_id, dates):
+    """
+    Restore the archived years among `dates` before entries are written to
+    them. No query unless a date is in a past year. The caller commits.
+    """
+    this_year = date.today().year
+    years = {day.year for day in dates if day.year < this_year}
+    if not years:
+        return 0
+    archived = db.session.execute(select(EntryArchive.year).where(
+        EntryArchive.user_id == user_id, EntryArchive.year.in_(years))).scalars().all()
+    return sum(restore(user_id, year) for year in sorted(archived))
+
+
+def years(user_id):
+    """The user's archived years, oldest first."""
+    return db.session.execute(select(EntryArchive.year).where(EntryArchive.user_id == user_id)
+                              .order_by(EntryArchive.year)).scalars().all()
+
+
+def read(user_id, details=False):
+    """
+    The user's archived entries in history.read()'s format, or None when
+    nothing is archived. With details=True also 'id', 'notes' and
+    'medications' (the ids of the medications taken) lists.
+    """
+    query = select(EntryArchive.year, EntryArchive.data, *([EntryArchive.details] if details else []))
+    rows = db.session.execute(query.where(EntryArchive.user_id == user_id).order_by(EntryArchive.year)).all()
+    if not rows:
+        return None
+    columns = history.join_years((row.year, history.decode(zlib.decompress(row.data))) for row in rows)
+    if details:
+        columns.update(id=[], notes=[], medications=[])
+        for row in rows:
+            found = json.loads(zlib.decompress(row.details))
+            columns['id'].extend(found['ids'])
+            columns['notes'].extend(found['notes'])
+            columns['medications'].extend([medication for medication, taken in links if taken]
+                                          for links in found['medications'])
+    return columns
+
+
+def year_columns(user_id, year):
+    """(columns, medication links per entry) of an archived year as history.decode() gives them, or None."""
+    found = db.session.execute(select(EntryArchive.data, EntryArchive.details).where(
+        EntryArchive.user_id == user_id, EntryArchive.year == year)).one_or_none()
+    if found is None:
+        return None
+    return history.decode(zlib.decompress(found.data)), json.loads(zlib.decompress(found.details))['medications']
+
+
+def entries(user_id):
+    """The user's archived entries as (row, links) pairs in date order: row maps MoodEntry columns to values."""
+    found = []
+    for year, data, details in db.session.execute(
+            select(EntryArchive.year, EntryArchive.data, EntryArchive.details)
+            .where(EntryArchive.user_id == user_id).order_by(EntryArchive.year)):
+        found.extend(_unpack(user_id, year, data, details))
+    return found
+
+
+def summary(user_id):
+    """Archived months, newest first: [{'month': date, 'entries': n, 'means': {metric: mean}}]."""
+    months = {}
+    for month, metric, count, total in db.session.execute(
+            select(EntryRollup.month, EntryRollup.metric, EntryRollup.count, EntryRollup.total)
+            .where(EntryRollup.user_id == user_id)):
+        found = months.setdefault(month, {'month': month, 'entries': 0, 'means': {}})
+        found['means'][metric] = total / count
+        if metric == 'mood_level':
+            found['entries'] = count
+    return [months[month] for month in sorted(months, reverse=True)]
+
+
+def moved_details(details, medication_ids):
+    """
+    An archive's details for a copy on another shard: without entry ids, and
+    with medication ids mapped through `medication_ids` (old id -> new id).
+    """
+    found = json.loads(zlib.decompress(details))
+    found['ids'] = [None] * len(found['ids'])
+    found['medications'] = [[[medication_ids[medication], taken] for medication, taken in links
+                             if medication in medication_ids] for links in found['medications']]
+    return zlib.compress(json.dumps(found, separators=(',', ':')).encode())
+
+
+def _same_rollup(a, b):
+    return a['count'] == b['count'] and all(math.isclose(a[name], b[name]) for name in ('total', 'low', 'high'))
+
+
+def verify(user_id):
+    """Problems with the user's archives, as messages (empty when they are sound)."""
+    problems = []
+    stored = {(row.month, row.metric): row._asdict() for row in db.session.execute(
+        select(EntryRollup.month, EntryRollup.metric, EntryRollup.count, EntryRollup.total, EntryRollup.low,
+               EntryRollup.high).where(EntryRollup.user_id == user_id))}
+    expected = {}
+    archives = db.session.execute(
+        select(EntryArchive.year, EntryArchive.entries, EntryArchive.data, EntryArchive.details)
+        .where(EntryArchive.user_id == user_id).order_by(EntryArchive.year)).all()
+    hot_years = set()
+    if archives:
+        hot_years = {day.year for day in db.session.execute(select(_entries.c.entry_date).where(
+            _entries.c.user_id == user_id, _entries.c.entry_date < date(archives[-1].year + 1, 1, 1))).scalars()}
+    for year, count, data, details in archives:
+        try:
+            found = _unpack(user_id, year, data, details)
+        except (zlib.error, ValueError, KeyError) as e:
+            problems.append(f"{year}: unreadable ({e})")
+            continue
+        if len(found) != count:
+            problems.append(f"{year}: {len(found)} entries, {count} recorded")
+        if _unpack(user_id, year, *_pack(year, found)) != found:
+            problems.append(f"{year}: doesn't round-trip")
+        if year in hot_years:
+            problems.append(f"{year}: also has entries in mood_entry")
+        expected.update({(rollup['month'], rollup['metric']): rollup for rollup in _rollups(user_id, found)})
+    for key in sorted(set(stored) | set(expected)):
+        if key not in stored or key not in expected or not _same_rollup(stored[key], expected[key]):
+            problems.append(f"rollup {key[0]:%Y-%m} {key[1]}: doesn't match the archive")
+    return problems
+
+
+def _user_ids(before_year=None):
+    """Users with entries before before_year (hot ones) or, without it, with archives."""
+    ids = set()
+    for shard in sharding.shards():
+        with sharding.use_shard(shard):
+            if before_year is None:
+                ids.update(db.session.execute(select(EntryArchive.user_id).distinct()).scalars())
+            else:
+                ids.update(db.session.execute(select(_entries.c.user_id).distinct().where(
+                    _entries.c.entry_date < date(before_year, 1, 1))).scalars())
+    return sorted(ids)
+
+
+def run(after_days=None, today=None):
+    """Archive every user's old years, committing per user. Returns a summary."""
+    before_year = cutoff_year(today, after_days)
+    result = {'before_year': before_year, 'users': 0, 'entries': 0}
+    if before_year is None:
+        return result
+    for user_id in _user_ids(before_year):
+        sharding.bind_user(user_id)
+        moved = archive_user(user_id, before_year)
+        db.session.commit()
+        if moved:
+            result['users'] += 1
+            result['entries'] += moved
+    return result
+
+
+@jobs.handler(ARCHIVE_JOB)
+def archive_job(job):
+    return json.dumps(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old entries to cold storage, restore or check them")
+    parser.add_argument('--archive', action='store_true', help="Archive years older than the horizon now")
+    parser.add_argument('--after-days', type=int, help="Horizon in days (default ARCHIVE_AFTER_DAYS)")
+    parser.add_argument('--verify', action='store_true', help="Check archives unpack and match their rollups")
+    parser.add_argument('--restore', type=int, metavar='YEAR', help="Move a year back to the hot tables")
+    parser.add_argument('--user-id', type=int, help="Only this user (required with --restore)")
+    args = parser.parse_args()
+    if not (args.archive or args.verify or args.restore):
+        parser.error("nothing to do: pass --archive, --verify and/or --restore")
+    if args.restore and not args.user_id:
+        parser.error("--restore needs --user-id")
+
+    from app import create_app
+
+    app = create_app({'JOB_WORKER_THREADS': 0})
+    with app.app_context():
+        if args.restore:
+            sharding.bind_user(args.user_id)
+            print(f"User {args.user_id}: restored {restore(args.user_id, args.restore)} entries")
+            db.session.commit()
+        if args.archive:
+            if args.user_id:
+                before_year = cutoff_year(after_days=args.after_days)
+                if before_year is None:
+                    parser.error("archiving is off: set ARCHIVE_AFTER_DAYS or pass --after-days")
+                sharding.bind_user(args.user_id)
+                result = {'users': 1, 'entries': archive_user(args.user_id, before_year)}
+                db.session.commit()
+            else:
+                result = run(args.after_days)
+                if result['before_year'] is None:
+                    parser.error("archiving is off: set ARCHIVE_AFTER_DAYS or pass --after-days")
+            print(f"Archived {result['entries']} entries of {result['users']} user(s)")
+        bad_users = 0
+        if args.verify:
+            for user_id in [args.user_id] if args.user_id else _user_ids():
+                sharding.bind_user(user_id)
+                problems = verify(user_id)
+                if problems:
+                    bad_users += 1
+                    print(f"User {user_id}: {len(problems)} problem(s), first: {problems[0]}")
+    return 1 if bad_users else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
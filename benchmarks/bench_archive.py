@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Hot-path benchmark for cold storage of old entries (archive.py).
+For each history length, loads a few users with that many years of daily
+entries (datagen) and times the per-user reads that scan the hot tables,
+/manage, /data and building the /visualize figure, before and after
+archiving everything older than --after-days. Also reports the bytes the
+hot tables and their indexes take (SQLite dbstat), the archive's size, and
+how long archiving and verifying took.
+
+Usage: python benchmarks/bench_archive.py [--years 2 5 10] [--users 3] [--after-days 365] [--repeat 20] [--json PATH]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import datagen
+
+HOT_TABLES = ('mood_entry', 'mood_entry_medication', 'sqlite_autoindex_mood_entry_1',
+              'ix_mood_entry_medication_mood_entry_id')
+COLD_TABLES = ('entry_archive', 'entry_rollup', 'sqlite_autoindex_entry_archive_1', 'sqlite_autoindex_entry_rollup_1')
+
+
+def table_bytes(names):
+    from sqlalchemy import bindparam, text
+
+    from models import db
+
+    return db.session.execute(text("SELECT coalesce(sum(pgsize), 0) FROM dbstat WHERE name IN :names")
+                              .bindparams(bindparam('names', expanding=True)), {'names': list(names)}).scalar()
+
+
+def measure(app, client, user_id, repeat):
+    """Median ms of each hot-path read."""
+    from app import mood_graph_job
+    from models import db
+
+    def figure():
+        with app.app_context():
+            mood_graph_job(SimpleNamespace(user_id=user_id, progress=lambda fraction: None))
+
+    reads = {
+        'manage': lambda: client.get('/manage'),
+        'data': lambda: client.get('/data'),
+        'figure': figure,
+    }
+    result = {}
+    for name, read in reads.items():
+        read()  # Warm up
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            read()
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+        result[f'{name}_ms'] = round(samples[len(samples) // 2] * 1000, 3)
+    with app.app_context():
+        db.session.remove()
+    return result
+
+
+def run(years, users, after_days, repeat):
+    from app import create_app
+    import archive
+    from models import db, User
+
+    workdir = tempfile.mkdtemp(prefix='mood_archive_')
+    try:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'archive.db'),
+            'LOG_DIR': os.path.join(workdir, 'logs'),
+            'LOG_CONSOLE': False,
+            'METRICS_DIR': os.path.join(workdir, 'metrics'),
+            'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+            'PREWARM_PLOTLY': False,
+            'JOB_WORKER_THREADS': 0,
+        })
+        with app.app_context():
+            summary = datagen.populate(users=users, years=years, seed=42)
+            username = summary['users'][0]
+            user_id = db.session.execute(db.select(User.id).where(User.username == username)).scalar()
+        client = app.test_client()
+        client.post('/login', data={'username': username, 'password': datagen.PASSWORD})
+
+        result = {'years': years, 'entries': summary['counts']['entries']}
+        with app.app_context():
+            result['hot_bytes_before'] = table_bytes(HOT_TABLES)
+        result['before'] = measure(app, client, user_id, repeat)
+        with app.app_context():
+            started = time.perf_counter()
+            moved = archive.run(after_days=after_days)
+            result['archive_s'] = round(time.perf_counter() - started, 3)
+            result['archived_entries'] = moved['entries']
+            started = time.perf_counter()
+            problems = sum(len(archive.verify(uid)) for uid in archive._user_ids())
+            result['verify_s'] = round(time.perf_counter() - started, 3)
+            result['verify_problems'] = problems
+            db.session.execute(db.text('VACUUM'))
+            result['hot_bytes_after'] = table_bytes(HOT_TABLES)
+            result['cold_bytes'] = table_bytes(COLD_TABLES)
+        result['after'] = measure(app, client, user_id, repeat)
+    finally:
+        import logging_setup
+        logging_setup.shutdown_logging()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--years', type=float, nargs='+', default=[2, 5, 10])
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--after-days', type=int, default=365, help="Archive years that ended this long ago")
+    parser.add_argument('--repeat', type=int, default=20, help="Timed reads per path")
+    parser.add_argument('--json', dest='json_path', help="Write the results as JSON")
+    args = parser.parse_args()
+
+    results = [run(years, args.users, args.after_days, args.repeat) for years in args.years]
+    print(f"{'':>15} {'/manage ms':^15} {'/data ms':^15} {'figure ms':^17} {'hot tables KiB':^17} "
+          f"{'cold':>6} {'archive':>8} {'verify':>7}")
+    print(f"{'years':>5} {'archived':>9} {'before':>7} {'after':>7} {'before':>7} {'after':>7} "
+          f"{'before':>8} {'after':>8} {'before':>8} {'after':>8} {'KiB':>6} {'s':>8} {'s':>7}")
+    for r in results:
+        before, after = r['before'], r['after']
+        print(f"{r['years']:>5g} {r['archived_entries']:>9} {before['manage_ms']:>7.1f} {after['manage_ms']:>7.1f} "
+              f"{before['data_ms']:>7.1f} {after['data_ms']:>7.1f} {before['figure_ms']:>8.1f} "
+              f"{after['figure_ms']:>8.1f} {r['hot_bytes_before'] / 1024:>8.0f} {r['hot_bytes_after'] / 1024:>8.0f} "
+              f"{r['cold_bytes'] / 1024:>6.0f} {r['archive_s']:>8.2f} {r['verify_s']:>7.2f}")
+        if r['verify_problems']:
+            print(f"      verify found {r['verify_problems']} problem(s)")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
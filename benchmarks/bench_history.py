@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Read benchmark for the columnar entry history (history.py).
+For each history length, loads one user with that many years of daily
+entries (datagen), builds their year blobs and compares reading everything
+through the ORM (MoodEntry objects) with decoding the blobs into NumPy
+arrays, both as raw columns and as /data's JSON records. Reports median
+latency and peak Python memory (tracemalloc) per read, plus the blob size.
+
+Usage: python benchmarks/bench_history.py [--years 1 2 5 10 20] [--repeat 20] [--json PATH]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import datagen
+
+
+def orm_columns(user_id):
+    from models import MoodEntry
+
+    return MoodEntry.query.filter_by(user_id=user_id).all()
+
+
+def orm_data(user_id):
+    entries = orm_columns(user_id)
+    return [{
+        'date': entry.entry_date.strftime('%Y-%m-%d'), 'mood': entry.mood_level,
+        'hours_slept': entry.hours_slept, 'anxiety': entry.anxiety, 'energy': entry.energy_level,
+        'irritability': entry.irritability, 'weight': entry.weight if entry.weight else None,
+    } for entry in entries]
+
+
+def columnar_columns(user_id):
+    import history
+
+    return history.read(user_id)
+
+
+def columnar_data(user_id):
+    from app import history_data
+
+    return history_data(user_id)
+
+
+READS = {
+    'orm': orm_columns,
+    'columnar': columnar_columns,
+    'orm_data': orm_data,
+    'columnar_data': columnar_data,
+}
+
+
+def measure(read, user_id, repeat):
+    """(median ms, peak KiB) for one read, each run in a fresh session."""
+    from models import db
+
+    samples = []
+    for _ in range(repeat):
+        db.session.remove()
+        started = time.perf_counter()
+        read(user_id)
+        samples.append(time.perf_counter() - started)
+    db.session.remove()
+    tracemalloc.start()
+    read(user_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    samples.sort()
+    return round(samples[len(samples) // 2] * 1000, 3), round(peak / 1024, 1)
+
+
+def run(years, repeat):
+    from app import create_app
+    import history
+    from models import db, EntryYearBlob, MoodEntry, User
+
+    workdir = tempfile.mkdtemp(prefix='mood_history_')
+    try:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'history.db'),
+            'COLUMNAR_HISTORY': True,
+            'LOG_DIR': os.path.join(workdir, 'logs'),
+            'LOG_CONSOLE': False,
+            'METRICS_DIR': os.path.join(workdir, 'metrics'),
+            'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+            'PREWARM_PLOTLY': False,
+            'JOB_WORKER_THREADS': 0,
+        })
+        with app.app_context():
+            datagen.populate(users=1, years=years, seed=42)
+            user_id = db.session.query(User.id).scalar()
+            history.rebuild(user_id)
+            db.session.commit()
+            result = {
+                'years': years,
+                'entries': MoodEntry.query.count(),
+                'blob_bytes': sum(len(data) for (data,) in db.session.query(EntryYearBlob.data)),
+            }
+            for name, read in READS.items():
+                result[f'{name}_ms'], result[f'{name}_kib'] = measure(read, user_id, repeat)
+    finally:
+        import logging_setup
+        logging_setup.shutdown_logging()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 2, 5, 10, 20])
+    parser.add_argument('--repeat', type=int, default=20, help="Timed reads per path")
+    parser.add_argument('--json', dest='json_path', help="Write the results as JSON")
+    args = parser.parse_args()
+
+    results = [run(years, args.repeat) for years in args.years]
+    print(f"{'':>14} {'read all entries':^31} {'/data records':^31}")
+    print(f"{'years':>5} {'entries':>8} {'orm ms':>8} {'KiB':>7} {'col ms':>7} {'KiB':>6} "
+          f"{'orm ms':>8} {'KiB':>7} {'col ms':>7} {'KiB':>6} {'blob KiB':>9}")
+    for r in results:
+        print(f"{r['years']:>5} {r['entries']:>8} {r['orm_ms']:>8.2f} {r['orm_kib']:>7.0f} "
+              f"{r['columnar_ms']:>7.2f} {r['columnar_kib']:>6.0f} {r['orm_data_ms']:>8.2f} {r['orm_data_kib']:>7.0f} "
+              f"{r['columnar_data_ms']:>7.2f} {r['columnar_data_kib']:>6.0f} {r['blob_bytes'] / 1024:>9.0f}")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Benchmark the log index against full scans on a synthetic rotation set.
+Generates mood_tracker.log plus .1-.5 backups totalling --size-mb of lines in
+the application's format, spanning several months and --users users.
+
+Usage: python benchmarks/bench_log_index.py [--size-mb 1024] [--users 2000] [--dir PATH]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_reader
+from log_index import LogIndex
+
+MESSAGES = [
+    "Index page accessed by user: {user}",
+    "Mood entry submission attempt by user: {user}",
+    "Mood entry created successfully - user: {user}, entry_id: {n}, date: 2024-01-01",
+    "Manage entries page accessed by user: {user}",
+    "Visualization page accessed by user: {user}",
+    "Login attempt for username: {user}",
+    "Login successful - username: {user}, user_id: {uid}",
+    '{{"type":"request","request_id":"{n:032x}","method":"GET","path":"/visualize",'
+    '"endpoint":"visualize","status":200,"duration_ms":12.5,"db_time_ms":1.2,"sql_count":3,'
+    '"response_bytes":10240,"user_id":{uid}}}',
+]
+
+
+def generate(log_dir, size_mb, users, seed=42):
+    """Write a rotation set of about size_mb megabytes; returns (first, last) timestamps."""
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    per_file = target // 6
+    start = datetime(2024, 1, 1)
+    # Spread the whole corpus over ~120 days.
+    step = timedelta(days=120) / max(1, target // 110)
+    stamp = start
+    n = 0
+    for suffix in ('.5', '.4', '.3', '.2', '.1', ''):
+        path = os.path.join(log_dir, f'mood_tracker.log{suffix}')
+        written = 0
+        with open(path, 'w', encoding='utf-8') as f:
+            buffer = []
+            while written < per_file:
+                uid = rng.randrange(1, users + 1)
+                message = rng.choice(MESSAGES).format(user=f'user{uid}', uid=uid, n=n)
+                logger = 'mood_tracker.requests' if message.startswith('{') else 'mood_tracker'
+                line = f"{stamp.strftime('%Y-%m-%d %H:%M:%S')},{stamp.microsecond // 1000:03d} - {logger} - INFO - {message}\n"
+                buffer.append(line)
+                written += len(line)
+                stamp += step
+                n += 1
+                if len(buffer) >= 10000:
+                    f.write(''.join(buffer))
+                    buffer = []
+            f.write(''.join(buffer))
+    return start, stamp
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label}: {elapsed:.3f}s")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size-mb', type=int, default=1024)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--dir', help="directory for the synthetic logs (default: a temp dir)")
+    args = parser.parse_args()
+
+    log_dir = args.dir or tempfile.mkdtemp(prefix='log_index_bench_')
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, 'mood_tracker.log')
+    try:
+        print(f"Generating {args.size_mb} MB of logs in {log_dir} ...")
+        first, last = generate(log_dir, args.size_mb, args.users)
+        middle = first + (last - first) / 2
+        day_start = middle.strftime('%Y-%m-%d')
+        day_end = (middle + timedelta(days=1)).strftime('%Y-%m-%d')
+        user = f'user{args.users // 2}'
+
+        print("Index:")
+        with LogIndex(log_file) as index:
+            timed("initial build", index.update)
+            timed("no-op update", index.update)
+            with open(log_file, 'a', encoding='utf-8') as f:
+                stamp = last.strftime('%Y-%m-%d %H:%M:%S')
+                f.write(''.join(f"{stamp},000 - mood_tracker - INFO - Index page accessed by user: {user}\n"
+                                for _ in range(1000)))
+            timed("incremental update (1000 new lines)", index.update)
+            stats = index.stats()
+            print(f"  index size: {stats['size_bytes'] / (1024 * 1024):.1f} MB")
+
+            print(f"Per-user query ({user}):")
+            indexed, t_index = timed("index", lambda: sum(1 for _ in index.user_lines(user)))
+            scanned, t_scan = timed("full scan", lambda: sum(
+                1 for line in log_reader.iter_lines(log_file) if f'{user},' in line or line.rstrip().endswith(user)))
+            print(f"  lines: index {indexed}, scan {scanned}, speedup {t_scan / t_index:.1f}x")
+
+            print(f"Time range query ({day_start} .. {day_end}):")
+            indexed, t_index = timed("index", lambda: sum(1 for _ in index.time_range(day_start, day_end)))
+            scanned, t_scan = timed("full scan", lambda: sum(
+                1 for line in log_reader.iter_lines(log_file) if day_start <= line[:19] < day_end))
+            print(f"  lines: index {indexed}, scan {scanned}, speedup {t_scan / t_index:.1f}x")
+    finally:
+        if not args.dir:
+            shutil.rmtree(log_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark request throughput with logging enabled.
+Compares the old synchronous handlers (eager f-string messages) against the
+queued pipeline from logging_setup (lazy %-style messages).
+
+Usage: python benchmarks/bench_logging.py [--requests 5000] [--threads 4]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+import logging_setup
+
+
+def setup_sync_logging(log_dir):
+    """The pre-queue setup: handlers attached directly to the root logger."""
+    formatter = logging.Formatter(logging_setup.LOG_FORMAT)
+    file_handler = RotatingFileHandler(os.path.join(log_dir, 'mood_tracker.log'),
+                                       maxBytes=10240000, backupCount=5)
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(formatter)
+    error_handler = RotatingFileHandler(os.path.join(log_dir, 'errors.log'),
+                                        maxBytes=10240000, backupCount=5)
+    error_handler.setLevel(logging.ERROR)
+    error_handler.setFormatter(formatter)
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(file_handler)
+    root_logger.addHandler(error_handler)
+    return [file_handler, error_handler]
+
+
+def build_app(mode):
+    """Tiny app whose route logs like the real ones do."""
+    app = Flask(__name__)
+    logger = logging.getLogger('mood_tracker')
+    username = 'bench_user'
+
+    if mode == 'sync':
+        @app.route('/')
+        def index():
+            logger.info(f"Index page accessed by user: {username}")
+            logger.debug(f"Loaded medications for user: {username}")
+            logger.info(f"Mood entry created successfully - user: {username}, entry_id: {42}, date: {'2024-01-01'}")
+            return 'ok'
+    else:
+        @app.route('/')
+        def index():
+            logger.info("Index page accessed by user: %s", username)
+            logger.debug("Loaded medications for user: %s", username)
+            logger.info("Mood entry created successfully - user: %s, entry_id: %s, date: %s", username, 42, '2024-01-01')
+            return 'ok'
+    return app
+
+
+def run(app, total_requests, threads):
+    """Issue requests from several threads and return requests per second."""
+    per_thread = total_requests // threads
+
+    def worker():
+        client = app.test_client()
+        for _ in range(per_thread):
+            client.get('/')
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    results = {}
+    with tempfile.TemporaryDirectory() as log_dir:
+        handlers = setup_sync_logging(log_dir)
+        results['sync'] = run(build_app('sync'), args.requests, args.threads)
+        for handler in handlers:
+            logging.getLogger().removeHandler(handler)
+            handler.close()
+
+        logging_setup.setup_logging(log_dir, console=False)
+        results['queue'] = run(build_app('queue'), args.requests, args.threads)
+        logging_setup.shutdown_logging()
+
+    print(f"Requests: {args.requests}, threads: {args.threads}")
+    print(f"  before (synchronous handlers): {results['sync']:.0f} req/s")
+    print(f"  after  (queued pipeline):      {results['queue']:.0f} req/s")
+    print(f"  speedup: {results['queue'] / results['sync']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
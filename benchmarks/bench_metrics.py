@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark the overhead of the metrics subsystem.
+Measures the cost of a single histogram observation and the per-request cost
+of the request tracking + metrics hooks on a minimal Flask app.
+
+Usage: python benchmarks/bench_metrics.py [--requests 5000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+import metrics
+import request_logging
+
+
+def build_app(instrumented, metrics_dir):
+    app = Flask(__name__)
+    app.config['REQUEST_LOG_ENABLED'] = False
+    app.config['METRICS_DIR'] = metrics_dir
+
+    @app.route('/')
+    def index():
+        return 'ok'
+
+    if instrumented:
+        request_logging.init_app(app)
+        metrics.init_app(app)
+    return app
+
+
+def time_requests(app, total_requests):
+    client = app.test_client()
+    for _ in range(200):
+        client.get('/')
+    start = time.perf_counter()
+    for _ in range(total_requests):
+        client.get('/')
+    return (time.perf_counter() - start) / total_requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    registry = metrics.Registry()
+    labels = (('route', 'visualize'),)
+    iterations = 200000
+    start = time.perf_counter()
+    for i in range(iterations):
+        registry.observe('http_request_duration_seconds', labels, (i % 1000) / 1000)
+    observe_ns = (time.perf_counter() - start) / iterations * 1e9
+
+    with tempfile.TemporaryDirectory() as metrics_dir:
+        plain = time_requests(build_app(False, metrics_dir), args.requests)
+        instrumented = time_requests(build_app(True, metrics_dir), args.requests)
+
+        start = time.perf_counter()
+        metrics.render_prometheus(metrics_dir)
+        render_ms = (time.perf_counter() - start) * 1000
+
+    print(f"Histogram observe: {observe_ns:.0f} ns")
+    print(f"Request without instrumentation: {plain * 1e6:.1f} us")
+    print(f"Request with request tracking + metrics: {instrumented * 1e6:.1f} us")
+    print(f"Overhead per request: {(instrumented - plain) * 1e6:.1f} us "
+          f"({(instrumented / plain - 1) * 100:.1f}%)")
+    print(f"/metrics render: {render_ms:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
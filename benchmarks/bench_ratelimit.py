@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark the overhead of the login and registration rate limits.
+Times one ratelimit.attempt() with the memory and database stores, a failed
+/login POST with the limits off and on, and a refused one (429), and
+measures the memory store's bytes per tracked key.
+
+Usage: python benchmarks/bench_ratelimit.py [--requests 200] [--keys 100000]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ratelimit
+
+
+def build_app(workdir, name, **config):
+    from app import create_app
+
+    return create_app(dict({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, f'{name}.db'),
+        'LOG_DIR': os.path.join(workdir, 'logs'),
+        'LOG_CONSOLE': False,
+        'METRICS_DIR': os.path.join(workdir, 'metrics'),
+        'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+        'PREWARM_PLOTLY': False,
+        'JOB_WORKER_THREADS': 0,
+    }, **config))
+
+
+def time_attempts(app, iterations):
+    """Mean µs of an allowed attempt, each from its own address."""
+    with app.test_request_context():
+        start = time.perf_counter()
+        for number in range(iterations):
+            ratelimit.attempt(ratelimit.LOGIN_IP, f'10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}')
+        return (time.perf_counter() - start) / iterations * 1e6
+
+
+def time_logins(app, requests, address='10.0.0.1'):
+    """Mean ms of a failed /login POST for an existing user."""
+    client = app.test_client()
+    form = {'username': 'alice', 'password': 'wrong'}
+    client.post('/login', data=form, environ_base={'REMOTE_ADDR': address})  # Warm up
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.post('/login', data=form, environ_base={'REMOTE_ADDR': address})
+    return (time.perf_counter() - start) / requests * 1000, response.status_code
+
+
+def bytes_per_key(keys):
+    store = ratelimit.MemoryStore(keys)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for number in range(keys):
+        store.attempt(ratelimit._key(ratelimit.LOGIN_USERNAME, f'user{number}'), 10, 300, 1000.0)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=200, help="Timed /login POSTs per case")
+    parser.add_argument('--keys', type=int, default=100000, help="Keys for the memory measurement")
+    args = parser.parse_args()
+
+    from models import db, User
+
+    workdir = tempfile.mkdtemp(prefix='mood_ratelimit_')
+    try:
+        unlimited = {'LOGIN_LIMIT_PER_IP': 0, 'LOGIN_LIMIT_PER_USERNAME': 0}
+        high = {'LOGIN_LIMIT_PER_IP': 10 ** 9, 'LOGIN_LIMIT_PER_USERNAME': 10 ** 9}
+        apps = {
+            'off': build_app(workdir, 'memory', **unlimited),
+            'memory': build_app(workdir, 'memory', **high),
+            'database': build_app(workdir, 'database', RATE_LIMIT_STORE='database', **high),
+        }
+        for app in apps.values():
+            with app.app_context():
+                if not User.query.filter_by(username='alice').first():
+                    user = User(username='alice', email='alice@example.com')
+                    user.set_password('password')
+                    db.session.add(user)
+                    db.session.commit()
+
+        memory_us = time_attempts(apps['memory'], 100000)
+        database_us = time_attempts(apps['database'], 2000)
+        logins = {name: time_logins(app, args.requests)[0] for name, app in apps.items()}
+        refused = build_app(workdir, 'memory', LOGIN_LIMIT_PER_IP=1)
+        refused_ms, status = time_logins(refused, args.requests)
+        assert status == 429, status
+    finally:
+        import logging_setup
+        logging_setup.shutdown_logging()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"attempt(), memory store: {memory_us:.1f} us")
+    print(f"attempt(), database store: {database_us:.1f} us")
+    for name in ('memory', 'database'):
+        print(f"Failed /login, limits off: {logins['off']:.2f} ms; {name} store: {logins[name]:.2f} ms "
+              f"({(logins[name] / logins['off'] - 1) * 100:+.1f}%)")
+    print(f"Refused /login (429): {refused_ms:.2f} ms")
+    print(f"Memory store: {bytes_per_key(args.keys):.0f} bytes per key at {args.keys} keys")
+
+
+if __name__ == '__main__':
+    main()
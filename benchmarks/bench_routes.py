@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of every Mood Tracker route.
+Loads a seeded synthetic dataset into a throwaway SQLite database, then:
+  1. drives each route through the Flask test client and records latency
+     percentiles, throughput, SQL statements per request, response size and
+     peak Python allocations (tracemalloc), the same for the job that builds
+     the /visualize figure (mood_graph, run directly), and
+  2. runs a multi-threaded HTTP load test against a real server socket with
+     a mixed read/write workload.
+Results are written as JSON (keyed by git commit) for comparison between commits.
+
+Usage: python benchmarks/bench_routes.py [--users 20] [--years 2] [--iterations 50]
+                                         [--threads 8] [--duration 10] [--output PATH]
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import datagen
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+# Not a route: the handler of the job /visualize queues, run directly, since
+# building the figure is no longer part of the request.
+FIGURE_JOB = 'mood_graph'
+ROUTES = ['index', 'login_page', 'login', 'submit', 'manage', 'edit', 'data', 'visualize', FIGURE_JOB]
+# Relative weights of the HTTP load mix (logins are rare, reads dominate).
+HTTP_MIX = {'index': 20, 'manage': 15, 'data': 20, 'visualize': 15, 'edit': 10, 'submit': 5, 'login_page': 10, 'login': 5}
+
+
+def load_app(workdir):
+    """Build the app against a fresh database and log directory under workdir."""
+    from app import create_app
+
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+        'LOG_DIR': os.path.join(workdir, 'logs'),
+        # Keep the file handlers (their cost is part of every request) but not the console.
+        'LOG_CONSOLE': False,
+        'METRICS_DIR': os.path.join(workdir, 'metrics'),
+        'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+        # A background plotly import would be timed as part of whichever requests it overlaps.
+        'PREWARM_PLOTLY': False,
+        # Likewise a figure built by a background job thread; /visualize is timed as the request itself.
+        'JOB_WORKER_THREADS': 0,
+        # The login route is timed hundreds of times from one address.
+        'LOGIN_LIMIT_PER_IP': 0,
+    })
+
+
+class SqlCounter:
+    """Counts statements executed on the app's engine."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'after_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+class Workload:
+    """Builds requests for each route for one synthetic user."""
+
+    def __init__(self, dataset, username, seed):
+        self.rng = random.Random(seed)
+        self.username = username
+        self.entry_ids = dataset['entry_ids'][username]
+        self.first_entry_date = date.fromisoformat(dataset['first_date'])
+        self.medication_ids = dataset['medication_ids'][username]
+        self.next_new_date = self.first_entry_date - timedelta(days=1)
+        self.lock = threading.Lock()
+
+    def request(self, route):
+        """Return (method, path, form) for a route."""
+        if route == 'index':
+            return 'GET', '/', None
+        if route == 'manage':
+            return 'GET', '/manage', None
+        if route == 'data':
+            return 'GET', '/data', None
+        if route == 'visualize':
+            return 'GET', '/visualize', None
+        if route == 'login_page':
+            return 'GET', '/login', None
+        if route == 'login':
+            return 'POST', '/login', {'username': self.username, 'password': datagen.PASSWORD}
+        if route == 'submit':
+            # New entries go before the generated history so dates never collide.
+            with self.lock:
+                entry_date = self.next_new_date
+                self.next_new_date -= timedelta(days=1)
+            return 'POST', '/submit', datagen.entry_form(self.rng, entry_date, self.medication_ids)
+        if route == 'edit':
+            index = self.rng.randrange(len(self.entry_ids))
+            entry_date = self.first_entry_date + timedelta(days=index)
+            form = datagen.entry_form(self.rng, entry_date)
+            return 'POST', f"/edit/{self.entry_ids[index]}", form
+        raise ValueError(f"unknown route: {route}")
+
+
+def percentiles(samples):
+    """Latency summary in milliseconds from a list of seconds."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pick(pct):
+        return round(ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': pick(50), 'p90_ms': pick(90), 'p95_ms': pick(95), 'p99_ms': pick(99),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def _login(client, username):
+    response = client.post('/login', data={'username': username, 'password': datagen.PASSWORD})
+    assert response.status_code == 302, f"login failed for {username}: {response.status_code}"
+
+
+def _caller(app, workload, route):
+    """A function that serves one request of a route (or runs the figure job) and returns the response bytes."""
+    if route == FIGURE_JOB:
+        return _figure_job_caller(app, workload)
+    authenticated = route not in ('login', 'login_page')
+    client = app.test_client()
+    if authenticated:
+        _login(client, workload.username)
+
+    def call():
+        method, path, form = workload.request(route)
+        target = client if authenticated else app.test_client()
+        response = target.get(path) if method == 'GET' else target.post(path, data=form)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{route}: HTTP {response.status_code}")
+        return response.get_data()
+    return call
+
+
+def _figure_job_caller(app, workload):
+    from types import SimpleNamespace
+
+    import sharding
+    from app import mood_graph_job
+    from models import db, User
+
+    with app.app_context():
+        user_id = db.session.execute(db.select(User.id).where(User.username == workload.username)).scalar()
+    job = SimpleNamespace(id=None, kind=FIGURE_JOB, user_id=user_id, params={}, progress=lambda fraction: None)
+
+    def call():
+        # As jobs.run_next() runs it: its own app context, the user's shard bound.
+        with app.app_context():
+            sharding.bind_user(user_id)
+            return mood_graph_job(job).encode()
+    return call
+
+
+def measure_route(app, workload, route, iterations, sql_counter, warmup=3):
+    """Time one route through the test client; returns latencies and per-request SQL counts."""
+    call = _caller(app, workload, route)
+    for _ in range(warmup):
+        call()
+
+    latencies, sql_counts, sizes = [], [], []
+    for _ in range(iterations):
+        before = sql_counter.count
+        start = time.perf_counter()
+        body = call()
+        latencies.append(time.perf_counter() - start)
+        sql_counts.append(sql_counter.count - before)
+        sizes.append(len(body))
+    return latencies, sql_counts, sizes
+
+
+def measure_memory(app, workload, route, iterations=3):
+    """Peak traced Python allocation (KB) while serving one request of a route."""
+    call = _caller(app, workload, route)
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(iterations):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            call()
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return round(max(peaks) / 1024, 1)
+
+
+def run_client_benchmark(app, dataset, routes, iterations, seed=42, memory=True):
+    """Benchmark each route through the test client. Returns {route: result}."""
+    from models import db
+
+    with app.app_context():
+        sql_counter = SqlCounter(db.engine)
+    users = dataset['users']
+    results = {}
+    for route in routes:
+        # /submit grows its user's history, so it writes as a different user
+        # than the read routes measure (keeps their results repeatable).
+        username = users[1] if route == 'submit' and len(users) > 1 else users[0]
+        workload = Workload(dataset, username, seed)
+        route_iterations = max(3, iterations // 10) if route == 'login' else iterations
+        start = time.perf_counter()
+        latencies, sql_counts, sizes = measure_route(app, workload, route, route_iterations, sql_counter)
+        elapsed = time.perf_counter() - start
+        result = percentiles(latencies)
+        result.update({
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'sql_per_request': sorted(sql_counts)[len(sql_counts) // 2],
+            'sql_max': max(sql_counts),
+            'response_bytes': sorted(sizes)[len(sizes) // 2],
+            'samples_ms': [round(value * 1000, 3) for value in latencies],
+        })
+        if memory:
+            result['peak_alloc_kb'] = measure_memory(app, workload, route)
+        results[route] = result
+    return results
+
+
+class HttpClient:
+    """One simulated browser: its own cookie jar, no automatic redirects."""
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self._NoRedirect)
+
+    def send(self, method, path, form=None):
+        data = urllib.parse.urlencode(form, doseq=True).encode() if form is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+def run_http_benchmark(app, dataset, threads, duration, seed=42):
+    """Mixed workload from several threads against a threaded WSGI server."""
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    routes = list(HTTP_MIX)
+    weights = [HTTP_MIX[route] for route in routes]
+
+    def worker(index):
+        username = dataset['users'][index % len(dataset['users'])]
+        # Each thread gets its own slice of dates for /submit.
+        workload = Workload(dataset, username, seed + index)
+        workload.next_new_date -= timedelta(days=10000 * (index // len(dataset['users'])))
+        rng = random.Random(seed + index)
+        client = HttpClient(base_url)
+        client.send(*workload.request('login'))
+        local = defaultdict(list)
+        local_errors = defaultdict(int)
+        while time.perf_counter() < deadline:
+            route = rng.choices(routes, weights)[0]
+            method, path, form = workload.request(route)
+            if route in ('login', 'login_page'):
+                sender = HttpClient(base_url)
+            else:
+                sender = client
+            start = time.perf_counter()
+            status = sender.send(method, path, form)
+            local[route].append(time.perf_counter() - start)
+            if status >= 400:
+                local_errors[route] += 1
+        with lock:
+            for route, values in local.items():
+                latencies[route].extend(values)
+            for route, count in local_errors.items():
+                errors[route] += count
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        'threads': threads,
+        'duration_s': round(elapsed, 2),
+        'requests': total,
+        'errors': sum(errors.values()),
+        'throughput_rps': round(total / elapsed, 2),
+        'routes': {route: dict(percentiles(values), errors=errors.get(route, 0))
+                   for route, values in sorted(latencies.items())},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def peak_rss_kb():
+    # ru_maxrss is KB on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def print_table(results):
+    print(f"{'route':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'SQL':>5} {'KB out':>8} {'alloc KB':>9}")
+    for route, r in results.items():
+        print(f"{route:<12} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} "
+              f"{r['throughput_rps']:>8.1f} {r['sql_per_request']:>5} {r['response_bytes'] / 1024:>8.1f} "
+              f"{r.get('peak_alloc_kb', 0):>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=50, help="Test client requests per route")
+    parser.add_argument('--routes', nargs='+', choices=ROUTES, default=ROUTES)
+    parser.add_argument('--threads', type=int, default=8, help="HTTP load threads (0 skips the load test)")
+    parser.add_argument('--duration', type=float, default=10, help="HTTP load test length in seconds")
+    parser.add_argument('--output', help="JSON result path (default benchmarks/results/routes-<commit>.json)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mood_bench_')
+    try:
+        app = load_app(workdir)
+        start = time.perf_counter()
+        with app.app_context():
+            dataset = datagen.populate(args.users, args.years, seed=args.seed)
+        print(f"Generated {dataset['counts']} in {time.perf_counter() - start:.1f}s")
+
+        client_results = run_client_benchmark(app, dataset, args.routes, args.iterations, args.seed)
+        print_table(client_results)
+
+        http_results = None
+        if args.threads > 0:
+            http_results = run_http_benchmark(app, dataset, args.threads, args.duration, args.seed)
+            print(f"HTTP: {http_results['requests']} requests from {args.threads} threads in "
+                  f"{http_results['duration_s']}s = {http_results['throughput_rps']} req/s, "
+                  f"{http_results['errors']} errors")
+
+        commit = git_commit()
+        report = {
+            'meta': {
+                'commit': commit,
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'users': args.users, 'years': args.years, 'seed': args.seed,
+                'iterations': args.iterations, 'dataset': dataset['counts'],
+            },
+            'routes': client_results,
+            'http': http_results,
+            'peak_rss_kb': peak_rss_kb(),
+        }
+        output = args.output or os.path.join(RESULTS_DIR, f"routes-{commit}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Peak RSS: {report['peak_rss_kb'] / 1024:.1f} MB. Results written to {output}")
+    finally:
+        import logging_setup
+        logging_setup.shutdown_logging()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
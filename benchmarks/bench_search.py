@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Query-latency benchmark for notes search (search.py).
+Loads USERS users with NOTES entries in total, written day by day through
+the index triggers, each with a note of 5-30 words drawn from a
+Zipf-distributed vocabulary (so some words are in most notes and many are
+rare). Then times search.search() for one random user per query: common,
+mid-frequency and rare words, two words, a phrase, a prefix, a 30-day date
+range and the first two pages of a common word. Two baselines for the common word: the same
+match without the owner token (ranking every user's matches, then
+filtering) and an unranked per-user LIKE scan. Reports load time, index
+size and median/p95 latency.
+
+Usage: python benchmarks/bench_search.py [--notes 1000000] [--users 1000] [--repeat 50] [--json PATH]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = (
+    'day work slept tired good bad felt anxious walk family friend call coffee headache '
+    'run gym rain sun meeting deadline argument dinner lunch breakfast nap dream nightmare '
+    'therapy doctor appointment medication dose forgot calm stressed happy sad angry '
+    'lonely party movie book music garden cooking cleaning shopping travel train bus '
+    'office boss project interview job promotion holiday weekend birthday wedding '
+    'funeral hospital cold flu fever pain back knee period cramps bloated hungry '
+).split()
+FIRST_DAY = date(2000, 1, 1)
+BATCH_SIZE = 20000
+
+
+def vocabulary(rng, size=20000):
+    """Real words first (most frequent), then made-up ones for the long tail."""
+    words = list(WORDS)
+    while len(words) < size:
+        words.append(''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(4, 9))))
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    return words, list(itertools.accumulate(weights))
+
+
+def load(notes, users, seed):
+    """Insert the users and entries. Returns seconds spent."""
+    from sqlalchemy import insert
+
+    from models import db, MoodEntry, User
+
+    rng = random.Random(seed)
+    words, cumulative = vocabulary(rng)
+    db.session.execute(insert(User), [
+        {'id': user_id, 'username': f'search{user_id}', 'email': f'search{user_id}@example.com', 'password_hash': 'x'}
+        for user_id in range(1, users + 1)])
+    per_user = notes // users
+    started = time.perf_counter()
+    rows = []
+    # Day by day, as users write: each user's entries are spread through the index.
+    for day in range(per_user):
+        for user_id in range(1, users + 1):
+            rows.append({
+                'user_id': user_id, 'entry_date': FIRST_DAY + timedelta(days=day), 'mood_level': 5,
+                'hours_slept': 7.0, 'anxiety': 3, 'energy_level': 5, 'irritability': 2,
+                'notes': ' '.join(rng.choices(words, cum_weights=cumulative, k=rng.randint(5, 30))),
+            })
+            if len(rows) == BATCH_SIZE:
+                db.session.execute(insert(MoodEntry), rows)
+                rows = []
+    if rows:
+        db.session.execute(insert(MoodEntry), rows)
+    db.session.commit()
+    return time.perf_counter() - started, words, per_user
+
+
+def unscoped(user_id, match, limit=20):
+    """The user's best matches found by ranking everyone's, as without the owner token."""
+    from sqlalchemy import text
+
+    from models import db
+
+    return db.session.execute(text(
+        "SELECT e.id, snippet(mood_entry_fts, 0, '[', ']', '…', 12), bm25(mood_entry_fts, 1.0, 0.0) AS rank "
+        "FROM mood_entry_fts JOIN mood_entry e ON e.id = mood_entry_fts.rowid "
+        "WHERE mood_entry_fts MATCH :match AND e.user_id = :user_id ORDER BY rank, e.id LIMIT :limit"),
+        {'match': match, 'user_id': user_id, 'limit': limit}).all()
+
+
+def like_scan(user_id, word, limit=20):
+    from models import db, MoodEntry
+
+    return db.session.query(MoodEntry.id, MoodEntry.notes).filter(
+        MoodEntry.user_id == user_id, MoodEntry.notes.like(f'%{word}%')).limit(limit).all()
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return (round(samples[len(samples) // 2] * 1000, 3),
+            round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3))
+
+
+def run(notes, users, repeat, seed=42):
+    from sqlalchemy import text
+
+    from app import create_app
+    import search
+    from models import db
+
+    workdir = tempfile.mkdtemp(prefix='mood_search_')
+    try:
+        path = os.path.join(workdir, 'search.db')
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+            'LOG_DIR': os.path.join(workdir, 'logs'),
+            'LOG_CONSOLE': False,
+            'METRICS_DIR': os.path.join(workdir, 'metrics'),
+            'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+            'PREWARM_PLOTLY': False,
+            'JOB_WORKER_THREADS': 0,
+        })
+        with app.app_context():
+            load_seconds, words, per_user = load(notes, users, seed)
+            search.run_command(db.engines[None], 'optimize')
+            index_bytes = db.session.execute(text(
+                "SELECT sum(pgsize) FROM dbstat WHERE name LIKE 'mood_entry_fts%'")).scalar()
+            last_day = FIRST_DAY + timedelta(days=per_user - 1)
+            common, mid, rare = words[2], words[40], words[5000]
+            cases = {
+                f'common ({common})': lambda user: search.search(user, search.fts_query(common)),
+                f'mid ({mid})': lambda user: search.search(user, search.fts_query(mid)),
+                f'rare ({rare})': lambda user: search.search(user, search.fts_query(rare)),
+                'two words': lambda user: search.search(user, search.fts_query(f'{common} {mid}')),
+                'phrase': lambda user: search.search(user, search.fts_query(f'"{words[0]} {words[1]}"')),
+                'prefix (sle*)': lambda user: search.search(user, search.fts_query('sle*')),
+                'common, 30 days': lambda user: search.search(user, search.fts_query(common),
+                                                              last_day - timedelta(days=29), last_day),
+                'common, pages 1+2': lambda user: search.search(
+                    user, search.fts_query(common),
+                    cursor=search.search(user, search.fts_query(common))['next_cursor']),
+                'common, unscoped': lambda user: unscoped(user, search.fts_query(common)),
+                'common, LIKE scan': lambda user: like_scan(user, common),
+            }
+            rng = random.Random(seed)
+            result = {'notes': per_user * users, 'users': users, 'load_s': round(load_seconds, 1),
+                      'db_mib': round(os.path.getsize(path) / 2 ** 20, 1),
+                      'index_mib': round(index_bytes / 2 ** 20, 1), 'queries': {}}
+            for name, query in cases.items():
+                samples = []
+                for _ in range(repeat):
+                    user_id = rng.randint(1, users)
+                    db.session.remove()
+                    started = time.perf_counter()
+                    query(user_id)
+                    samples.append(time.perf_counter() - started)
+                result['queries'][name] = percentiles(samples)
+    finally:
+        import logging_setup
+        logging_setup.shutdown_logging()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--notes', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50, help="Timed queries per case")
+    parser.add_argument('--json', dest='json_path', help="Write the results as JSON")
+    args = parser.parse_args()
+
+    result = run(args.notes, args.users, args.repeat)
+    print(f"{result['notes']} notes, {result['users']} users: loaded in {result['load_s']} s, "
+          f"database {result['db_mib']} MiB, of which index {result['index_mib']} MiB")
+    print(f"{'query':<28} {'median ms':>10} {'p95 ms':>8}")
+    for name, (median, p95) in result['queries'].items():
+        print(f"{name:<28} {median:>10.2f} {p95:>8.2f}")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Write-throughput benchmark for sharded storage.
+For each shard count, builds a fresh set of databases, registers users
+spread over the shards and starts worker processes that each save new
+entries (entry_store.save_entry + commit, as /submit does) for their own
+users as fast as they can. Reports total writes per second, latency
+percentiles and how many writes failed on a locked database.
+
+Usage: python benchmarks/bench_shards.py [--shards 1 4 16] [--workers 8]
+                                         [--users 64] [--writes 200] [--json PATH]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import bench_routes
+
+
+def build_app(workdir, shards):
+    from app import create_app
+
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'directory.db'),
+        'SHARD_COUNT': shards,
+        'SHARD_URI_TEMPLATE': 'sqlite:///' + os.path.join(workdir, 'shard{shard}.db'),
+        'LOG_DIR': os.path.join(workdir, 'logs'),
+        'LOG_CONSOLE': False,
+        'METRICS_DIR': os.path.join(workdir, 'metrics'),
+        'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+        'PREWARM_PLOTLY': False,
+    })
+
+
+def create_users(app, count):
+    import sharding
+    from models import db, User
+
+    with app.app_context():
+        ids = []
+        for index in range(count):
+            # A fixed hash: hashing is slow and not what is measured here.
+            user = User(username=f'shard-bench-{index}', email=f'shard-bench-{index}@example.com',
+                        password_hash='x')
+            db.session.add(user)
+            db.session.flush()
+            sharding.assign_shard(user.id)
+            ids.append(user.id)
+        db.session.commit()
+    return ids
+
+
+def writer(app, user_ids, writes, start, results):
+    """Worker process: save `writes` new entries round-robin over its users."""
+    import entry_store
+    import sharding
+    from models import db
+
+    values = {'mood_level': 5, 'hours_slept': 7.0, 'anxiety': 3, 'energy_level': 5, 'irritability': 2,
+              'alcohol_drugs': False, 'exercise': False, 'menstruation': False, 'stressful_event': False,
+              'weight': None, 'notes': ''}
+    samples, failures = [], 0
+    start.wait()
+    began = time.perf_counter()
+    for index in range(writes):
+        user_id = user_ids[index % len(user_ids)]
+        entry_date = date(2020, 1, 1) + timedelta(days=index // len(user_ids))
+        with app.app_context():
+            sharding.bind_user(user_id)
+            started = time.perf_counter()
+            try:
+                entry_store.save_entry(user_id, entry_date, values)
+                db.session.commit()
+                samples.append(time.perf_counter() - started)
+            except Exception:
+                db.session.rollback()
+                failures += 1
+    results.put({'samples': samples, 'failures': failures, 'elapsed': time.perf_counter() - began})
+
+
+def run(shards, workers, users, writes):
+    workdir = tempfile.mkdtemp(prefix='mood_shards_')
+    try:
+        app = build_app(workdir, shards)
+        user_ids = create_users(app, users)
+        context = multiprocessing.get_context('fork')
+        start, results = context.Event(), context.Queue()
+        processes = [
+            context.Process(target=writer, args=(app, user_ids[index::workers], writes, start, results))
+            for index in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        began = time.perf_counter()
+        start.set()
+        reports = [results.get() for _ in processes]
+        wall = time.perf_counter() - began
+        for process in processes:
+            process.join()
+    finally:
+        import logging_setup
+        logging_setup.shutdown_logging()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    samples = [s for report in reports for s in report['samples']]
+    summary = bench_routes.percentiles(samples)
+    summary.update(shards=shards, workers=workers, writes=len(samples),
+                   failures=sum(report['failures'] for report in reports),
+                   writes_per_second=round(len(samples) / wall, 1))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--workers', type=int, default=8, help="Writer processes")
+    parser.add_argument('--users', type=int, default=64)
+    parser.add_argument('--writes', type=int, default=200, help="Writes per worker")
+    parser.add_argument('--json', dest='json_path', help="Write the results as JSON")
+    args = parser.parse_args()
+
+    results = [run(shards, args.workers, args.users, args.writes) for shards in args.shards]
+    print(f"{args.workers} writer processes, {args.users} users, {args.writes} writes each")
+    print(f"{'shards':>6} {'writes/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'failed':>7}")
+    for result in results:
+        print(f"{result['shards']:>6} {result['writes_per_second']:>9} {result['p50_ms']:>8.2f} "
+              f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['failures']:>7}")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
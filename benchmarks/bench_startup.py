@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for Mood Tracker.
+Starts fresh interpreters and measures how long it takes to import app, build
+the app and serve the first request, the resident memory at each step, and
+the cost of the first chart build. Also lists the slowest imports from
+python -X importtime. Results are checked against BUDGET (also enforced by
+test_startup.py).
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--json PATH]
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Generous enough for a laptop; a regression here usually means a heavy
+# import crept back into module scope.
+BUDGET = {
+    'time_to_first_request_ms': 1500,
+    'rss_after_first_request_mb': 90,
+}
+# Loaded on first use only; none of these may be imported just to serve a request.
+HEAVY_MODULES = ['plotly', 'pandas', 'numpy']
+
+CHILD = r'''
+import json, resource, sys, threading, time
+start = time.perf_counter()
+
+def rss_mb():
+    # ru_maxrss survives exec on Linux, so it would report the launching
+    # process's peak (e.g. a long pytest run); VmHWM is reset by exec.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round((peak / 1024 / 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+config = json.loads(sys.argv[1])
+heavy = json.loads(sys.argv[2])
+import app as mood_app
+imported = time.perf_counter()
+rss_import = rss_mb()
+flask_app = mood_app.create_app(config)
+created = time.perf_counter()
+response = flask_app.test_client().get('/login')
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+rss_first = rss_mb()
+loaded_heavy = sorted(name for name in heavy if name in sys.modules)
+for thread in threading.enumerate():
+    if thread.name == 'prewarm-plotly':
+        thread.join()
+chart_start = time.perf_counter()
+mood_app.prewarm_plotly()
+chart = time.perf_counter()
+print(json.dumps({
+    'import_ms': round((imported - start) * 1000, 1),
+    'create_app_ms': round((created - imported) * 1000, 1),
+    'first_request_ms': round((served - created) * 1000, 1),
+    'time_to_first_request_ms': round((served - start) * 1000, 1),
+    'rss_after_import_mb': rss_import,
+    'rss_after_first_request_mb': rss_first,
+    'heavy_modules_loaded': loaded_heavy,
+    'first_chart_ms': round((chart - chart_start) * 1000, 1),
+    'rss_after_first_chart_mb': rss_mb(),
+}))
+'''
+
+
+def measure_startup(prewarm=False):
+    """One cold start in a fresh interpreter; returns the timings and memory figures."""
+    workdir = tempfile.mkdtemp(prefix='mood_startup_')
+    try:
+        config = {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'startup.db'),
+            'LOG_DIR': os.path.join(workdir, 'logs'),
+            'LOG_CONSOLE': False,
+            'METRICS_DIR': os.path.join(workdir, 'metrics'),
+            'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+            'PREWARM_PLOTLY': prewarm,
+        }
+        output = subprocess.check_output(
+            [sys.executable, '-c', CHILD, json.dumps(config), json.dumps(HEAVY_MODULES)],
+            cwd=ROOT, text=True)
+        return json.loads(output.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def slowest_imports(limit=10):
+    """Top-level modules by cumulative import time for `import app`."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=ROOT, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)', line)
+        # Only direct imports of app (two spaces of nesting) to keep the list readable.
+        if match and len(match.group(3)) == 2:
+            rows.append((int(match.group(2)) / 1000, match.group(4)))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def check_budget(result):
+    """List of budget violations (empty when within budget)."""
+    problems = [f"{key} {result[key]} > {limit}" for key, limit in BUDGET.items() if result[key] > limit]
+    if result['heavy_modules_loaded']:
+        problems.append(f"heavy modules imported before first use: {', '.join(result['heavy_modules_loaded'])}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', dest='json_path', help="Write the median run as JSON")
+    args = parser.parse_args()
+
+    runs = sorted((measure_startup() for _ in range(args.runs)), key=lambda r: r['time_to_first_request_ms'])
+    result = runs[len(runs) // 2]
+    print(f"Median of {args.runs} cold starts:")
+    for key, value in result.items():
+        print(f"  {key:<28} {value}")
+
+    print("Slowest imports under app (cumulative ms):")
+    for ms, name in slowest_imports():
+        print(f"  {ms:>8.1f}  {name}")
+
+    warmed = measure_startup(prewarm=True)
+    print(f"First chart after background pre-warm: {warmed['first_chart_ms']} ms "
+          f"(cold: {result['first_chart_ms']} ms)")
+
+    problems = check_budget(result)
+    print('Budget: ' + ('OK' if not problems else 'EXCEEDED - ' + '; '.join(problems)))
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'median': result, 'runs': runs, 'budget': BUDGET}, f, indent=2)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
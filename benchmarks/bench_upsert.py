@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the entry write path.
+Compares the old check-then-insert sequence (SELECT for a duplicate, INSERT,
+flush, SELECT the medications, one INSERT per link) with entry_store's single
+INSERT ... ON CONFLICT plus INSERT ... SELECT for the links, for new entries
+and for duplicate submits. Reports latency percentiles and SQL statements per
+operation.
+
+Usage: python benchmarks/bench_upsert.py [--operations 500] [--json PATH]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import bench_routes
+import datagen
+
+
+def legacy_submit(user_id, entry_date, values, medication_ids):
+    """The pre-upsert /submit sequence, kept here for comparison."""
+    from models import db, Medication, MoodEntry, MoodEntryMedication
+
+    if MoodEntry.query.filter_by(entry_date=entry_date, user_id=user_id).first():
+        return 'exists'
+    entry = MoodEntry(user_id=user_id, entry_date=entry_date, **values)
+    db.session.add(entry)
+    db.session.flush()
+    for med in Medication.query.filter(Medication.id.in_(medication_ids), Medication.user_id == user_id).all():
+        db.session.add(MoodEntryMedication(mood_entry_id=entry.id, medication_id=med.id, taken=True))
+    return 'inserted'
+
+
+def upsert_submit(user_id, entry_date, values, medication_ids):
+    import entry_store
+
+    outcome, _ = entry_store.save_entry(user_id, entry_date, values, medication_ids, mode='insert')
+    return outcome
+
+
+def run(write, operations, start_date, user_id, medication_ids, seed):
+    """Time `operations` new entries followed by the same number of duplicate submits."""
+    import entry_store
+    from models import db
+
+    rng = random.Random(seed)
+    counter = bench_routes.SqlCounter(db.engine)
+    results = {}
+    dates = [start_date - timedelta(days=day) for day in range(operations)]
+    for phase in ('new', 'duplicate'):
+        samples, statements = [], 0
+        for entry_date in dates:
+            values = entry_store.entry_values_from_form(datagen.entry_form(rng, entry_date))
+            counter.count = 0
+            started = time.perf_counter()
+            write(user_id, entry_date, values, medication_ids)
+            db.session.commit()
+            samples.append(time.perf_counter() - started)
+            statements += counter.count
+        summary = bench_routes.percentiles(samples)
+        summary['sql_per_op'] = round(statements / operations, 2)
+        results[phase] = summary
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--operations', type=int, default=500, help="Entries written per variant and phase")
+    parser.add_argument('--json', dest='json_path', help="Write the results as JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mood_upsert_')
+    try:
+        app = bench_routes.load_app(workdir)
+        report = {}
+        with app.app_context():
+            from models import User
+
+            dataset = datagen.populate(users=2, years=1, seed=42)
+            start_date = date.fromisoformat(dataset['first_date']) - timedelta(days=1)
+            for variant, write, username in (('legacy', legacy_submit, dataset['users'][0]),
+                                             ('upsert', upsert_submit, dataset['users'][1])):
+                user_id = User.query.filter_by(username=username).one().id
+                report[variant] = run(write, args.operations, start_date, user_id,
+                                      dataset['medication_ids'][username], seed=42)
+    finally:
+        import logging_setup
+        logging_setup.shutdown_logging()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.operations} operations per phase")
+    print(f"{'variant':<8} {'phase':<10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'SQL/op':>7}")
+    for variant, phases in report.items():
+        for phase, summary in phases.items():
+            print(f"{variant:<8} {phase:<10} {summary['p50_ms']:>8.3f} {summary['p95_ms']:>8.3f} "
+                  f"{summary['p99_ms']:>8.3f} {summary['sql_per_op']:>7}")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
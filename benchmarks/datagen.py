@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Seeded synthetic data for Mood Tracker benchmarks.
+Creates N users, each with a few medications and M years of daily mood
+entries (with medication links), using bulk inserts so large datasets load
+in seconds. The same seed always produces the same rows.
+
+Usage: python benchmarks/datagen.py --database sqlite:////tmp/bench.db [--users 20] [--years 2]
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, insert
+from werkzeug.security import generate_password_hash
+
+import entry_stats
+import sharding
+from models import db, User, UserShard, Medication, MoodEntry, MoodEntryMedication
+
+PASSWORD = 'benchmark-pass'
+MEDICATION_NAMES = ['Sertraline', 'Lithium', 'Lamotrigine', 'Quetiapine', 'Bupropion', 'Melatonin']
+NOTES = [
+    'Slept badly, woke up twice.', 'Good day at work.', 'Argument with a friend.',
+    'Went for a long walk.', 'Felt flat all afternoon.', 'Headache in the morning.',
+]
+BATCH_SIZE = 5000
+
+
+def username_for(index):
+    return f"bench{index:05d}"
+
+
+def _clamp(value, low=0, high=10):
+    return max(low, min(high, int(round(value))))
+
+
+def _entries_for_user(rng, user_id, days, end_date):
+    """Daily rows for one user: a slow mood random walk plus a 28-day cycle."""
+    mood = rng.uniform(4, 7)
+    weight = rng.uniform(120, 220)
+    cycle_offset = rng.randrange(28)
+    tracks_cycle = rng.random() < 0.5
+    for day in range(days):
+        entry_date = end_date - timedelta(days=days - 1 - day)
+        mood = min(10, max(0, mood + rng.gauss(0, 0.8) + (5.5 - mood) * 0.1))
+        sleep = min(12, max(0, rng.gauss(7 + (mood - 5) * 0.2, 1.2)))
+        stressful = rng.random() < 0.1
+        yield {
+            'user_id': user_id,
+            'entry_date': entry_date,
+            'mood_level': _clamp(mood),
+            'hours_slept': round(sleep * 2) / 2,
+            'anxiety': _clamp(rng.gauss(9 - mood * 0.8 + (2 if stressful else 0), 1.5)),
+            'energy_level': _clamp(rng.gauss(mood + (sleep - 7) * 0.5, 1.5)),
+            'irritability': _clamp(rng.gauss(4 + (2 if stressful else 0), 1.5)),
+            'alcohol_drugs': rng.random() < 0.08,
+            'exercise': rng.random() < 0.35,
+            'menstruation': tracks_cycle and (day + cycle_offset) % 28 < 5,
+            'stressful_event': stressful,
+            'weight': round(weight + 3 * math.sin(day / 60) + rng.gauss(0, 0.5), 1) if day % 7 == 0 else None,
+            'notes': rng.choice(NOTES) if rng.random() < 0.2 else '',
+        }
+
+
+def _next_id(model):
+    if model is User or not sharding.is_sharded():
+        return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+    # Keep generated ids unique across shards.
+    highest = 0
+    for shard in sharding.shards():
+        with sharding.use_shard(shard):
+            highest = max(highest, db.session.query(func.max(model.id)).scalar() or 0)
+    return highest + 1
+
+
+def _bulk_insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start:start + BATCH_SIZE])
+
+
+def populate(users=20, years=2, medications=3, seed=42, end_date=None):
+    """
+    Fill the app's database with synthetic users and history.
+    Returns a dict describing what was created (usernames, entry ids per user, counts).
+    Must be called inside an app context.
+    """
+    rng = random.Random(seed)
+    end_date = end_date or date.today() - timedelta(days=1)
+    days = int(years * 365)
+    # Hashing is deliberately slow, so every synthetic user shares one hash.
+    password_hash = generate_password_hash(PASSWORD)
+    created_at = datetime.utcnow()
+
+    user_id = _next_id(User)
+    med_id = _next_id(Medication)
+    entry_id = _next_id(MoodEntry)
+    first_user_index = user_id
+
+    user_rows, med_rows, entry_rows, link_rows = [], [], [], []
+    summary = {'users': [], 'entry_ids': {}, 'medication_ids': {}}
+    for index in range(first_user_index, first_user_index + users):
+        username = username_for(index)
+        user_rows.append({
+            'id': user_id, 'username': username, 'email': f"{username}@example.com",
+            'password_hash': password_hash, 'created_at': created_at, 'is_active': True,
+        })
+        user_meds = []
+        for name in rng.sample(MEDICATION_NAMES, medications):
+            # Medication names are unique across the whole table.
+            med_rows.append({'id': med_id, 'name': f"{name} ({username})", 'active': True, 'user_id': user_id})
+            user_meds.append(med_id)
+            med_id += 1
+
+        entry_ids = []
+        for row in _entries_for_user(rng, user_id, days, end_date):
+            row['id'] = entry_id
+            entry_rows.append(row)
+            entry_ids.append(entry_id)
+            for med in user_meds:
+                if rng.random() < 0.85:
+                    link_rows.append({'mood_entry_id': entry_id, 'medication_id': med, 'taken': True})
+            entry_id += 1
+
+        summary['users'].append(username)
+        summary['entry_ids'][username] = entry_ids
+        summary['medication_ids'][username] = user_meds
+        user_id += 1
+
+    _bulk_insert(User, user_rows)
+    if sharding.is_sharded():
+        shard_of = {row['id']: row['id'] % sharding.shard_count() for row in user_rows}
+        _bulk_insert(UserShard, [{'user_id': uid, 'shard': shard} for uid, shard in shard_of.items()])
+        entry_shard = {row['id']: shard_of[row['user_id']] for row in entry_rows}
+        for shard in sharding.shards():
+            with sharding.use_shard(shard):
+                _bulk_insert(Medication, [row for row in med_rows if shard_of[row['user_id']] == shard])
+                _bulk_insert(MoodEntry, [row for row in entry_rows if shard_of[row['user_id']] == shard])
+                _bulk_insert(MoodEntryMedication,
+                             [row for row in link_rows if entry_shard[row['mood_entry_id']] == shard])
+    else:
+        _bulk_insert(Medication, med_rows)
+        _bulk_insert(MoodEntry, entry_rows)
+        _bulk_insert(MoodEntryMedication, link_rows)
+    # Count the entries in each user's running statistics, as writing them through the app would have.
+    for row in user_rows:
+        with sharding.use_shard(row['id'] % sharding.shard_count() if sharding.is_sharded() else None):
+            entry_stats.rebuild(row['id'])
+    db.session.commit()
+
+    summary['counts'] = {
+        'users': len(user_rows), 'medications': len(med_rows),
+        'entries': len(entry_rows), 'medication_links': len(link_rows),
+    }
+    summary['first_date'] = (end_date - timedelta(days=days - 1)).isoformat()
+    summary['end_date'] = end_date.isoformat()
+    return summary
+
+
+def entry_form(rng, entry_date, medication_ids=()):
+    """Form fields for /submit and /edit, as the browser would send them."""
+    form = {
+        'date': entry_date.strftime('%Y-%m-%d'),
+        'mood': str(rng.randint(0, 10)),
+        'hours_slept': str(rng.choice([5, 6, 6.5, 7, 7.5, 8, 9])),
+        'anxiety': str(rng.randint(0, 10)),
+        'energy': str(rng.randint(0, 10)),
+        'irritability': str(rng.randint(0, 10)),
+        'notes': rng.choice(NOTES),
+    }
+    if rng.random() < 0.3:
+        form['exercise'] = 'on'
+    if medication_ids:
+        form['medications_taken'] = [str(med) for med in medication_ids]
+    return form
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--database', required=True, help="SQLAlchemy URI, e.g. sqlite:////tmp/bench.db")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--medications', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database})
+
+    with app.app_context():
+        summary = populate(args.users, args.years, args.medications, args.seed)
+    counts = summary['counts']
+    print(f"Created {counts['users']} users, {counts['medications']} medications, "
+          f"{counts['entries']} entries and {counts['medication_links']} medication links "
+          f"({summary['first_date']} to {summary['end_date']}). Password: {PASSWORD}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Performance regression gate for Mood Tracker routes.
+Runs a fixed subset of the route benchmarks several times on a small seeded
+dataset and compares each route's median latency (with a bootstrap confidence
+interval) against the committed baseline in benchmarks/baseline.json. Hard
+budgets on SQL statements per request and on the /visualize graphJSON size
+are enforced as well. Exits non-zero with a readable report on regression.
+
+Usage: python benchmarks/perf_gate.py [--runs 3] [--tolerance 0.2] [--update-baseline]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import bench_routes
+import datagen
+
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+# Fixed so results are comparable between commits; kept small enough for a laptop.
+# /visualize only queues its figure job; the job itself is timed as mood_graph.
+GATE_ROUTES = ['index', 'submit', 'manage', 'edit', 'data', 'visualize', bench_routes.FIGURE_JOB]
+DATASET = {'users': 3, 'years': 1, 'seed': 42}
+ITERATIONS = 15
+BOOTSTRAP_RESAMPLES = 1000
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def bootstrap_ci(samples, confidence=0.95, resamples=BOOTSTRAP_RESAMPLES, seed=0):
+    """Percentile bootstrap confidence interval for the median."""
+    rng = random.Random(seed)
+    medians = sorted(median(rng.choices(samples, k=len(samples))) for _ in range(resamples))
+    tail = (1 - confidence) / 2
+    return medians[int(tail * resamples)], medians[min(resamples - 1, int((1 - tail) * resamples))]
+
+
+def graph_json_bytes(app, username):
+    """Size of the figure JSON /visualize embeds for a user."""
+    from app import build_mood_graph_json
+    from models import MoodEntry, User
+
+    with app.app_context():
+        user = User.query.filter_by(username=username).first()
+        entries = MoodEntry.query.filter_by(user_id=user.id).all()
+        return len(build_mood_graph_json(entries))
+
+
+def measure(runs, iterations):
+    """Run the gate's benchmark subset; returns per-route samples and budget measurements."""
+    workdir = tempfile.mkdtemp(prefix='mood_gate_')
+    try:
+        app = bench_routes.load_app(workdir)
+        with app.app_context():
+            dataset = datagen.populate(DATASET['users'], DATASET['years'], seed=DATASET['seed'])
+        # Measured before the edit/submit routes change the data, so the size is reproducible.
+        graph_bytes = graph_json_bytes(app, dataset['users'][0])
+
+        samples = {route: [] for route in GATE_ROUTES}
+        sql = {route: 0 for route in GATE_ROUTES}
+        for run in range(runs):
+            results = bench_routes.run_client_benchmark(app, dataset, GATE_ROUTES, iterations,
+                                                        seed=DATASET['seed'] + run, memory=False)
+            for route, result in results.items():
+                samples[route].extend(result['samples_ms'])
+                sql[route] = max(sql[route], result['sql_max'])
+        return {
+            'samples': samples,
+            'sql_per_request': sql,
+            'graph_json_bytes': graph_bytes,
+        }
+    finally:
+        import logging_setup
+        logging_setup.shutdown_logging()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def summarize(measured):
+    routes = {}
+    for route, samples in measured['samples'].items():
+        low, high = bootstrap_ci(samples)
+        routes[route] = {
+            'median_ms': round(median(samples), 3),
+            'ci_low_ms': round(low, 3),
+            'ci_high_ms': round(high, 3),
+            'samples': len(samples),
+        }
+    return routes
+
+
+def compare(baseline, routes, measured, tolerance):
+    """Return (report lines, failure count) for current results against the baseline."""
+    lines = []
+    failures = 0
+
+    lines.append(f"{'route':<10} {'baseline ms (95% CI)':>26} {'current ms (95% CI)':>26} {'change':>8}  verdict")
+    for route in GATE_ROUTES:
+        current = routes[route]
+        base = baseline['routes'].get(route)
+        current_text = f"{current['median_ms']:.2f} ({current['ci_low_ms']:.2f}-{current['ci_high_ms']:.2f})"
+        if base is None:
+            lines.append(f"{route:<10} {'-':>26} {current_text:>26} {'':>8}  new (no baseline)")
+            continue
+        change = (current['median_ms'] - base['median_ms']) / base['median_ms']
+        # Slower only counts when the intervals separate and the change is material.
+        if current['ci_low_ms'] > base['ci_high_ms'] and change > tolerance:
+            verdict = 'REGRESSION'
+            failures += 1
+        elif current['ci_high_ms'] < base['ci_low_ms'] and change < -tolerance:
+            verdict = 'faster'
+        else:
+            verdict = 'ok'
+        base_text = f"{base['median_ms']:.2f} ({base['ci_low_ms']:.2f}-{base['ci_high_ms']:.2f})"
+        lines.append(f"{route:<10} {base_text:>26} {current_text:>26} {change:>+8.1%}  {verdict}")
+
+    budgets = baseline.get('budgets', {})
+    lines.append('')
+    lines.append('Budgets:')
+    for route in GATE_ROUTES:
+        limit = budgets.get('sql_per_request', {}).get(route)
+        count = measured['sql_per_request'][route]
+        if limit is None:
+            lines.append(f"  SQL {route:<10} {count:>6} statements (no budget)")
+            continue
+        over = count > limit
+        failures += over
+        lines.append(f"  SQL {route:<10} {count:>6} / {limit:<6} statements  {'OVER BUDGET' if over else 'ok'}")
+    limit = budgets.get('graph_json_bytes')
+    size = measured['graph_json_bytes']
+    if limit is not None:
+        over = size > limit
+        failures += over
+        lines.append(f"  graphJSON      {size:>6} / {limit:<6} bytes       {'OVER BUDGET' if over else 'ok'}")
+    return lines, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=3, help="Repetitions of the benchmark subset")
+    parser.add_argument('--iterations', type=int, default=ITERATIONS, help="Requests per route per run")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Minimum relative slowdown that fails")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="Record the current results as the new baseline (budgets are kept)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    measured = measure(args.runs, args.iterations)
+    routes = summarize(measured)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline or baseline is None:
+        budgets = baseline['budgets'] if baseline else {
+            'sql_per_request': dict(measured['sql_per_request']),
+            'graph_json_bytes': measured['graph_json_bytes'],
+        }
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'commit': bench_routes.git_commit(),
+                'dataset': DATASET,
+                'routes': routes,
+                'budgets': budgets,
+            }, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline} ({time.perf_counter() - start:.0f}s)")
+        return 0
+
+    lines, failures = compare(baseline, routes, measured, args.tolerance)
+    print(f"Performance gate against baseline from commit {baseline.get('commit', '?')} "
+          f"({args.runs} runs x {args.iterations} requests per route, {time.perf_counter() - start:.0f}s)")
+    print()
+    print('\n'.join(lines))
+    print()
+    if failures:
+        print(f"FAILED: {failures} regression(s) or budget violation(s).")
+        return 1
+    print('PASSED')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Per-user change log for delta sync.
+
+Every write to a user's entries or medications calls record() in the same
+transaction, which takes the next versions from the user's SyncState row
+and appends one ChangeLog row per changed object. /api/sync reads the rows
+after a client's cursor.
+
+compact() keeps the log small: it drops rows superseded by a later change
+to the same object (always safe) and rows older than the retention period.
+The second step raises the user's pruned_through mark; clients whose cursor
+is below it have to do a full resync.
+
+Usage: python changelog.py [--retention-days 90]
+"""
+
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, exists, func, insert, literal, select, union, update
+from sqlalchemy.orm import aliased
+
+import sharding
+from models import db, dialect_insert, ChangeLog, EntryArchive, Medication, MoodEntry, SyncState
+
+ENTRY = 'entry'
+MEDICATION = 'medication'
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+
+def record(user_id, kind, object_ids, op=UPSERT):
+    """Log a change to some of the user's objects. The caller commits."""
+    ids = list(object_ids)
+    if not ids:
+        return
+    # One statement reserves len(ids) versions; concurrent writers queue on the row.
+    statement = dialect_insert(SyncState).values(user_id=user_id, version=len(ids), pruned_through=0)
+    last = db.session.execute(
+        statement.on_conflict_do_update(index_elements=['user_id'],
+                                        set_={'version': SyncState.version + len(ids)})
+        .returning(SyncState.version)
+    ).scalar()
+    # Kept until commit, so the user's next reads wait for the replica to reach it (replicas.py).
+    db.session.info['write_version'] = last
+    now = datetime.utcnow()
+    first = last - len(ids) + 1
+    db.session.execute(insert(ChangeLog), [
+        {'user_id': user_id, 'version': first + offset, 'kind': kind, 'object_id': object_id,
+         'op': op, 'created_at': now}
+        for offset, object_id in enumerate(ids)
+    ])
+
+
+def sync_state(user_id):
+    """(current version, pruned_through) for a user; (0, 0) before their first change."""
+    row = db.session.execute(
+        select(SyncState.version, SyncState.pruned_through).where(SyncState.user_id == user_id)
+    ).first()
+    return tuple(row) if row else (0, 0)
+
+
+def backfill():
+    """
+    Give users whose data predates the change log a SyncState row, so their
+    version isn't 0 until their next write. They start at version 1 with
+    everything up to it pruned: a cursor of 0 handed out before is expired
+    and the client takes a fresh snapshot. Returns the number of users
+    backfilled. The caller commits.
+    """
+    owners = union(select(MoodEntry.user_id), select(Medication.user_id), select(EntryArchive.user_id)).subquery()
+    missing = select(owners.c.user_id, literal(1), literal(1)).where(
+        ~exists().where(SyncState.user_id == owners.c.user_id))
+    return db.session.execute(
+        insert(SyncState).from_select(['user_id', 'version', 'pruned_through'], missing)).rowcount
+
+
+def changes_after(user_id, cursor, limit):
+    """Up to `limit` log rows after the cursor, oldest first, plus whether more remain."""
+    rows = db.session.execute(
+        select(ChangeLog.version, ChangeLog.kind, ChangeLog.object_id, ChangeLog.op)
+        .where(ChangeLog.user_id == user_id, ChangeLog.version > cursor)
+        .order_by(ChangeLog.version)
+        .limit(limit + 1)
+    ).all()
+    return rows[:limit], len(rows) > limit
+
+
+def compact(retention_days):
+    """
+    Prune the change log on every shard. Returns (superseded rows removed,
+    expired rows removed). The caller commits.
+    """
+    superseded = expired = 0
+    for shard in sharding.shards():
+        with sharding.use_shard(shard):
+            counts = _compact_shard(retention_days)
+        superseded += counts[0]
+        expired += counts[1]
+    return superseded, expired
+
+
+def _compact_shard(retention_days):
+    newer = aliased(ChangeLog)
+    superseded = db.session.execute(
+        delete(ChangeLog).where(
+            select(newer.id).where(
+                newer.user_id == ChangeLog.user_id, newer.kind == ChangeLog.kind,
+                newer.object_id == ChangeLog.object_id, newer.version > ChangeLog.version,
+            ).exists()
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    pruned = db.session.execute(
+        select(ChangeLog.user_id, func.max(ChangeLog.version))
+        .where(ChangeLog.created_at < cutoff)
+        .group_by(ChangeLog.user_id)
+    ).all()
+    for user_id, version in pruned:
+        db.session.execute(
+            update(SyncState)
+            .where(SyncState.user_id == user_id, SyncState.pruned_through < version)
+            .values(pruned_through=version)
+        )
+    expired = db.session.execute(
+        delete(ChangeLog).where(ChangeLog.created_at < cutoff).execution_options(synchronize_session=False)
+    ).rowcount
+    return superseded, expired
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact the delta-sync change log")
+    parser.add_argument('--retention-days', type=int,
+                        help="Drop log rows older than this (default: CHANGELOG_RETENTION_DAYS)")
+    args = parser.parse_args()
+
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        retention_days = args.retention_days or app.config['CHANGELOG_RETENTION_DAYS']
+        superseded, expired = compact(retention_days)
+        db.session.commit()
+    print(f"Removed {superseded} superseded and {expired} expired change log rows "
+          f"(retention {retention_days} days).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
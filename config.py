@@ -3,12 +3,24 @@ Configuration file for Mood Tracker application.
 You can modify these settings without touching the main application code.
 """
 
+import os
+
 # Beta access configuration
 BETA_CODE = "moodtracker2024"  # Change this to your desired beta code
 
 # Application settings
 SECRET_KEY = 'your-secret-key-here'  # Change this for production
-DATABASE_URI = 'sqlite:///mood_tracker.db'
+DATABASE_URI = os.environ.get('MOOD_TRACKER_DATABASE_URI', 'sqlite:///mood_tracker.db')
+CREATE_TABLES = True  # Create missing tables when the app starts
+PREWARM_PLOTLY = True  # Load the charting library in the background after the first request
+COLUMNAR_HISTORY = False  # Also keep entries as packed per-year arrays for fast reads (see history.py)
+SHARD_COUNT = 1  # Above 1, user data is spread over this many SQLite files (see sharding.py)
+SHARD_URI_TEMPLATE = 'sqlite:///mood_tracker_shard{shard}.db'
+# Read replica for /data, /visualize and /manage (see replicas.py), e.g. 'sqlite:///mood_tracker_replica.db'
+REPLICA_DATABASE_URI = os.environ.get('MOOD_TRACKER_REPLICA_URI')
+REPLICA_MAX_LAG_SECONDS = 10.0  # Read from the primary while the replica is further behind
+REPLICA_LAG_CHECK_INTERVAL = 1.0  # Seconds each worker reuses its last lag reading
+REPLICA_SYNC_INTERVAL = 2.0  # Seconds between heartbeats/copies made by `python replica_sync.py`
 
 # Notification settings
 DEFAULT_NOTIFICATION_TIME = '15:00'
@@ -17,4 +29,85 @@ DEFAULT_DURATION = 10
 DEFAULT_GENDER = 'female'
 
 # Security settings
-MIN_PASSWORD_LENGTH = 6 
\ No newline at end of file
+MIN_PASSWORD_LENGTH = 6
+
+# JSON entry API (/api/entries/batch)
+API_MAX_BATCH_SIZE = 366  # Most entries accepted in one upload
+IDEMPOTENCY_KEY_TTL_HOURS = 24  # How long a retried upload is recognised by its Idempotency-Key
+
+# Delta sync (/api/sync)
+SYNC_PAGE_SIZE = 500  # Most changes returned per page
+CHANGELOG_RETENTION_DAYS = 90  # `python changelog.py` drops older log rows; older cursors must resync
+
+# Notes search (/api/search, see search.py)
+SEARCH_PAGE_SIZE = 50  # Most results returned per page
+
+# Calendar heatmaps (see heatmap.py)
+HEATMAP_CACHE_SIZE = 1024  # Year grids kept in memory per app process
+
+# Unusual-day flags (see entry_stats.py)
+ANOMALY_Z_THRESHOLD = 2.0  # Flag a metric this many standard deviations from the user's usual or recent level
+ANOMALY_MIN_ENTRIES = 14  # Entries a user needs before their days are flagged
+
+# Background jobs (see jobs.py)
+JOB_WORKER_THREADS = 1  # Job threads in each app process; 0 when `python job_worker.py` runs them
+JOB_POLL_INTERVAL = 1.0  # Seconds an idle worker waits before looking for jobs again
+JOB_LEASE_SECONDS = 60  # A running job not heard from for this long is retried (its worker died)
+JOB_MAX_ATTEMPTS = 3
+JOB_RESULT_TTL_SECONDS = 3600  # How long finished jobs and their results are kept
+
+# Admin dashboard (see admin_stats.py)
+ADMIN_STATS_INTERVAL = 300  # Seconds between background snapshots; keep below JOB_RESULT_TTL_SECONDS, 0 turns them off
+ADMIN_STATS_DAYS = 30  # Days of entries and signups shown
+ADMIN_STATS_TOP_USERS = 10  # Users with the most entries listed
+
+# Cold storage for old entries (see archive.py)
+ARCHIVE_AFTER_DAYS = 0  # Archive years that ended more than this many days ago, e.g. 730; 0 turns archiving off
+ARCHIVE_INTERVAL = 86400  # Seconds between background archival runs
+
+# Login and registration rate limits (see ratelimit.py); 0 turns a limit off
+RATE_LIMIT_WINDOW = 300  # Seconds each limit counts attempts over
+LOGIN_LIMIT_PER_IP = 30  # Login attempts from one address
+LOGIN_LIMIT_PER_USERNAME = 10  # Failed logins for one username, from any address
+REGISTER_LIMIT_PER_IP = 10  # Registration attempts from one address
+RATE_LIMIT_MAX_KEYS = 100000  # Addresses and usernames each worker tracks (about 220 bytes each)
+RATE_LIMIT_STORE = 'memory'  # 'memory' (each worker counts alone) or 'database' (shared by all workers)
+# Reverse proxies in front of the app that append to X-Forwarded-For. The limits
+# key on the client address, which behind a proxy is the proxy's own; 0 ignores
+# the header, as anyone can send it.
+TRUSTED_PROXY_HOPS = 0
+
+# Logging settings
+LOG_DIR = os.environ.get('MOOD_TRACKER_LOG_DIR', 'logs')
+LOG_QUEUE_SIZE = 10000  # Max records waiting for the background log writer
+LOG_OVERFLOW_POLICY = 'drop_new'  # 'drop_new', 'drop_oldest' or 'block' when the queue is full
+LOG_CONSOLE = True  # Also print log lines to stdout
+# 'size' rotates the log files at 10MB from the process that built the app;
+# workers forked from it (serve.py, gunicorn --preload) only append. With
+# several workers use 'external' and rotate with logrotate (see the README).
+LOG_ROTATION = 'size'
+
+# Request logging (one JSON line per request in logs/mood_tracker.log)
+REQUEST_LOG_ENABLED = True
+REQUEST_LOG_SAMPLE_RATE = 1.0  # Fraction of requests to log; server errors are always logged
+
+# Operators allowed to see /metrics and other admin-only pages
+ADMIN_USERNAMES = []  # e.g. ['alice']
+
+# Metrics (Prometheus text at /metrics)
+METRICS_ENABLED = True
+METRICS_DIR = 'logs/metrics'  # Per-worker snapshots are merged from this directory
+METRICS_FLUSH_INTERVAL = 5.0  # Seconds between snapshot writes
+METRICS_TOKEN = None  # Optional bearer token for scrapers, e.g. 'change-me'
+
+# Request profiling (admins add ?_profile=1 or an 'X-Profile: 1' header)
+PROFILE_ENABLED = True
+PROFILE_SAMPLE_RATE = 0.0  # Fraction of all requests to profile automatically
+PROFILE_DIR = 'logs/profiles'
+PROFILE_MAX_FILES = 200
+PROFILE_RETENTION_DAYS = 7
+
+# Slow query log (shown on the admin panel)
+SLOW_QUERY_ENABLED = True
+SLOW_QUERY_THRESHOLD_MS = 100  # Statements slower than this are recorded
+SLOW_QUERY_CAPTURE_PLANS = True  # Capture EXPLAIN QUERY PLAN once per distinct statement
@@ -0,0 +1,68 @@
+"""
+Fixtures shared by the tests that build the whole app: make_app() runs
+create_app() with its database, logs, metrics and profiles in the test's
+tmp_path, and register() / login() return a test client signed in as a user.
+"""
+
+import pytest
+
+from app import create_app
+
+
+@pytest.fixture
+def app_config(tmp_path):
+    """Settings that keep an app's files in tmp_path and its background threads off."""
+    return {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'mood_tracker.db'}",
+        'LOG_DIR': str(tmp_path / 'logs'),
+        'LOG_CONSOLE': False,
+        'METRICS_DIR': str(tmp_path / 'metrics'),
+        'PROFILE_DIR': str(tmp_path / 'profiles'),
+        'PREWARM_PLOTLY': False,
+        'JOB_WORKER_THREADS': 0,
+        'TESTING': True,
+    }
+
+
+@pytest.fixture
+def shard_config(tmp_path):
+    """Overrides for a directory database plus shards, all SQLite files in tmp_path."""
+    return {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'directory.db'}",
+        'SHARD_COUNT': 2,
+        'SHARD_URI_TEMPLATE': f"sqlite:///{tmp_path}/shard{{shard}}.db",
+    }
+
+
+@pytest.fixture
+def make_app(app_config):
+    """make_app(**overrides) builds an app from app_config with the given settings replaced."""
+    def make(**config):
+        return create_app(dict(app_config, **config))
+    return make
+
+
+def _login(app, username='alice'):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': 'password'})
+    return client
+
+
+def _register(app, username='alice'):
+    client = app.test_client()
+    client.post('/register', data={'username': username, 'email': f'{username}@example.com', 'password': 'password',
+                                   'confirm_password': 'password', 'beta_code': app.config['BETA_CODE']})
+    client.post('/login', data={'username': username, 'password': 'password'})
+    return client
+
+
+@pytest.fixture
+def login():
+    """login(app, username='alice') returns a client logged in as an existing user (password 'password')."""
+    return _login
+
+
+@pytest.fixture
+def register():
+    """register(app, username='alice') signs a new user up and returns a client logged in as them."""
+    return _register
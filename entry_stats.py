@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Running per-user statistics of entry metrics, and unusual-day flags.
+
+For every user and metric (mood, sleep, anxiety, energy, irritability and
+weight) the entry_stats table keeps:
+
+    count, mean, m2         Welford's running mean and sum of squared
+                            deviations over all the user's entries
+    ew_sum, ew_sum_sq,      exponentially weighted sums of the values, of
+    ew_weight               their squares and of the weights (span EW_SPAN
+                            entries): the recent mean and variance
+
+The entry write paths (entry_store.py and /delete) count each write in the
+same transaction, in constant time. An entry's entry_score row keeps the
+values it contributed and its position (seq), so an edit or delete takes
+exactly those values back out: Welford's update run in reverse, and for
+the weighted sums the entry's own weight, which only depends on how many
+entries were counted after it. An edited entry keeps its position.
+
+When an entry is counted it is compared with the user's other entries. A
+metric whose z-score against the all-time or the recent mean reaches
+ANOMALY_Z_THRESHOLD sets that metric's LOW or HIGH bit in entry_score.flags.
+Nothing is flagged before a user has ANOMALY_MIN_ENTRIES values of a
+metric. Flags record how unusual a day was when it was written; later
+entries don't change them.
+
+A user's first write after this was added counts their existing entries in
+date order. Data written any other way (imports, restores) needs a rebuild;
+the verifier compares the running statistics with a full recompute:
+
+Usage: python entry_stats.py [--rebuild] [--verify] [--user-id ID]
+"""
+
+import argparse
+import math
+import sys
+
+from flask import current_app
+from sqlalchemy import bindparam, delete, insert, select, update
+
+import sharding
+from models import db, dialect_insert, EntryScore, EntryStats, MoodEntry
+
+METRICS = ('mood_level', 'hours_slept', 'anxiety', 'energy_level', 'irritability', 'weight')
+LABELS = {
+    'mood_level': 'Mood', 'hours_slept': 'Sleep', 'anxiety': 'Anxiety', 'energy_level': 'Energy',
+    'irritability': 'Irritability', 'weight': 'Weight',
+}
+EW_SPAN = 14
+EW_ALPHA = 2 / (EW_SPAN + 1)
+# The recent mean is only used once recent entries carry at least this much weight (of 1).
+EW_MIN_WEIGHT = 0.5
+# Standard deviations below this (a user who always logs the same sleep) count as this.
+MIN_STDDEV = 0.5
+_STATE = ('count', 'mean', 'm2', 'ew_sum', 'ew_sum_sq', 'ew_weight', 'seq')
+
+# The statements of every write, built once as Core statements on the tables: the
+# ORM's per-statement work on these small queries cost more than running them.
+_stats, _scores = EntryStats.__table__, EntryScore.__table__
+_LOAD = (select(_stats.c.metric, *(_stats.c[name] for name in _STATE))
+         .where(_stats.c.user_id == bindparam('user_id')).with_for_update())
+_SAVE = (update(_stats)
+         .where(_stats.c.user_id == bindparam('b_user_id'), _stats.c.metric == bindparam('b_metric'))
+         .values({name: bindparam(name) for name in _STATE}))
+_PREVIOUS = (select(_scores.c.entry_id, _scores.c.seq, *(_scores.c[metric] for metric in METRICS))
+             .where(_scores.c.user_id == bindparam('user_id'),
+                    _scores.c.entry_id.in_(bindparam('entry_ids', expanding=True))))
+_upserts = {}
+
+
+def _upsert_scores():
+    """The entry_score upsert for the session's database, built on first use."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in _upserts:
+        statement = dialect_insert(_scores)
+        _upserts[dialect] = statement.on_conflict_do_update(
+            index_elements=['entry_id'], set_={name: statement.excluded[name] for name in ('seq', 'flags') + METRICS})
+    return _upserts[dialect]
+
+
+def low_bit(metric):
+    return 1 << (2 * METRICS.index(metric))
+
+
+def high_bit(metric):
+    return low_bit(metric) << 1
+
+
+def describe(flags):
+    """Readable list of what an entry's flags mark, e.g. ['Mood low', 'Sleep low']."""
+    found = []
+    for metric in METRICS:
+        if flags & low_bit(metric):
+            found.append(f'{LABELS[metric]} low')
+        if flags & high_bit(metric):
+            found.append(f'{LABELS[metric]} high')
+    return found
+
+
+class RunningStats:
+    """One metric's running statistics; add() and remove() are exact inverses."""
+
+    __slots__ = _STATE
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, ew_sum=0.0, ew_sum_sq=0.0, ew_weight=0.0, seq=0):
+        self.count, self.mean, self.m2 = count, mean, m2
+        self.ew_sum, self.ew_sum_sq, self.ew_weight, self.seq = ew_sum, ew_sum_sq, ew_weight, seq
+
+    def advance(self):
+        """Make room for the next entry: every weight so far decays by (1 - alpha)."""
+        decay = 1 - EW_ALPHA
+        self.ew_sum *= decay
+        self.ew_sum_sq *= decay
+        self.ew_weight *= decay
+        self.seq += 1
+
+    def _weight(self, seq):
+        return EW_ALPHA * (1 - EW_ALPHA) ** (self.seq - seq)
+
+    def add(self, value, seq):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        weight = self._weight(seq)
+        self.ew_sum += weight * value
+        self.ew_sum_sq += weight * value * value
+        self.ew_weight += weight
+
+    def remove(self, value, seq):
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            self.ew_sum = self.ew_sum_sq = self.ew_weight = 0.0
+            return
+        mean = (self.count * self.mean - value) / (self.count - 1)
+        self.m2 = max(self.m2 - (value - mean) * (value - self.mean), 0.0)
+        self.count -= 1
+        self.mean = mean
+        weight = self._weight(seq)
+        self.ew_sum -= weight * value
+        self.ew_sum_sq -= weight * value * value
+        self.ew_weight = max(self.ew_weight - weight, 0.0)
+
+    def stddev(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def ew_mean(self):
+        return self.ew_sum / self.ew_weight if self.ew_weight >= EW_MIN_WEIGHT else None
+
+    def ew_stddev(self):
+        mean = self.ew_mean()
+        if mean is None:
+            return None
+        return math.sqrt(max(self.ew_sum_sq / self.ew_weight - mean * mean, 0.0))
+
+    def zscores(self, value):
+        """(all-time z, recent z) of a value; recent z is 0 without recent entries."""
+        z_all = (value - self.mean) / max(self.stddev(), MIN_STDDEV)
+        mean = self.ew_mean()
+        z_recent = 0.0 if mean is None else (value - mean) / max(self.ew_stddev(), MIN_STDDEV)
+        return z_all, z_recent
+
+    def as_row(self):
+        return {name: getattr(self, name) for name in _STATE}
+
+
+def flags_for(states, values, threshold, min_entries):
+    """Unusual-day bits for an entry's values, against the stats of the user's other entries."""
+    flags = 0
+    for metric in METRICS:
+        value, state = values.get(metric), states[metric]
+        if value is None or state.count < min_entries:
+            continue
+        z_all, z_recent = state.zscores(float(value))
+        if min(z_all, z_recent) <= -threshold:
+            flags |= low_bit(metric)
+        if max(z_all, z_recent) >= threshold:
+            flags |= high_bit(metric)
+    return flags
+
+
+class _Counter:
+    """Counts entries into a user's states and collects their entry_score rows."""
+
+    def __init__(self, user_id, states):
+        config = current_app.config
+        self.user_id, self.states, self.scores = user_id, states, []
+        self.threshold, self.min_entries = config['ANOMALY_Z_THRESHOLD'], config['ANOMALY_MIN_ENTRIES']
+
+    def uncount(self, score):
+        for metric in METRICS:
+            value = getattr(score, metric)
+            if value is not None:
+                self.states[metric].remove(value, score.seq)
+
+    def count(self, entry_id, values, seq=None):
+        if seq is None:
+            for state in self.states.values():
+                state.advance()
+            seq = self.states[METRICS[0]].seq
+        flags = flags_for(self.states, values, self.threshold, self.min_entries)
+        row = {'entry_id': entry_id, 'user_id': self.user_id, 'seq': seq, 'flags': flags}
+        for metric in METRICS:
+            value = values.get(metric)
+            row[metric] = None if value is None else float(value)
+            if value is not None:
+                self.states[metric].add(row[metric], seq)
+        self.scores.append(row)
+
+
+def _load(user_id):
+    # FOR UPDATE (a no-op on SQLite, where the entry write already holds the
+    # write lock) serialises concurrent writes of the same user.
+    rows = db.session.execute(_LOAD, {'user_id': user_id}).all()
+    if not rows:
+        return None
+    states = {metric: RunningStats() for metric in METRICS}
+    for row in rows:
+        states[row.metric] = RunningStats(*(getattr(row, name) for name in _STATE))
+    return states
+
+
+def _save(user_id, states):
+    # The rows exist (loaded or just seeded): one executemany UPDATE by primary key.
+    db.session.execute(_SAVE, [
+        dict(state.as_row(), b_user_id=user_id, b_metric=metric) for metric, state in states.items()])
+
+
+def _seed(user_id, exclude=()):
+    """
+    Count the user's existing entries (except `exclude`) in date order,
+    replacing their entry_score rows. Returns the states, or None if another
+    transaction created the user's stats first.
+    """
+    query = select(MoodEntry.id, *(getattr(MoodEntry, metric) for metric in METRICS)).where(
+        MoodEntry.user_id == user_id)
+    if exclude:
+        query = query.where(MoodEntry.id.not_in(list(exclude)))
+    counter = _Counter(user_id, {metric: RunningStats() for metric in METRICS})
+    for row in db.session.execute(query.order_by(MoodEntry.entry_date, MoodEntry.id)):
+        counter.count(row.id, row._mapping)
+
+    created = db.session.execute(
+        dialect_insert(EntryStats).values([
+            dict(state.as_row(), user_id=user_id, metric=metric) for metric, state in counter.states.items()])
+        .on_conflict_do_nothing(index_elements=['user_id', 'metric'])
+    ).rowcount
+    if created < len(METRICS):
+        return None
+    db.session.execute(delete(EntryScore).where(EntryScore.user_id == user_id))
+    if counter.scores:
+        db.session.execute(insert(EntryScore), counter.scores)
+    return counter.states
+
+
+def record(user_id, written=None, deleted=(), inserted=()):
+    """
+    Count a write in the user's statistics. `written` maps entry ids to their
+    new column values (new or changed entries, in the order written),
+    `deleted` lists entry ids removed and `inserted` says which of `written`
+    are new (they have nothing to take back out). Returns {entry_id: flags}
+    for `written`. The caller commits.
+    """
+    written = written or {}
+    changed = set(written) | set(deleted)
+    while True:
+        states = _load(user_id)
+        if states is None:
+            states = _seed(user_id, exclude=changed)
+        if states is not None:
+            break
+        # Another transaction counted the user's entries first: count into theirs.
+
+    lookup = [entry_id for entry_id in changed if entry_id not in set(inserted)]
+    previous = {}
+    if lookup:
+        previous = {row.entry_id: row for row in db.session.execute(
+            _PREVIOUS, {'user_id': user_id, 'entry_ids': lookup})}
+
+    counter = _Counter(user_id, states)
+    for entry_id in deleted:
+        if entry_id in previous:
+            counter.uncount(previous[entry_id])
+    for entry_id, values in written.items():
+        old = previous.get(entry_id)
+        if old is not None:
+            counter.uncount(old)
+        counter.count(entry_id, values, old.seq if old is not None else None)
+
+    _save(user_id, states)
+    if counter.scores:
+        db.session.execute(_upsert_scores(), counter.scores)
+    if deleted:
+        db.session.execute(delete(_scores).where(_scores.c.entry_id.in_(list(deleted))))
+    return {row['entry_id']: row['flags'] for row in counter.scores}
+
+
+def flagged_days(user_id):
+    """{entry_date: describe(flags)} for the user's entries flagged as unusual."""
+    rows = db.session.execute(
+        select(MoodEntry.entry_date, EntryScore.flags)
+        .join(EntryScore, EntryScore.entry_id == MoodEntry.id)
+        .where(EntryScore.user_id == user_id, EntryScore.flags != 0)
+    ).all()
+    return {entry_date: describe(flags) for entry_date, flags in rows}
+
+
+def rebuild(user_id):
+    """Recount the user's entries from scratch, in date order. Returns how many. The caller commits."""
+    db.session.execute(delete(EntryStats).where(EntryStats.user_id == user_id))
+    states = _seed(user_id)
+    return states[METRICS[0]].seq
+
+
+def _close(a, b):
+    return math.isclose(a, b, rel_tol=1e-6, abs_tol=1e-6)
+
+
+def verify(user_id):
+    """
+    Differences between the user's running statistics and a full recompute
+    from their entry rows (and entry_score positions); empty when in step.
+    """
+    states = _load(user_id) or {metric: RunningStats() for metric in METRICS}
+    entries = db.session.execute(
+        select(MoodEntry.id, *(getattr(MoodEntry, metric) for metric in METRICS)).where(MoodEntry.user_id == user_id)
+    ).all()
+    scores = {row.entry_id: row for row in db.session.execute(
+        select(EntryScore.entry_id, EntryScore.seq, *(getattr(EntryScore, metric) for metric in METRICS))
+        .where(EntryScore.user_id == user_id))}
+    problems = [f"entry {entry_id}: counted but deleted" for entry_id in sorted(set(scores) - {e.id for e in entries})]
+    for entry in entries:
+        score = scores.get(entry.id)
+        if score is None:
+            problems.append(f"entry {entry.id}: not counted")
+        elif any(getattr(entry, metric) != getattr(score, metric) for metric in METRICS):
+            problems.append(f"entry {entry.id}: counted with other values")
+
+    for metric in METRICS:
+        state = states[metric]
+        counted = [(float(getattr(entry, metric)), scores[entry.id].seq) for entry in entries
+                   if getattr(entry, metric) is not None and entry.id in scores]
+        values = [value for value, _ in counted]
+        mean = sum(values) / len(values) if values else 0.0
+        weights = [EW_ALPHA * (1 - EW_ALPHA) ** (state.seq - seq) for _, seq in counted]
+        expected = {
+            'count': len(values),
+            'mean': mean,
+            'm2': sum((value - mean) ** 2 for value in values),
+            'ew_sum': sum(weight * value for weight, (value, _) in zip(weights, counted)),
+            'ew_sum_sq': sum(weight * value * value for weight, (value, _) in zip(weights, counted)),
+            'ew_weight': sum(weights),
+        }
+        for name, want in expected.items():
+            if not _close(getattr(state, name), want):
+                problems.append(f"{metric}: {name} is {getattr(state, name)!r}, recomputed {want!r}")
+    return problems
+
+
+def _user_ids():
+    ids = set()
+    for shard in sharding.shards():
+        with sharding.use_shard(shard):
+            ids.update(db.session.execute(select(MoodEntry.user_id).distinct()).scalars())
+            ids.update(db.session.execute(select(EntryStats.user_id).distinct()).scalars())
+    return sorted(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or check the running entry statistics")
+    parser.add_argument('--rebuild', action='store_true', help="Recount every entry (also recomputes flags)")
+    parser.add_argument('--verify', action='store_true', help="Compare the running statistics with a full recompute")
+    parser.add_argument('--user-id', type=int, help="Only this user")
+    args = parser.parse_args()
+    if not (args.rebuild or args.verify):
+        parser.error("nothing to do: pass --rebuild and/or --verify")
+
+    from app import create_app
+
+    app = create_app()
+    bad_users = 0
+    with app.app_context():
+        for user_id in [args.user_id] if args.user_id else _user_ids():
+            sharding.bind_user(user_id)
+            if args.rebuild:
+                counted = rebuild(user_id)
+                db.session.commit()
+                print(f"User {user_id}: counted {counted} entries")
+            if args.verify:
+                problems = verify(user_id)
+                if problems:
+                    bad_users += 1
+                    print(f"User {user_id}: {len(problems)} difference(s), first: {problems[0]}")
+    return 1 if bad_users else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
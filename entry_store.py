@@ -0,0 +1,317 @@
+"""
+Atomic write path for mood entries.
+
+Creating an entry is one INSERT ... ON CONFLICT (user_id, entry_date)
+statement, so two concurrent submits for the same day can never both pass a
+"does it exist?" check and race into an IntegrityError. Medication links are
+written with a single INSERT ... SELECT that also checks the medications
+belong to the user. Every call reports what happened as one of the outcome
+constants below, records the change in the change log (changelog.py),
+counts it in the user's running statistics (entry_stats.py) and keeps the
+columnar history (history.py) in step when it is on. A write dated in an
+archived year first brings that year back from cold storage (archive.py).
+"""
+
+import math
+from datetime import date
+
+from sqlalchemy import and_, delete, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+
+import archive
+import changelog
+import entry_stats
+import history
+import sharding
+from models import db, dialect_insert, Medication, MoodEntry, MoodEntryMedication
+
+INSERTED = 'inserted'    # New entry created
+UPDATED = 'updated'      # Existing entry for that date overwritten (mode='update')
+EXISTS = 'exists'        # Entry for that date already there, left alone (mode='insert')
+CONFLICT = 'conflict'    # Edit would move the entry onto a date that is taken
+NOT_FOUND = 'not_found'  # No such entry for this user
+
+ENTRY_FIELDS = (
+    'mood_level', 'hours_slept', 'anxiety', 'energy_level', 'irritability', 'alcohol_drugs',
+    'exercise', 'menstruation', 'stressful_event', 'weight', 'notes',
+)
+_CONFLICT_COLUMNS = ['user_id', 'entry_date']
+
+# JSON field name -> (column, type, minimum, maximum). Ranges match the entry form.
+JSON_METRICS = {
+    'mood': ('mood_level', int, 0, 10),
+    'hours_slept': ('hours_slept', float, 0, 24),
+    'anxiety': ('anxiety', int, 0, 10),
+    'energy': ('energy_level', int, 0, 10),
+    'irritability': ('irritability', int, 0, 10),
+}
+JSON_FLAGS = ('alcohol_drugs', 'exercise', 'menstruation', 'stressful_event')
+
+
+def entry_values_from_form(form):
+    """
+    Column values from the entry form (/submit and /edit share the field
+    names, which are the JSON ones). Raises ValueError, with a message for
+    the user, for a value the JSON API would refuse: the packed history
+    stores the levels as uint8.
+    """
+    values = {}
+    for field, (column, kind, low, high) in JSON_METRICS.items():
+        try:
+            value = kind(form[field])
+        except ValueError:
+            raise ValueError(f'{field} must be a {"whole " if kind is int else ""}number') from None
+        if not low <= value <= high:  # Also false for NaN
+            raise ValueError(f'{field} must be between {low} and {high}')
+        values[column] = value
+    for flag in JSON_FLAGS:
+        values[flag] = form.get(flag) == 'on'
+    weight = float(form['weight']) if form.get('weight') else None
+    if weight is not None and not 0 <= weight <= 500:
+        raise ValueError('weight must be a number between 0 and 500')
+    values['weight'] = weight
+    values['notes'] = form.get('notes', '')
+    return values
+
+
+def entry_to_json(entry, medication_ids):
+    """An entry in the format entry_from_json() accepts, plus its id."""
+    item = {'id': entry.id, 'date': entry.entry_date.isoformat()}
+    for field, (column, _, _, _) in JSON_METRICS.items():
+        item[field] = getattr(entry, column)
+    for flag in JSON_FLAGS:
+        item[flag] = bool(getattr(entry, flag))
+    item['weight'] = entry.weight
+    item['notes'] = entry.notes or ''
+    item['medications'] = sorted(medication_ids)
+    return item
+
+
+def _finite(value):
+    # math.isfinite() would overflow on ints too large for a float; those fail the range check instead.
+    return not isinstance(value, float) or math.isfinite(value)
+
+
+def entry_from_json(item, today):
+    """
+    Validate one entry of a JSON upload.
+    Returns ((entry_date, values, medication_ids), errors); the first part is
+    None when there are errors.
+    """
+    if not isinstance(item, dict):
+        return None, ['entry must be an object']
+    errors = []
+    try:
+        entry_date = date.fromisoformat(item.get('date'))
+        if entry_date > today:
+            errors.append('date is in the future')
+    except (TypeError, ValueError):
+        entry_date = None
+        errors.append('date must be YYYY-MM-DD')
+
+    values = {}
+    for field, (column, kind, low, high) in JSON_METRICS.items():
+        value = item.get(field)
+        # bool is an int subclass; true/false is never a valid rating. get_json() lets NaN and Infinity through.
+        if (isinstance(value, bool) or not isinstance(value, (int, float)) or not _finite(value)
+                or (kind is int and value != int(value))):
+            errors.append(f'{field} must be a {"whole " if kind is int else ""}number')
+        elif not low <= value <= high:
+            errors.append(f'{field} must be between {low} and {high}')
+        else:
+            values[column] = kind(value)
+    for flag in JSON_FLAGS:
+        value = item.get(flag, False)
+        if not isinstance(value, bool):
+            errors.append(f'{flag} must be true or false')
+        values[flag] = value is True
+    weight = item.get('weight')
+    if weight is not None and (isinstance(weight, bool) or not isinstance(weight, (int, float)) or not 0 <= weight <= 500):
+        errors.append('weight must be a number between 0 and 500')
+        weight = None
+    values['weight'] = float(weight) if weight is not None else None
+    notes = item.get('notes', '')
+    if not isinstance(notes, str):
+        errors.append('notes must be a string')
+    values['notes'] = notes if isinstance(notes, str) else ''
+    medication_ids = item.get('medications', [])
+    if not isinstance(medication_ids, list) or not all(
+            isinstance(m, int) and not isinstance(m, bool) for m in medication_ids):
+        errors.append('medications must be a list of medication ids')
+        medication_ids = []
+
+    if errors:
+        return None, errors
+    return (entry_date, values, medication_ids), []
+
+
+def owned_medication_ids(user_id, medication_ids):
+    """The subset of medication_ids that belong to the user (one query)."""
+    ids = _medication_ids(medication_ids)
+    if not ids:
+        return set()
+    return set(db.session.execute(
+        select(Medication.id).where(Medication.user_id == user_id, Medication.id.in_(ids))).scalars())
+
+
+def _medication_ids(values):
+    ids = set()
+    for value in values:
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    return sorted(ids)
+
+
+def link_medications(entry_id, user_id, medication_ids, replace=False):
+    """Mark medications as taken for an entry in one statement; ignores ids the user doesn't own."""
+    if replace:
+        db.session.execute(delete(MoodEntryMedication).where(MoodEntryMedication.mood_entry_id == entry_id))
+    ids = _medication_ids(medication_ids)
+    if not ids:
+        return 0
+    owned = select(literal(entry_id), Medication.id, literal(True)).where(
+        and_(Medication.user_id == user_id, Medication.id.in_(ids)))
+    result = db.session.execute(
+        MoodEntryMedication.__table__.insert().from_select(['mood_entry_id', 'medication_id', 'taken'], owned))
+    return result.rowcount
+
+
+def save_entry(user_id, entry_date, values, medication_ids=(), mode='insert'):
+    """
+    Create the user's entry for entry_date.
+    mode='insert' leaves an existing entry alone (ON CONFLICT DO NOTHING) and
+    returns EXISTS; mode='update' overwrites it (ON CONFLICT DO UPDATE) and
+    returns UPDATED, replacing its medication links. Returns (outcome, entry_id).
+    The caller commits.
+    """
+    if mode not in ('insert', 'update'):
+        raise ValueError(f"unknown mode: {mode}")
+    archive.restore_dates(user_id, [entry_date])
+    row = dict(values, user_id=user_id, entry_date=entry_date)
+    statement = dialect_insert(MoodEntry).values(**row)
+
+    entry_id = db.session.execute(
+        statement.on_conflict_do_nothing(index_elements=_CONFLICT_COLUMNS).returning(MoodEntry.id)
+    ).scalar()
+    if entry_id is not None:
+        link_medications(entry_id, user_id, medication_ids)
+        changelog.record(user_id, changelog.ENTRY, [entry_id])
+        entry_stats.record(user_id, {entry_id: values}, inserted=[entry_id])
+        history.update_days(user_id, {entry_date: values})
+        return INSERTED, entry_id
+
+    if mode == 'insert':
+        entry_id = db.session.execute(
+            select(MoodEntry.id).where(MoodEntry.user_id == user_id, MoodEntry.entry_date == entry_date)
+        ).scalar()
+        return EXISTS, entry_id
+
+    # The row exists, so this DO UPDATE always takes the update branch; it is
+    # still an upsert so a concurrent delete can't make the write disappear.
+    entry_id = db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=_CONFLICT_COLUMNS,
+            set_={field: statement.excluded[field] for field in ENTRY_FIELDS},
+        ).returning(MoodEntry.id)
+    ).scalar()
+    link_medications(entry_id, user_id, medication_ids, replace=True)
+    changelog.record(user_id, changelog.ENTRY, [entry_id])
+    entry_stats.record(user_id, {entry_id: values})
+    history.update_days(user_id, {entry_date: values})
+    return UPDATED, entry_id
+
+
+def edit_entry(entry_id, user_id, entry_date, values):
+    """
+    Update one of the user's entries (possibly moving it to another date) in a
+    single UPDATE. The unique (user_id, entry_date) constraint reports a
+    clash with another entry as CONFLICT (after rolling the session back).
+    Returns the outcome; the caller commits.
+    """
+    archive.restore_dates(user_id, [entry_date])
+    old_date = None
+    if history.is_enabled():
+        # The columnar history must also drop the day the entry moves away from.
+        old_date = db.session.execute(
+            select(MoodEntry.entry_date).where(MoodEntry.id == entry_id, MoodEntry.user_id == user_id)
+        ).scalar()
+    try:
+        result = db.session.execute(
+            update(MoodEntry)
+            .where(MoodEntry.id == entry_id, MoodEntry.user_id == user_id)
+            .values(entry_date=entry_date, **values)
+            .execution_options(synchronize_session=False)
+        )
+    except IntegrityError as e:
+        db.session.rollback()
+        if sharding.user_moved(e):
+            raise
+        return CONFLICT
+    if not result.rowcount:
+        return NOT_FOUND
+    changelog.record(user_id, changelog.ENTRY, [entry_id])
+    entry_stats.record(user_id, {entry_id: values})
+    history.update_days(user_id, {entry_date: values}, [old_date] if old_date not in (None, entry_date) else [])
+    return UPDATED
+
+
+def save_entries(user_id, items, mode='update'):
+    """
+    Bulk version of save_entry for (entry_date, values, medication_ids) items
+    with distinct dates: one multi-row INSERT ... ON CONFLICT DO NOTHING, then
+    one DO UPDATE (mode='update') or SELECT (mode='insert') for the dates that
+    already had entries, and one bulk insert of medication links.
+    Returns [(outcome, entry_id)] in item order. The caller commits.
+    """
+    if mode not in ('insert', 'update'):
+        raise ValueError(f"unknown mode: {mode}")
+    if not items:
+        return []
+    archive.restore_dates(user_id, [entry_date for entry_date, _, _ in items])
+    rows = [dict(values, user_id=user_id, entry_date=entry_date) for entry_date, values, _ in items]
+    statement = dialect_insert(MoodEntry).values(rows)
+    inserted = dict(db.session.execute(
+        statement.on_conflict_do_nothing(index_elements=_CONFLICT_COLUMNS)
+        .returning(MoodEntry.entry_date, MoodEntry.id)
+    ).all())
+    outcomes = {entry_date: (INSERTED, entry_id) for entry_date, entry_id in inserted.items()}
+
+    existing = [row for row in rows if row['entry_date'] not in inserted]
+    if existing and mode == 'insert':
+        found = db.session.execute(
+            select(MoodEntry.entry_date, MoodEntry.id).where(
+                MoodEntry.user_id == user_id, MoodEntry.entry_date.in_([row['entry_date'] for row in existing]))
+        ).all()
+        outcomes.update({entry_date: (EXISTS, entry_id) for entry_date, entry_id in found})
+    elif existing:
+        statement = dialect_insert(MoodEntry).values(existing)
+        updated = db.session.execute(
+            statement.on_conflict_do_update(
+                index_elements=_CONFLICT_COLUMNS,
+                set_={field: statement.excluded[field] for field in ENTRY_FIELDS},
+            ).returning(MoodEntry.entry_date, MoodEntry.id)
+        ).all()
+        outcomes.update({entry_date: (UPDATED, entry_id) for entry_date, entry_id in updated})
+        db.session.execute(delete(MoodEntryMedication).where(
+            MoodEntryMedication.mood_entry_id.in_([entry_id for _, entry_id in updated])))
+
+    owned = owned_medication_ids(user_id, [m for _, _, meds in items for m in meds])
+    links = []
+    for entry_date, _, medication_ids in items:
+        outcome, entry_id = outcomes[entry_date]
+        if outcome != EXISTS:
+            links.extend({'mood_entry_id': entry_id, 'medication_id': med, 'taken': True}
+                         for med in _medication_ids(medication_ids) if med in owned)
+    if links:
+        db.session.execute(insert(MoodEntryMedication), links)
+    changelog.record(user_id, changelog.ENTRY,
+                     [entry_id for outcome, entry_id in outcomes.values() if outcome != EXISTS])
+    entry_stats.record(
+        user_id,
+        {outcomes[entry_date][1]: values for entry_date, values, _ in items if outcomes[entry_date][0] != EXISTS},
+        inserted=[entry_id for outcome, entry_id in outcomes.values() if outcome == INSERTED])
+    history.update_days(user_id, {entry_date: values for entry_date, values, _ in items
+                                  if outcomes[entry_date][0] != EXISTS})
+    return [outcomes[entry_date] for entry_date, _, _ in items]
@@ -0,0 +1,246 @@
+"""
+Calendar heatmaps: one metric for one year of a user's entries as a
+GitHub-style grid, 7 rows (Sunday to Saturday) by one column per week.
+
+The grid starts on the Sunday on or before 1 January, so a year takes 53
+columns (54 in a leap year starting on a Saturday). Each cell is a value
+(null without one), a level from 0 to LEVELS (0 for a day without a value,
+-1 for cells outside the year) and a missing-day flag. Levels split the
+metric's scale into LEVELS equal bands; weight, which has no fixed scale,
+uses the lowest and highest weight of the year.
+
+A grid comes from one range query over the year's entries, or straight from
+the year's blob when COLUMNAR_HISTORY is on or the year is archived
+(archive.py), and is placed with NumPy.
+Grids are cached per app by (user, year, metric, change-log version): any
+write to the user's data moves the version on, so a cached grid is never
+stale and the /api/heatmap response can carry the version as its ETag.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from flask import current_app
+from sqlalchemy import and_, func, select
+
+import archive
+import changelog
+import history
+import metrics
+from models import db, EntryYearBlob, Medication, MoodEntry, MoodEntryMedication
+
+LEVELS = 4
+MIN_YEAR, MAX_YEAR = 1900, 9998
+MEDICATIONS = 'medications'
+MEDICATION_PREFIX = 'medication-'
+
+# name: (label, scale low, scale high, direction: 1 when higher is better, -1 worse, 0 neither)
+METRICS = {
+    'mood_level': ('Mood', 0, 10, 1),
+    'hours_slept': ('Hours slept', 0, 12, 1),
+    'anxiety': ('Anxiety', 0, 10, -1),
+    'energy_level': ('Energy', 0, 10, 1),
+    'irritability': ('Irritability', 0, 10, -1),
+    'weight': ('Weight', None, None, 0),
+    'exercise': ('Exercise', 0, 1, 1),
+    'alcohol_drugs': ('Alcohol/drugs', 0, 1, -1),
+    'stressful_event': ('Stressful event', 0, 1, -1),
+    'menstruation': ('Menstruation', 0, 1, 0),
+    MEDICATIONS: ('Medications taken', 0, 1, 1),
+}
+
+
+class UnknownMetric(ValueError):
+    """A ?metric= that isn't a column, 'medications' or one of the user's medications."""
+
+
+class GridCache:
+    """A bounded least-recently-used map from cache keys to grids, shared by an app's threads."""
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.grids = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            grid = self.grids.get(key)
+            if grid is not None:
+                self.grids.move_to_end(key)
+            return grid
+
+    def put(self, key, grid):
+        with self.lock:
+            self.grids[key] = grid
+            self.grids.move_to_end(key)
+            while len(self.grids) > self.size:
+                self.grids.popitem(last=False)
+
+
+def _cache():
+    extensions = current_app.extensions
+    if 'heatmap_cache' not in extensions:
+        extensions['heatmap_cache'] = GridCache(current_app.config['HEATMAP_CACHE_SIZE'])
+    return extensions['heatmap_cache']
+
+
+def metric_info(user_id, metric):
+    """(label, low, high, direction) for a metric name, or UnknownMetric."""
+    if metric in METRICS:
+        return METRICS[metric]
+    if metric.startswith(MEDICATION_PREFIX) and metric[len(MEDICATION_PREFIX):].isdigit():
+        name = db.session.execute(select(Medication.name).where(
+            Medication.id == int(metric[len(MEDICATION_PREFIX):]), Medication.user_id == user_id)).scalar()
+        if name is not None:
+            return name, 0, 1, 1
+    raise UnknownMetric(metric)
+
+
+def _year_bounds(year):
+    first = date(year, 1, 1)
+    return first, (date(year + 1, 1, 1) - first).days
+
+
+def _day_values(user_id, year, metric):
+    """(day-of-year indexes, values) of the days in the year with a value for the metric."""
+    import numpy as np
+
+    first, days = _year_bounds(year)
+    archived = archive.year_columns(user_id, year)
+    if archived is not None:
+        columns, links = archived
+        if metric in history.COLUMNS:
+            return _column_values(columns, metric, days)
+        medication = None if metric == MEDICATIONS else int(metric[len(MEDICATION_PREFIX):])
+        indexes = np.flatnonzero(columns['present'])
+        values = np.array([sum(1 for med, taken in day if taken and medication in (None, med)) for day in links],
+                          dtype=float)
+        return indexes, _medication_values(user_id, metric, values)
+    if history.is_enabled() and metric in history.COLUMNS:
+        blob = db.session.execute(select(EntryYearBlob.data).where(
+            EntryYearBlob.user_id == user_id, EntryYearBlob.year == year)).scalar()
+        if blob is None:
+            return np.array([], dtype=np.int64), np.array([])
+        return _column_values(history.decode(blob), metric, days)
+
+    in_year = and_(MoodEntry.user_id == user_id, MoodEntry.entry_date >= first,
+                   MoodEntry.entry_date < date(year + 1, 1, 1))
+    if metric == MEDICATIONS or metric.startswith(MEDICATION_PREFIX):
+        taken = MoodEntryMedication.taken.is_(True)
+        if metric != MEDICATIONS:
+            taken = and_(taken, MoodEntryMedication.medication_id == int(metric[len(MEDICATION_PREFIX):]))
+        query = (select(MoodEntry.entry_date, func.count(MoodEntryMedication.id))
+                 .outerjoin(MoodEntryMedication, and_(MoodEntryMedication.mood_entry_id == MoodEntry.id, taken))
+                 .where(in_year).group_by(MoodEntry.entry_date))
+    else:
+        column = getattr(MoodEntry, metric)
+        query = select(MoodEntry.entry_date, column).where(in_year, column.is_not(None))
+    rows = db.session.execute(query).all()
+    ordinal = first.toordinal()
+    indexes = np.fromiter((row[0].toordinal() - ordinal for row in rows), dtype=np.int64, count=len(rows))
+    values = np.fromiter((row[1] for row in rows), dtype=float, count=len(rows))
+    if metric == MEDICATIONS or metric.startswith(MEDICATION_PREFIX):
+        values = _medication_values(user_id, metric, values)
+    return indexes, values
+
+
+def _column_values(columns, metric, days):
+    """(day-of-year indexes, values) of a decoded year blob's days with a value for the metric."""
+    import numpy as np
+
+    values = columns[metric][:days].astype(float)
+    present = columns['present'][:days] & ~np.isnan(values)
+    indexes = np.flatnonzero(present)
+    return indexes, values[indexes]
+
+
+def _medication_values(user_id, metric, counts):
+    """Medication metric values from the number of (matching) medications taken each day."""
+    import numpy as np
+
+    if metric == MEDICATIONS:
+        # The share of the user's current medications taken that day.
+        active = db.session.execute(select(func.count()).select_from(Medication).where(
+            Medication.user_id == user_id, Medication.active.is_(True))).scalar()
+        return counts / np.maximum(counts, max(active, 1))
+    return np.minimum(counts, 1.0)
+
+
+def build_grid(user_id, year, metric):
+    """The year grid of one metric (uncached); see the module docstring for the cells."""
+    import numpy as np
+
+    label, low, high, direction = metric_info(user_id, metric)
+    first, days = _year_bounds(year)
+    offset = (first.weekday() + 1) % 7  # Cells before 1 January in the first week (weeks start on Sunday)
+    weeks = -(-(offset + days) // 7)
+    indexes, values = _day_values(user_id, year, metric)
+
+    cells = np.full(weeks * 7, np.nan)
+    cells[offset + indexes] = values
+    if low is None:
+        low, high = (float(values.min()), float(values.max())) if len(values) else (0.0, 1.0)
+        high = max(high, low + 1e-9)
+    levels = np.full(weeks * 7, -1, dtype=np.int8)
+    in_year = slice(offset, offset + days)
+    levels[in_year] = 0
+    bands = np.clip(np.floor((values - low) / (high - low) * LEVELS), 0, LEVELS - 1).astype(np.int8) + 1
+    levels[offset + indexes] = bands
+    missing = np.zeros(weeks * 7, dtype=np.int8)
+    missing[in_year] = np.isnan(cells[in_year])
+
+    def rows(array):
+        # Column-major days to 7 weekday rows.
+        return array.reshape(weeks, 7).T.tolist()
+
+    rounded = np.round(cells, 2).astype(object)
+    rounded[np.isnan(cells)] = None
+    return {
+        'year': year,
+        'metric': metric,
+        'label': label,
+        'direction': direction,
+        'scale': [low, high],
+        'start': date.fromordinal(first.toordinal() - offset).isoformat(),
+        'weeks': weeks,
+        'values': rows(rounded),
+        'levels': rows(levels),
+        'missing': rows(missing),
+        'logged': int(len(indexes)),
+        'mean': round(float(values.mean()), 2) if len(values) else None,
+    }
+
+
+def years(user_id):
+    """The first and last years the user has entries in (hot or archived), or None."""
+    first, last = db.session.execute(select(func.min(MoodEntry.entry_date), func.max(MoodEntry.entry_date))
+                                     .where(MoodEntry.user_id == user_id)).one()
+    found = archive.years(user_id) + ([first.year, last.year] if first else [])
+    return (min(found), max(found)) if found else None
+
+
+def medications(user_id):
+    """[{'metric', 'name'}] for the user's active medications, to pick one as the metric."""
+    return [{'metric': f'{MEDICATION_PREFIX}{med_id}', 'name': name} for med_id, name in db.session.execute(
+        select(Medication.id, Medication.name).where(Medication.user_id == user_id, Medication.active.is_(True))
+        .order_by(Medication.name))]
+
+
+def grid(user_id, year, metric):
+    """
+    The cached grid for the user's data as of now, with 'version' (the
+    user's change-log version it was built at), 'years' (first, last) and
+    the user's 'medications'.
+    """
+    # The version is read first: entries read after it are at least that new.
+    version, _ = changelog.sync_state(user_id)
+    key = (user_id, year, metric, version)
+    cache = _cache()
+    found = cache.get(key)
+    metrics.record_cache('heatmap', found is not None)
+    if found is None:
+        found = dict(build_grid(user_id, year, metric), version=version, years=years(user_id),
+                     medications=medications(user_id))
+        cache.put(key, found)
+    return found
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Columnar copy of users' entry history (optional, COLUMNAR_HISTORY).
+
+Reading a year of entries through the ORM builds 365 MoodEntry objects just
+to pull a handful of small numbers out of each. With COLUMNAR_HISTORY on,
+every user also has one row per year in entry_year_blob holding that year's
+entries packed into fixed-width arrays indexed by day of year (0-365):
+
+    header      b'MTH1', year (uint16), entries (uint16)
+    bitmaps     present, alcohol_drugs, exercise, menstruation,
+                stressful_event: 366 bits each, padded to 48 bytes
+    levels      mood_level, anxiety, energy_level, irritability: uint8 x 368
+    floats      hours_slept, weight: float64 x 366 (weight NaN when not given)
+
+Every section starts on an 8-byte boundary, so read() decodes a blob with
+np.frombuffer() views straight onto the bytes, without copying. Notes and
+medications are not included.
+
+The entry write paths (entry_store.py and /delete) update the blob in the
+same transaction as the row, so the two never disagree. Data written any
+other way (imports, restores, turning the setting on for an existing
+database) needs a rebuild:
+
+Usage: python history.py [--rebuild] [--verify] [--user-id ID]
+"""
+
+import argparse
+import struct
+import sys
+
+from flask import current_app
+from sqlalchemy import delete, insert, select, update
+
+import sharding
+from models import db, dialect_insert, EntryYearBlob, MoodEntry
+
+MAGIC = b'MTH1'
+DAYS = 366
+_HEADER = struct.Struct('<4sHH')
+_BITMAP_BYTES = 48
+_LEVEL_BYTES = 368
+
+FLAGS = ('alcohol_drugs', 'exercise', 'menstruation', 'stressful_event')
+LEVELS = ('mood_level', 'anxiety', 'energy_level', 'irritability')
+FLOATS = ('hours_slept', 'weight')
+COLUMNS = LEVELS + FLOATS + FLAGS
+
+
+def _layout():
+    """(name, kind, offset) for every section after the header."""
+    sections, offset = [], _HEADER.size
+    for name in ('present',) + FLAGS:
+        sections.append((name, 'bits', offset))
+        offset += _BITMAP_BYTES
+    for name in LEVELS:
+        sections.append((name, 'uint8', offset))
+        offset += _LEVEL_BYTES
+    for name in FLOATS:
+        sections.append((name, 'float64', offset))
+        offset += DAYS * 8
+    return sections, offset
+
+
+SECTIONS, BLOB_SIZE = _layout()
+
+
+def is_enabled(app=None):
+    return bool((app or current_app).config.get('COLUMNAR_HISTORY'))
+
+
+def day_of_year(day):
+    return day.timetuple().tm_yday - 1
+
+
+def empty_year():
+    """Columns for a year with no entries: {name: array of DAYS}."""
+    # numpy is only needed with COLUMNAR_HISTORY on, so it is imported on first use.
+    import numpy as np
+
+    columns = {name: np.zeros(DAYS, dtype=bool) for name in ('present',) + FLAGS}
+    columns.update({name: np.zeros(DAYS, dtype=np.uint8) for name in LEVELS})
+    columns['hours_slept'] = np.zeros(DAYS)
+    columns['weight'] = np.full(DAYS, np.nan)
+    return columns
+
+
+def encode(year, columns):
+    """Pack a year's columns (as returned by decode() or empty_year()) into a blob."""
+    import numpy as np
+
+    blob = bytearray(BLOB_SIZE)
+    _HEADER.pack_into(blob, 0, MAGIC, year, int(np.count_nonzero(columns['present'])))
+    for name, kind, offset in SECTIONS:
+        if kind == 'bits':
+            packed = np.packbits(columns[name], bitorder='little')
+            blob[offset:offset + len(packed)] = packed.tobytes()
+        else:
+            np.frombuffer(blob, dtype=kind, count=DAYS, offset=offset)[:] = columns[name]
+    return bytes(blob)
+
+
+def decode(blob):
+    """
+    A blob's columns as {name: array of DAYS}. The level and float arrays
+    are views onto the blob (read-only for bytes, writable for a bytearray);
+    the bitmaps are unpacked to bool arrays.
+    """
+    import numpy as np
+
+    magic, _, _ = _HEADER.unpack_from(blob, 0)
+    if magic != MAGIC:
+        raise ValueError("not an entry history blob")
+    columns = {}
+    for name, kind, offset in SECTIONS:
+        if kind == 'bits':
+            bits = np.frombuffer(blob, dtype=np.uint8, count=_BITMAP_BYTES, offset=offset)
+            columns[name] = np.unpackbits(bits, count=DAYS, bitorder='little').view(bool)
+        else:
+            columns[name] = np.frombuffer(blob, dtype=kind, count=DAYS, offset=offset)
+    return columns
+
+
+def set_day(columns, index, values):
+    """Put an entry's column values (a mapping) into a year's columns at day-of-year `index`."""
+    columns['present'][index] = True
+    for name in LEVELS + ('hours_slept',):
+        columns[name][index] = values[name]
+    weight = values.get('weight')
+    columns['weight'][index] = float('nan') if weight is None else weight
+    for name in FLAGS:
+        columns[name][index] = bool(values.get(name))
+
+
+def _clear_day(columns, index):
+    columns['present'][index] = False
+    for name in LEVELS + FLAGS:
+        columns[name][index] = 0
+    columns['hours_slept'][index] = 0.0
+    columns['weight'][index] = float('nan')
+
+
+def update_days(user_id, written=None, cleared=()):
+    """
+    Bring the user's blobs in line after a write: `written` maps dates to
+    the entry's column values, `cleared` lists dates that no longer have an
+    entry. Two statements per year touched. Does nothing unless
+    COLUMNAR_HISTORY is on. The caller commits.
+    """
+    if not is_enabled():
+        return
+    written = written or {}
+    years = {}
+    for day in cleared:
+        years.setdefault(day.year, []).append((day, None))
+    for day, values in written.items():
+        years.setdefault(day.year, []).append((day, values))
+
+    for year, changes in sorted(years.items()):
+        while True:
+            # FOR UPDATE (a no-op on SQLite, where the entry write already holds
+            # the write lock) serialises concurrent writers of the same year.
+            blob = db.session.execute(
+                select(EntryYearBlob.data)
+                .where(EntryYearBlob.user_id == user_id, EntryYearBlob.year == year)
+                .with_for_update()
+            ).scalar()
+            columns = decode(bytearray(blob)) if blob is not None else empty_year()
+            for day, values in changes:
+                if values is None:
+                    _clear_day(columns, day_of_year(day))
+                else:
+                    set_day(columns, day_of_year(day), values)
+            data = encode(year, columns)
+            if blob is not None:
+                db.session.execute(
+                    update(EntryYearBlob)
+                    .where(EntryYearBlob.user_id == user_id, EntryYearBlob.year == year)
+                    .values(data=data)
+                    .execution_options(synchronize_session=False))
+                break
+            inserted = db.session.execute(
+                dialect_insert(EntryYearBlob).values(user_id=user_id, year=year, data=data)
+                .on_conflict_do_nothing(index_elements=['user_id', 'year'])
+            ).rowcount
+            if inserted:
+                break
+            # Another transaction created this year's blob first: patch theirs.
+
+
+def read(user_id, first_year=None, last_year=None):
+    """
+    The user's entries as {'date': datetime64[D] array, column: array, ...},
+    one element per entry in date order, decoded from the year blobs.
+    """
+    query = select(EntryYearBlob.year, EntryYearBlob.data).where(EntryYearBlob.user_id == user_id)
+    if first_year is not None:
+        query = query.where(EntryYearBlob.year >= first_year)
+    if last_year is not None:
+        query = query.where(EntryYearBlob.year <= last_year)
+    return join_years((year, decode(blob)) for year, blob in db.session.execute(query.order_by(EntryYearBlob.year)))
+
+
+def join_years(years):
+    """read()'s arrays for the entries in (year, columns) pairs, taken in the order given."""
+    import numpy as np
+
+    parts = {name: [] for name in ('date',) + COLUMNS}
+    for year, columns in years:
+        days = np.flatnonzero(columns['present'])
+        parts['date'].append(np.datetime64(f'{year:04d}-01-01', 'D') + days)
+        for name in COLUMNS:
+            parts[name].append(columns[name][days])
+    if not parts['date']:
+        return {'date': np.array([], dtype='datetime64[D]'),
+                **{name: array[:0] for name, array in empty_year().items() if name != 'present'}}
+    return {name: np.concatenate(arrays) for name, arrays in parts.items()}
+
+
+def _row_values(entry):
+    return {name: getattr(entry, name) for name in COLUMNS}
+
+
+def rebuild(user_id):
+    """Recreate the user's blobs from their mood_entry rows. Returns the number of years. The caller commits."""
+    years = {}
+    for entry in db.session.execute(select(MoodEntry).where(MoodEntry.user_id == user_id)).scalars():
+        columns = years.setdefault(entry.entry_date.year, empty_year())
+        set_day(columns, day_of_year(entry.entry_date), _row_values(entry))
+    db.session.execute(delete(EntryYearBlob).where(EntryYearBlob.user_id == user_id))
+    if years:
+        db.session.execute(insert(EntryYearBlob), [
+            {'user_id': user_id, 'year': year, 'data': encode(year, columns)} for year, columns in years.items()
+        ])
+    return len(years)
+
+
+def verify(user_id):
+    """Dates whose blob contents differ from the user's rows (empty when in step)."""
+    import numpy as np
+
+    expected = {entry.entry_date: _row_values(entry) for entry in db.session.execute(
+        select(MoodEntry).where(MoodEntry.user_id == user_id)).scalars()}
+    stored = read(user_id)
+    days = stored['date'].tolist()
+    mismatched = set(expected) ^ set(days)
+    for index, day in enumerate(days):
+        values = expected.get(day)
+        if values is None:
+            continue
+        for name in COLUMNS:
+            value, want = stored[name][index], values[name]
+            if not (np.isnan(value) if name == 'weight' and want is None else value == want):
+                mismatched.add(day)
+    return sorted(mismatched)
+
+
+def _user_ids():
+    ids = set()
+    for shard in sharding.shards():
+        with sharding.use_shard(shard):
+            ids.update(db.session.execute(select(MoodEntry.user_id).distinct()).scalars())
+    return sorted(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or check the columnar entry history")
+    parser.add_argument('--rebuild', action='store_true', help="Recreate blobs from the entry rows")
+    parser.add_argument('--verify', action='store_true', help="Compare blobs with the entry rows")
+    parser.add_argument('--user-id', type=int, help="Only this user")
+    args = parser.parse_args()
+    if not (args.rebuild or args.verify):
+        parser.error("nothing to do: pass --rebuild and/or --verify")
+
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        if not is_enabled():
+            print("Note: COLUMNAR_HISTORY is off, so the app doesn't keep blobs up to date.")
+        bad_users = 0
+        for user_id in [args.user_id] if args.user_id else _user_ids():
+            sharding.bind_user(user_id)
+            if args.rebuild:
+                years = rebuild(user_id)
+                db.session.commit()
+                print(f"User {user_id}: rebuilt {years} year(s)")
+            if args.verify:
+                mismatched = verify(user_id)
+                if mismatched:
+                    bad_users += 1
+                    print(f"User {user_id}: {len(mismatched)} day(s) differ, first {mismatched[0]}")
+    return 1 if bad_users else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Idempotency keys for API writes.
+
+A client sends an Idempotency-Key header with a write. The first request
+with a key stores its response in the same transaction as its writes; a
+retry with the same key and body gets that stored response back instead of
+being applied again. Reusing a key for a different body is an error. Keys
+expire after IDEMPOTENCY_KEY_TTL_HOURS.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+
+from models import db, dialect_insert, IdempotencyKey
+
+MAX_KEY_LENGTH = 200
+
+
+class KeyReused(Exception):
+    """The key was already used for a request with a different body."""
+
+
+def request_hash(payload):
+    """Stable hash of a JSON payload (key order doesn't matter)."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def lookup(user_id, key, payload_hash, ttl_hours):
+    """
+    Stored (status_code, body) for this key, or None if the request should run.
+    Raises KeyReused if the key was used for a different request body.
+    """
+    row = db.session.execute(
+        select(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+    ).scalar()
+    if row is None:
+        return None
+    if row.created_at < datetime.utcnow() - timedelta(hours=ttl_hours):
+        db.session.delete(row)
+        db.session.flush()
+        return None
+    if row.request_hash != payload_hash:
+        raise KeyReused(key)
+    return row.status_code, json.loads(row.response)
+
+
+def store(user_id, key, payload_hash, status_code, body, ttl_hours):
+    """
+    Record the response in the current transaction. Returns False if another
+    request with the same key got there first; the caller should then roll
+    back and answer with lookup() instead.
+    """
+    # Expired keys are cleared here rather than by a separate job.
+    db.session.execute(delete(IdempotencyKey).where(
+        IdempotencyKey.user_id == user_id,
+        IdempotencyKey.created_at < datetime.utcnow() - timedelta(hours=ttl_hours)))
+    stored = db.session.execute(
+        dialect_insert(IdempotencyKey).values(
+            user_id=user_id, key=key, request_hash=payload_hash, status_code=status_code,
+            response=json.dumps(body), created_at=datetime.utcnow(),
+        ).on_conflict_do_nothing(index_elements=['user_id', 'key']).returning(IdempotencyKey.id)
+    ).scalar()
+    return stored is not None
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Runs Mood Tracker background jobs (see jobs.py) in their own process, so
+heavy jobs don't take CPU from the web workers. Set JOB_WORKER_THREADS = 0
+for the web app when using it.
+
+Usage: python job_worker.py [--threads 2] [--purge]
+"""
+
+import argparse
+import sys
+import time
+
+import jobs
+from models import db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Mood Tracker background jobs")
+    parser.add_argument('--threads', type=int, default=2, help="Worker threads")
+    parser.add_argument('--purge', action='store_true', help="Delete expired job results and exit")
+    args = parser.parse_args()
+
+    from app import create_app
+
+    # This process is the worker pool; it doesn't also need in-app workers.
+    app = create_app({'JOB_WORKER_THREADS': 0})
+    if args.purge:
+        with app.app_context():
+            purged = jobs.purge_expired()
+            db.session.commit()
+        print(f"Purged {purged} expired jobs.")
+        return 0
+    pool = jobs.WorkerPool(app, args.threads).start()
+    print(f"Running {args.threads} job workers. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop(timeout=10)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,375 @@
+"""
+Background jobs for work too slow to do inside a request.
+
+A route enqueues a job (a row in the job table) and returns straight away;
+the page then polls /jobs/<id> and fetches /jobs/<id>/result when it is
+done. Jobs are run by worker threads, either inside each app process
+(JOB_WORKER_THREADS) or in a separate process started with
+`python job_worker.py`, which uses the same models and database.
+
+* Deduplication: a job enqueued with a key that is already queued, running
+  or has an unexpired result returns that job instead of adding another.
+* Priorities: higher priority jobs are claimed first, then oldest first.
+* Leases: a worker claims a job for JOB_LEASE_SECONDS and renews the lease
+  every time the handler reports progress. A job whose lease runs out was
+  lost with its worker (the process crashed or was killed); it is queued
+  again, up to JOB_MAX_ATTEMPTS attempts in all.
+* Results are kept for JOB_RESULT_TTL_SECONDS after the job finishes.
+* Cancelling a queued job stops it at once; a running job stops at its
+  handler's next progress() call.
+* Periodic jobs: a kind registered with every(kind, setting) is queued once
+  per app.config[setting] seconds by whichever worker asks first; the
+  interval number is part of its key, so more workers don't mean more runs.
+
+Handlers are registered with @handler(kind) and called as
+handler(job_context) inside an app context (with the job's user bound, when
+sharded). They return the result as a JSON string.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, event, exists, or_, select, update
+from sqlalchemy.orm import Session
+
+import profiling
+import sharding
+from models import db, dialect_insert, Job
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+ACTIVE = (QUEUED, RUNNING)
+
+PRIORITY_BACKGROUND = 0
+PRIORITY_INTERACTIVE = 10  # Someone is waiting on a page for it
+
+# Seconds between purges of expired results by an idle worker.
+PURGE_INTERVAL = 60.0
+
+logger = logging.getLogger('mood_tracker')
+
+_handlers = {}
+_periodic = {}
+# Set when a transaction that enqueued a job commits, so idle workers in this process look at once.
+_wakeup = threading.Event()
+
+
+class JobCancelled(Exception):
+    """Raised by JobContext.progress() when the job has been cancelled."""
+
+
+class JobLost(Exception):
+    """Raised by JobContext.progress() when the job's lease was taken over by another worker."""
+
+
+def handler(kind):
+    """Register the function that runs jobs of this kind."""
+    def decorator(function):
+        _handlers[kind] = function
+        return function
+    return decorator
+
+
+def every(kind, setting):
+    """Queue a job of this kind every app.config[setting] seconds while workers run (0 turns it off)."""
+    _periodic[kind] = setting
+
+
+def _settings():
+    config = current_app.config
+    return (timedelta(seconds=config['JOB_LEASE_SECONDS']), config['JOB_MAX_ATTEMPTS'],
+            timedelta(seconds=config['JOB_RESULT_TTL_SECONDS']))
+
+
+def _fresh(job, now):
+    """True if enqueuing this job's key again should return it instead of starting over."""
+    return job.status in ACTIVE or (job.status == SUCCEEDED and job.expires_at >= now)
+
+
+def enqueue(kind, params=None, user_id=None, key=None, priority=PRIORITY_BACKGROUND):
+    """
+    Queue a job and return it. With a key, an active job or unexpired result
+    for that key is returned instead; a failed, cancelled or expired one is
+    queued again under the same id. The caller commits.
+    """
+    now = datetime.utcnow()
+    if key is not None:
+        # Usually the job exists; finding it is a read, not a write.
+        job = db.session.execute(select(Job).where(Job.dedupe_key == key)).scalar()
+        if job is not None and _fresh(job, now):
+            return job
+    values = {
+        'kind': kind, 'user_id': user_id, 'priority': priority, 'status': QUEUED,
+        'params': json.dumps(params or {}), 'progress': 0.0, 'result': None, 'error': None,
+        'attempts': 0, 'cancel_requested': False, 'worker': None, 'lease_expires_at': None,
+        'created_at': now, 'started_at': None, 'finished_at': None, 'expires_at': None,
+    }
+    statement = dialect_insert(Job).values(dedupe_key=key, **values)
+    if key is not None:
+        statement = statement.on_conflict_do_update(
+            index_elements=['dedupe_key'], set_=values,
+            where=or_(Job.status.in_([FAILED, CANCELLED]), Job.expires_at < now))
+    job_id = db.session.execute(statement.returning(Job.id)).scalar()
+    if job_id is None:
+        # Another request queued the same key in between.
+        job_id = db.session.execute(select(Job.id).where(Job.dedupe_key == key)).scalar()
+    db.session.info['job_enqueued'] = True
+    return db.session.get(Job, job_id, populate_existing=True)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('job_enqueued', False):
+        _wakeup.set()
+
+
+def get_job(job_id, user_id=None):
+    """A job by id, or None. With user_id, only that user's jobs are found."""
+    job = db.session.get(Job, job_id, populate_existing=True)
+    if job is None or (user_id is not None and job.user_id != user_id):
+        return None
+    return job
+
+
+def job_to_json(job):
+    """The status fields the job endpoints return."""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'expires_at': job.expires_at.isoformat() if job.expires_at else None,
+    }
+
+
+def cancel(job_id):
+    """
+    Cancel a job. A queued job is cancelled now; a running one is flagged and
+    stops at its next progress() call. Finished jobs are left alone. The
+    caller commits.
+    """
+    now = datetime.utcnow()
+    _, _, ttl = _settings()
+    cancelled = db.session.execute(
+        update(Job).where(Job.id == job_id, Job.status == QUEUED)
+        .values(status=CANCELLED, finished_at=now, expires_at=now + ttl)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not cancelled:
+        db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == RUNNING)
+            .values(cancel_requested=True)
+            .execution_options(synchronize_session=False))
+
+
+class JobContext:
+    """What a handler gets: the job's id, user and params, and progress reporting."""
+
+    def __init__(self, job_id, kind, user_id, params, attempt, worker):
+        self.id = job_id
+        self.kind = kind
+        self.user_id = user_id
+        self.params = params
+        self.attempt = attempt
+        self.worker = worker
+
+    def progress(self, fraction):
+        """
+        Record progress (0 to 1) and renew the lease; commits the session.
+        Handlers call this at least once per JOB_LEASE_SECONDS. Raises
+        JobCancelled or JobLost when the handler should stop.
+        """
+        lease, _, _ = _settings()
+        row = db.session.execute(
+            update(Job).where(Job.id == self.id, Job.status == RUNNING, Job.worker == self.worker)
+            .values(progress=fraction, lease_expires_at=datetime.utcnow() + lease)
+            .returning(Job.cancel_requested)
+            .execution_options(synchronize_session=False)
+        ).first()
+        db.session.commit()
+        if row is None:
+            raise JobLost(f"job {self.id} is no longer held by {self.worker}")
+        if row.cancel_requested:
+            raise JobCancelled(f"job {self.id} was cancelled")
+
+
+def recover_expired():
+    """
+    Requeue running jobs whose lease ran out (their worker died), or fail
+    them once they have used all their attempts. Returns how many were
+    recovered. The caller commits.
+    """
+    now = datetime.utcnow()
+    expired = (Job.status == RUNNING, Job.lease_expires_at < now)
+    # A cheap read first: the UPDATEs would take the write lock on every poll.
+    if not db.session.execute(select(exists().where(*expired))).scalar():
+        return 0
+    _, max_attempts, ttl = _settings()
+    finished = {'finished_at': now, 'expires_at': now + ttl, 'lease_expires_at': None}
+    statements = [
+        update(Job).where(*expired, Job.cancel_requested.is_(True)).values(status=CANCELLED, **finished),
+        update(Job).where(*expired, Job.attempts < max_attempts)
+        .values(status=QUEUED, worker=None, lease_expires_at=None, error='worker lost'),
+        update(Job).where(*expired).values(status=FAILED, error='worker lost', **finished),
+    ]
+    recovered = 0
+    for statement in statements:
+        recovered += db.session.execute(statement.execution_options(synchronize_session=False)).rowcount
+    logger.warning("Recovered %s background jobs whose worker was lost", recovered)
+    return recovered
+
+
+def claim(worker):
+    """Take the next queued job for this worker; returns its JobContext or None. The caller commits."""
+    if not db.session.execute(select(exists().where(Job.status == QUEUED))).scalar():
+        return None
+    lease, _, _ = _settings()
+    now = datetime.utcnow()
+    next_job = (select(Job.id).where(Job.status == QUEUED)
+                .order_by(Job.priority.desc(), Job.id).limit(1)
+                .with_for_update(skip_locked=True).scalar_subquery())
+    row = db.session.execute(
+        update(Job).where(Job.id == next_job, Job.status == QUEUED)
+        .values(status=RUNNING, worker=worker, attempts=Job.attempts + 1, progress=0.0,
+                cancel_requested=False, started_at=now, lease_expires_at=now + lease)
+        .returning(Job.id, Job.kind, Job.user_id, Job.params, Job.attempts)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        return None
+    return JobContext(row.id, row.kind, row.user_id, json.loads(row.params), row.attempts, worker)
+
+
+def _finish(job, status, result=None, error=None):
+    """Record a job's outcome if this worker still holds it; commits."""
+    now = datetime.utcnow()
+    _, max_attempts, ttl = _settings()
+    held = (Job.id == job.id, Job.status == RUNNING, Job.worker == job.worker)
+    if status == FAILED and job.attempt < max_attempts:
+        values = {'status': QUEUED, 'worker': None, 'lease_expires_at': None, 'error': error}
+    else:
+        values = {'status': status, 'result': result, 'error': error, 'finished_at': now,
+                  'expires_at': now + ttl, 'lease_expires_at': None}
+        if status == SUCCEEDED:
+            values['progress'] = 1.0
+    db.session.execute(update(Job).where(*held).values(**values).execution_options(synchronize_session=False))
+    db.session.commit()
+
+
+def run_next(worker):
+    """Recover lost jobs, then claim and run one job. Returns False if none was queued."""
+    recover_expired()
+    job = claim(worker)
+    db.session.commit()
+    if job is None:
+        return False
+    started = time.perf_counter()
+    try:
+        run = _handlers.get(job.kind)
+        if run is None:
+            raise LookupError(f"no handler for job kind {job.kind!r}")
+        if job.user_id is not None:
+            sharding.bind_user(job.user_id)
+        result = profiling.run_job(job, run)
+    except JobCancelled:
+        db.session.rollback()
+        _finish(job, CANCELLED)
+        logger.info("Job %s (%s) cancelled", job.id, job.kind)
+    except JobLost:
+        db.session.rollback()
+        logger.warning("Job %s (%s) was taken over after its lease expired", job.id, job.kind)
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Job %s (%s) failed on attempt %s: %s", job.id, job.kind, job.attempt, e)
+        _finish(job, FAILED, error=str(e) or type(e).__name__)
+    else:
+        db.session.rollback()
+        _finish(job, SUCCEEDED, result=result)
+        logger.info("Job %s (%s) done in %.0f ms", job.id, job.kind, (time.perf_counter() - started) * 1000)
+    return True
+
+
+def enqueue_periodic(queued, now=None):
+    """
+    Queue the periodic jobs whose interval has started since they were last
+    queued here; `queued` maps kinds to that interval number and is updated.
+    Returns the jobs. The caller commits.
+    """
+    now = time.time() if now is None else now
+    found = []
+    for kind, setting in _periodic.items():
+        interval = current_app.config[setting]
+        if not interval:
+            continue
+        number = int(now // interval)
+        if queued.get(kind) != number:
+            found.append(enqueue(kind, key=f'{kind}:{number}'))
+            queued[kind] = number
+    return found
+
+
+def purge_expired():
+    """Delete finished jobs whose results have expired. Returns the count. The caller commits."""
+    return db.session.execute(
+        delete(Job).where(Job.expires_at < datetime.utcnow()).execution_options(synchronize_session=False)
+    ).rowcount
+
+
+class WorkerPool:
+    """Threads that run queued jobs for one app until stop() is called."""
+
+    def __init__(self, app, threads):
+        self.app = app
+        self.size = threads
+        self.threads = []
+        self.stopping = threading.Event()
+        self.last_purge = 0.0
+        self.periodic = {}
+
+    def start(self):
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        for index in range(self.size):
+            thread = threading.Thread(target=self._work, args=(f"{prefix}:{index}",),
+                                      name=f'job-worker-{index}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        _wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _work(self, worker):
+        poll_interval = self.app.config['JOB_POLL_INTERVAL']
+        while not self.stopping.is_set():
+            try:
+                with self.app.app_context():
+                    if enqueue_periodic(self.periodic):
+                        db.session.commit()
+                    ran = run_next(worker)
+                    if not ran and time.monotonic() - self.last_purge > PURGE_INTERVAL:
+                        self.last_purge = time.monotonic()
+                        purge_expired()
+                        db.session.commit()
+            except Exception:
+                logger.exception("Job worker %s failed; retrying", worker)
+                ran = False
+            if not ran:
+                _wakeup.wait(poll_interval)
+                _wakeup.clear()
+
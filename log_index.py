@@ -0,0 +1,333 @@
+"""
+Persistent sidecar index over the Mood Tracker log files.
+
+The index lives in an SQLite file next to the logs and records, per log file:
+  - the byte range of every hour of log lines ("YYYY-MM-DD HH"), and
+  - which fixed-size blocks of the file mention each username / user_id.
+Time-range and per-user queries then seek straight to the relevant regions
+instead of scanning every line.
+
+Files are identified by a fingerprint of their first line, so an index entry
+follows a file when RotatingFileHandler renames mood_tracker.log to .log.1.
+Each update only reads what was appended since the last indexed offset; a file
+that shrank is re-indexed from scratch. Gzip-compressed archives cannot be
+seeked and are scanned instead.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+
+import log_reader
+
+BLOCK_SIZE = 8 * 1024
+FINGERPRINT_BYTES = 256
+
+_TIMESTAMP = re.compile(rb'^(\d{4}-\d{2}-\d{2} \d{2}):\d{2}:\d{2}')
+_TEXT_TIMESTAMP = re.compile(_TIMESTAMP.pattern.decode())
+# Our messages say "user: alice", "username: alice" or "user_id: 3"; request
+# records carry "user_id":3.
+_USERNAME = re.compile(rb'\b(?:user|username): ([^,\s]+)')
+_USER_ID = re.compile(rb'\buser_id"?: ?(\d+)')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT UNIQUE NOT NULL,
+    path TEXT NOT NULL,
+    indexed_offset INTEGER NOT NULL DEFAULT 0,
+    last_bucket TEXT
+);
+CREATE TABLE IF NOT EXISTS time_buckets (
+    file_id INTEGER NOT NULL,
+    bucket TEXT NOT NULL,
+    start_offset INTEGER NOT NULL,
+    end_offset INTEGER NOT NULL,
+    PRIMARY KEY (file_id, bucket)
+);
+CREATE TABLE IF NOT EXISTS user_keys (
+    id INTEGER PRIMARY KEY,
+    user_key TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_blocks (
+    key_id INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    block INTEGER NOT NULL,
+    PRIMARY KEY (key_id, file_id, block)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_time_buckets_bucket ON time_buckets (bucket);
+"""
+
+
+def default_index_path(log_file):
+    return os.path.join(os.path.dirname(log_file) or '.',
+                        f".{os.path.basename(log_file)}.index.sqlite")
+
+
+def _fingerprint(path):
+    """Identify a file by (the start of) its first line, which survives renames."""
+    with open(path, 'rb') as f:
+        first = f.readline(FINGERPRINT_BYTES)
+    if len(first) < FINGERPRINT_BYTES and not first.endswith(b'\n'):
+        return None  # Too new to identify reliably; index it next time.
+    return hashlib.sha1(first).hexdigest()
+
+
+class LogIndex:
+    """Sidecar index for one log file and its rotated backups."""
+
+    def __init__(self, log_file, index_path=None):
+        self.log_file = log_file
+        self.index_path = index_path or default_index_path(log_file)
+        self.conn = sqlite3.connect(self.index_path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Building
+
+    def rebuild(self):
+        """Drop everything and index the rotation set from scratch."""
+        with self.conn:
+            self.conn.execute("DELETE FROM user_blocks")
+            self.conn.execute("DELETE FROM time_buckets")
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("DELETE FROM user_keys")
+        return self.update()
+
+    def update(self):
+        """Index whatever was written since the last run. Returns bytes read."""
+        seen = set()
+        total = 0
+        for path in log_reader.rotation_set(self.log_file):
+            if path.endswith('.gz'):
+                continue
+            fingerprint = _fingerprint(path)
+            if fingerprint is None:
+                continue
+            seen.add(fingerprint)
+            total += self._update_file(path, fingerprint)
+        # Files that rotated out of the set are gone for good.
+        with self.conn:
+            stale = [row[0] for row in self.conn.execute("SELECT id, fingerprint FROM files")
+                     if row[1] not in seen]
+            for file_id in stale:
+                self.conn.execute("DELETE FROM user_blocks WHERE file_id = ?", (file_id,))
+                self.conn.execute("DELETE FROM time_buckets WHERE file_id = ?", (file_id,))
+                self.conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+        return total
+
+    def _update_file(self, path, fingerprint):
+        size = os.path.getsize(path)
+        row = self.conn.execute(
+            "SELECT id, indexed_offset, last_bucket FROM files WHERE fingerprint = ?", (fingerprint,)
+        ).fetchone()
+        if row is None:
+            with self.conn:
+                cursor = self.conn.execute(
+                    "INSERT INTO files (fingerprint, path) VALUES (?, ?)", (fingerprint, path))
+            file_id, offset, last_bucket = cursor.lastrowid, 0, None
+        else:
+            file_id, offset, last_bucket = row
+            if size < offset:
+                # Truncated and rewritten with the same first line: start over.
+                with self.conn:
+                    self.conn.execute("DELETE FROM user_blocks WHERE file_id = ?", (file_id,))
+                    self.conn.execute("DELETE FROM time_buckets WHERE file_id = ?", (file_id,))
+                offset, last_bucket = 0, None
+        self.conn.execute("UPDATE files SET path = ? WHERE id = ?", (path, file_id))
+        if size == offset:
+            self.conn.commit()
+            return 0
+
+        buckets = {}
+        user_blocks = set()
+        position = offset
+        current_bucket = last_bucket
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Partially written line; pick it up next time.
+                start = position
+                position += len(line)
+                match = _TIMESTAMP.match(line)
+                if match:
+                    current_bucket = match.group(1).decode()
+                if current_bucket is not None:
+                    bucket = buckets.get(current_bucket)
+                    if bucket is None:
+                        buckets[current_bucket] = [start, position]
+                    else:
+                        bucket[1] = position
+                block = start // BLOCK_SIZE
+                if b'user' in line:
+                    for name in _USERNAME.findall(line):
+                        user_blocks.add(('u:' + name.decode('utf-8', 'replace').lower(), block))
+                    for user_id in _USER_ID.findall(line):
+                        user_blocks.add(('id:' + user_id.decode(), block))
+
+        with self.conn:
+            for bucket, (start, end) in buckets.items():
+                # An hour that continues from the previous run keeps its start.
+                self.conn.execute(
+                    "INSERT INTO time_buckets (file_id, bucket, start_offset, end_offset) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT (file_id, bucket) "
+                    "DO UPDATE SET end_offset = excluded.end_offset",
+                    (file_id, bucket, start, end))
+            key_ids = self._key_ids({key for key, _ in user_blocks})
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO user_blocks (key_id, file_id, block) VALUES (?, ?, ?)",
+                ((key_ids[key], file_id, block) for key, block in user_blocks))
+            self.conn.execute("UPDATE files SET indexed_offset = ?, last_bucket = ? WHERE id = ?",
+                              (position, current_bucket, file_id))
+        return position - offset
+
+    def _key_ids(self, keys):
+        """Map user keys to their integer ids, creating missing ones."""
+        self.conn.executemany("INSERT OR IGNORE INTO user_keys (user_key) VALUES (?)",
+                              ((key,) for key in keys))
+        return dict((key, key_id) for key_id, key in
+                    self.conn.execute("SELECT id, user_key FROM user_keys"))
+
+    # Querying
+
+    def _files_in_order(self, include_rotated=True):
+        """Indexed files keyed by path, plus unindexed (gzip) files, oldest first."""
+        by_path = {row[1]: (row[0], row[2]) for row in
+                   self.conn.execute("SELECT id, path, indexed_offset FROM files")}
+        files = log_reader.rotation_set(self.log_file) if include_rotated else [self.log_file]
+        for path in files:
+            if os.path.exists(path):
+                yield path, by_path.get(path)
+
+    @staticmethod
+    def _read_ranges(path, ranges):
+        """Yield the lines in the given (start, end) byte ranges, merged and in order."""
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        with open(path, 'rb') as f:
+            for start, end in merged:
+                f.seek(start)
+                while f.tell() < end:
+                    line = f.readline()
+                    if not line:
+                        break
+                    yield line.decode('utf-8', errors='replace')
+
+    def time_range(self, start, end, include_rotated=True):
+        """
+        Yield lines with start <= timestamp < end ('YYYY-MM-DD HH:MM:SS' strings
+        or prefixes). Undated lines take the timestamp of the line before them.
+        """
+        start_bucket, end_bucket = start[:13], end[:13]
+        for path, indexed in self._files_in_order(include_rotated):
+            if indexed is None:
+                lines = log_reader.iter_lines(path, include_rotated=False)
+            else:
+                file_id, indexed_offset = indexed
+                ranges = [(s, e) for s, e in self.conn.execute(
+                    "SELECT start_offset, end_offset FROM time_buckets "
+                    "WHERE file_id = ? AND bucket >= ? AND bucket <= ?",
+                    (file_id, start_bucket, end_bucket))]
+                # Anything appended after the last update has not been indexed yet.
+                if os.path.getsize(path) > indexed_offset:
+                    ranges.append((indexed_offset, os.path.getsize(path)))
+                lines = self._read_ranges(path, ranges)
+            # Traceback and other continuation lines have no timestamp of their
+            # own; they belong to the line above them.
+            stamp = None
+            for line in lines:
+                if _TEXT_TIMESTAMP.match(line):
+                    stamp = line[:19]
+                if stamp is not None and start <= stamp < end:
+                    yield line
+
+    def user_lines(self, username=None, user_id=None, include_rotated=True):
+        """Yield lines that mention a username and/or user_id."""
+        keys = []
+        patterns = []
+        if username:
+            keys.append('u:' + username.lower())
+            patterns.append(rb'\b(?:user|username): ' + re.escape(username.encode()) + rb'(?=[,\s]|$)')
+        if user_id is not None:
+            keys.append(f'id:{user_id}')
+            patterns.append(rb'\buser_id"?: ?' + str(int(user_id)).encode() + rb'\b')
+        if not keys:
+            return
+        pattern = re.compile(b'|'.join(patterns), re.IGNORECASE | re.MULTILINE)
+
+        placeholders = ','.join('?' * len(keys))
+        for path, indexed in self._files_in_order(include_rotated):
+            if indexed is None:
+                for line in log_reader.iter_lines(path, include_rotated=False):
+                    if pattern.search(line.encode('utf-8')):
+                        yield line
+                continue
+            file_id, indexed_offset = indexed
+            blocks = [row[0] for row in self.conn.execute(
+                "SELECT DISTINCT b.block FROM user_blocks b JOIN user_keys k ON k.id = b.key_id "
+                f"WHERE b.file_id = ? AND k.user_key IN ({placeholders})",
+                (file_id, *keys))]
+            for chunk in self._read_blocks(path, blocks, indexed_offset):
+                yield from self._matching_lines(chunk, pattern)
+
+    @staticmethod
+    def _matching_lines(chunk, pattern):
+        """Yield the complete lines of a chunk that contain a pattern match."""
+        last_line_end = -1
+        for match in pattern.finditer(chunk):
+            line_start = chunk.rfind(b'\n', 0, match.start()) + 1
+            if line_start <= last_line_end:
+                continue  # Several matches on one line.
+            line_end = chunk.find(b'\n', match.end())
+            line_end = len(chunk) if line_end == -1 else line_end + 1
+            last_line_end = line_end - 1
+            yield chunk[line_start:line_end].decode('utf-8', errors='replace')
+
+    @staticmethod
+    def _read_blocks(path, blocks, indexed_offset):
+        """Yield chunks holding the lines that start in the given blocks, then the unindexed tail."""
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            for block in sorted(blocks):
+                start = block * BLOCK_SIZE
+                end = min(start + BLOCK_SIZE, indexed_offset)
+                if start:
+                    # Skip the rest of a line that began in the previous block.
+                    f.seek(start - 1)
+                    f.readline()
+                else:
+                    f.seek(0)
+                chunk_start = f.tell()
+                if chunk_start >= end:
+                    continue
+                chunk = f.read(end - chunk_start)
+                if not chunk.endswith(b'\n'):
+                    # Finish the last line, which runs into the next block.
+                    chunk += f.readline()
+                yield chunk
+            if size > indexed_offset:
+                f.seek(indexed_offset)
+                yield f.read()
+
+    def stats(self):
+        """Row counts, for the CLI."""
+        return {
+            'files': self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0],
+            'hours': self.conn.execute("SELECT COUNT(*) FROM time_buckets").fetchone()[0],
+            'user_blocks': self.conn.execute("SELECT COUNT(*) FROM user_blocks").fetchone()[0],
+            'size_bytes': os.path.getsize(self.index_path),
+        }
@@ -0,0 +1,134 @@
+"""
+Streaming access to the Mood Tracker log files.
+
+RotatingFileHandler keeps the active file plus numbered backups
+(mood_tracker.log.1 ... .5, newest first). The helpers here read that whole
+rotation set in chronological order, transparently opening gzip-compressed
+archives (mood_tracker.log.3.gz), and tail files by seeking backward from the
+end instead of reading them whole.
+"""
+
+import gzip
+import os
+import re
+import time
+from collections import deque
+
+BLOCK_SIZE = 64 * 1024
+
+
+def rotation_set(log_file):
+    """Return the existing files of a rotation set, oldest first."""
+    directory = os.path.dirname(log_file) or '.'
+    base = os.path.basename(log_file)
+    pattern = re.compile(rf'^{re.escape(base)}\.(\d+)(\.gz)?$')
+    backups = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            match = pattern.match(name)
+            if match:
+                backups.append((int(match.group(1)), os.path.join(directory, name)))
+    # Higher suffix numbers are older.
+    files = [path for _, path in sorted(backups, reverse=True)]
+    if os.path.exists(log_file):
+        files.append(log_file)
+    return files
+
+
+def open_log(path):
+    """Open a log file (plain or .gz) for reading text."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def iter_lines(log_file, include_rotated=True):
+    """Yield lines from the rotation set (or just the active file) in order."""
+    files = rotation_set(log_file) if include_rotated else [log_file]
+    for path in files:
+        if not os.path.exists(path):
+            continue
+        with open_log(path) as f:
+            yield from f
+
+
+def _tail_plain(path, lines, block_size=BLOCK_SIZE):
+    """Last lines of an uncompressed file, read backward in blocks from EOF."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        chunks = []
+        newlines = 0
+        # One extra newline is needed to be sure the first line is complete.
+        while position > 0 and newlines <= lines:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            chunk = f.read(read_size)
+            chunks.append(chunk)
+            newlines += chunk.count(b'\n')
+    data = b''.join(reversed(chunks)).decode('utf-8', errors='replace')
+    result = data.splitlines(keepends=True)
+    return result[-lines:] if lines else []
+
+
+def _tail_gzip(path, lines):
+    """Last lines of a gzip archive (compressed data has to be streamed)."""
+    with open_log(path) as f:
+        return list(deque(f, maxlen=lines))
+
+
+def tail(log_file, lines=50, include_rotated=True):
+    """Return the last lines of a log, continuing into rotated files if needed."""
+    if lines <= 0:
+        return []
+    files = rotation_set(log_file) if include_rotated else [log_file]
+    collected = []
+    for path in reversed(files):
+        if not os.path.exists(path):
+            continue
+        needed = lines - len(collected)
+        if path.endswith('.gz'):
+            chunk = _tail_gzip(path, needed)
+        else:
+            chunk = _tail_plain(path, needed)
+        collected = chunk + collected
+        if len(collected) >= lines:
+            break
+    return collected[-lines:]
+
+
+def follow(log_file, poll_interval=0.5, start_at_end=True):
+    """Yield new lines as they are written, surviving rotation (like tail -F)."""
+    f = None
+    inode = None
+    try:
+        while True:
+            if f is None:
+                if not os.path.exists(log_file):
+                    time.sleep(poll_interval)
+                    continue
+                f = open(log_file, 'r', encoding='utf-8', errors='replace')
+                inode = os.fstat(f.fileno()).st_ino
+                if start_at_end:
+                    f.seek(0, os.SEEK_END)
+                start_at_end = False  # Files that appear after rotation are read from the start.
+
+            line = f.readline()
+            if line:
+                yield line
+                continue
+
+            try:
+                current = os.stat(log_file)
+            except FileNotFoundError:
+                current = None
+            if current is None or current.st_ino != inode or current.st_size < f.tell():
+                # Rotated or truncated: finish with the old handle, then reopen.
+                f.close()
+                f = None
+                continue
+            time.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
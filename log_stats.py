@@ -0,0 +1,206 @@
+"""
+Single-pass statistics over the Mood Tracker log rotation set.
+
+Every file (active and rotated) is split into newline-aligned chunks that are
+processed in parallel by a process pool. Each worker memory-maps its file and
+runs one compiled regex over the chunk, collecting in the same pass:
+  - line counts by level,
+  - request volume per hour,
+  - the most active users,
+  - WARNING/ERROR messages grouped by template, and
+  - login attempts and failures, and
+  - request latency (from the structured request records).
+Gzip archives cannot be split, so each one is a single chunk.
+"""
+
+import gzip
+import json
+import mmap
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import log_reader
+
+CHUNK_SIZE = 32 * 1024 * 1024
+
+LINE_PATTERN = re.compile(
+    rb'^(\d{4}-\d{2}-\d{2} \d{2}):\d{2}:\d{2},\d{3} - (\S+) - ([A-Z]+) - ([^\n]*)$',
+    re.MULTILINE
+)
+_USERNAME = re.compile(rb'\b(?:user|username): ([^,\s]+)')
+_DURATION = re.compile(rb'"duration_ms":([\d.]+)')
+_ACCESS_LINE = re.compile(rb'"(?:GET|POST|PUT|PATCH|DELETE|HEAD|OPTIONS) ')
+# Values after "name: " and bare numbers vary per line; the rest is the template.
+_TEMPLATE_VALUE = re.compile(rb'(: )[^,\s]+')
+_TEMPLATE_NUMBER = re.compile(rb'\b\d+\b')
+
+TOP_N = 20
+
+
+def plan_chunks(log_file, include_rotated=True, chunk_size=CHUNK_SIZE):
+    """Split the rotation set into (path, start, end) pieces aligned to line starts."""
+    files = log_reader.rotation_set(log_file) if include_rotated else [log_file]
+    chunks = []
+    for path in files:
+        if not os.path.exists(path):
+            continue
+        size = os.path.getsize(path)
+        if path.endswith('.gz') or size <= chunk_size:
+            chunks.append((path, 0, size))
+            continue
+        with open(path, 'rb') as f:
+            start = 0
+            while start < size:
+                end = min(start + chunk_size, size)
+                if end < size:
+                    f.seek(end)
+                    f.readline()
+                    end = f.tell()
+                chunks.append((path, start, end))
+                start = end
+    return chunks
+
+
+def _template(message):
+    message = _TEMPLATE_VALUE.sub(rb'\1<*>', message)
+    return _TEMPLATE_NUMBER.sub(b'<n>', message).decode('utf-8', errors='replace')
+
+
+def _scan(buffer, start, end):
+    levels = Counter()
+    hourly = Counter()
+    users = Counter()
+    signatures = Counter()
+    login_attempts = 0
+    login_failures = Counter()
+    latency = Counter()
+    lines = 0
+
+    for match in LINE_PATTERN.finditer(buffer, start, end):
+        hour, logger_name, level, message = match.groups()
+        lines += 1
+        levels[level] += 1
+        if logger_name == b'mood_tracker.requests':
+            hourly[hour] += 1
+            duration = _DURATION.search(message)
+            if duration:
+                # Whole milliseconds are precise enough for percentiles.
+                latency[int(float(duration.group(1)))] += 1
+        elif logger_name == b'werkzeug' and _ACCESS_LINE.search(message):
+            hourly[hour] += 1
+        if b'user' in message:
+            user_match = _USERNAME.search(message)
+            if user_match:
+                users[user_match.group(1)] += 1
+        if level in (b'WARNING', b'ERROR', b'CRITICAL'):
+            signatures[(level, _template(message))] += 1
+        if message.startswith(b'Login attempt'):
+            login_attempts += 1
+        elif message.startswith(b'Login failed'):
+            user_match = _USERNAME.search(message)
+            login_failures[user_match.group(1) if user_match else b'?'] += 1
+
+    return {
+        'lines': lines,
+        'levels': {k.decode(): v for k, v in levels.items()},
+        'hourly': {k.decode(): v for k, v in hourly.items()},
+        'users': {k.decode('utf-8', 'replace'): v for k, v in users.items()},
+        'signatures': {f"{level.decode()}\t{template}": v for (level, template), v in signatures.items()},
+        'login_attempts': login_attempts,
+        'login_failures': {k.decode('utf-8', 'replace'): v for k, v in login_failures.items()},
+        'latency': dict(latency),
+    }
+
+
+def process_chunk(chunk):
+    """Collect statistics for one (path, start, end) piece. Runs in a worker process."""
+    path, start, end = chunk
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            data = f.read()
+        return _scan(data, 0, len(data))
+    if end <= start:
+        return _scan(b'', 0, 0)
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return _scan(mapped, start, min(end, len(mapped)))
+
+
+def merge(results):
+    """Combine per-chunk results into one report."""
+    levels, hourly, users, signatures, login_failures, latency = (Counter() for _ in range(6))
+    lines = 0
+    login_attempts = 0
+    for result in results:
+        lines += result['lines']
+        levels.update(result['levels'])
+        hourly.update(result['hourly'])
+        users.update(result['users'])
+        signatures.update(result['signatures'])
+        login_attempts += result['login_attempts']
+        login_failures.update(result['login_failures'])
+        latency.update(result['latency'])
+
+    failures = sum(login_failures.values())
+    error_signatures = []
+    for key, count in signatures.most_common(TOP_N):
+        level, template = key.split('\t', 1)
+        error_signatures.append({'level': level, 'template': template, 'count': count})
+
+    return {
+        'lines': lines,
+        'levels': dict(levels),
+        'requests_per_hour': dict(sorted(hourly.items())),
+        'top_users': [{'user': user, 'lines': count} for user, count in users.most_common(TOP_N)],
+        'error_signatures': error_signatures,
+        'logins': {
+            'attempts': login_attempts,
+            'failures': failures,
+            'failure_rate': round(failures / login_attempts, 4) if login_attempts else 0.0,
+            'top_failed_users': [{'user': user, 'failures': count}
+                                 for user, count in login_failures.most_common(TOP_N)],
+        },
+        'request_latency_ms': _latency_summary(latency),
+    }
+
+
+def _latency_summary(latency):
+    total = sum(latency.values())
+    if not total:
+        return None
+    summary = {'count': total, 'max': max(latency)}
+    targets = [('p50', 0.50), ('p95', 0.95), ('p99', 0.99)]
+    seen = 0
+    for ms in sorted(latency):
+        seen += latency[ms]
+        while targets and seen >= targets[0][1] * total:
+            summary[targets.pop(0)[0]] = ms
+    return summary
+
+
+def compute_stats(log_file, include_rotated=True, workers=None, chunk_size=CHUNK_SIZE):
+    """Compute the full report for a log's rotation set."""
+    chunks = plan_chunks(log_file, include_rotated, chunk_size)
+    files = sorted({path for path, _, _ in chunks})
+    started = datetime.now()
+    if len(chunks) <= 1 or workers == 1:
+        results = [process_chunk(chunk) for chunk in chunks]
+    else:
+        workers = workers or min(len(chunks), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(process_chunk, chunks))
+    report = merge(results)
+    report['files'] = [{'path': path, 'bytes': os.path.getsize(path)} for path in files]
+    report['bytes'] = sum(f['bytes'] for f in report['files'])
+    report['generated_at'] = started.isoformat(timespec='seconds')
+    report['elapsed_seconds'] = round((datetime.now() - started).total_seconds(), 3)
+    return report
+
+
+def write_report(report, path):
+    """Save a report as JSON."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
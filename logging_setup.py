@@ -0,0 +1,181 @@
+"""
+Logging pipeline for Mood Tracker.
+Request threads only push records onto a bounded in-memory queue; a background
+listener thread formats them and writes the log files and console.
+
+With 'size' rotation only the process that set up logging rotates the files.
+Workers forked from it append through a WatchedFileHandler, which reopens a
+file once it has been renamed, so two processes never rotate the same file.
+With 'external' rotation no process rotates; logrotate does.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+CONSOLE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+OVERFLOW_POLICIES = ('drop_new', 'drop_oldest', 'block')
+ROTATION_MODES = ('size', 'external')
+
+_lock = threading.Lock()
+_state = {'pid': None, 'handler': None, 'listener': None, 'options': None}
+
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler with a bounded queue and a configurable overflow policy."""
+
+    def __init__(self, log_queue, overflow_policy='drop_new'):
+        super().__init__(log_queue)
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown log overflow policy: {overflow_policy}")
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The listener lives in this process, so the record does not need to be
+        # pickled. Skipping the default prepare() keeps message formatting off
+        # the request thread.
+        return record
+
+    def enqueue(self, record):
+        if self.overflow_policy == 'block':
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if self.overflow_policy == 'drop_oldest':
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(record)
+                self.dropped += 1
+                return
+            except (queue.Empty, queue.Full):
+                pass
+        self.dropped += 1
+
+
+def _file_handler(path, rotation):
+    if rotation == 'external':
+        return WatchedFileHandler(path)
+    return RotatingFileHandler(
+        path,
+        maxBytes=10240000,  # 10MB
+        backupCount=5
+    )
+
+
+def _build_handlers(log_dir, console, rotation):
+    """Create the handlers that the background listener writes to."""
+    file_formatter = logging.Formatter(LOG_FORMAT)
+
+    file_handler = _file_handler(os.path.join(log_dir, 'mood_tracker.log'), rotation)
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(file_formatter)
+
+    error_handler = _file_handler(os.path.join(log_dir, 'errors.log'), rotation)
+    error_handler.setLevel(logging.ERROR)
+    error_handler.setFormatter(file_formatter)
+
+    handlers = [file_handler, error_handler]
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setLevel(logging.INFO)
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers.append(console_handler)
+    return handlers
+
+
+def _detach(stop_listener):
+    """Remove the pipeline from the root logger, optionally draining it first."""
+    handler = _state['handler']
+    listener = _state['listener']
+    if handler is not None:
+        logging.getLogger().removeHandler(handler)
+    if listener is not None:
+        if stop_listener:
+            listener.stop()
+        for target in listener.handlers:
+            target.close()
+    _state.update(pid=None, handler=None, listener=None)
+
+
+def setup_logging(log_dir='logs', queue_size=10000, overflow_policy='drop_new', console=True, rotation='size'):
+    """Setup the queued logging pipeline once per process and return the app logger."""
+    if rotation not in ROTATION_MODES:
+        raise ValueError(f"Unknown log rotation mode: {rotation}")
+    with _lock:
+        options = (log_dir, queue_size, overflow_policy, console, rotation)
+        if _state['pid'] == os.getpid() and _state['options'] == options:
+            return logging.getLogger('mood_tracker')
+
+        # A different pid means we were forked: the listener thread did not
+        # survive, so drop the inherited handler without trying to stop it.
+        _detach(stop_listener=_state['pid'] == os.getpid())
+
+        os.makedirs(log_dir, exist_ok=True)
+        log_queue = queue.Queue(maxsize=queue_size)
+        handler = BoundedQueueHandler(log_queue, overflow_policy)
+        listener = QueueListener(log_queue, *_build_handlers(log_dir, console, rotation),
+                                 respect_handler_level=True)
+
+        root_logger = logging.getLogger()
+        root_logger.setLevel(logging.INFO)
+        root_logger.addHandler(handler)
+        listener.start()
+
+        _state.update(pid=os.getpid(), handler=handler, listener=listener, options=options)
+
+    app_logger = logging.getLogger('mood_tracker')
+    app_logger.setLevel(logging.INFO)
+    return app_logger
+
+
+def shutdown_logging():
+    """Flush queued records and stop the background writer."""
+    with _lock:
+        handler = _state['handler']
+        if handler is None or _state['pid'] != os.getpid():
+            return
+        listener = _state['listener']
+        listener.stop()
+        if handler.dropped:
+            # The writer thread is gone, so report the overflow synchronously.
+            for target in listener.handlers:
+                if target.level <= logging.WARNING:
+                    target.handle(logging.makeLogRecord({
+                        'name': 'mood_tracker', 'levelno': logging.WARNING,
+                        'levelname': 'WARNING',
+                        'msg': 'Log queue overflow: %d records dropped',
+                        'args': (handler.dropped,),
+                    }))
+        _detach(stop_listener=False)
+
+
+def dropped_records():
+    """Number of records dropped by the overflow policy in this process."""
+    handler = _state['handler']
+    return handler.dropped if handler is not None else 0
+
+
+def _reinit_after_fork():
+    global _lock
+    # The parent may have held the lock in another thread at fork time.
+    _lock = threading.Lock()
+    options = _state['options']
+    if options is not None and _state['pid'] is not None:
+        # The parent (or logrotate) rotates; this worker only follows renames.
+        setup_logging(*options[:-1], rotation='external')
+
+
+atexit.register(shutdown_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
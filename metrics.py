@@ -0,0 +1,410 @@
+"""
+In-process metrics for Mood Tracker, exposed in Prometheus text format.
+
+Each worker process keeps its own counters and fixed-bucket histograms in
+memory and periodically writes a snapshot to METRICS_DIR/metrics_<pid>.json.
+The /metrics endpoint merges the snapshots of every worker, so the numbers are
+correct no matter which worker serves the scrape. When a worker has exited,
+the next scrape folds its counters and histograms into
+METRICS_DIR/exited_workers.json and deletes its snapshot, so totals never
+go down (Prometheus would read that as a counter reset). Its gauges are
+dropped.
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows, where serve.py runs a single process
+    fcntl = None
+
+from flask import request
+from sqlalchemy import event
+
+import request_logging
+
+# Upper bounds in seconds; +Inf is implicit.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+HELP = {
+    'http_requests_total': ('counter', 'HTTP requests by route, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency by route.'),
+    'sql_queries_total': ('counter', 'SQL statements executed, by route.'),
+    'sql_query_seconds_total': ('counter', 'Time spent executing SQL, by route.'),
+    'cache_requests_total': ('counter', 'Cache lookups by cache and result.'),
+    'cache_hit_ratio': ('gauge', 'Cache hits / lookups since start, by cache.'),
+    'db_pool_checkout_seconds': ('histogram', 'Time spent waiting for a pooled DB connection, by bind.'),
+    'db_pool_checked_out': ('gauge', 'DB connections currently checked out (live workers), by bind.'),
+    'log_records_dropped_total': ('counter', 'Log records dropped because the log queue was full.'),
+    'replica_reads_total': ('counter', 'Read-only requests by where they read from and why.'),
+    'replica_lag_seconds': ('gauge', 'Age of the read replica\'s heartbeat at the last check.'),
+    'rate_limited_total': ('counter', 'Login and registration attempts refused by a rate limit, by limit.'),
+}
+# Gauges every worker measures the same thing for; merged with max() instead of summed.
+MAX_GAUGES = frozenset(['replica_lag_seconds'])
+
+PREFIX = 'mood_tracker_'
+EXITED_FILE = 'exited_workers.json'
+
+
+class Registry:
+    """Counters and histograms for one process.
+
+    Values live in plain dicts keyed by (name, labels). A single lock guards
+    the dict updates; bucket lookup happens before taking it, so the critical
+    section is a couple of integer additions.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, labels=(), value=0):
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        index = bisect_left(buckets, value)
+        key = (name, labels)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {
+                    'buckets': list(buckets), 'counts': [0] * (len(buckets) + 1), 'sum': 0.0
+                }
+            hist['counts'][index] += 1
+            hist['sum'] += value
+
+    def snapshot(self):
+        """Return a JSON-serialisable copy of the current values."""
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'counters': [[n, list(map(list, l)), v] for (n, l), v in self.counters.items()],
+                'gauges': [[n, list(map(list, l)), v] for (n, l), v in self.gauges.items()],
+                'histograms': [[n, list(map(list, l)), dict(h, counts=list(h['counts']))]
+                               for (n, l), h in self.histograms.items()],
+            }
+
+
+registry = Registry()
+_flusher = {'thread': None, 'pid': None, 'dir': None, 'interval': 5.0}
+
+
+def record_cache(cache_name, hit):
+    """Count a cache lookup; used by cached views and aggregates."""
+    registry.inc('cache_requests_total', (('cache', cache_name), ('result', 'hit' if hit else 'miss')))
+
+
+def record_replica_read(target, reason):
+    """Count where a read-only request read from; used by replicas.py."""
+    registry.inc('replica_reads_total', (('reason', reason), ('target', target)))
+
+
+def record_rate_limited(limit):
+    """Count an attempt a rate limit refused; used by ratelimit.py."""
+    registry.inc('rate_limited_total', (('limit', limit),))
+
+
+def _labels(**labels):
+    return tuple(sorted(labels.items()))
+
+
+def _after_request(response):
+    stats = request_logging.current_request_stats()
+    if stats is None:
+        return response
+    duration, db_time, sql_count = stats
+    route = request.endpoint or 'unmatched'
+    registry.inc('http_requests_total',
+                 _labels(route=route, method=request.method, status=str(response.status_code)))
+    registry.observe('http_request_duration_seconds', _labels(route=route), duration)
+    if sql_count:
+        registry.inc('sql_queries_total', _labels(route=route), sql_count)
+        registry.inc('sql_query_seconds_total', _labels(route=route), db_time)
+    return response
+
+
+def _instrument_pool(engine, bind):
+    """Time pool checkouts and track how many connections are in use, labelled with the bind."""
+    pool = engine.pool
+    if getattr(pool, '_mood_tracker_timed', False):
+        return
+    original_connect = pool.connect
+    labels = (('bind', bind),)
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return original_connect()
+        finally:
+            registry.observe('db_pool_checkout_seconds', labels, time.perf_counter() - start,
+                             POOL_WAIT_BUCKETS)
+
+    pool.connect = timed_connect
+    pool._mood_tracker_timed = True
+
+    checked_out = [0]
+    lock = threading.Lock()  # Request threads check connections in and out concurrently
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with lock:
+            checked_out[0] += 1
+            registry.set_gauge('db_pool_checked_out', labels, checked_out[0])
+
+    def on_checkin(dbapi_connection, connection_record):
+        with lock:
+            checked_out[0] = max(0, checked_out[0] - 1)
+            registry.set_gauge('db_pool_checked_out', labels, checked_out[0])
+
+    event.listen(pool, 'checkout', on_checkout)
+    event.listen(pool, 'checkin', on_checkin)
+
+
+def flush():
+    """Write this process's snapshot to the shared metrics directory."""
+    metrics_dir = _flusher['dir']
+    if not metrics_dir:
+        return
+    import logging_setup
+    registry.set_gauge('log_records_dropped_total', (), logging_setup.dropped_records())
+    path = os.path.join(metrics_dir, f"metrics_{os.getpid()}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def _flush_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def _start_flusher():
+    if _flusher['pid'] == os.getpid() or not _flusher['dir']:
+        return
+    thread = threading.Thread(target=_flush_loop, args=(_flusher['interval'],),
+                              name='metrics-flusher', daemon=True)
+    thread.start()
+    _flusher.update(thread=thread, pid=os.getpid())
+
+
+def _reset_after_fork():
+    # A forked worker starts with its own empty registry; the parent's values
+    # are still reported from the parent's snapshot file.
+    global registry
+    registry = Registry()
+    _flusher['pid'] = None
+    _start_flusher()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _snapshot_pid(path):
+    try:
+        return int(os.path.basename(path)[len('metrics_'):-len('.json')])
+    except ValueError:
+        return None
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def _folding(metrics_dir):
+    """Hold the lock that keeps two workers from folding the same snapshot."""
+    with open(os.path.join(metrics_dir, '.exited_workers.lock'), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _fold_exited(metrics_dir, paths):
+    """Add exited workers' counters and histograms to EXITED_FILE, then delete their snapshots."""
+    exited_path = os.path.join(metrics_dir, EXITED_FILE)
+    with _folding(metrics_dir):
+        snapshots = [snap for snap in map(_load, paths) if snap is not None]  # Gone: folded by another worker
+        if not snapshots:
+            return
+        previous = _load(exited_path)
+        counters, _, histograms = _merge(([previous] if previous else []) + snapshots, live_gauges=False)
+        folded = {
+            'pid': None,
+            'counters': [[n, list(map(list, l)), v] for (n, l), v in counters.items()],
+            'gauges': [],
+            'histograms': [[n, list(map(list, l)), h] for (n, l), h in histograms.items()],
+        }
+        tmp_path = f"{exited_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(folded, f)
+        os.replace(tmp_path, exited_path)
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _merge(snapshots, live_gauges=True):
+    """Sum snapshots into (counters, gauges, histograms) dicts keyed by (name, labels)."""
+    counters, gauges, histograms = {}, {}, {}
+    for snap in snapshots:
+        alive = live_gauges and snap['pid'] is not None and _pid_alive(snap['pid'])
+        for name, labels, value in snap['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in snap['gauges']:
+            # Counters exported as gauges (dropped log records) survive the
+            # worker; real gauges only count for live workers.
+            if HELP.get(name, ('gauge',))[0] == 'counter':
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            elif alive:
+                key = (name, tuple(map(tuple, labels)))
+                if name in MAX_GAUGES:
+                    gauges[key] = max(gauges.get(key, value), value)
+                else:
+                    gauges[key] = gauges.get(key, 0) + value
+        for name, labels, hist in snap['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = {'buckets': hist['buckets'], 'counts': list(hist['counts']),
+                                   'sum': hist['sum']}
+            else:
+                merged['counts'] = [a + b for a, b in zip(merged['counts'], hist['counts'])]
+                merged['sum'] += hist['sum']
+    return counters, gauges, histograms
+
+
+def collect(metrics_dir=None):
+    """
+    Merge the snapshots of every worker, and what exited workers counted,
+    into one set of values. Snapshots of exited workers are folded first.
+    """
+    metrics_dir = metrics_dir or _flusher['dir']
+    snapshots = []
+    if metrics_dir:
+        flush()
+        paths = glob.glob(os.path.join(metrics_dir, 'metrics_*.json'))
+        exited = [path for path in paths if not _pid_alive(_snapshot_pid(path) or 0)]
+        if exited:
+            _fold_exited(metrics_dir, exited)
+        for path in paths + [os.path.join(metrics_dir, EXITED_FILE)]:
+            if path not in exited:
+                snap = _load(path)
+                if snap is not None:
+                    snapshots.append(snap)
+    else:
+        snapshots.append(json.loads(json.dumps(registry.snapshot())))
+
+    counters, gauges, histograms = _merge(snapshots)
+
+    lookups = {}
+    for (name, labels), value in counters.items():
+        if name == 'cache_requests_total':
+            label_map = dict(labels)
+            hits, total = lookups.get(label_map['cache'], (0, 0))
+            lookups[label_map['cache']] = (hits + (value if label_map['result'] == 'hit' else 0),
+                                          total + value)
+    for cache_name, (hits, total) in lookups.items():
+        gauges[('cache_hit_ratio', (('cache', cache_name),))] = hits / total if total else 0.0
+
+    return counters, gauges, histograms
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render_prometheus(metrics_dir=None):
+    """Render the merged metrics in the Prometheus text exposition format."""
+    counters, gauges, histograms = collect(metrics_dir)
+    by_name = {}
+    for (name, labels), value in list(counters.items()) + list(gauges.items()):
+        by_name.setdefault(name, []).append((labels, value))
+    for (name, labels), hist in histograms.items():
+        by_name.setdefault(name, []).append((labels, hist))
+
+    lines = []
+    for name in sorted(by_name):
+        kind, help_text = HELP.get(name, ('untyped', ''))
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+        for labels, value in sorted(by_name[name], key=lambda item: item[0]):
+            if kind == 'histogram':
+                cumulative = 0
+                for bound, count in zip(value['buckets'] + ['+Inf'], value['counts']):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {value['sum']}")
+                lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {cumulative}")
+            else:
+                lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app, db=None):
+    """Register the metrics hooks on a Flask app."""
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    metrics_dir = app.config.get('METRICS_DIR')
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+    _flusher.update(dir=metrics_dir, interval=float(app.config.get('METRICS_FLUSH_INTERVAL', 5.0)))
+    _start_flusher()
+
+    app.after_request(_after_request)
+
+    if db is not None:
+        # Every bind: the default database, and any shards and replica.
+        with app.app_context():
+            engines = dict(db.engines)
+        for bind, engine in engines.items():
+            bind = bind or 'default'
+            _instrument_pool(engine, bind)
+            # dispose() swaps in a fresh pool, which needs instrumenting again.
+            event.listen(engine, 'engine_disposed', lambda engine, bind=bind: _instrument_pool(engine, bind))
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
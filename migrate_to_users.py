@@ -13,7 +13,8 @@ from werkzeug.security import generate_password_hash
 # Add the current directory to the Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db, User, MoodEntry, Medication
+from app import create_app
+from models import db, User, MoodEntry, Medication
 
 def backup_existing_data():
     """Backup existing data before migration."""
@@ -88,6 +89,7 @@ def restore_data_from_backup(backup_path):
 
 def migrate_data():
     """Migrate existing data to user authentication system."""
+    app = create_app()
     with app.app_context():
         print("Starting migration to user authentication system...")
         
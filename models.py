@@ -0,0 +1,221 @@
+"""
+Database models for Mood Tracker.
+
+The SQLAlchemy extension is created unbound here and attached to each
+application by create_app() in app.py.
+"""
+
+from datetime import datetime
+
+from flask_login import UserMixin
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from replicas import ReadReplicaSession
+
+db = SQLAlchemy(session_options={'class_': ReadReplicaSession})
+
+
+def dialect_insert(table):
+    """INSERT construct with ON CONFLICT support for the session's database."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return sqlite.insert(table)
+    if dialect == 'postgresql':
+        return postgresql.insert(table)
+    raise NotImplementedError(f"ON CONFLICT upserts are not supported on {dialect}")
+
+
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(200), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    is_active = db.Column(db.Boolean, default=True)
+    
+    # Relationship to mood entries
+    mood_entries = db.relationship('MoodEntry', backref='user', lazy=True, cascade='all, delete-orphan')
+    
+    def set_password(self, password):
+        self.password_hash = generate_password_hash(password)
+    
+    def check_password(self, password):
+        return check_password_hash(self.password_hash, password)
+
+
+class Medication(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    active = db.Column(db.Boolean, default=True)  # For soft delete
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user = db.relationship('User', backref='medications')
+    
+class MoodEntryMedication(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    mood_entry_id = db.Column(db.Integer, db.ForeignKey('mood_entry.id'), nullable=False, index=True)
+    medication_id = db.Column(db.Integer, db.ForeignKey('medication.id'), nullable=False)
+    taken = db.Column(db.Boolean, default=False)
+    
+    medication = db.relationship('Medication')
+
+
+class MoodEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    entry_date = db.Column(db.Date, nullable=False)
+    mood_level = db.Column(db.Integer, nullable=False)
+    hours_slept = db.Column(db.Float, nullable=False)
+    anxiety = db.Column(db.Integer, nullable=False)
+    energy_level = db.Column(db.Integer, nullable=False)
+    irritability = db.Column(db.Integer, nullable=False)
+    alcohol_drugs = db.Column(db.Boolean, default=False)
+    exercise = db.Column(db.Boolean, default=False)
+    menstruation = db.Column(db.Boolean, default=False)
+    stressful_event = db.Column(db.Boolean, default=False)
+    weight = db.Column(db.Float)  # Optional weight field
+    notes = db.Column(db.Text)
+    medications = db.relationship('MoodEntryMedication', backref='mood_entry', cascade='all, delete-orphan')
+    
+    # Add unique constraint for user_id and entry_date combination
+    __table_args__ = (db.UniqueConstraint('user_id', 'entry_date', name='_user_date_uc'),)
+
+
+class IdempotencyKey(db.Model):
+    """Response of an API write, kept so a retried request gets the same answer without writing twice."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    key = db.Column(db.String(200), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)  # sha256 of the request body
+    status_code = db.Column(db.Integer, nullable=False)
+    response = db.Column(db.Text, nullable=False)  # JSON body
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'key', name='_user_idempotency_key_uc'),)
+
+
+class SyncState(db.Model):
+    """Per-user change counter for delta sync."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)  # Latest version handed out
+    pruned_through = db.Column(db.Integer, nullable=False, default=0)  # Log rows up to here may be gone
+
+
+class ChangeLog(db.Model):
+    """One change to a user's entry or medication; read by /api/sync."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # 'entry' or 'medication'
+    object_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # 'upsert' or 'delete'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'version', name='_user_version_uc'),
+        db.Index('ix_change_log_object', 'user_id', 'kind', 'object_id', 'version'),
+    )
+
+
+class UserShard(db.Model):
+    """Which shard holds a user's data (directory database; see sharding.py)."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    shard = db.Column(db.Integer, nullable=False)
+
+
+class MovedUser(db.Model):
+    """Marker left on a shard a user has moved away from; triggers reject their writes there."""
+    user_id = db.Column(db.Integer, primary_key=True)
+
+
+class ReplicaHeartbeat(db.Model):
+    """Single row stamped on the primary by replica_sync.py; its age on the replica is the lag."""
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
+
+class Job(db.Model):
+    """A unit of background work; see jobs.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # Picks the handler
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    dedupe_key = db.Column(db.String(200), unique=True)  # Enqueuing an active or fresh key returns this job
+    priority = db.Column(db.Integer, nullable=False, default=0)  # Higher runs first
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    params = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    progress = db.Column(db.Float, nullable=False, default=0.0)  # 0 to 1
+    result = db.Column(db.Text)  # JSON, once succeeded
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    worker = db.Column(db.String(100))  # Holder of the lease while running
+    lease_expires_at = db.Column(db.DateTime)  # Requeued if still running after this
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime)  # Finished jobs are purged after this
+
+    __table_args__ = (db.Index('ix_job_queue', 'status', 'priority', 'id'),)
+
+
+class EntryYearBlob(db.Model):
+    """One year of a user's entries packed into typed arrays (history.py, COLUMNAR_HISTORY)."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+
+class EntryStats(db.Model):
+    """Running statistics of one metric over a user's entries (entry_stats.py)."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    metric = db.Column(db.String(20), primary_key=True)  # MoodEntry column name
+    count = db.Column(db.Integer, nullable=False, default=0)
+    mean = db.Column(db.Float, nullable=False, default=0.0)
+    m2 = db.Column(db.Float, nullable=False, default=0.0)  # Sum of squared deviations from the mean (Welford)
+    ew_sum = db.Column(db.Float, nullable=False, default=0.0)  # Exponentially weighted sums of values,
+    ew_sum_sq = db.Column(db.Float, nullable=False, default=0.0)  # of squared values
+    ew_weight = db.Column(db.Float, nullable=False, default=0.0)  # and of the weights themselves
+    seq = db.Column(db.Integer, nullable=False, default=0)  # Entries counted so far; EW weights decay per entry
+
+
+class EntryScore(db.Model):
+    """The values an entry contributed to its user's EntryStats, and the unusual-day flags it got."""
+    entry_id = db.Column(db.Integer, db.ForeignKey('mood_entry.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    seq = db.Column(db.Integer, nullable=False)  # EntryStats.seq when the entry was counted
+    flags = db.Column(db.Integer, nullable=False, default=0)  # entry_stats.LOW/HIGH bits per metric
+    mood_level = db.Column(db.Float)
+    hours_slept = db.Column(db.Float)
+    anxiety = db.Column(db.Float)
+    energy_level = db.Column(db.Float)
+    irritability = db.Column(db.Float)
+    weight = db.Column(db.Float)
+
+
+class EntryArchive(db.Model):
+    """One year of a user's entries moved out of the hot tables, compressed (archive.py)."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    entries = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed history.py blob
+    details = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed JSON: ids, notes, medication links
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class EntryRollup(db.Model):
+    """A month of one metric over a user's archived entries (archive.py)."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)  # First day of the month
+    metric = db.Column(db.String(20), primary_key=True)  # MoodEntry column name or 'medications'
+    count = db.Column(db.Integer, nullable=False)  # Entries with a value
+    total = db.Column(db.Float, nullable=False)
+    low = db.Column(db.Float, nullable=False)
+    high = db.Column(db.Float, nullable=False)
+
+
+class RateLimitCount(db.Model):
+    """Attempts counted against one rate limit key in one window (ratelimit.py's database store)."""
+    key = db.Column(db.String(32), primary_key=True)  # Hash of the limit and the address or username
+    window = db.Column(db.Integer, primary_key=True)  # Unix time // RATE_LIMIT_WINDOW
+    count = db.Column(db.Integer, nullable=False)
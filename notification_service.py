@@ -12,7 +12,9 @@ import json
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Import the database models from app.py
-from app import db, MoodEntry
+from models import db, MoodEntry
+import replicas
+import sharding
 
 def load_notification_settings():
     """Load notification settings from JSON file."""
@@ -58,11 +60,20 @@ def check_today_entry():
         tz = timezone(timedelta(hours=tz_offset))
         today = datetime.now(tz).date()
         
-        # Check if entry exists for today
-        existing_entry = MoodEntry.query.filter_by(entry_date=today).first()
-        
-        # Check if weight input is needed (every 7 days)
-        last_weight_entry = MoodEntry.query.filter(MoodEntry.weight.isnot(None)).order_by(MoodEntry.entry_date.desc()).first()
+        # Read-only checks, so they may use the read replica
+        existing_entry = None
+        last_weight_entry = None
+        with replicas.reading():
+            # Entries are spread over the shards (a single None shard when unsharded)
+            for shard in sharding.shards():
+                with sharding.use_shard(shard):
+                    # Check if entry exists for today
+                    existing_entry = existing_entry or MoodEntry.query.filter_by(entry_date=today).first()
+
+                    # Check if weight input is needed (every 7 days)
+                    latest = MoodEntry.query.filter(MoodEntry.weight.isnot(None)).order_by(MoodEntry.entry_date.desc()).first()
+                    if latest and (not last_weight_entry or latest.entry_date > last_weight_entry.entry_date):
+                        last_weight_entry = latest
         weight_needed = False
         if not last_weight_entry:
             weight_needed = True
@@ -130,6 +141,6 @@ def run_notification_service():
 
 if __name__ == "__main__":
     # Create Flask app context for database operations
-    from app import app
-    with app.app_context():
+    from app import create_app
+    with create_app().app_context():
         run_notification_service() 
\ No newline at end of file
@@ -23,6 +23,7 @@ class MoodTrackerNotificationService(win32serviceutil.ServiceFramework):
         self.stop_event = win32event.CreateEvent(None, 0, 0, None)
         socket.setdefaulttimeout(60)
         self.is_alive = True
+        self.app = None
 
     def SvcStop(self):
         self.ReportServiceStatus(win32service.SERVICE_STOP_PENDING)
@@ -39,9 +40,12 @@ class MoodTrackerNotificationService(win32serviceutil.ServiceFramework):
         """Check if an entry exists for today and send notification if not."""
         try:
             # Import here to avoid issues during service installation
-            from app import app, MoodEntry
+            from app import create_app
+            from models import MoodEntry
             
-            with app.app_context():
+            if self.app is None:
+                self.app = create_app()
+            with self.app.app_context():
                 # Get today's date in EST
                 est_tz = timezone(timedelta(hours=-5))
                 today = datetime.now(est_tz).date()
@@ -0,0 +1,290 @@
+"""
+Opt-in request profiler for Mood Tracker.
+
+A request is profiled with cProfile when an admin asks for it (the X-Profile
+header or ?_profile=1) or when it is picked by PROFILE_SAMPLE_RATE. Profiles
+are written to PROFILE_DIR as a pstats dump plus a small JSON summary, and old
+ones are pruned on every save.
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from flask_login import current_user
+
+import request_logging
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_QUERY_ARG = '_profile'
+PROFILE_JOB_PARAM = '_profile'  # Set in a job's params to profile its handler (see run_job())
+
+logger = logging.getLogger('mood_tracker')
+
+_settings = {'dir': 'logs/profiles', 'max_files': 200, 'retention_days': 7}
+_PROFILE_NAME = re.compile(r'^[\w.-]+$')
+# Held while a profiler runs: from Python 3.12 only one cProfile profiler can be
+# enabled per process, so a request or job that finds it taken goes unprofiled.
+_active = threading.Lock()
+
+
+@contextmanager
+def section(name):
+    """Record the wall time of a named part of the request (or profiled job) in its profile."""
+    sections = g.get('_profile_sections')
+    if sections is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        sections[name] = sections.get(name, 0.0) + time.perf_counter() - start
+
+
+def _start_profiler():
+    """Enable a new profiler, or return None when another one is already running."""
+    if not _active.acquire(blocking=False):
+        logger.debug("Profile skipped: another profile is running")
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:  # Some other tool's profiler is attached
+        _active.release()
+        logger.debug("Profile skipped: %s", e)
+        return None
+    return profiler
+
+
+def _stop_profiler(profiler):
+    profiler.disable()
+    _active.release()
+
+
+def _wants_profile(is_admin, sample_rate):
+    requested = (request.headers.get(PROFILE_HEADER) == '1'
+                 or request.args.get(PROFILE_QUERY_ARG) == '1')
+    if requested and is_admin(current_user):
+        return 'requested'
+    if sample_rate > 0 and random.random() < sample_rate:
+        return 'sampled'
+    return None
+
+
+def _on_before_render(sender, template, context, **extra):
+    if g.get('_profile_sections') is not None:
+        g._profile_render_start = time.perf_counter()
+
+
+def _on_rendered(sender, template, context, **extra):
+    start = g.pop('_profile_render_start', None)
+    sections = g.get('_profile_sections')
+    if start is not None and sections is not None:
+        key = f"render:{template.name}"
+        sections[key] = sections.get(key, 0.0) + time.perf_counter() - start
+
+
+def _prune():
+    """Apply the retention policy to the stored profiles."""
+    profile_dir = _settings['dir']
+    cutoff = time.time() - _settings['retention_days'] * 86400
+    summaries = sorted(
+        (os.path.join(profile_dir, name) for name in os.listdir(profile_dir) if name.endswith('.json')),
+        key=os.path.getmtime, reverse=True
+    )
+    for index, path in enumerate(summaries):
+        if index >= _settings['max_files'] or os.path.getmtime(path) < cutoff:
+            for stale in (path, path[:-len('.json')] + '.prof'):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+
+
+def _write(profiler, summary):
+    """Store a profile and its JSON summary, then prune."""
+    profile_dir = _settings['dir']
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler.dump_stats(os.path.join(profile_dir, f"{summary['name']}.prof"))
+    with open(os.path.join(profile_dir, f"{summary['name']}.json"), 'w') as f:
+        json.dump(summary, f, indent=2)
+    _prune()
+    logger.info("Profile saved: %s (%s, %.1fms)", summary['name'], summary['reason'], summary['duration_ms'])
+
+
+def _save(profiler, response, reason):
+    duration = time.perf_counter() - g._profile_start
+    request_id = g.get('request_id', '')
+    name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{request.endpoint or 'unmatched'}_{request_id[:8]}"
+    stats = request_logging.current_request_stats()
+    _write(profiler, {
+        'name': name,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'request_id': request_id,
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'reason': reason,
+        'user': current_user.username if current_user.is_authenticated else None,
+        'duration_ms': round(duration * 1000, 2),
+        'sql_count': stats[2] if stats else None,
+        'db_time_ms': round(stats[1] * 1000, 2) if stats else None,
+        'sections_ms': {k: round(v * 1000, 2) for k, v in g._profile_sections.items()},
+    })
+    return name
+
+
+def requested():
+    """True while serving a profiled request; routes pass it on to the jobs doing their work."""
+    return has_request_context() and g.get('_profiler') is not None
+
+
+def run_job(job, run):
+    """
+    Call a job handler, under cProfile when the job's params ask for it (the
+    request that queued it was profiled) and no other profile is running. The
+    profile is stored with the request profiles as "JOB job:<kind>", sections
+    and all.
+    """
+    profiler = _start_profiler() if job.params.get(PROFILE_JOB_PARAM) else None
+    if profiler is None:
+        return run(job)
+    g._profile_sections = {}
+    status = 'failed'
+    start = time.perf_counter()
+    try:
+        result = run(job)
+        status = 'succeeded'
+        return result
+    finally:
+        _stop_profiler(profiler)
+        duration = time.perf_counter() - start
+        sections = g.pop('_profile_sections')
+        try:
+            _write(profiler, {
+                'name': f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_job-{job.kind}_{job.id}",
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'request_id': f'job {job.id}',
+                'method': 'JOB',
+                'path': f'job:{job.kind}',
+                'endpoint': job.kind,
+                'status': status,
+                'reason': 'requested',
+                'user': None if job.user_id is None else f'user id {job.user_id}',
+                'duration_ms': round(duration * 1000, 2),
+                'sql_count': None,
+                'db_time_ms': None,
+                'sections_ms': {k: round(v * 1000, 2) for k, v in sections.items()},
+            })
+        except OSError as e:
+            logger.error("Failed to save job profile: %s", e)
+
+
+def list_profiles(limit=50):
+    """Return the summaries of the most recent profiles, newest first."""
+    profile_dir = _settings['dir']
+    if not os.path.isdir(profile_dir):
+        return []
+    summaries = []
+    for filename in sorted(os.listdir(profile_dir), reverse=True):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(profile_dir, filename)) as f:
+                summaries.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+        if len(summaries) >= limit:
+            break
+    return summaries
+
+
+def load_profile(name, sort='cumulative', limit=40):
+    """Load a profile summary and its top functions, or None if it does not exist."""
+    if not _PROFILE_NAME.match(name):
+        return None
+    base = os.path.join(_settings['dir'], name)
+    if not (os.path.exists(f"{base}.json") and os.path.exists(f"{base}.prof")):
+        return None
+    with open(f"{base}.json") as f:
+        summary = json.load(f)
+
+    stats = pstats.Stats(f"{base}.prof", stream=io.StringIO())
+    sort_key = {'cumulative': 3, 'tottime': 2, 'calls': 1}.get(sort, 3)
+    rows = []
+    for (filename, line, func), (cc, nc, tt, ct, callers) in stats.stats.items():
+        rows.append({
+            'function': f"{func} ({os.path.basename(filename)}:{line})" if line else func,
+            'file': filename,
+            'primitive_calls': cc,
+            'calls': nc,
+            'tottime_ms': round(tt * 1000, 3),
+            'cumtime_ms': round(ct * 1000, 3),
+            '_key': (cc, nc, tt, ct),
+        })
+    rows.sort(key=lambda row: row['_key'][sort_key], reverse=True)
+    for row in rows:
+        del row['_key']
+    summary['functions'] = rows[:limit]
+    summary['total_calls'] = stats.total_calls
+    return summary
+
+
+def init_app(app, is_admin):
+    """Register the profiling hooks. is_admin(user) decides who may request a profile."""
+    _settings.update(
+        dir=app.config.get('PROFILE_DIR', 'logs/profiles'),
+        max_files=int(app.config.get('PROFILE_MAX_FILES', 200)),
+        retention_days=float(app.config.get('PROFILE_RETENTION_DAYS', 7)),
+    )
+    if not app.config.get('PROFILE_ENABLED', True):
+        return
+    sample_rate = float(app.config.get('PROFILE_SAMPLE_RATE', 0.0))
+
+    @app.before_request
+    def start_profile():
+        reason = _wants_profile(is_admin, sample_rate)
+        if reason is None:
+            return
+        profiler = _start_profiler()
+        if profiler is None:
+            return
+        g._profile_sections = {}
+        g._profile_reason = reason
+        g._profile_start = time.perf_counter()
+        g._profiler = profiler
+
+    @app.after_request
+    def finish_profile(response):
+        profiler = g.pop('_profiler', None)
+        if profiler is None:
+            return response
+        _stop_profiler(profiler)
+        try:
+            response.headers['X-Profile-Id'] = _save(profiler, response, g._profile_reason)
+        except OSError as e:
+            logger.error("Failed to save request profile: %s", e)
+        return response
+
+    @app.teardown_request
+    def stop_profile(exc):
+        # after_request is skipped when a request fails hard; never leave the
+        # profiler attached to a worker thread.
+        profiler = g.pop('_profiler', None)
+        if profiler is not None:
+            _stop_profiler(profiler)
+
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_rendered, app)
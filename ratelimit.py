@@ -0,0 +1,190 @@
+"""
+Sliding-window limits on login and registration attempts.
+
+Every login or registration form post costs a PBKDF2 hash, so unlimited
+attempts let a credential-stuffing script tie up every worker. Each limit
+counts attempts per key (a client address or a username) over the last
+RATE_LIMIT_WINDOW seconds and the routes answer 429 with Retry-After,
+before touching the database or hashing anything, once a key is over:
+
+  login-ip        every login attempt from an address   LOGIN_LIMIT_PER_IP
+  login-username  failed logins for a username          LOGIN_LIMIT_PER_USERNAME
+  register-ip     every registration from an address    REGISTER_LIMIT_PER_IP
+
+The window is approximated from two fixed windows: the count so far in the
+current one plus the previous one's count, weighted by how much of it still
+overlaps the sliding window. That needs three numbers per key instead of a
+timestamp per attempt. Keys are hashed to 16 bytes, so a long username
+costs no more than a short one.
+
+The memory store keeps at most RATE_LIMIT_MAX_KEYS keys per worker,
+dropping the least recently used (in practice keys whose windows are long
+over). With several worker processes each one counts on its own, so a
+client gets up to a limit per worker; RATE_LIMIT_STORE = 'database' keeps
+the counts in the rate_limit_count table instead, shared by every worker
+at the cost of two or three statements per attempt.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import delete, select
+
+import metrics
+from models import db, dialect_insert, RateLimitCount
+
+LOGIN_IP = 'login-ip'
+LOGIN_USERNAME = 'login-username'
+REGISTER_IP = 'register-ip'
+LIMITS = {
+    LOGIN_IP: 'LOGIN_LIMIT_PER_IP',
+    LOGIN_USERNAME: 'LOGIN_LIMIT_PER_USERNAME',
+    REGISTER_IP: 'REGISTER_LIMIT_PER_IP',
+}
+STORES = ('memory', 'database')
+
+
+def _key(limit, value):
+    return hashlib.blake2b(f'{limit}\0{value}'.encode('utf-8'), digest_size=16).digest()
+
+
+def estimate(previous, current, elapsed, window):
+    """Attempts in the sliding window ending `elapsed` seconds into the current fixed window."""
+    return previous * (1 - elapsed / window) + current
+
+
+def wait_seconds(previous, current, elapsed, window, allowed):
+    """Whole seconds until the estimate drops below `allowed` if no more attempts come (at least 1)."""
+    if current < allowed:
+        # Still in this window, as the previous window's share shrinks.
+        wait = window * (1 - (allowed - current) / previous) - elapsed
+    else:
+        # In the next one, where this window's count is the shrinking share.
+        wait = window - elapsed + window * (1 - allowed / current)
+    return max(1, math.floor(wait) + 1)
+
+
+class MemoryStore:
+    """Per-key (window, current, previous) counts for one process, at most `size` keys."""
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.counts = OrderedDict()
+
+    def _counts(self, key, window):
+        """(current, previous) for a key in the given window; called with the lock held."""
+        entry = self.counts.get(key)
+        if entry is None:
+            return 0, 0
+        if entry[0] == window:
+            return entry[1], entry[2]
+        return 0, entry[1] if entry[0] == window - 1 else 0
+
+    def attempt(self, key, allowed, window_seconds, now):
+        """Count an attempt unless the key is at its limit; returns 0 or the seconds to wait."""
+        window, elapsed = divmod(now, window_seconds)
+        window = int(window)
+        with self.lock:
+            current, previous = self._counts(key, window)
+            if estimate(previous, current, elapsed, window_seconds) >= allowed:
+                return wait_seconds(previous, current, elapsed, window_seconds, allowed)
+            self.counts[key] = (window, current + 1, previous)
+            self.counts.move_to_end(key)
+            while len(self.counts) > self.size:
+                self.counts.popitem(last=False)
+            return 0
+
+    def retry_after(self, key, allowed, window_seconds, now):
+        """0 if the key is under its limit, else the seconds to wait; counts nothing."""
+        window, elapsed = divmod(now, window_seconds)
+        with self.lock:
+            current, previous = self._counts(key, int(window))
+        if estimate(previous, current, elapsed, window_seconds) >= allowed:
+            return wait_seconds(previous, current, elapsed, window_seconds, allowed)
+        return 0
+
+
+class DatabaseStore:
+    """
+    Counts in the rate_limit_count table, shared by every worker. Statements
+    run on their own connection and commit at once, outside the request's
+    session, so a rejected request still leaves its count behind.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.purged = None  # Last window this worker cleared older rows in
+
+    def _counts(self, connection, key, window):
+        rows = dict(connection.execute(select(RateLimitCount.window, RateLimitCount.count).where(
+            RateLimitCount.key == key.hex(), RateLimitCount.window.in_((window - 1, window)))).all())
+        return rows.get(window, 0), rows.get(window - 1, 0)
+
+    def _purge(self, connection, window):
+        # Once per window and worker rather than per attempt.
+        with self.lock:
+            if self.purged == window:
+                return
+            self.purged = window
+        connection.execute(delete(RateLimitCount).where(RateLimitCount.window < window - 1))
+
+    def attempt(self, key, allowed, window_seconds, now):
+        window, elapsed = divmod(now, window_seconds)
+        window = int(window)
+        with db.engine.begin() as connection:
+            self._purge(connection, window)
+            current, previous = self._counts(connection, key, window)
+            if estimate(previous, current, elapsed, window_seconds) >= allowed:
+                return wait_seconds(previous, current, elapsed, window_seconds, allowed)
+            insert = dialect_insert(RateLimitCount)
+            connection.execute(insert.values(key=key.hex(), window=window, count=1).on_conflict_do_update(
+                index_elements=['key', 'window'], set_={'count': RateLimitCount.count + 1}))
+            return 0
+
+    def retry_after(self, key, allowed, window_seconds, now):
+        window, elapsed = divmod(now, window_seconds)
+        with db.engine.connect() as connection:
+            current, previous = self._counts(connection, key, int(window))
+        if estimate(previous, current, elapsed, window_seconds) >= allowed:
+            return wait_seconds(previous, current, elapsed, window_seconds, allowed)
+        return 0
+
+
+def init_app(app):
+    """Give the app its store; RATE_LIMIT_STORE picks which."""
+    store = app.config['RATE_LIMIT_STORE']
+    if store not in STORES:
+        raise ValueError(f"RATE_LIMIT_STORE must be one of {', '.join(STORES)}, not {store!r}")
+    app.extensions['rate_limit'] = (MemoryStore(app.config['RATE_LIMIT_MAX_KEYS']) if store == 'memory'
+                                    else DatabaseStore())
+
+
+def _check(limit, value, count):
+    allowed = current_app.config[LIMITS[limit]]
+    if not allowed:
+        return 0
+    store = current_app.extensions['rate_limit']
+    check = store.attempt if count else store.retry_after
+    wait = check(_key(limit, value), allowed, current_app.config['RATE_LIMIT_WINDOW'], time.time())
+    if wait:
+        metrics.record_rate_limited(limit)
+    return wait
+
+
+def attempt(limit, value):
+    """
+    Count an attempt against a limit for an address or username. Returns 0,
+    or the seconds until the next attempt is allowed if the key is already at
+    its limit (that attempt isn't counted). A limit set to 0 is off.
+    """
+    return _check(limit, value, count=True)
+
+
+def retry_after(limit, value):
+    """Like attempt(), but only checks: for limits that count some attempts (failed logins) afterwards."""
+    return _check(limit, value, count=False)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Keeps the read replica (REPLICA_DATABASE_URI, see replicas.py) current.
+
+Every REPLICA_SYNC_INTERVAL seconds it stamps the heartbeat row on the
+primary; for a SQLite replica it then copies the primary over the replica
+with SQLite's online backup API, so the stamp arrives with the data it
+covers. A Postgres standby replicates the stamp itself, so there only the
+heartbeat is written.
+
+Usage: python replica_sync.py [--once] [--interval SECONDS]
+"""
+
+import argparse
+import sqlite3
+import sys
+import time
+
+import replicas
+from models import db
+
+
+def copy_sqlite(primary_path, replica_path):
+    """Copy the primary database over the replica file; readers wait on its lock meanwhile."""
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path, timeout=30)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def sync_once():
+    """Stamp the heartbeat and, for a SQLite replica, refresh the copy. Returns True if copied."""
+    replicas.beat()
+    db.session.commit()
+    primary = db.engines[None]
+    replica = db.engines[replicas.REPLICA_BIND]
+    if replica.dialect.name != 'sqlite':
+        return False
+    copy_sqlite(primary.url.database, replica.url.database)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the Mood Tracker read replica up to date")
+    parser.add_argument('--once', action='store_true', help="Sync once and exit")
+    parser.add_argument('--interval', type=float, help="Seconds between syncs (default REPLICA_SYNC_INTERVAL)")
+    args = parser.parse_args()
+
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        if not replicas.is_enabled():
+            print("No replica configured (REPLICA_DATABASE_URI).")
+            return 1
+        interval = args.interval or app.config['REPLICA_SYNC_INTERVAL']
+        while True:
+            started = time.perf_counter()
+            copied = sync_once()
+            if args.once:
+                print(f"{'Copied' if copied else 'Heartbeat'} in {(time.perf_counter() - started) * 1000:.0f} ms")
+                return 0
+            time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+Read replica for the read-only routes.
+
+With REPLICA_DATABASE_URI set, views marked @read_only (/data, /visualize,
+/manage) and the notification checker read users' entries and medications
+from a replica bind, leaving the primary's connections and write lock to
+/submit, /edit and the other writers. Writes, and reads of any other table,
+always go to the primary. The replica can be a streaming Postgres standby
+or, locally, a SQLite copy refreshed by `python replica_sync.py`.
+
+Two checks decide, once per read-only request, whether the replica is used:
+
+* Lag. replica_sync.py stamps the replica_heartbeat row on the primary
+  before every copy (or every interval, for a streaming replica); how old
+  that row is on the replica is how far behind it is. Past
+  REPLICA_MAX_LAG_SECONDS, or if the replica can't be read, the request
+  reads from the primary.
+* Read-your-writes. changelog.record() gives each write a per-user version.
+  When a request that wrote commits, the version is kept in the user's
+  session, and their reads stay on the primary until the replica's
+  sync_state row for them has reached it.
+
+A replica can't be combined with sharding (SHARD_COUNT > 1).
+"""
+
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, g, has_request_context, session
+from flask_login import current_user
+from sqlalchemy import event, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import util as sql_util
+
+import metrics
+import sharding
+
+REPLICA_BIND = 'replica'
+# Tables whose reads may be served by the replica: the ones changelog.record() versions,
+# and the archive of older entries, which has to be read from the same copy as the hot rows.
+REPLICATED_TABLES = frozenset([
+    'medication', 'mood_entry', 'mood_entry_medication', 'entry_year_blob', 'mood_entry_fts', 'entry_score',
+    'entry_archive', 'entry_rollup',
+])
+WAIT_VERSION_KEY = 'replica_wait_version'
+
+_UNDECIDED = object()
+# engine -> (monotonic time checked, lag in seconds or None)
+_lag_checks = {}
+
+
+def is_enabled(app=None):
+    return bool((app or current_app).config.get('REPLICA_DATABASE_URI'))
+
+
+def configure(app):
+    """Add the replica bind. Call before db.init_app()."""
+    if not is_enabled(app):
+        return
+    if sharding.is_sharded(app):
+        raise ValueError("REPLICA_DATABASE_URI can't be used with SHARD_COUNT > 1")
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds[REPLICA_BIND] = app.config['REPLICA_DATABASE_URI']
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def _db():
+    # models imports this module for ReadReplicaSession, so it is imported late.
+    from models import db
+    return db
+
+
+def _reads_replicated_tables(clause):
+    if clause is None or not clause.is_select:
+        return False
+    names = {getattr(table, 'name', None) for table in sql_util.find_tables(clause)}
+    return bool(names) and names <= REPLICATED_TABLES
+
+
+class ReadReplicaSession(sharding.RoutingSession):
+    """Sends reads of replicated tables inside reading() blocks to the replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and g.get('replica_choice') is not None and _reads_replicated_tables(clause):
+            if g.replica_choice is _UNDECIDED:
+                g.replica_choice = _choose_engine()
+            if g.replica_choice:
+                return g.replica_choice
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(ReadReplicaSession, 'after_commit')
+def _remember_write(db_session):
+    version = db_session.info.pop('write_version', None)
+    if version is not None and has_request_context() and is_enabled():
+        session[WAIT_VERSION_KEY] = max(version, session.get(WAIT_VERSION_KEY, 0))
+
+
+@event.listens_for(ReadReplicaSession, 'after_rollback')
+def _forget_write(db_session):
+    db_session.info.pop('write_version', None)
+
+
+@contextmanager
+def reading():
+    """Let reads of user data inside the block use the replica when it is fresh enough."""
+    previous = g.get('replica_choice')
+    g.replica_choice = _UNDECIDED if is_enabled() else None
+    try:
+        yield
+    finally:
+        g.replica_choice = previous
+
+
+def read_only(view):
+    """Mark a view as read-only: its reads of user data may use the replica."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        with reading():
+            return view(*args, **kwargs)
+    return wrapped
+
+
+def replica_lag(engine):
+    """
+    Seconds the replica is behind the primary (the age of its heartbeat), or
+    None if it can't be read. Checked at most every REPLICA_LAG_CHECK_INTERVAL
+    seconds per process.
+    """
+    from models import ReplicaHeartbeat
+
+    now = time.monotonic()
+    checked = _lag_checks.get(engine)
+    if checked and now - checked[0] < current_app.config['REPLICA_LAG_CHECK_INTERVAL']:
+        return checked[1]
+    try:
+        with engine.connect() as conn:
+            beat_at = conn.execute(select(ReplicaHeartbeat.beat_at)).scalar()
+    except SQLAlchemyError:
+        beat_at = None
+    lag = None if beat_at is None else max(0.0, (datetime.utcnow() - beat_at).total_seconds())
+    _lag_checks[engine] = (now, lag)
+    if lag is not None:
+        metrics.registry.set_gauge('replica_lag_seconds', (), lag)
+    return lag
+
+
+def _replica_version(engine, user_id):
+    from models import SyncState
+
+    with engine.connect() as conn:
+        return conn.execute(select(SyncState.version).where(SyncState.user_id == user_id)).scalar() or 0
+
+
+def _choose_engine():
+    """The replica engine if this request may read from it, else False (use the primary)."""
+    engine = _db().engines[REPLICA_BIND]
+    lag = replica_lag(engine)
+    if lag is None:
+        return _use_primary('unavailable')
+    if lag > current_app.config['REPLICA_MAX_LAG_SECONDS']:
+        return _use_primary('stale')
+    if has_request_context() and session.get(WAIT_VERSION_KEY):
+        try:
+            caught_up = _replica_version(engine, current_user.id) >= session[WAIT_VERSION_KEY]
+        except SQLAlchemyError:
+            return _use_primary('unavailable')
+        if not caught_up:
+            return _use_primary('read_your_writes')
+        session.pop(WAIT_VERSION_KEY)
+    metrics.record_replica_read('replica', 'fresh')
+    return engine
+
+
+def _use_primary(reason):
+    metrics.record_replica_read('primary', reason)
+    return False
+
+
+def beat():
+    """Stamp the primary's heartbeat row. The caller commits."""
+    from models import ReplicaHeartbeat, dialect_insert
+
+    now = datetime.utcnow()
+    _db().session.execute(
+        dialect_insert(ReplicaHeartbeat).values(id=1, beat_at=now)
+        .on_conflict_do_update(index_elements=['id'], set_={'beat_at': now}))
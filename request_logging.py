@@ -0,0 +1,126 @@
+"""
+Request lifecycle logging for Mood Tracker.
+Every (sampled) request produces one JSON line on the 'mood_tracker.requests'
+logger with its request ID, status, wall time, DB time and SQL statement count.
+"""
+
+import json
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request, session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REQUEST_LOGGER_NAME = 'mood_tracker.requests'
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+request_logger = logging.getLogger(REQUEST_LOGGER_NAME)
+
+
+class JsonLine:
+    """Log argument that serialises to JSON only when the record is formatted."""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(self.data, separators=(',', ':'), default=str)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get('query_start_time')
+    if not start_times:
+        return
+    elapsed = time.perf_counter() - start_times.pop()
+    if has_request_context():
+        stats = g.get('_request_stats')
+        if stats is not None:
+            stats['sql_count'] += 1
+            stats['db_time'] += elapsed
+
+
+def _install_sql_listeners():
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _start_request():
+    incoming = request.headers.get(REQUEST_ID_HEADER, '')
+    # Accept a caller-supplied ID (e.g. from a proxy) only if it looks sane.
+    if incoming and len(incoming) <= 64 and incoming.replace('-', '').isalnum():
+        g.request_id = incoming
+    else:
+        g.request_id = uuid.uuid4().hex
+    g._request_stats = {'start': time.perf_counter(), 'sql_count': 0, 'db_time': 0.0}
+
+
+def current_request_stats():
+    """Return (wall_seconds, db_seconds, sql_count) for the current request so far."""
+    stats = g.get('_request_stats') if has_request_context() else None
+    if stats is None:
+        return None
+    return time.perf_counter() - stats['start'], stats['db_time'], stats['sql_count']
+
+
+def _finish_request(response):
+    stats = g.get('_request_stats')
+    if stats is None:
+        return response
+    response.headers[REQUEST_ID_HEADER] = g.request_id
+
+    sample_rate = g.get('_request_log_sample_rate', 1.0)
+    if sample_rate is None:  # REQUEST_LOG_ENABLED is off
+        return response
+    # Server errors are always logged regardless of sampling.
+    if response.status_code < 500 and sample_rate < 1.0 and random.random() >= sample_rate:
+        return response
+
+    duration = time.perf_counter() - stats['start']
+    # The id Flask-Login keeps in the session: current_user would reload a user the commit expired.
+    user_id = session.get('_user_id')
+    request_logger.info('%s', JsonLine({
+        'type': 'request',
+        'request_id': g.request_id,
+        'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 2),
+        'db_time_ms': round(stats['db_time'] * 1000, 2),
+        'sql_count': stats['sql_count'],
+        'response_bytes': response.calculate_content_length(),
+        'user_id': int(user_id) if user_id is not None else None,
+        'remote_addr': request.remote_addr,
+    }))
+    return response
+
+
+def init_app(app):
+    """Register the request tracking hooks on a Flask app.
+
+    Request IDs and SQL statistics are always tracked (other instrumentation
+    reads them); the JSON line is only written when REQUEST_LOG_ENABLED is set.
+    """
+    enabled = app.config.get('REQUEST_LOG_ENABLED', True)
+    sample_rate = float(app.config.get('REQUEST_LOG_SAMPLE_RATE', 1.0))
+
+    _install_sql_listeners()
+
+    @app.before_request
+    def start_request_log():
+        _start_request()
+        g._request_log_sample_rate = sample_rate if enabled else None
+
+    app.after_request(_finish_request)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Full-text search over entry notes (SQLite FTS5).
+
+mood_entry_fts is an external-content FTS5 index: it stores only the
+tokens and reads note text back from mood_entry (through the
+mood_entry_fts_content view) when it builds a snippet. Triggers on
+mood_entry keep it in step with every write path: the forms, the batch
+API, shard moves and deletes.
+
+Besides the note, every row indexes an owner token ('u<user id>'). A
+search matches that token as well as the user's terms, so FTS5 only ranks
+the user's own entries, not everybody's that contain a common word.
+
+Results come best first by bm25 rank, then by entry id. Pages are keyset
+paginated: the cursor holds the last (rank, id) returned and the next page
+starts after it. Ranks depend on the whole index, so an entry written
+between two page requests can shift results across the page boundary.
+
+The index is created with the tables (and filled from existing entries the
+first time). Other databases have no FTS5; search then reports itself
+unavailable. To rebuild the index from mood_entry, check it or merge its
+segments:
+
+Usage: python search.py [--rebuild] [--check] [--optimize]
+"""
+
+import argparse
+import base64
+import binascii
+import html
+import json
+import re
+import sys
+
+from sqlalchemy import and_, column, func, literal_column, or_, select, table, text
+
+import sharding
+from models import db, MoodEntry
+
+INDEX = 'mood_entry_fts'
+SNIPPET_TOKENS = 12
+# Marks the matched terms in snippets; swapped for <mark> after HTML-escaping the note.
+_OPEN, _CLOSE = '\x02', '\x03'
+
+_DDL = [
+    f"CREATE VIEW IF NOT EXISTS {INDEX}_content AS "
+    f"SELECT id, notes, 'u' || user_id AS owner FROM mood_entry",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX} USING fts5("
+    f"notes, owner, content='{INDEX}_content', content_rowid='id', tokenize='porter unicode61')",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_insert AFTER INSERT ON mood_entry BEGIN "
+    f"INSERT INTO {INDEX}(rowid, notes, owner) VALUES (NEW.id, NEW.notes, 'u' || NEW.user_id); END",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_delete AFTER DELETE ON mood_entry BEGIN "
+    f"INSERT INTO {INDEX}({INDEX}, rowid, notes, owner) VALUES ('delete', OLD.id, OLD.notes, 'u' || OLD.user_id); END",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_update AFTER UPDATE OF notes, user_id ON mood_entry BEGIN "
+    f"INSERT INTO {INDEX}({INDEX}, rowid, notes, owner) VALUES ('delete', OLD.id, OLD.notes, 'u' || OLD.user_id); "
+    f"INSERT INTO {INDEX}(rowid, notes, owner) VALUES (NEW.id, NEW.notes, 'u' || NEW.user_id); END",
+]
+
+_fts = table(INDEX, column('rowid'))
+_index = literal_column(INDEX)
+
+
+class InvalidCursor(ValueError):
+    """A ?cursor= that this module didn't produce."""
+
+
+def is_available(engine):
+    return engine.dialect.name == 'sqlite'
+
+
+def engines(app):
+    """The engines holding mood_entry: every shard, or the main database."""
+    if sharding.is_sharded(app):
+        return [db.engines[sharding.bind_key(shard)] for shard in range(sharding.shard_count(app))]
+    return [db.engines[None]]
+
+
+def install(engine):
+    """
+    Create the index, its content view and triggers on one database if
+    missing, filling a new index from existing entries. Returns whether the
+    index was created.
+    """
+    if not is_available(engine):
+        return False
+    with engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': INDEX}).first()
+        for statement in _DDL:
+            conn.execute(text(statement))
+        if not exists:
+            _command(conn, 'rebuild')
+    return not exists
+
+
+def _command(conn, command):
+    conn.execute(text(f"INSERT INTO {INDEX}({INDEX}) VALUES (:command)"), {'command': command})
+
+
+def run_command(engine, command):
+    """Run an FTS5 maintenance command ('rebuild', 'optimize', 'integrity-check')."""
+    with engine.begin() as conn:
+        _command(conn, command)
+
+
+def fts_query(terms):
+    """
+    Turn what the user typed into an FTS5 query over the notes column, or
+    None if it has nothing to search for. Words must all appear ("new job"
+    finds notes with both), "quoted words" must appear together, and a
+    trailing * matches any word starting with what comes before it. Other
+    FTS5 syntax is searched for literally rather than raising an error.
+    """
+    phrases = []
+    for quoted, word in re.findall(r'"([^"]*)"|(\S+)', terms):
+        phrase = quoted if quoted else word
+        prefix = phrase.endswith('*')
+        phrase = phrase.rstrip('*').strip()
+        if not re.search(r'\w', phrase):
+            continue
+        phrases.append('notes : "%s"%s' % (phrase.replace('"', '""'), ' *' if prefix else ''))
+    return ' AND '.join(phrases) or None
+
+
+def encode_cursor(rank, entry_id):
+    return base64.urlsafe_b64encode(json.dumps([rank, entry_id]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        rank, entry_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if isinstance(rank, (int, float)) and isinstance(entry_id, int) and not isinstance(entry_id, bool):
+            return float(rank), entry_id
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        pass
+    raise InvalidCursor(cursor)
+
+
+def _snippet_html(snippet):
+    return html.escape(snippet or '').replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def search(user_id, match, start=None, end=None, cursor=None, limit=20):
+    """
+    One page of the user's entries whose notes match `match` (an fts_query()),
+    optionally between the dates `start` and `end` (inclusive), after the
+    page that returned `cursor`. Returns {'results': [{'id', 'date',
+    'snippet', 'rank'}], 'next_cursor'}; next_cursor is None on the last page.
+    Snippets are HTML with the matched terms in <mark>.
+    """
+    # Weight 0 for the owner column: it only restricts the match, it mustn't score.
+    rank = func.bm25(_index, 1.0, 0.0)
+    query = (
+        select(MoodEntry.id, MoodEntry.entry_date,
+               func.snippet(_index, 0, _OPEN, _CLOSE, '…', SNIPPET_TOKENS).label('snippet'), rank.label('rank'))
+        .select_from(_fts.join(MoodEntry.__table__, MoodEntry.id == _fts.c.rowid))
+        .where(_index.op('MATCH')(f'owner : "u{int(user_id)}" AND ({match})'), MoodEntry.user_id == user_id)
+    )
+    if start is not None:
+        query = query.where(MoodEntry.entry_date >= start)
+    if end is not None:
+        query = query.where(MoodEntry.entry_date <= end)
+    if cursor is not None:
+        after_rank, after_id = decode_cursor(cursor)
+        query = query.where(or_(rank > after_rank, and_(rank == after_rank, MoodEntry.id > after_id)))
+    rows = db.session.execute(query.order_by(rank, MoodEntry.id).limit(limit + 1)).all()
+    page = rows[:limit]
+    return {
+        'results': [{'id': row.id, 'date': row.entry_date.isoformat(), 'snippet': _snippet_html(row.snippet),
+                     'rank': row.rank} for row in page],
+        'next_cursor': encode_cursor(page[-1].rank, page[-1].id) if len(rows) > limit else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the full-text index over entry notes")
+    parser.add_argument('--rebuild', action='store_true', help="Recreate the index from mood_entry")
+    parser.add_argument('--check', action='store_true', help="Check the index matches mood_entry")
+    parser.add_argument('--optimize', action='store_true', help="Merge the index into one segment")
+    args = parser.parse_args()
+    if not (args.rebuild or args.check or args.optimize):
+        parser.error("nothing to do: pass --rebuild, --check and/or --optimize")
+
+    from app import create_app
+
+    app = create_app()
+    failed = 0
+    with app.app_context():
+        for number, engine in enumerate(engines(app)):
+            name = f"Shard {number}" if sharding.is_sharded(app) else "Database"
+            if not is_available(engine):
+                print(f"{name}: full-text search needs SQLite")
+                return 1
+            install(engine)
+            if args.rebuild:
+                run_command(engine, 'rebuild')
+                print(f"{name}: index rebuilt")
+            if args.optimize:
+                run_command(engine, 'optimize')
+                print(f"{name}: index optimized")
+            if args.check:
+                try:
+                    # rank=1 also compares the index with the note text in mood_entry.
+                    with engine.begin() as conn:
+                        conn.execute(text(f"INSERT INTO {INDEX}({INDEX}, rank) VALUES ('integrity-check', 1)"))
+                    print(f"{name}: index OK")
+                except Exception as e:
+                    failed += 1
+                    print(f"{name}: index does not match the entries ({e}); run with --rebuild")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
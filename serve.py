@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Run Mood Tracker with several worker processes and threads.
+The app is built once in the parent process (like gunicorn --preload), then
+the listening socket is shared with forked workers, each serving requests
+from a fixed-size thread pool. Workers that die are restarted. Platforms
+without fork() (Windows) run a single threaded worker.
+
+Usage: python serve.py [--host 127.0.0.1] [--port 5000] [--workers 2] [--threads 8]
+"""
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+from app import create_app
+
+logger = logging.getLogger('mood_tracker.serve')
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server that handles connections on a bounded thread pool."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads=8, **kwargs):
+        super().__init__(host, port, app, **kwargs)
+        self.threads = threads
+        # Created on first use so a forked worker never inherits the parent's threads.
+        self.executor = None
+
+    def process_request(self, request, client_address):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='request')
+        self.executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        super().server_close()
+
+
+def _run_worker(server):
+    """Serve until SIGTERM, then finish in-flight requests and exit the process."""
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent coordinates Ctrl+C.
+    logger.info("Worker %s serving", os.getpid())
+    server.timeout = 0.5
+    try:
+        while not stopping.is_set():
+            server.handle_request()
+    finally:
+        server.server_close()
+    sys.exit(0)
+
+
+def _spawn(server):
+    pid = os.fork()
+    if pid == 0:
+        _run_worker(server)
+    return pid
+
+
+def serve(host='127.0.0.1', port=5000, workers=2, threads=8, config=None):
+    """Build the app once, then serve it from `workers` processes with `threads` threads each."""
+    app = create_app(config)
+    server = PooledWSGIServer(host, port, app, threads=threads)
+    logger.info("Listening on http://%s:%s with %s worker(s) x %s thread(s)",
+                host, server.server_port, workers, threads)
+
+    if workers <= 1 or not hasattr(os, 'fork'):
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    children = {_spawn(server) for _ in range(workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            logger.warning("Worker %s exited with status %s; starting a replacement", pid, status)
+            children.add(_spawn(server))
+    server.socket.close()
+    logger.info("All workers stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=2, help="Worker processes (needs fork)")
+    parser.add_argument('--threads', type=int, default=8, help="Request threads per worker")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.threads)
+
+
+if __name__ == '__main__':
+    main()
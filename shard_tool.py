@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Shard management for Mood Tracker (SHARD_COUNT > 1, see sharding.py).
+
+  python shard_tool.py status                 users and entries per shard
+  python shard_tool.py move USER_ID SHARD     move one user while the app runs
+  python shard_tool.py rebalance [--dry-run]  move users until entry counts are even
+
+Moves change the user's entry ids, so their sync clients do a full resync.
+Re-running an interrupted move finishes it.
+"""
+
+import argparse
+import sys
+
+from sqlalchemy import func, select
+
+import sharding
+from models import db, MoodEntry, UserShard
+
+
+def shard_loads():
+    """{shard: {user_id: entry count}} for every user with data."""
+    loads = {}
+    for shard in sharding.shards():
+        with sharding.use_shard(shard):
+            rows = db.session.execute(
+                select(MoodEntry.user_id, func.count()).group_by(MoodEntry.user_id)).all()
+        loads[shard] = dict(rows)
+    return loads
+
+
+def plan_rebalance(loads, tolerance=0.1):
+    """
+    Greedy plan of (user_id, from_shard, to_shard) moves: repeatedly move the
+    largest user that fits from the fullest shard to the emptiest one, until
+    every shard is within tolerance of the mean.
+    """
+    totals = {shard: sum(users.values()) for shard, users in loads.items()}
+    users = {shard: dict(counts) for shard, counts in loads.items()}
+    target = sum(totals.values()) / len(totals)
+    moves = []
+    while True:
+        fullest = max(totals, key=totals.get)
+        emptiest = min(totals, key=totals.get)
+        gap = totals[fullest] - totals[emptiest]
+        if totals[fullest] <= target * (1 + tolerance) or gap <= 1:
+            return moves
+        # Largest user whose move narrows the gap.
+        candidates = [(count, user_id) for user_id, count in users[fullest].items() if count < gap]
+        if not candidates:
+            return moves
+        count, user_id = max(candidates)
+        moves.append((user_id, fullest, emptiest))
+        del users[fullest][user_id]
+        users[emptiest][user_id] = count
+        totals[fullest] -= count
+        totals[emptiest] += count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and rebalance Mood Tracker shards")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status')
+    move = commands.add_parser('move')
+    move.add_argument('user_id', type=int)
+    move.add_argument('shard', type=int)
+    rebalance = commands.add_parser('rebalance')
+    rebalance.add_argument('--dry-run', action='store_true')
+    rebalance.add_argument('--tolerance', type=float, default=0.1,
+                           help="Allowed excess over the mean entries per shard")
+    args = parser.parse_args()
+
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        if not sharding.is_sharded():
+            print("Sharding is off (SHARD_COUNT = 1).")
+            return 1
+
+        if args.command == 'status':
+            loads = shard_loads()
+            directory = dict(db.session.execute(
+                select(UserShard.shard, func.count()).group_by(UserShard.shard)).all())
+            print(f"{'shard':>5} {'users':>7} {'entries':>9}")
+            for shard, users in loads.items():
+                print(f"{shard:>5} {directory.get(shard, 0):>7} {sum(users.values()):>9}")
+            return 0
+
+        if args.command == 'move':
+            entries, medications, links = sharding.move_user(args.user_id, args.shard)
+            print(f"Moved user {args.user_id} to shard {args.shard}: {entries} entries, "
+                  f"{medications} medications, {links} medication links.")
+            return 0
+
+        moves = plan_rebalance(shard_loads(), args.tolerance)
+        if not moves:
+            print("Shards are balanced.")
+        for user_id, source, target in moves:
+            print(f"{'Would move' if args.dry_run else 'Moving'} user {user_id}: shard {source} -> {target}")
+            if not args.dry_run:
+                sharding.move_user(user_id, target)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
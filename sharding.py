@@ -0,0 +1,273 @@
+"""
+Sharding of user data across several SQLite files.
+
+With SHARD_COUNT > 1 the main database (SQLALCHEMY_DATABASE_URI) becomes a
+small directory holding the user table and the user -> shard map, and each
+user's entries, medications, change log and idempotency keys live in one of
+SHARD_COUNT shard files (SHARD_URI_TEMPLATE). SQLite allows one writer per
+file, so users on different shards no longer queue behind each other.
+
+Routing is done by RoutingSession, so routes keep using db.session and the
+models as before: statements on sharded tables go to the shard selected for
+the current app context. Requests select it when Flask-Login loads the
+user (bind_user); scripts call bind_user() or use_shard() themselves.
+
+With SHARD_COUNT = 1 (the default) there is a single database and nothing
+here changes how it is used.
+
+move_user() moves a user to another shard while the app is running; see
+shard_tool.py.
+"""
+
+from contextlib import contextmanager
+
+from flask import current_app, g
+from flask_sqlalchemy.session import Session
+from sqlalchemy import delete, insert, inspect, select, text
+from sqlalchemy.sql import util as sql_util
+
+SHARDED_TABLES = frozenset([
+    'medication', 'mood_entry', 'mood_entry_medication', 'change_log', 'sync_state',
+    'idempotency_key', 'moved_user', 'entry_year_blob', 'entry_stats', 'entry_score', 'entry_archive', 'entry_rollup',
+])
+# Tables whose rows belong to one user (have a user_id column).
+_USER_TABLES = [
+    'medication', 'mood_entry', 'change_log', 'sync_state', 'idempotency_key', 'entry_year_blob', 'entry_stats',
+    'entry_score', 'entry_archive', 'entry_rollup',
+]
+MOVED_MESSAGE = 'user moved to another shard'
+
+
+class NoShardSelected(Exception):
+    """A sharded table was used before bind_user()/use_shard()."""
+
+
+def shard_count(app=None):
+    return (app or current_app).config['SHARD_COUNT']
+
+
+def is_sharded(app=None):
+    return shard_count(app) > 1
+
+
+def bind_key(shard):
+    return f'shard{shard}'
+
+
+def configure(app):
+    """Add a Flask-SQLAlchemy bind per shard. Call before db.init_app()."""
+    if not is_sharded(app):
+        return
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for shard in range(shard_count(app)):
+        binds.setdefault(bind_key(shard), app.config['SHARD_URI_TEMPLATE'].format(shard=shard))
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def _touches_sharded_table(mapper, clause):
+    if mapper is not None:
+        return mapper.local_table.name in SHARDED_TABLES
+    if clause is None:
+        return False
+    tables = sql_util.find_tables(clause, include_crud=True)
+    return any(getattr(table, 'name', None) in SHARDED_TABLES for table in tables)
+
+
+class RoutingSession(Session):
+    """Sends statements on sharded tables to the current shard's engine."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and is_sharded() and _touches_sharded_table(
+                None if mapper is None else inspect(mapper), clause):
+            shard = g.get('shard')
+            if shard is None:
+                raise NoShardSelected("call sharding.bind_user() before using user data")
+            return self._db.engines[bind_key(shard)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _db():
+    # models imports this module for RoutingSession, so it is imported late.
+    from models import db
+    return db
+
+
+def shard_for(user_id):
+    """The shard holding a user's data (from the directory)."""
+    from models import UserShard
+
+    shard = _db().session.execute(select(UserShard.shard).where(UserShard.user_id == user_id)).scalar()
+    # Users without a directory row predate it; they sit where a new user with that id would.
+    return shard if shard is not None else user_id % shard_count()
+
+
+def bind_user(user_id):
+    """Route this app context's user data to the user's shard."""
+    if is_sharded():
+        g.shard = shard_for(user_id)
+
+
+@contextmanager
+def use_shard(shard):
+    """Route user data to a specific shard inside the block (maintenance scripts)."""
+    previous = g.get('shard')
+    g.shard = shard
+    try:
+        yield
+    finally:
+        g.shard = previous
+
+
+def shards():
+    """Shard numbers; [None] when not sharded, so loops over shards work either way."""
+    return list(range(shard_count())) if is_sharded() else [None]
+
+
+def assign_shard(user_id):
+    """Record the shard of a new user. The caller commits."""
+    if not is_sharded():
+        return None
+    from models import UserShard
+
+    shard = user_id % shard_count()
+    _db().session.add(UserShard(user_id=user_id, shard=shard))
+    return shard
+
+
+def _shard_tables():
+    metadata = _db().metadata
+    return [metadata.tables[name] for name in sorted(SHARDED_TABLES)]
+
+
+def create_all(app):
+    """Create the directory tables and every shard's tables (and their guard triggers)."""
+    db = _db()
+    directory = [table for table in db.metadata.sorted_tables if table.name not in SHARDED_TABLES]
+    db.metadata.create_all(db.engines[None], tables=directory)
+    for shard in range(shard_count(app)):
+        engine = db.engines[bind_key(shard)]
+        db.metadata.create_all(engine, tables=_shard_tables())
+        with engine.begin() as conn:
+            for table in _USER_TABLES:
+                for action in ('INSERT', 'UPDATE'):
+                    # Rejects writes that were routed here before the user moved away.
+                    conn.execute(text(
+                        f"CREATE TRIGGER IF NOT EXISTS {table}_moved_{action.lower()} BEFORE {action} ON {table} "
+                        f"WHEN EXISTS (SELECT 1 FROM moved_user WHERE user_id = NEW.user_id) "
+                        f"BEGIN SELECT RAISE(ABORT, '{MOVED_MESSAGE}'); END"))
+
+
+def user_moved(error):
+    """True if a database error came from writing to a shard the user has left."""
+    return MOVED_MESSAGE in str(getattr(error, 'orig', error))
+
+
+def _copy_user(src, dst, user_id):
+    """Copy a user's rows from one shard connection to another with fresh ids."""
+    import archive
+    from models import (ChangeLog, EntryArchive, EntryRollup, EntryScore, EntryStats, EntryYearBlob, Medication,
+                        MoodEntry, MoodEntryMedication, SyncState)
+
+    # Leftovers from an interrupted earlier move to this shard.
+    _purge_user(dst, user_id)
+    dst.execute(text("DELETE FROM moved_user WHERE user_id = :user_id"), {'user_id': user_id})
+
+    medication_ids = {}
+    for row in src.execute(select(Medication).where(Medication.user_id == user_id)).mappings():
+        values = dict(row)
+        old_id = values.pop('id')
+        medication_ids[old_id] = dst.execute(insert(Medication).values(values).returning(Medication.id)).scalar()
+
+    entry_ids = {}
+    for row in src.execute(select(MoodEntry).where(MoodEntry.user_id == user_id)).mappings():
+        values = dict(row)
+        old_id = values.pop('id')
+        entry_ids[old_id] = dst.execute(insert(MoodEntry).values(values).returning(MoodEntry.id)).scalar()
+
+    links = [
+        {'mood_entry_id': entry_ids[row.mood_entry_id], 'medication_id': medication_ids.get(row.medication_id),
+         'taken': row.taken}
+        for row in src.execute(
+            select(MoodEntryMedication).where(MoodEntryMedication.mood_entry_id.in_(list(entry_ids))))
+    ]
+    links = [link for link in links if link['medication_id'] is not None]
+    if links:
+        dst.execute(insert(MoodEntryMedication), links)
+
+    # Year blobs hold no ids and are copied as they are.
+    blobs = [dict(row) for row in src.execute(select(EntryYearBlob).where(EntryYearBlob.user_id == user_id)).mappings()]
+    if blobs:
+        dst.execute(insert(EntryYearBlob), blobs)
+    # Archived entry ids would clash with this shard's; they get new ones if restored.
+    archives = [dict(row, details=archive.moved_details(row['details'], medication_ids)) for row in src.execute(
+        select(EntryArchive).where(EntryArchive.user_id == user_id)).mappings()]
+    if archives:
+        dst.execute(insert(EntryArchive), archives)
+    rollups = [dict(row) for row in src.execute(select(EntryRollup).where(EntryRollup.user_id == user_id)).mappings()]
+    if rollups:
+        dst.execute(insert(EntryRollup), rollups)
+    stats = [dict(row) for row in src.execute(select(EntryStats).where(EntryStats.user_id == user_id)).mappings()]
+    if stats:
+        dst.execute(insert(EntryStats), stats)
+    scores = [dict(row, entry_id=entry_ids[row['entry_id']]) for row in src.execute(
+        select(EntryScore).where(EntryScore.user_id == user_id)).mappings() if row['entry_id'] in entry_ids]
+    if scores:
+        dst.execute(insert(EntryScore), scores)
+
+    # Ids changed, so every existing cursor must be refused: start a new version past them all.
+    version = (src.execute(select(SyncState.version).where(SyncState.user_id == user_id)).scalar() or 0) + 1
+    dst.execute(insert(SyncState).values(user_id=user_id, version=version, pruned_through=version))
+    dst.execute(delete(ChangeLog).where(ChangeLog.user_id == user_id))
+    return len(entry_ids), len(medication_ids), len(links)
+
+
+def _purge_user(conn, user_id):
+    from models import (ChangeLog, EntryArchive, EntryRollup, EntryScore, EntryStats, EntryYearBlob, IdempotencyKey,
+                        Medication, MoodEntry, MoodEntryMedication, SyncState)
+
+    entry_ids = select(MoodEntry.id).where(MoodEntry.user_id == user_id)
+    conn.execute(delete(MoodEntryMedication).where(MoodEntryMedication.mood_entry_id.in_(entry_ids)))
+    # entry_score references mood_entry, so it goes first.
+    for model in (EntryScore, MoodEntry, Medication, ChangeLog, SyncState, IdempotencyKey, EntryYearBlob, EntryStats,
+                  EntryArchive, EntryRollup):
+        conn.execute(delete(model).where(model.user_id == user_id))
+
+
+def move_user(user_id, target):
+    """
+    Move a user's data to another shard while the app keeps serving.
+    The source shard is write-locked (BEGIN IMMEDIATE) for the copy, so no
+    write can slip in unseen; reads carry on. After the directory points at
+    the target, the source rows are deleted and a moved_user marker is left
+    whose triggers reject writes from requests that still had the old shard.
+    Entry and medication ids change; the user's sync clients get a full
+    resync. Returns (entries, medications, links) copied.
+    """
+    from models import UserShard
+
+    db = _db()
+    source = shard_for(user_id)
+    if not 0 <= target < shard_count():
+        raise ValueError(f"shard {target} does not exist")
+    if source == target:
+        return 0, 0, 0
+    src_engine = db.engines[bind_key(source)]
+    dst_engine = db.engines[bind_key(target)]
+
+    with src_engine.connect() as src:
+        src.exec_driver_sql('BEGIN IMMEDIATE')
+        try:
+            with dst_engine.begin() as dst:
+                copied = _copy_user(src, dst, user_id)
+            directory = db.engines[None]
+            with directory.begin() as conn:
+                conn.execute(delete(UserShard).where(UserShard.user_id == user_id))
+                conn.execute(insert(UserShard).values(user_id=user_id, shard=target))
+            _purge_user(src, user_id)
+            src.execute(text("INSERT OR IGNORE INTO moved_user (user_id) VALUES (:user_id)"), {'user_id': user_id})
+            src.exec_driver_sql('COMMIT')
+        except Exception:
+            src.exec_driver_sql('ROLLBACK')
+            raise
+    return copied
+
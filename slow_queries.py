@@ -0,0 +1,169 @@
+"""
+Slow query recorder for Mood Tracker.
+
+When enabled, SQLAlchemy cursor events time every statement. Statements slower
+than SLOW_QUERY_THRESHOLD_MS are aggregated by their normalized text (literals
+and parameter lists collapsed), the query plan is captured once per distinct
+statement, and the most recent occurrences are kept with parameters redacted.
+When disabled no listeners are installed at all.
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('mood_tracker.slow_queries')
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+_lock = threading.Lock()
+_settings = {'threshold': 0.1, 'capture_plans': True}
+_stats = {}
+_recent = deque(maxlen=100)
+
+
+def normalize_statement(statement):
+    """Collapse literals, placeholder lists and whitespace so equal queries group together."""
+    normalized = _STRING_LITERAL.sub('?', statement)
+    normalized = _NUMBER_LITERAL.sub('?', normalized)
+    normalized = _PLACEHOLDER_LIST.sub('(?)', normalized)
+    return _WHITESPACE.sub(' ', normalized).strip()
+
+
+def redact_parameters(parameters):
+    """Replace parameter values with their type so no user data is retained."""
+    if parameters is None:
+        return None
+    if isinstance(parameters, dict):
+        return {key: f"<{type(value).__name__}>" for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            return [f"<{len(parameters)} rows>"]
+        return [f"<{type(value).__name__}>" for value in parameters]
+    return f"<{type(parameters).__name__}>"
+
+
+def _explain(conn, statement, parameters):
+    """Run the dialect's plan command for a statement on the same connection."""
+    if conn.dialect.name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif conn.dialect.name in ('postgresql', 'mysql'):
+        prefix = 'EXPLAIN '
+    else:
+        return None
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters or ())
+        return [' | '.join(str(col) for col in row) for row in cursor.fetchall()]
+    except Exception as e:
+        return [f"plan unavailable: {e}"]
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('slow_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get('slow_query_start')
+    if not start_times:
+        return
+    elapsed = time.perf_counter() - start_times.pop()
+    if elapsed < _settings['threshold']:
+        return
+
+    normalized = normalize_statement(statement)
+    now = datetime.now().isoformat(timespec='seconds')
+    with _lock:
+        entry = _stats.get(normalized)
+        if entry is None:
+            entry = _stats[normalized] = {
+                'statement': normalized, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'first_seen': now, 'last_seen': now, 'plan': None
+            }
+        entry['count'] += 1
+        entry['total_ms'] += elapsed * 1000
+        entry['max_ms'] = max(entry['max_ms'], elapsed * 1000)
+        entry['last_seen'] = now
+        needs_plan = _settings['capture_plans'] and entry['plan'] is None and not executemany
+        if needs_plan:
+            entry['plan'] = []  # Claimed; filled in below outside the lock.
+        _recent.append({
+            'time': now,
+            'duration_ms': round(elapsed * 1000, 2),
+            'statement': normalized,  # Inline literals can be user data, like the parameters
+            'parameters': redact_parameters(parameters),
+            'request_id': g.get('request_id') if has_request_context() else None,
+        })
+
+    if needs_plan:
+        plan = _explain(conn, statement, parameters)
+        if plan is None:
+            plan = [f"plans are not captured for {conn.dialect.name}"]
+        entry['plan'] = plan or ['(no plan rows)']
+    logger.warning("Slow query (%.1fms): %s", elapsed * 1000, normalized)
+
+
+def summary(sort='total_ms', limit=50):
+    """Aggregated slow statements, slowest first."""
+    with _lock:
+        rows = [dict(entry, mean_ms=entry['total_ms'] / entry['count']) for entry in _stats.values()]
+    for row in rows:
+        for key in ('total_ms', 'max_ms', 'mean_ms'):
+            row[key] = round(row[key], 2)
+    rows.sort(key=lambda row: row.get(sort, row['total_ms']), reverse=True)
+    return rows[:limit]
+
+
+def recent(limit=50):
+    """Most recent slow statement occurrences, newest first."""
+    with _lock:
+        return list(_recent)[::-1][:limit]
+
+
+def export():
+    """Everything recorded so far, for the JSON export."""
+    return {
+        'threshold_ms': _settings['threshold'] * 1000,
+        'exported_at': datetime.now().isoformat(timespec='seconds'),
+        'statements': summary(limit=None),
+        'recent': recent(limit=None),
+    }
+
+
+def reset():
+    """Forget all recorded slow statements."""
+    with _lock:
+        _stats.clear()
+        _recent.clear()
+
+
+def is_enabled():
+    return event.contains(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def init_app(app):
+    """Install the slow query listeners if SLOW_QUERY_ENABLED is set."""
+    global _recent
+    if not app.config.get('SLOW_QUERY_ENABLED', True):
+        return
+    _settings.update(
+        threshold=float(app.config.get('SLOW_QUERY_THRESHOLD_MS', 100)) / 1000,
+        capture_plans=bool(app.config.get('SLOW_QUERY_CAPTURE_PLANS', True)),
+    )
+    with _lock:
+        _recent = deque(_recent, maxlen=int(app.config.get('SLOW_QUERY_RECENT_SIZE', 100)))
+    if not is_enabled():
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
@@ -0,0 +1,100 @@
+"""
+Delta sync for clients that mirror a user's data.
+
+A client starts with snapshot(), which returns everything plus a cursor,
+then calls changes_since(cursor) to get only what changed: the current state
+of each entry or medication written since, and the ids of deleted entries.
+Snapshots include archived entries (archive.py); archiving doesn't change
+anything a client holds, so it never shows up in changes_since().
+A cursor older than the compacted part of the change log raises
+CursorExpired; the client then takes a fresh snapshot.
+"""
+
+from types import SimpleNamespace
+
+from sqlalchemy import select
+
+import archive
+import changelog
+from entry_store import entry_to_json
+from models import db, Medication, MoodEntry, MoodEntryMedication
+
+
+class CursorExpired(Exception):
+    """The change log no longer covers everything after this cursor."""
+
+
+def medication_to_json(medication):
+    return {'id': medication.id, 'name': medication.name, 'active': bool(medication.active)}
+
+
+def _entries_json(query):
+    entries = query.order_by(MoodEntry.entry_date).all()
+    taken = {}
+    if entries:
+        links = db.session.execute(
+            select(MoodEntryMedication.mood_entry_id, MoodEntryMedication.medication_id).where(
+                MoodEntryMedication.mood_entry_id.in_([entry.id for entry in entries]),
+                MoodEntryMedication.taken.is_(True))
+        ).all()
+        for entry_id, medication_id in links:
+            taken.setdefault(entry_id, []).append(medication_id)
+    return [entry_to_json(entry, taken.get(entry.id, [])) for entry in entries]
+
+
+def _archived_json(user_id):
+    return [entry_to_json(SimpleNamespace(**row), [medication for medication, taken in links if taken])
+            for row, links in archive.entries(user_id)]
+
+
+def snapshot(user_id):
+    """All of a user's entries and medications, with the cursor to sync from next."""
+    # Read the version first: anything written meanwhile is at most sent twice, never missed.
+    version, _ = changelog.sync_state(user_id)
+    return {
+        'cursor': version,
+        'entries': _archived_json(user_id) + _entries_json(MoodEntry.query.filter_by(user_id=user_id)),
+        'medications': [medication_to_json(m) for m in
+                        Medication.query.filter_by(user_id=user_id).order_by(Medication.id).all()],
+    }
+
+
+def changes_since(user_id, cursor, limit):
+    """
+    One page of changes after `cursor`: objects written since (current state)
+    and deleted entry ids, plus the cursor for the next call and whether more
+    pages remain. Raises CursorExpired if the client must resync.
+    """
+    version, pruned_through = changelog.sync_state(user_id)
+    if cursor < pruned_through or cursor > version:
+        raise CursorExpired(cursor)
+    rows, more = changelog.changes_after(user_id, cursor, limit)
+
+    latest = {}
+    for row in rows:  # Oldest first, so the last change to an object wins.
+        latest[(row.kind, row.object_id)] = row.op
+    upserted = {changelog.ENTRY: [], changelog.MEDICATION: []}
+    deleted = {changelog.ENTRY: [], changelog.MEDICATION: []}
+    for (kind, object_id), op in latest.items():
+        (upserted if op == changelog.UPSERT else deleted)[kind].append(object_id)
+
+    entries = []
+    if upserted[changelog.ENTRY]:
+        # Objects deleted after this page are skipped here; their tombstone comes later.
+        entries = _entries_json(MoodEntry.query.filter(
+            MoodEntry.user_id == user_id, MoodEntry.id.in_(upserted[changelog.ENTRY])))
+    medications = []
+    if upserted[changelog.MEDICATION]:
+        medications = [medication_to_json(m) for m in Medication.query.filter(
+            Medication.user_id == user_id, Medication.id.in_(upserted[changelog.MEDICATION])
+        ).order_by(Medication.id).all()]
+
+    last_seen = rows[-1].version if rows else cursor
+    return {
+        'cursor': last_seen if more else max(version, last_seen),
+        'more': more,
+        'entries': entries,
+        'deleted_entries': sorted(deleted[changelog.ENTRY]),
+        'medications': medications,
+        'deleted_medications': sorted(deleted[changelog.MEDICATION]),
+    }
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Tests for the admin dashboard: the snapshot's aggregate numbers, periodic
+jobs queued once per interval, and pages that only read the stored
+snapshot.
+"""
+
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event, insert
+
+import admin_stats
+import jobs
+import sharding
+from models import db, EntryYearBlob, Job, MoodEntry, User
+
+TODAY = date.today()
+
+
+@pytest.fixture
+def app_config(app_config):
+    # ARCHIVE_INTERVAL 0: the only periodic job here is the snapshot.
+    return dict(app_config, ADMIN_USERNAMES=['root'], ADMIN_STATS_DAYS=10, ARCHIVE_INTERVAL=0)
+
+
+def add_entries(app, username, days_ago):
+    with app.app_context():
+        user_id = db.session.execute(db.select(User.id).where(User.username == username)).scalar()
+        sharding.bind_user(user_id)
+        db.session.execute(insert(MoodEntry), [
+            {'user_id': user_id, 'entry_date': TODAY - timedelta(days=ago), 'mood_level': 5, 'hours_slept': 7.0,
+             'anxiety': 3, 'energy_level': 5, 'irritability': 2} for ago in days_ago])
+        db.session.commit()
+        return user_id
+
+
+def test_snapshot_numbers(make_app, register):
+    app = make_app()
+    for name in ('ann', 'bob', 'cat'):
+        register(app, name)
+    ann = add_entries(app, 'ann', [0, 1, 2, 30, 400])
+    add_entries(app, 'bob', [5, 9])
+    add_entries(app, 'cat', [20])
+    with app.app_context():
+        db.session.execute(insert(EntryYearBlob).values(user_id=ann, year=2000, data=b'x' * 100))
+        db.session.commit()
+        stats = admin_stats.collect()
+
+    assert stats['users'] == {'total': 3, 'signups': 3, 'active_today': 1, 'active_week': 2, 'active_period': 2}
+    assert stats['entries'] == {'total': 8, 'recent': 5}
+    per_day = {day['date']: (day['entries'], day['users']) for day in stats['entries_per_day']}
+    assert len(per_day) == 10 and per_day[TODAY.isoformat()] == (1, 1)
+    assert per_day[(TODAY - timedelta(days=3)).isoformat()] == (0, 0)
+    assert stats['signups_per_day'][-1] == {'date': TODAY.isoformat(), 'signups': 3}
+    assert [(user['username'], user['entries']) for user in stats['heaviest_users']] == \
+        [('ann', 5), ('bob', 2), ('cat', 1)]
+    assert stats['heaviest_users'][0]['years'] == 1.1
+    assert stats['heaviest_users'][0]['packed_bytes'] == 100
+    [main] = stats['databases']
+    assert main['name'] == 'main' and main['bytes'] == main['page_size'] * main['page_count']
+    assert main['freelist_count'] >= 0
+    sizes = [table['bytes'] for table in main['tables']]
+    assert sizes and sizes == sorted(sizes, reverse=True)
+
+
+def test_pages_read_the_snapshot_jobs_take(make_app, register):
+    app = make_app()
+    register(app, 'ann')
+    root = register(app, 'root')
+    add_entries(app, 'ann', [0, 1])
+    assert register(app, 'ann').get('/admin/stats').status_code == 403
+    assert 'No snapshot yet' in root.get('/admin/stats').data.decode()
+    assert root.get('/admin/stats.json').status_code == 404
+
+    with app.app_context():
+        # Every worker asks; the interval's key means one job per interval.
+        first = jobs.enqueue_periodic({}, now=1000.0)
+        again = jobs.enqueue_periodic({}, now=1100.0)
+        db.session.commit()
+        assert [job.id for job in first] == [job.id for job in again]
+        assert jobs.enqueue_periodic({admin_stats.ADMIN_STATS_JOB: 3}, now=1100.0) == []
+        assert jobs.run_next('test')
+        assert not jobs.run_next('test')
+        later = jobs.enqueue_periodic({}, now=1300.0)
+        db.session.commit()
+        assert later[0].id != first[0].id
+        engine = db.engines[None]
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    page = root.get('/admin/stats').data.decode()
+    body = root.get('/admin/stats.json').get_json()
+    event.remove(engine, 'before_cursor_execute', record)
+    assert 'Longest Histories' in page and 'ann' in page
+    assert body['users']['total'] == 2 and body['entries']['total'] == 2
+    # The pages read the job table, never the entries.
+    assert statements and not any('mood_entry' in statement for statement in statements)
+
+    root.post('/admin/stats/refresh')
+    with app.app_context():
+        queued = db.session.execute(db.select(Job).where(Job.status == jobs.QUEUED)).scalars().all()
+        assert {job.priority for job in queued} == {jobs.PRIORITY_BACKGROUND, jobs.PRIORITY_INTERACTIVE}
+        app.config['ADMIN_STATS_INTERVAL'] = 0
+        assert jobs.enqueue_periodic({}, now=2000.0) == []
+
+
+def test_sharded_numbers_add_up(make_app, register, shard_config):
+    app = make_app(**shard_config)
+    for name in ('ann', 'bob', 'cat'):
+        register(app, name)
+    add_entries(app, 'ann', [0, 1, 2])
+    add_entries(app, 'bob', [0, 1])
+    add_entries(app, 'cat', [0])
+    with app.app_context():
+        stats = admin_stats.collect()
+    assert stats['users']['active_today'] == 3
+    assert stats['entries_per_day'][-1] == {'date': TODAY.isoformat(), 'entries': 3, 'users': 3}
+    assert [user['entries'] for user in stats['heaviest_users']] == [3, 2, 1]
+    assert {user['shard'] for user in stats['heaviest_users']} == {0, 1}
+    assert [database['name'] for database in stats['databases']] == ['main', 'shard 0', 'shard 1']
+
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Tests that create_app() is safe to preload before forking WSGI workers:
+every worker must open its own database connections and keep exactly one
+log pipeline.
+"""
+
+import logging
+import multiprocessing
+import os
+
+import pytest
+from sqlalchemy import event, text
+
+import logging_setup
+from app import create_app
+from models import db
+
+WORKERS = 3
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork()")
+
+
+def queue_handlers():
+    return [h for h in logging.getLogger().handlers if isinstance(h, logging_setup.BoundedQueueHandler)]
+
+
+def worker(app, config, results):
+    """Runs in a forked worker: use the preloaded app and report what it shares with the parent."""
+    report = {'pid': os.getpid()}
+    with app.app_context():
+        engine = db.engine
+        report['inherited_idle_connections'] = engine.pool.checkedin()
+        owners = []
+        event.listen(engine, 'checkout', lambda dbapi_conn, record, proxy: owners.append(record.info.get('pid')))
+
+        client = app.test_client()
+        for _ in range(3):
+            # A failed login still looks the user up in the database.
+            client.post('/login', data={'username': 'nobody', 'password': 'wrong'})
+        db.session.execute(text('SELECT 1'))
+        db.session.remove()
+        report['connection_owners'] = owners
+
+    # A second app in the same worker must reuse the worker's log pipeline.
+    create_app(config)
+    report['queue_handlers'] = len(queue_handlers())
+    report['app_logger_handlers'] = len(logging.getLogger('mood_tracker').handlers)
+    logging.getLogger('mood_tracker').info("factory-test marker from %s", os.getpid())
+    # multiprocessing skips atexit in the child, so flush the log writer here.
+    logging_setup.shutdown_logging()
+    results.put(report)
+
+
+def test_forked_workers_do_not_share_connections_or_handlers(tmp_path, app_config):
+    app = create_app(app_config)
+    with app.app_context():
+        engine = db.engine
+        event.listen(engine, 'connect', lambda dbapi_conn, record: record.info.__setitem__('pid', os.getpid()))
+        # Leave an idle connection in the parent's pool, as a preloading server would.
+        db.session.execute(text('SELECT 1'))
+        db.session.remove()
+        assert engine.pool.checkedin() == 1
+    assert len(queue_handlers()) == 1
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(app, app_config, results)) for _ in range(WORKERS)]
+    for process in processes:
+        process.start()
+    reports = [results.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    assert len({report['pid'] for report in reports}) == WORKERS
+    for report in reports:
+        assert report['inherited_idle_connections'] == 0
+        assert report['connection_owners'], "worker never used the database"
+        assert set(report['connection_owners']) == {report['pid']}
+        assert report['queue_handlers'] == 1
+        assert report['app_logger_handlers'] == 0
+
+    with open(tmp_path / 'logs' / 'mood_tracker.log') as f:
+        log_text = f.read()
+    for report in reports:
+        assert log_text.count(f"factory-test marker from {report['pid']}") == 1
+
+
+def test_create_app_registers_routes_and_settings(app_config):
+    app = create_app(dict(app_config, MIN_PASSWORD_LENGTH=12))
+    endpoints = {rule.endpoint for rule in app.url_map.iter_rules()}
+    assert {'index', 'login', 'submit_entry', 'manage_entries', 'visualize', 'metrics_endpoint'} <= endpoints
+    assert app.config['MIN_PASSWORD_LENGTH'] == 12
+    assert 'notification_settings' in app.extensions
+    response = app.test_client().get('/register')
+    assert b'12' in response.data
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Tests for cold storage of old entries: archived years leave the hot tables
+but every read that merges them (/data, the chart, the year view, sync
+snapshots) returns what it did before, writes restore an archived year,
+years that wouldn't round-trip stay hot, and archives follow shard moves.
+"""
+
+import json
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import func, insert, select, update
+
+import archive
+import entry_stats
+import heatmap
+import history
+import jobs
+import sharding
+from app import mood_graph_job
+from models import db, EntryRollup, Medication, MoodEntry, MoodEntryMedication, User
+
+TODAY = date.today()
+
+
+def entry(day, mood, medications=(), **values):
+    return dict({'date': day.isoformat(), 'mood': mood, 'hours_slept': 6.5, 'anxiety': 3, 'energy': 5,
+                 'irritability': 2, 'medications': list(medications)}, **values)
+
+
+def load(client, app):
+    """Entries in 2019, 2020 and today (written last, so it holds the newest id)."""
+    with app.app_context():
+        user_id = User.query.one().id
+        sharding.bind_user(user_id)
+        for name in ('Lithium', 'Sertraline'):
+            db.session.add(Medication(name=f'{name} {user_id}', user_id=user_id))
+        db.session.commit()
+        meds = [med.id for med in Medication.query.filter_by(user_id=user_id).order_by(Medication.id)]
+    days = [entry(date(2019, 1, 1), 7, meds, weight=150.5, notes='first day'),
+            entry(date(2019, 6, 30), 2, [meds[1]], exercise=True, notes='rained all day'),
+            entry(date(2019, 12, 31), 9)]
+    days += [entry(date(2020, 1, 1) + timedelta(days=offset), offset % 11, meds[:offset % 3],
+                   stressful_event=offset % 5 == 0) for offset in range(0, 366, 3)]
+    days.append(entry(TODAY, 5, [meds[0]], notes='today'))
+    response = client.post('/api/entries/batch', json={'entries': days})
+    assert response.status_code == 200, response.get_json()
+    return user_id, meds
+
+
+def reads(client, app, user_id, meds):
+    """Everything that should look the same whether or not old years are archived."""
+    with app.app_context():
+        sharding.bind_user(user_id)
+        figure = mood_graph_job(SimpleNamespace(user_id=user_id, progress=lambda fraction: None))
+        grids = [heatmap.build_grid(user_id, 2019, metric) for metric in
+                 ('mood_level', 'weight', 'exercise', 'medications', f'{heatmap.MEDICATION_PREFIX}{meds[1]}')]
+        span = heatmap.years(user_id)
+    snapshot = client.get('/api/sync/snapshot').get_json()
+    return {'data': client.get('/data').get_json(), 'figure': json.loads(figure), 'grids': grids, 'years': span,
+            'entries': snapshot['entries'], 'cursor': snapshot['cursor']}
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+def test_archived_years_read_back_the_same(make_app, register, columnar):
+    app = make_app(COLUMNAR_HISTORY=columnar)
+    client = register(app)
+    user_id, meds = load(client, app)
+    before = reads(client, app, user_id, meds)
+
+    with app.app_context():
+        assert archive.run(after_days=365) == {'before_year': (TODAY - timedelta(days=365)).year, 'users': 1,
+                                               'entries': 3 + 122}
+        assert archive.run(after_days=365)['entries'] == 0
+        assert db.session.execute(select(MoodEntry.entry_date)).scalars().all() == [TODAY]
+        assert db.session.execute(select(func.count()).select_from(MoodEntryMedication)).scalar() == 1
+        assert archive.years(user_id) == [2019, 2020]
+        assert archive.verify(user_id) == [] and entry_stats.verify(user_id) == []
+        if columnar:
+            assert history.verify(user_id) == []
+        june = db.session.get(EntryRollup, (user_id, date(2019, 6, 1), 'mood_level'))
+        assert (june.count, june.total, june.low, june.high) == (1, 2.0, 2.0, 2.0)
+
+    assert reads(client, app, user_id, meds) == before
+    page = client.get('/manage').data.decode()
+    assert 'Archived History' in page and 'June 2019' in page and 'rained all day' not in page
+    # Search only covers hot entries.
+    assert client.get('/api/search?q=rained').get_json()['results'] == []
+    assert client.get('/api/search?q=today').get_json()['results']
+
+
+def test_writing_to_an_archived_year_restores_it(make_app, register):
+    app = make_app()
+    client = register(app)
+    user_id, meds = load(client, app)
+    with app.app_context():
+        archive.run(after_days=365)
+        db.session.commit()
+    cursor = client.get('/api/sync/snapshot').get_json()['cursor']
+
+    response = client.post('/api/entries/batch', json={'entries': [entry(date(2019, 6, 30), 4)],
+                                                       'on_conflict': 'skip'})
+    assert response.get_json()['results'][0]['status'] == 'exists'
+    with app.app_context():
+        assert archive.years(user_id) == [2020]
+        restored = db.session.execute(select(MoodEntry.entry_date).where(MoodEntry.entry_date < date(2020, 1, 1))
+                                      .order_by(MoodEntry.entry_date)).scalars().all()
+        assert restored == [date(2019, 1, 1), date(2019, 6, 30), date(2019, 12, 31)]
+        assert db.session.get(EntryRollup, (user_id, date(2019, 6, 1), 'mood_level')) is None
+        assert archive.verify(user_id) == [] and entry_stats.verify(user_id) == []
+    # The entries came back under the ids clients already had.
+    assert client.get(f'/api/sync?cursor={cursor}').get_json()['entries'] == []
+    assert client.get('/api/search?q=rained').get_json()['results']
+
+    client.post('/submit', data={'date': '2020-01-02', 'mood': '8', 'hours_slept': '7', 'anxiety': '1',
+                                 'energy': '6', 'irritability': '1', 'notes': ''})
+    with app.app_context():
+        assert archive.years(user_id) == []
+        assert db.session.execute(select(MoodEntry.mood_level).where(
+            MoodEntry.entry_date == date(2020, 1, 2))).scalar() == 8
+        # A taken id means a new one; clients get both entries again.
+        sharding.bind_user(user_id)
+        archive.archive_user(user_id, 2021)
+        old_id = archive.entries(user_id)[0][0]['id']
+        db.session.execute(insert(MoodEntry).values(id=old_id, user_id=user_id, entry_date=TODAY - timedelta(days=1),
+                                                    mood_level=5, hours_slept=7, anxiety=1, energy_level=1,
+                                                    irritability=1))
+        archive.restore(user_id, 2019)
+        db.session.commit()
+        moved = db.session.execute(select(MoodEntry.id).where(MoodEntry.entry_date == date(2019, 1, 1))).scalar()
+        assert moved != old_id
+    changes = client.get(f'/api/sync?cursor={cursor}').get_json()
+    assert changes['deleted_entries'] == []
+    assert {old_id, moved} <= {item['id'] for item in changes['entries']}
+
+
+def test_years_that_would_not_round_trip_stay_hot(make_app, register):
+    app = make_app()
+    register(app)
+    with app.app_context():
+        user_id = User.query.one().id
+        rows = [{'user_id': user_id, 'entry_date': day, 'mood_level': 5, 'hours_slept': 7.0, 'anxiety': 3,
+                 'energy_level': 5, 'irritability': 2, 'notes': None}
+                for day in (date(2018, 3, 1), date(2019, 3, 1), TODAY)]
+        rows[0]['mood_level'] = 300  # Doesn't fit the blob's uint8 levels
+        db.session.execute(insert(MoodEntry), rows)
+        db.session.execute(update(MoodEntry).where(MoodEntry.entry_date == date(2019, 3, 1)).values(menstruation=None))
+        db.session.commit()
+        assert archive.run(after_days=365)['entries'] == 1
+        assert archive.years(user_id) == [2019]
+        [(row, links)] = archive.entries(user_id)
+        assert row['menstruation'] is None and row['exercise'] is False and row['notes'] is None
+        assert db.session.execute(select(MoodEntry.entry_date).order_by(MoodEntry.entry_date)).scalars().all() == \
+            [date(2018, 3, 1), TODAY]
+
+        db.session.execute(update(EntryRollup).where(EntryRollup.metric == 'anxiety').values(total=4.0))
+        db.session.commit()
+        assert archive.verify(user_id) == ['rollup 2019-03 anxiety: doesn\'t match the archive']
+
+        # The newest row keeps its id hot: SQLite would hand it out again.
+        db.session.execute(insert(MoodEntry).values(user_id=user_id, entry_date=date(2017, 1, 1), mood_level=1,
+                                                    hours_slept=7, anxiety=1, energy_level=1, irritability=1))
+        db.session.commit()
+        assert archive.run(after_days=365)['entries'] == 0
+
+        app.config['ARCHIVE_AFTER_DAYS'] = 0
+        assert archive.run() == {'before_year': None, 'users': 0, 'entries': 0}
+        assert archive.ARCHIVE_JOB in jobs._periodic
+
+
+def test_archives_follow_shard_moves(make_app, register, shard_config):
+    app = make_app(**shard_config)
+    client = register(app)
+    user_id, meds = load(client, app)
+    with app.app_context():
+        archive.run(after_days=365)
+    data = client.get('/data').get_json()
+
+    with app.app_context():
+        target = 1 - sharding.shard_for(user_id)
+        sharding.move_user(user_id, target)
+        db.session.remove()
+        sharding.bind_user(user_id)
+        assert archive.years(user_id) == [2019, 2020] and archive.verify(user_id) == []
+        new_meds = [med.id for med in Medication.query.filter_by(user_id=user_id).order_by(Medication.id)]
+        first = archive.entries(user_id)[0]
+        assert first[0]['id'] is None and [med for med, _ in first[1]] == new_meds
+    assert client.get('/data').get_json() == data
+    assert all(item['id'] is None for item in client.get('/api/sync/snapshot').get_json()['entries'][:-1])
+
+    client.post('/api/entries/batch', json={'entries': [entry(date(2019, 1, 1), 3)], 'on_conflict': 'update'})
+    with app.app_context():
+        sharding.bind_user(user_id)
+        assert archive.years(user_id) == [2020]
+        assert db.session.execute(select(func.count()).select_from(MoodEntry)).scalar() == 4
+        assert entry_stats.verify(user_id) == []
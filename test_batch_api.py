@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Tests for the JSON batch entry API: per-item results, all-or-nothing
+validation, the batch size limit and idempotent retries.
+"""
+
+import json
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from models import db, Medication, MoodEntry, MoodEntryMedication, User
+
+START = date(2024, 1, 1)
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(API_MAX_BATCH_SIZE=50)
+    with app.app_context():
+        for name in ('alice', 'bob'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password('password')
+            db.session.add(user)
+        db.session.flush()
+        alice, bob = User.query.order_by(User.id).all()
+        db.session.add_all([Medication(name='Alice med', user_id=alice.id),
+                            Medication(name='Bob med', user_id=bob.id)])
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def client(app, login):
+    return login(app)
+
+
+def medication_ids(app):
+    with app.app_context():
+        return [m.id for m in Medication.query.order_by(Medication.id).all()]
+
+
+def entry(day, **fields):
+    item = {'date': (START + timedelta(days=day)).isoformat(), 'mood': 5, 'hours_slept': 7.5,
+            'anxiety': 3, 'energy': 6, 'irritability': 2, 'exercise': True, 'weight': 70.2, 'notes': 'ok'}
+    item.update(fields)
+    return item
+
+
+def test_batch_inserts_then_updates(app, client):
+    alice_med = medication_ids(app)[0]
+    response = client.post('/api/entries/batch', json={'entries': [entry(0, medications=[alice_med]), entry(1)]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [r['status'] for r in body['results']] == ['inserted', 'inserted']
+    assert (body['inserted'], body['updated']) == (2, 0)
+
+    response = client.post('/api/entries/batch', json={'entries': [entry(0, mood=9), entry(2)]})
+    body = response.get_json()
+    assert [r['status'] for r in body['results']] == ['updated', 'inserted']
+    with app.app_context():
+        assert MoodEntry.query.count() == 3
+        assert db.session.get(MoodEntry, body['results'][0]['id']).mood_level == 9
+        # An update replaces the medication list with the one sent.
+        assert MoodEntryMedication.query.count() == 0
+
+    response = client.post('/api/entries/batch', json={'entries': [entry(1, mood=1)], 'on_conflict': 'skip'})
+    assert response.get_json()['results'][0]['status'] == 'exists'
+    with app.app_context():
+        assert MoodEntry.query.filter_by(entry_date=START + timedelta(days=1)).one().mood_level == 5
+
+
+def test_invalid_batch_writes_nothing(app, client):
+    bob_med = medication_ids(app)[1]
+    future = (date.today() + timedelta(days=1)).isoformat()
+    response = client.post('/api/entries/batch', json={'entries': [
+        entry(0),
+        entry(1, mood=11),
+        entry(2, date=future),
+        entry(3, medications=[bob_med]),
+        entry(0),
+        'not an object',
+    ]})
+    assert response.status_code == 422
+    results = response.get_json()['results']
+    assert [r['status'] for r in results] == ['ok'] + ['invalid'] * 5
+    assert 'mood must be between 0 and 10' in results[1]['errors']
+    assert 'date is in the future' in results[2]['errors']
+    assert results[3]['errors'] == [f'unknown medication ids: [{bob_med}]']
+    with app.app_context():
+        assert MoodEntry.query.count() == 0
+
+
+def test_non_finite_numbers_are_invalid(app, client):
+    # get_json() accepts these JavaScript literals.
+    body = ('{"entries": [%s, %s, %s, %s]}' % tuple(
+        json.dumps(entry(day)).replace('"mood": 5', f'"mood": {value}').replace('"weight": 70.2', f'"weight": {value}')
+        for day, value in enumerate(['NaN', 'Infinity', '-Infinity', '1e999'])))
+    response = client.post('/api/entries/batch', data=body, content_type='application/json')
+    assert response.status_code == 422
+    for result in response.get_json()['results']:
+        assert result['errors'] == ['mood must be a whole number', 'weight must be a number between 0 and 500']
+    response = client.post('/api/entries/batch', json={'entries': [entry(0, hours_slept=float('nan'), mood=10 ** 400)]})
+    assert response.get_json()['results'][0]['errors'] == ['mood must be between 0 and 10',
+                                                           'hours_slept must be a number']
+    with app.app_context():
+        assert MoodEntry.query.count() == 0
+
+
+def test_batch_size_limit(app, client):
+    response = client.post('/api/entries/batch', json={'entries': [entry(day) for day in range(51)]})
+    assert response.status_code == 413
+    assert response.get_json()['max_batch_size'] == 50
+    assert client.post('/api/entries/batch', json=[entry(0)]).status_code == 400
+
+
+def test_retry_with_idempotency_key_is_replayed(app, client):
+    payload = {'entries': [entry(day) for day in range(3)]}
+    headers = {'Idempotency-Key': 'upload-1'}
+    first = client.post('/api/entries/batch', json=payload, headers=headers)
+    retry = client.post('/api/entries/batch', json=payload, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.get_json() == first.get_json()
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    with app.app_context():
+        assert MoodEntry.query.count() == 3
+
+    reused = client.post('/api/entries/batch', json={'entries': [entry(5)]}, headers=headers)
+    assert reused.status_code == 422
+
+    # Keys are per user.
+    other = app.test_client()
+    other.post('/login', data={'username': 'bob', 'password': 'password'})
+    assert other.post('/api/entries/batch', json=payload, headers=headers).get_json()['inserted'] == 3
+
+
+def test_statement_count_does_not_grow_with_batch_size(app, client):
+    alice_med = medication_ids(app)[0]
+    counts = []
+    with app.app_context():
+        engine = db.engine
+    # The user's first write also counts their earlier entries (entry_stats); it happens once.
+    assert client.post('/api/entries/batch', json={'entries': [entry(300)]}).status_code == 200
+    statements = []
+    event.listen(engine, 'after_cursor_execute', lambda *args: statements.append(args[2]))
+    for first_day, size in ((0, 2), (100, 40)):
+        statements.clear()
+        items = [entry(first_day + day, medications=[alice_med]) for day in range(size)]
+        assert client.post('/api/entries/batch', json={'entries': items}).status_code == 200
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Tests for the running entry statistics: add/remove are exact inverses,
+every write route keeps them equal to a full recompute, and unusual days
+are flagged on /manage and in the chart.
+"""
+
+import json
+import random
+import statistics
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import delete, event, insert
+
+import entry_stats
+import sharding
+from app import build_mood_graph_json
+from models import db, EntryScore, EntryStats, MoodEntry, User
+
+START = date(2024, 1, 1)
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+def form(day, mood=6, sleep=7.5, weight=''):
+    return {'date': day.isoformat(), 'mood': str(mood), 'hours_slept': str(sleep), 'anxiety': '3', 'energy': '6',
+            'irritability': '2', 'notes': '', 'weight': str(weight)}
+
+
+def user_state(app):
+    with app.app_context():
+        user_id = User.query.one().id
+        sharding.bind_user(user_id)
+        return user_id, entry_stats.verify(user_id), entry_stats.flagged_days(user_id)
+
+
+def test_remove_undoes_add():
+    rng = random.Random(5)
+    state = entry_stats.RunningStats()
+    counted = []
+    for _ in range(200):
+        state.advance()
+        value = rng.gauss(6, 2)
+        state.add(value, state.seq)
+        counted.append((value, state.seq))
+    for value, seq in rng.sample(counted, 150):
+        state.remove(value, seq)
+        counted.remove((value, seq))
+
+    values = [value for value, _ in counted]
+    weights = [entry_stats.EW_ALPHA * (1 - entry_stats.EW_ALPHA) ** (state.seq - seq) for _, seq in counted]
+    assert state.count == 50
+    assert state.mean == pytest.approx(statistics.fmean(values), rel=1e-12)
+    assert state.stddev() == pytest.approx(statistics.stdev(values), rel=1e-9)
+    assert state.ew_weight == pytest.approx(sum(weights), abs=1e-12)
+    assert state.ew_sum == pytest.approx(sum(w * v for w, v in zip(weights, values)), abs=1e-12)
+
+    for value, seq in counted:
+        state.remove(value, seq)
+    assert (state.count, state.mean, state.m2, state.ew_weight) == (0, 0.0, 0.0, 0.0)
+    assert entry_stats.describe(entry_stats.low_bit('mood_level') | entry_stats.high_bit('weight')) == \
+        ['Mood low', 'Weight high']
+
+
+def test_write_routes_keep_stats_exact_and_flag_unusual_days(app, register):
+    client = register(app)
+    rng = random.Random(1)
+    for offset in range(20):
+        client.post('/submit', data=form(START + timedelta(days=offset), mood=rng.choice([5, 6, 7]),
+                                         sleep=rng.choice([7, 7.5, 8]), weight=rng.choice(['', 150, 151])))
+    bad_day = START + timedelta(days=20)
+    client.post('/submit', data=form(bad_day, mood=1, sleep=3))
+    _, problems, flagged = user_state(app)
+    assert problems == []
+    assert flagged == {bad_day: ['Mood low', 'Sleep low']}
+    assert 'Sleep low' in client.get('/manage').data.decode()
+
+    # The batch API, overwriting days and adding new ones.
+    client.post('/api/entries/batch', json={'on_conflict': 'update', 'entries': [
+        {'date': (START + timedelta(days=offset)).isoformat(), 'mood': 6, 'hours_slept': 7.5, 'anxiety': 3,
+         'energy': 6, 'irritability': 2, 'weight': None} for offset in range(15, 25)] + [
+        {'date': (START + timedelta(days=25)).isoformat(), 'mood': 10, 'hours_slept': 7.5, 'anxiety': 3,
+         'energy': 6, 'irritability': 9}]})
+    _, problems, flagged = user_state(app)
+    assert problems == []
+    assert flagged == {START + timedelta(days=25): ['Mood high', 'Irritability high']}
+
+    with app.app_context():
+        ids = {e.entry_date: e.id for e in MoodEntry.query.all()}
+    client.post(f'/edit/{ids[START + timedelta(days=25)]}', data=form(START + timedelta(days=26)))
+    client.post(f'/edit/{ids[START + timedelta(days=3)]}', data=form(START + timedelta(days=3), mood=0, sleep=12))
+    client.post(f'/delete/{ids[START + timedelta(days=4)]}')
+    client.post(f'/delete/{ids[START]}')
+    user_id, problems, flagged = user_state(app)
+    assert problems == []
+    assert flagged == {START + timedelta(days=3): ['Mood low', 'Sleep high']}
+
+    with app.app_context():
+        figure = json.loads(build_mood_graph_json(MoodEntry.query.order_by(MoodEntry.entry_date).all()))
+    unusual = [trace for trace in figure['data'] if trace['name'] == 'Unusual day']
+    assert unusual[0]['x'] == [(START + timedelta(days=3)).isoformat()]
+    assert unusual[0]['hovertext'] == ['Mood low, Sleep high']
+
+    with app.app_context():
+        # A rebuild counts in date order: day 3 now has too few days before it to be judged.
+        assert entry_stats.rebuild(user_id) == 24
+        db.session.commit()
+        assert entry_stats.verify(user_id) == []
+        assert entry_stats.flagged_days(user_id) == {}
+        db.session.execute(db.update(EntryStats).where(EntryStats.metric == 'mood_level').values(mean=9.0))
+        assert entry_stats.verify(user_id)[0].startswith('mood_level: mean')
+
+
+def test_existing_entries_are_counted_on_first_write(app, register):
+    register(app)
+    with app.app_context():
+        user_id = User.query.one().id
+        # Entries from before running statistics existed.
+        db.session.execute(insert(MoodEntry), [
+            {'user_id': user_id, 'entry_date': START + timedelta(days=offset), 'mood_level': 5 + offset % 2,
+             'hours_slept': 8.0, 'anxiety': 3, 'energy_level': 6, 'irritability': 2}
+            for offset in range(30)])
+        db.session.commit()
+        assert entry_stats.verify(user_id)[0] == 'entry 1: not counted'
+
+    register(app).post('/submit', data=form(START + timedelta(days=30), mood=0))
+    user_id, problems, flagged = user_state(app)
+    assert problems == []
+    assert flagged == {START + timedelta(days=30): ['Mood low']}
+    with app.app_context():
+        assert db.session.query(EntryScore).count() == 31
+
+
+def test_moving_a_user_takes_stats_along(make_app, register, shard_config):
+    app = make_app(**shard_config)
+    client = register(app, 'ann')
+    for offset in range(16):
+        client.post('/submit', data=form(START + timedelta(days=offset), mood=6 + offset % 2))
+    client.post('/submit', data=form(START + timedelta(days=16), mood=0))
+    with app.app_context():
+        user_id = User.query.one().id
+        sharding.move_user(user_id, (user_id + 1) % 2)
+        sharding.bind_user(user_id)
+        assert entry_stats.verify(user_id) == []
+        assert list(entry_stats.flagged_days(user_id)) == [START + timedelta(days=16)]
+        with sharding.use_shard(user_id % 2):
+            assert db.session.execute(delete(EntryStats)).rowcount == 0
+
+
+def test_deletes_with_foreign_keys_enforced(app, register):
+    with app.app_context():
+        # As Postgres would: entry_score rows must go before the entries they reference.
+        event.listen(db.engine, 'connect', lambda dbapi_conn, record: dbapi_conn.execute('PRAGMA foreign_keys = ON'))
+        db.engine.dispose()
+    client = register(app)
+    for offset in range(3):
+        client.post('/submit', data=form(START + timedelta(days=offset)))
+    with app.app_context():
+        first = MoodEntry.query.filter_by(entry_date=START).one().id
+    response = client.post(f'/delete/{first}', follow_redirects=True)
+    assert b'Entry deleted successfully!' in response.data
+
+    user_id, problems, _ = user_state(app)
+    assert problems == []
+    with app.app_context():
+        assert MoodEntry.query.count() == db.session.query(EntryScore).count() == 2
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Tests for the atomic entry write path: concurrent submits for the same day
+must produce exactly one entry and no IntegrityError, and edits that move an
+entry onto a taken date must be reported as conflicts.
+"""
+
+import threading
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+import entry_store
+from models import db, Medication, MoodEntry, MoodEntryMedication, User
+
+THREADS = 8
+
+VALUES = {
+    'mood_level': 5, 'hours_slept': 7.5, 'anxiety': 3, 'energy_level': 6, 'irritability': 2,
+    'alcohol_drugs': False, 'exercise': True, 'menstruation': False, 'stressful_event': False,
+    'weight': None, 'notes': 'test',
+}
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        # Concurrent writers wait on SQLite's lock instead of failing with "database is locked".
+        event.listen(db.engine, 'connect', lambda dbapi_conn, record: dbapi_conn.execute('PRAGMA busy_timeout = 5000'))
+        for name in ('alice', 'bob'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password('password')
+            db.session.add(user)
+        db.session.flush()
+        alice, bob = User.query.order_by(User.id).all()
+        db.session.add_all([Medication(name='Alice med', user_id=alice.id),
+                            Medication(name='Bob med', user_id=bob.id)])
+        db.session.commit()
+    return app
+
+
+def ids(app):
+    with app.app_context():
+        alice, bob = (u.id for u in User.query.order_by(User.id).all())
+        alice_med, bob_med = (m.id for m in Medication.query.order_by(Medication.id).all())
+    return alice, bob, alice_med, bob_med
+
+
+def test_concurrent_submits_for_same_day_create_one_entry(app):
+    alice = ids(app)[0]
+    barrier = threading.Barrier(THREADS)
+    outcomes, errors = [], []
+
+    def submit():
+        with app.app_context():
+            try:
+                barrier.wait()
+                outcome, entry_id = entry_store.save_entry(alice, date(2024, 3, 1), VALUES, mode='insert')
+                db.session.commit()
+                outcomes.append((outcome, entry_id))
+            except Exception as e:
+                errors.append(e)
+                db.session.rollback()
+
+    threads = [threading.Thread(target=submit) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(outcome for outcome, _ in outcomes) == [entry_store.EXISTS] * (THREADS - 1) + [entry_store.INSERTED]
+    assert len({entry_id for _, entry_id in outcomes}) == 1
+    with app.app_context():
+        assert MoodEntry.query.filter_by(user_id=alice).count() == 1
+
+
+def test_update_mode_overwrites_and_replaces_medications(app):
+    alice, _, alice_med, bob_med = ids(app)
+    with app.app_context():
+        outcome, first_id = entry_store.save_entry(alice, date(2024, 3, 2), VALUES, [alice_med, bob_med])
+        db.session.commit()
+        assert outcome == entry_store.INSERTED
+        # Someone else's medication is silently ignored.
+        assert [m.medication_id for m in MoodEntryMedication.query.all()] == [alice_med]
+
+        outcome, second_id = entry_store.save_entry(alice, date(2024, 3, 2), dict(VALUES, mood_level=9), [], mode='update')
+        db.session.commit()
+        assert (outcome, second_id) == (entry_store.UPDATED, first_id)
+        assert db.session.get(MoodEntry, first_id).mood_level == 9
+        assert MoodEntryMedication.query.count() == 0
+
+        outcome, _ = entry_store.save_entry(alice, date(2024, 3, 2), dict(VALUES, mood_level=1))
+        assert outcome == entry_store.EXISTS
+        assert db.session.get(MoodEntry, first_id).mood_level == 9
+
+
+def test_edit_reports_conflict_and_not_found(app):
+    alice, bob = ids(app)[:2]
+    with app.app_context():
+        _, first_id = entry_store.save_entry(alice, date(2024, 3, 3), VALUES)
+        _, second_id = entry_store.save_entry(alice, date(2024, 3, 4), VALUES)
+        db.session.commit()
+
+        assert entry_store.edit_entry(second_id, alice, date(2024, 3, 3), VALUES) == entry_store.CONFLICT
+        assert entry_store.edit_entry(second_id, bob, date(2024, 3, 5), VALUES) == entry_store.NOT_FOUND
+        assert entry_store.edit_entry(second_id, alice, date(2024, 3, 5), dict(VALUES, notes='moved')) == entry_store.UPDATED
+        db.session.commit()
+        moved = db.session.get(MoodEntry, second_id)
+        assert (moved.entry_date, moved.notes) == (date(2024, 3, 5), 'moved')
+        assert db.session.get(MoodEntry, first_id).entry_date == date(2024, 3, 3)
+
+
+def test_routes_use_atomic_path(app, login):
+    client = login(app)
+    form = {'date': '2024-03-06', 'mood': '5', 'hours_slept': '7', 'anxiety': '3', 'energy': '6',
+            'irritability': '2', 'notes': ''}
+    assert client.post('/submit', data=form).headers['Location'].endswith('/')
+    assert client.post('/submit', data=form).headers['Location'].endswith('/manage')
+    with app.app_context():
+        entry_id = MoodEntry.query.one().id
+    assert client.post(f'/edit/{entry_id + 1}', data=form).status_code == 404
+    assert client.post(f'/edit/{entry_id}', data=dict(form, mood='8')).status_code == 302
+    with app.app_context():
+        assert MoodEntry.query.one().mood_level == 8
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Tests for calendar heatmaps: days land in the right cells of the year grid,
+levels and the missing-day mask, medication metrics, the columnar history
+giving the same grid, and the per-version cache behind /api/heatmap.
+"""
+
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event, inspect, text
+
+import heatmap
+from models import db, Medication, User
+
+
+def entry(day, mood, medications=(), **values):
+    return dict({'date': day.isoformat(), 'mood': mood, 'hours_slept': 7, 'anxiety': 3, 'energy': 5,
+                 'irritability': 2, 'medications': list(medications)}, **values)
+
+
+def cell(grid, day):
+    """(row, column) of a date in a grid."""
+    offset = (day - date.fromisoformat(grid['start'])).days
+    return offset % 7, offset // 7
+
+
+def load(client, app):
+    with app.app_context():
+        user_id = User.query.one().id
+        for name in ('Lithium', 'Sertraline'):
+            db.session.add(Medication(name=name, user_id=user_id))
+        db.session.commit()
+        meds = {med.name: med.id for med in Medication.query.all()}
+    response = client.post('/api/entries/batch', json={'entries': [
+        entry(date(2023, 12, 31), 9),
+        entry(date(2024, 1, 1), 10, [meds['Lithium'], meds['Sertraline']], weight=150),
+        entry(date(2024, 1, 2), 0, [meds['Lithium']], weight=160),
+        entry(date(2024, 7, 4), 5, exercise=True),
+        entry(date(2024, 12, 31), 6),
+    ]})
+    assert response.status_code == 200, response.get_json()
+    return meds
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+def test_days_land_in_their_cells(make_app, register, columnar):
+    app = make_app(COLUMNAR_HISTORY=columnar)
+    client = register(app)
+    meds = load(client, app)
+
+    grid = client.get('/api/heatmap?metric=mood_level').get_json()
+    # 1 January 2024 was a Monday: the grid starts on the Sunday before, outside the year.
+    assert (grid['year'], grid['start'], grid['weeks']) == (2024, '2023-12-31', 53)
+    assert grid['years'] == [2023, 2024]
+    assert grid['levels'][0][0] == -1 and grid['values'][0][0] is None
+    row, column = cell(grid, date(2024, 1, 1))
+    assert (row, column) == (1, 0)
+    assert (grid['values'][row][column], grid['levels'][row][column], grid['missing'][row][column]) == (10, 4, 0)
+    row, column = cell(grid, date(2024, 1, 2))
+    assert (grid['values'][row][column], grid['levels'][row][column]) == (0, 1)
+    row, column = cell(grid, date(2024, 1, 3))
+    assert (grid['values'][row][column], grid['levels'][row][column], grid['missing'][row][column]) == (None, 0, 1)
+    row, column = cell(grid, date(2024, 12, 31))
+    assert (row, column) == (2, 52) and grid['values'][row][column] == 6
+    assert sum(map(sum, grid['missing'])) == 366 - 4
+    assert (grid['logged'], grid['mean']) == (4, 5.25)
+
+    # Weight has no fixed scale: the year's lowest and highest weights.
+    weight = client.get('/api/heatmap?metric=weight&year=2024').get_json()
+    assert weight['scale'] == [150, 160] and weight['logged'] == 2
+    assert weight['levels'][1][0] == 1 and weight['levels'][2][0] == 4
+    exercise = client.get('/api/heatmap?metric=exercise&year=2024').get_json()
+    row, column = cell(exercise, date(2024, 7, 4))
+    assert exercise['levels'][row][column] == 4 and exercise['levels'][1][0] == 1
+
+    taken = client.get('/api/heatmap?metric=medications&year=2024').get_json()
+    assert [taken['values'][1][0], taken['values'][2][0], taken['values'][4][26]] == [1.0, 0.5, 0.0]
+    assert [med['name'] for med in taken['medications']] == ['Lithium', 'Sertraline']
+    sertraline = client.get(f"/api/heatmap?metric=medication-{meds['Sertraline']}&year=2024").get_json()
+    assert (sertraline['label'], sertraline['values'][1][0], sertraline['values'][2][0]) == ('Sertraline', 1.0, 0.0)
+
+    assert client.get('/api/heatmap?metric=password_hash').status_code == 400
+    assert client.get('/api/heatmap?metric=medication-999').status_code == 400
+    assert client.get('/api/heatmap?year=12').status_code == 400
+    # Another user's medication is not a metric.
+    assert register(app, 'bob').get(f"/api/heatmap?metric=medication-{meds['Lithium']}").status_code == 400
+
+
+def test_fifty_four_week_years(make_app, register):
+    app = make_app()
+    register(app)
+    with app.app_context():
+        # 2028 is a leap year starting on a Saturday: 31 December is a Sunday in a 54th column.
+        grid = heatmap.build_grid(User.query.one().id, 2028, 'weight')
+    assert (grid['start'], grid['weeks'], grid['logged'], grid['mean']) == ('2027-12-26', 54, 0, None)
+    assert [row[53] for row in grid['levels']] == [0, -1, -1, -1, -1, -1, -1]
+    assert sum(map(sum, grid['missing'])) == 366
+
+
+def test_existing_databases_get_the_medication_link_index(make_app):
+    # Without it every day of a medications grid scanned all the links.
+    with make_app().app_context():
+        engine = db.engines[None]
+    with engine.begin() as conn:
+        conn.execute(text('DROP INDEX ix_mood_entry_medication_mood_entry_id'))
+    make_app()
+    assert 'ix_mood_entry_medication_mood_entry_id' in {
+        index['name'] for index in inspect(engine).get_indexes('mood_entry_medication')}
+
+
+def test_grids_are_cached_per_data_version(make_app, register):
+    app = make_app()
+    client = register(app)
+    load(client, app)
+    first = client.get('/api/heatmap?year=2024')
+    etag = first.headers['ETag']
+
+    with app.app_context():
+        engine = db.engines[None]
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    again = client.get('/api/heatmap?year=2024')
+    event.remove(engine, 'before_cursor_execute', record)
+    assert again.get_json() == first.get_json()
+    # Loading the user and reading their version; the entries aren't read again.
+    assert not any('FROM mood_entry' in statement for statement in statements)
+    assert client.get('/api/heatmap?year=2024', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/api/entries/batch', json={'entries': [entry(date(2024, 1, 3), 7)], 'on_conflict': 'update'})
+    changed = client.get('/api/heatmap?year=2024', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert changed.get_json()['values'][3][0] == 7
+
+    cache = heatmap.GridCache(2)
+    for key in 'abc':
+        cache.put(key, {key: 1})
+    assert cache.get('a') is None and cache.get('c') == {'c': 1}
+
+
+def test_visualize_offers_the_year_view(make_app, register):
+    app = make_app()
+    client = register(app)
+    client.post('/submit', data={'date': (date.today() - timedelta(days=1)).isoformat(), 'mood': '5',
+                                 'hours_slept': '7', 'anxiety': '3', 'energy': '6', 'irritability': '2', 'notes': ''})
+    page = client.get('/visualize').data.decode()
+    assert 'Year View' in page and '<option value="hours_slept">Hours slept</option>' in page
+    grid = client.get('/api/heatmap').get_json()
+    assert grid['year'] == (date.today() - timedelta(days=1)).year and grid['logged'] == 1
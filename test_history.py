@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Tests for the columnar entry history: blobs round-trip, every write route
+keeps them equal to the entry rows, and /data and the chart read from them.
+"""
+
+import json
+import random
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+import history
+import sharding
+from app import build_mood_graph_json, build_mood_graph_json_from_history
+from models import db, EntryYearBlob, MoodEntry, User
+
+
+@pytest.fixture
+def app_config(app_config):
+    return dict(app_config, COLUMNAR_HISTORY=True)
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        user = User(username='alice', email='alice@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+    return app
+
+
+def form(day, mood=5, weight='', **flags):
+    return dict({'date': day.isoformat(), 'mood': str(mood), 'hours_slept': '7.5', 'anxiety': '3', 'energy': '6',
+                 'irritability': '2', 'notes': '', 'weight': weight}, **{flag: 'on' for flag in flags})
+
+
+def orm_data(app):
+    """What /data returns without the columnar history, in date order."""
+    with app.app_context():
+        entries = MoodEntry.query.order_by(MoodEntry.entry_date).all()
+        return [{'date': e.entry_date.isoformat(), 'mood': e.mood_level, 'hours_slept': e.hours_slept,
+                 'anxiety': e.anxiety, 'energy': e.energy_level, 'irritability': e.irritability,
+                 'weight': e.weight if e.weight else None} for e in entries]
+
+
+def test_blob_round_trip():
+    columns = history.empty_year()
+    history.set_day(columns, 0, {'mood_level': 10, 'anxiety': 0, 'energy_level': 7, 'irritability': 1,
+                                  'hours_slept': 6.5, 'weight': 150.2, 'exercise': True})
+    history.set_day(columns, 365, {'mood_level': 3, 'anxiety': 9, 'energy_level': 2, 'irritability': 8,
+                                    'hours_slept': 11.0, 'weight': None, 'stressful_event': True})
+    blob = history.encode(2024, columns)
+    assert len(blob) == history.BLOB_SIZE
+
+    decoded = history.decode(blob)
+    for name, array in columns.items():
+        np.testing.assert_array_equal(decoded[name], array)
+    # Numbers are read in place, not copied out of the blob.
+    assert decoded['mood_level'].base is not None and not decoded['hours_slept'].flags.writeable
+    assert np.flatnonzero(decoded['present']).tolist() == [0, 365]
+    assert history.day_of_year(date(2024, 12, 31)) == 365
+    with pytest.raises(ValueError):
+        history.decode(b'\0' * history.BLOB_SIZE)
+
+
+def test_write_routes_keep_history_in_step(app, login):
+    client = login(app)
+    rng = random.Random(3)
+    start = date(2022, 12, 20)
+    days = [start + timedelta(days=offset) for offset in range(30)]
+    for day in days[:10]:
+        client.post('/submit', data=form(day, mood=rng.randrange(11), weight=str(rng.choice(['', 140.5]))))
+    client.post('/api/entries/batch', json={'on_conflict': 'update', 'entries': [
+        {'date': day.isoformat(), 'mood': rng.randrange(11), 'hours_slept': 6, 'anxiety': 1, 'energy': 5,
+         'irritability': 0, 'exercise': True, 'weight': 141.0 if day.day % 2 else None} for day in days[5:20]]})
+
+    with app.app_context():
+        ids = {e.entry_date: e.id for e in MoodEntry.query.all()}
+    # Edits across the year boundary move the entry between blobs.
+    client.post(f'/edit/{ids[date(2022, 12, 31)]}', data=form(date(2023, 2, 1), mood=1, menstruation=True))
+    client.post(f'/edit/{ids[date(2023, 1, 2)]}', data=form(date(2023, 1, 2), mood=9))
+    client.post(f'/delete/{ids[date(2022, 12, 25)]}')
+    client.post(f'/delete/{ids[date(2023, 1, 5)]}')
+
+    with app.app_context():
+        user_id = User.query.one().id
+        assert history.verify(user_id) == []
+        assert sorted(year for (year,) in db.session.query(EntryYearBlob.year)) == [2022, 2023]
+    assert client.get('/data').get_json() == orm_data(app)
+
+    # A rebuild from the rows produces the same blobs.
+    with app.app_context():
+        before = {year: data for year, data in db.session.query(EntryYearBlob.year, EntryYearBlob.data)}
+        history.rebuild(user_id)
+        db.session.commit()
+        assert before == {year: data for year, data in db.session.query(EntryYearBlob.year, EntryYearBlob.data)}
+        db.session.execute(db.update(EntryYearBlob).values(data=history.encode(2023, history.empty_year())))
+        assert history.verify(user_id)[0] == date(2022, 12, 20)
+
+
+def test_out_of_range_form_values_are_refused(app, login):
+    client = login(app)
+    day = date(2024, 3, 1)
+    client.post('/submit', data=form(day))
+    with app.app_context():
+        entry_id = MoodEntry.query.one().id
+    for field, value, message in (('anxiety', '-1', 'anxiety must be between 0 and 10'),
+                                  ('mood', '300', 'mood must be between 0 and 10'),
+                                  ('hours_slept', 'nan', 'hours_slept must be between 0 and 24'),
+                                  ('energy', 'lots', 'energy must be a whole number'),
+                                  ('weight', '-5', 'weight must be a number between 0 and 500')):
+        bad = dict(form(day + timedelta(days=1)), **{field: value})
+        response = client.post('/submit', data=bad, follow_redirects=True)
+        assert f'Invalid entry: {message}.' in response.data.decode()
+        response = client.post(f'/edit/{entry_id}', data=dict(bad, date=day.isoformat()), follow_redirects=True)
+        assert f'Invalid entry: {message}.' in response.data.decode()
+    assert client.get('/data').get_json() == orm_data(app)
+    assert len(orm_data(app)) == 1 and orm_data(app)[0]['anxiety'] == 3
+
+
+def test_chart_from_history_matches_rows(app, login):
+    client = login(app)
+    client.post('/add_medication', data={'medication_name': 'Med A'})
+    for offset in range(5):
+        day = date(2024, 3, 1) + timedelta(days=offset)
+        data = form(day, mood=offset, weight='150' if offset == 2 else '')
+        if offset % 2:
+            data['medications_taken'] = ['1']
+        client.post('/submit', data=data)
+    with app.app_context():
+        user_id = User.query.one().id
+        expected = json.loads(build_mood_graph_json(MoodEntry.query.order_by(MoodEntry.entry_date).all()))
+        columnar = json.loads(build_mood_graph_json_from_history(user_id))
+    assert columnar['data'] == expected['data']
+    assert sum(trace['type'] == 'bar' for trace in columnar['data']) == 2
+
+
+def test_move_user_takes_history_along(make_app, register, shard_config):
+    app = make_app(**shard_config)
+    client = register(app, 'ann')
+    client.post('/submit', data=form(date(2024, 5, 1)))
+    with app.app_context():
+        user_id = User.query.one().id
+        sharding.move_user(user_id, (user_id + 1) % 2)
+        sharding.bind_user(user_id)
+        assert history.verify(user_id) == []
+    assert client.get('/data').get_json()[0]['date'] == '2024-05-01'
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Tests for background jobs: deduplication, priorities, cancellation, result
+expiry, recovery of jobs whose worker crashed mid-run, and /visualize
+handing its figure to a job.
+"""
+
+import json
+import multiprocessing
+import os
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import jobs
+from models import db, Job, User
+
+START = date(2024, 1, 1)
+LEASE_SECONDS = 0.5
+ran = []
+
+
+@jobs.handler('test_echo')
+def echo_job(job):
+    ran.append(job.params['name'])
+    job.progress(0.5)
+    return json.dumps(job.params)
+
+
+@jobs.handler('test_cancel_self')
+def cancel_self_job(job):
+    # As if the user pressed cancel while the job was running.
+    jobs.cancel(job.id)
+    db.session.commit()
+    job.progress(0.5)
+    return 'null'
+
+
+@jobs.handler('test_crash_once')
+def crash_once_job(job):
+    job.progress(0.1)
+    if job.attempt == 1:
+        os._exit(1)  # The worker process dies holding the job.
+    return json.dumps({'attempt': job.attempt})
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(JOB_LEASE_SECONDS=LEASE_SECONDS)
+    with app.app_context():
+        for name in ('alice', 'bob'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password('password')
+            db.session.add(user)
+        db.session.commit()
+    ran.clear()
+    return app
+
+
+def run_all(worker='test-worker'):
+    while jobs.run_next(worker):
+        pass
+
+
+def test_dedupe_priority_and_expiry(app):
+    with app.app_context():
+        first = jobs.enqueue('test_echo', {'name': 'low'}, key='low')
+        assert jobs.enqueue('test_echo', {'name': 'low again'}, key='low').id == first.id
+        jobs.enqueue('test_echo', {'name': 'high'}, priority=jobs.PRIORITY_INTERACTIVE)
+        jobs.enqueue('test_echo', {'name': 'unkeyed'})
+        db.session.commit()
+        run_all()
+        assert ran == ['high', 'low', 'unkeyed']
+
+        done = jobs.get_job(first.id)
+        assert (done.status, done.progress, json.loads(done.result)) == (jobs.SUCCEEDED, 1.0, {'name': 'low'})
+        # A fresh result is reused rather than recomputed.
+        assert jobs.enqueue('test_echo', {'name': 'low'}, key='low').status == jobs.SUCCEEDED
+
+        db.session.execute(db.update(Job).values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+        db.session.commit()
+        again = jobs.enqueue('test_echo', {'name': 'low'}, key='low')
+        assert (again.id, again.status, again.result) == (first.id, jobs.QUEUED, None)
+        assert jobs.purge_expired() == 2
+        db.session.commit()
+        assert [job.id for job in Job.query.all()] == [first.id]
+
+
+def test_cancel_queued_and_running_jobs(app):
+    with app.app_context():
+        queued = jobs.enqueue('test_echo', {'name': 'never'}, key='never')
+        running = jobs.enqueue('test_cancel_self')
+        db.session.commit()
+        jobs.cancel(queued.id)
+        db.session.commit()
+        run_all()
+        assert ran == []
+        assert jobs.get_job(queued.id).status == jobs.CANCELLED
+        assert jobs.get_job(running.id).status == jobs.CANCELLED
+        # A cancelled key can be queued again.
+        assert jobs.enqueue('test_echo', {'name': 'never'}, key='never').status == jobs.QUEUED
+
+
+def crashing_worker(app):
+    with app.app_context():
+        jobs.run_next('doomed-worker')
+
+
+def test_job_of_crashed_worker_is_retried(app):
+    with app.app_context():
+        job_id = jobs.enqueue('test_crash_once').id
+        db.session.commit()
+
+    process = multiprocessing.get_context('fork').Process(target=crashing_worker, args=(app,))
+    process.start()
+    process.join()
+    assert process.exitcode == 1
+
+    with app.app_context():
+        job = jobs.get_job(job_id)
+        assert (job.status, job.worker, job.progress) == (jobs.RUNNING, 'doomed-worker', 0.1)
+        # Still leased: nobody else may take it yet.
+        assert not jobs.run_next('rescuer')
+        time.sleep(LEASE_SECONDS + 0.1)
+        assert jobs.run_next('rescuer')
+        job = jobs.get_job(job_id)
+        assert (job.status, job.attempts, job.worker) == (jobs.SUCCEEDED, 2, 'rescuer')
+        assert json.loads(job.result) == {'attempt': 2}
+
+
+def test_lost_jobs_fail_after_max_attempts_and_stale_worker_is_ignored(app):
+    with app.app_context():
+        job_id = jobs.enqueue('test_echo', {'name': 'lost'}).id
+        db.session.commit()
+        for attempt in range(1, app.config['JOB_MAX_ATTEMPTS'] + 1):
+            stale = jobs.claim(f'worker-{attempt}')
+            db.session.commit()
+            assert stale.attempt == attempt
+            db.session.execute(db.update(Job).values(lease_expires_at=datetime.utcnow() - timedelta(seconds=1)))
+            db.session.commit()
+            assert jobs.recover_expired() == 1
+            db.session.commit()
+        job = jobs.get_job(job_id)
+        assert (job.status, job.error) == (jobs.FAILED, 'worker lost')
+
+        # A worker whose lease was taken over can neither report progress nor finish.
+        with pytest.raises(jobs.JobLost):
+            stale.progress(0.9)
+        jobs._finish(stale, jobs.SUCCEEDED, result='{}')
+        assert jobs.get_job(job_id).status == jobs.FAILED
+
+
+def test_visualize_builds_the_figure_in_a_job(app, login):
+    client = login(app)
+    assert b'No data available' in client.get('/visualize').data
+    client.post('/submit', data={'date': START.isoformat(), 'mood': '5', 'hours_slept': '7', 'anxiety': '3',
+                                 'energy': '6', 'irritability': '2', 'notes': ''})
+
+    page = client.get('/visualize').data.decode()
+    assert 'chart-status' in page and '/jobs/1' in page
+    assert client.get('/jobs/1').get_json()['status'] == jobs.QUEUED
+    assert client.get('/jobs/1/result').status_code == 409
+    assert login(app, 'bob').get('/jobs/1').status_code == 404
+
+    with app.app_context():
+        run_all()
+    status = client.get('/jobs/1').get_json()
+    assert (status['status'], status['result_url']) == (jobs.SUCCEEDED, '/jobs/1/result')
+    assert 'data' in client.get(status['result_url']).get_json()
+    page = client.get('/visualize').data.decode()
+    assert 'Plotly.newPlot' in page and 'chart-status' not in page
+
+    # New data, new figure.
+    client.post('/submit', data={'date': (START + timedelta(days=1)).isoformat(), 'mood': '5', 'hours_slept': '7',
+                                 'anxiety': '3', 'energy': '6', 'irritability': '2', 'notes': ''})
+    assert '/jobs/2' in client.get('/visualize').data.decode()
+    assert client.post('/jobs/2/cancel').get_json()['status'] == jobs.CANCELLED
+
+
+def test_visualize_for_data_from_before_the_change_log_and_profiled(app, login):
+    import profiling
+    from models import MoodEntry
+
+    app.config['ADMIN_USERNAMES'] = ['bob']
+    with app.app_context():
+        # No change-log version yet: written before it existed, and no restart since.
+        db.session.add(MoodEntry(user_id=2, entry_date=START, mood_level=5, hours_slept=7, anxiety=3,
+                                 energy_level=6, irritability=2))
+        db.session.commit()
+    client = login(app, 'bob')
+    page = client.get('/visualize?_profile=1').data.decode()
+    assert 'chart-status' in page and '/jobs/1' in page
+
+    with app.app_context():
+        assert json.loads(jobs.get_job(1).params) == {profiling.PROFILE_JOB_PARAM: True}
+        run_all()
+        [job_profile] = [p for p in profiling.list_profiles() if p['method'] == 'JOB']
+    assert (job_profile['path'], job_profile['status']) == ('job:mood_graph', 'succeeded')
+    assert 'build_figure' in job_profile['sections_ms']
+    assert 'Plotly.newPlot' in client.get('/visualize').data.decode()
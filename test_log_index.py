@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Tests for the sidecar log index: time-range and per-user queries return the
+same lines as a full scan, across rotated and gzip-compressed files and
+lines appended since the last update, traceback lines go with the record
+above them, and an index entry follows its file when it is rotated.
+"""
+
+import gzip
+import os
+
+import log_index
+import log_reader
+
+USERS = ('alice', 'bob', 'carol')
+
+
+def log_lines(day, count, first=0):
+    lines = []
+    for number in range(first, first + count):
+        stamp = f'2024-01-{day:02d} {number // 60 % 24:02d}:{number % 60:02d}:00,000'
+        if number % 4 == 3:
+            lines.append(f'{stamp} - mood_tracker.requests - INFO - '
+                         f'{{"path":"/manage","user_id":{number % 3 + 1}}}\n')
+        else:
+            lines.append(f'{stamp} - mood_tracker - INFO - '
+                         f'Entry edited successfully - user: {USERS[number % 3]}, entry_id: {number}\n')
+    return lines
+
+
+def write(path, lines, mode='w'):
+    if str(path).endswith('.gz'):
+        f = gzip.open(path, mode + 't', encoding='utf-8')
+    else:
+        f = open(path, mode, encoding='utf-8')
+    with f:
+        f.writelines(lines)
+
+
+def scan(log_file, keep):
+    return [line for line in log_reader.iter_lines(log_file) if keep(line)]
+
+
+def test_queries_match_a_full_scan(tmp_path):
+    log_file = str(tmp_path / 'mood_tracker.log')
+    write(log_file + '.2.gz', log_lines(1, 300))
+    write(log_file + '.1', log_lines(2, 1500))  # Several index blocks
+    write(log_file, log_lines(3, 400))
+
+    with log_index.LogIndex(log_file) as index:
+        assert index.update() == sum(os.path.getsize(path) for path in (log_file + '.1', log_file))
+        assert index.update() == 0
+        write(log_file, log_lines(3, 50, first=400), mode='a')  # Not indexed yet
+
+        start, end = '2024-01-02 05:30', '2024-01-03 07:00'
+        assert list(index.time_range(start, end)) == scan(log_file, lambda line: start <= line[:19] < end)
+        assert list(index.time_range('2024-01-01 02', '2024-01-01 03')) == \
+            scan(log_file, lambda line: line.startswith('2024-01-01 02'))  # From the archive
+        assert list(index.time_range('2024-01-03 07', '2024-01-04')) == \
+            scan(log_file, lambda line: line >= '2024-01-03 07')  # Includes the appended lines
+
+        bob = list(index.user_lines(username='bob'))
+        assert bob and bob == scan(log_file, lambda line: 'user: bob,' in line)
+        assert list(index.user_lines(username='BOB')) == bob
+        assert list(index.user_lines(user_id=2)) == scan(log_file, lambda line: '"user_id":2}' in line)
+        assert len(list(index.user_lines(username='bob', user_id=2))) == len(bob) + len(
+            list(index.user_lines(user_id=2)))
+        assert list(index.user_lines(username='bo')) == []
+        assert list(index.user_lines()) == []
+
+
+def test_index_follows_rotation(tmp_path):
+    log_file = str(tmp_path / 'mood_tracker.log')
+    write(log_file, log_lines(1, 200))
+    with log_index.LogIndex(log_file) as index:
+        index.update()
+        rotated = os.path.getsize(log_file)
+        os.rename(log_file, log_file + '.1')
+        write(log_file, log_lines(2, 100))
+
+        # Only the new active file is read; the old entry now points at .1.
+        assert index.update() == os.path.getsize(log_file)
+        assert index.stats()['files'] == 2
+        assert list(index.time_range('2024-01-01', '2024-01-03')) == scan(log_file, lambda line: True)
+        assert index.conn.execute("SELECT indexed_offset FROM files WHERE path = ?",
+                                  (log_file + '.1',)).fetchone() == (rotated,)
+
+        # Rotated out of the set: its rows go too.
+        os.remove(log_file + '.1')
+        index.update()
+        assert index.stats()['files'] == 1
+        assert list(index.user_lines(username='alice')) == scan(log_file, lambda line: 'user: alice,' in line)
+
+        # Rewritten in place with the same first line: indexed again from the start.
+        write(log_file, log_lines(2, 10))
+        assert index.update() == os.path.getsize(log_file)
+        assert len(list(index.time_range('2024-01-02', '2024-01-03'))) == 10
+
+
+def test_traceback_lines_keep_the_time_of_their_record(tmp_path):
+    log_file = str(tmp_path / 'mood_tracker.log')
+    traceback = ['2024-01-01 10:00:00,000 - mood_tracker - ERROR - Failed to save entry\n',
+                 'Traceback (most recent call last):\n',
+                 '  File "app.py", line 1, in submit_entry\n',
+                 'ValueError: boom\n']
+    write(log_file, ['Continued from before the file started\n'] + log_lines(1, 3, first=590) + traceback
+          + log_lines(1, 3, first=660))
+    with log_index.LogIndex(log_file) as index:
+        index.update()
+        assert list(index.time_range('2024-01-01 10:00', '2024-01-01 10:01')) == traceback
+        assert len(list(index.time_range('2024-01-01', '2024-01-02'))) == 10
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Tests for reading the log rotation set: files in chronological order with
+gzip archives opened transparently, tail continuing into older files, and
+follow surviving a rotation.
+"""
+
+import gzip
+import os
+
+import log_reader
+
+
+def write_rotation_set(log_dir):
+    """mood_tracker.log.3.gz (oldest) ... mood_tracker.log (newest), four lines each."""
+    log_file = log_dir / 'mood_tracker.log'
+    for suffix, first in (('.3.gz', 0), ('.2', 4), ('.1', 8), ('', 12)):
+        text = ''.join(f'line {number}\n' for number in range(first, first + 4))
+        path = log_dir / f'mood_tracker.log{suffix}'
+        if suffix.endswith('.gz'):
+            with gzip.open(path, 'wt', encoding='utf-8') as f:
+                f.write(text)
+        else:
+            path.write_text(text)
+    (log_dir / 'errors.log.1').write_text('not part of the set\n')
+    return str(log_file)
+
+
+def test_lines_and_tail_across_rotation(tmp_path):
+    log_file = write_rotation_set(tmp_path)
+    assert [os.path.basename(path) for path in log_reader.rotation_set(log_file)] == \
+        ['mood_tracker.log.3.gz', 'mood_tracker.log.2', 'mood_tracker.log.1', 'mood_tracker.log']
+    assert list(log_reader.iter_lines(log_file)) == [f'line {number}\n' for number in range(16)]
+    assert list(log_reader.iter_lines(log_file, include_rotated=False))[0] == 'line 12\n'
+
+    assert log_reader.tail(log_file, 2) == ['line 14\n', 'line 15\n']
+    assert log_reader.tail(log_file, 14) == [f'line {number}\n' for number in range(2, 16)]  # Into the .gz
+    assert len(log_reader.tail(log_file, 100)) == 16
+    assert len(log_reader.tail(log_file, 100, include_rotated=False)) == 4
+    assert log_reader.tail(log_file, 0) == []
+    assert log_reader.tail(str(tmp_path / 'missing.log'), 5) == []
+
+
+def test_tail_reads_backward_in_blocks(tmp_path):
+    path = tmp_path / 'big.log'
+    path.write_text(''.join(f'{number:05d} {"x" * 50}\n' for number in range(5000)))
+    lines = log_reader._tail_plain(str(path), 3, block_size=100)
+    assert [line[:5] for line in lines] == ['04997', '04998', '04999']
+    assert log_reader._tail_plain(str(path), 5000, block_size=4096)[0].startswith('00000')
+
+
+def test_follow_survives_rotation(tmp_path):
+    log_file = tmp_path / 'mood_tracker.log'
+    log_file.write_text('before\n')
+    lines = log_reader.follow(str(log_file), poll_interval=0.01, start_at_end=False)
+    try:
+        assert next(lines) == 'before\n'
+        with open(log_file, 'a') as f:
+            f.write('appended\n')
+        assert next(lines) == 'appended\n'
+
+        os.rename(log_file, tmp_path / 'mood_tracker.log.1')
+        log_file.write_text('after rotation\n')
+        assert next(lines) == 'after rotation\n'  # The new file is read from its start
+    finally:
+        lines.close()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Tests for the one-pass log statistics: chunks end on line boundaries, and
+splitting the rotation set across worker processes gives the same report as
+reading it in one piece.
+"""
+
+import gzip
+import json
+
+import log_stats
+
+
+def lines(day, count):
+    result = []
+    for number in range(count):
+        stamp = f'2024-01-{day:02d} {number // 60 % 24:02d}:{number % 60:02d}:00,{number % 1000:03d}'
+        user = ('alice', 'bob', 'carol')[number % 3]
+        if number % 5 == 0:
+            result.append(f'{stamp} - mood_tracker - INFO - Login attempt for username: {user}\n')
+        elif number % 5 == 1 and user == 'bob':
+            result.append(f'{stamp} - mood_tracker - WARNING - Login failed for username: {user}\n')
+        elif number % 5 == 2:
+            result.append(f'{stamp} - mood_tracker.requests - INFO - '
+                          f'{{"path":"/manage","duration_ms":{number % 40}.5,"user_id":{number % 3 + 1}}}\n')
+        elif number % 50 == 3:
+            result.append(f'{stamp} - mood_tracker - ERROR - Entry edit failed - user: {user}, entry_id: {number}\n')
+        else:
+            result.append(f'{stamp} - mood_tracker - INFO - Manage entries page accessed by user: {user}\n')
+    return ''.join(result)
+
+
+def comparable(report):
+    return {key: value for key, value in report.items() if key not in ('generated_at', 'elapsed_seconds')}
+
+
+def test_parallel_chunks_match_a_single_pass(tmp_path):
+    log_file = tmp_path / 'mood_tracker.log'
+    with gzip.open(f'{log_file}.2.gz', 'wt', encoding='utf-8') as f:
+        f.write(lines(1, 400))
+    (tmp_path / 'mood_tracker.log.1').write_text(lines(2, 1000))
+    log_file.write_text(lines(3, 700))
+
+    chunks = log_stats.plan_chunks(str(log_file), chunk_size=4096)
+    assert len(chunks) > 10
+    for path, start, end in chunks:
+        if not path.endswith('.gz') and start:
+            with open(path, 'rb') as f:
+                f.seek(start - 1)
+                assert f.read(1) == b'\n'
+
+    whole = log_stats.compute_stats(str(log_file), workers=1, chunk_size=10 ** 9)
+    parallel = log_stats.compute_stats(str(log_file), workers=2, chunk_size=4096)
+    assert json.dumps(comparable(parallel), sort_keys=True) == json.dumps(comparable(whole), sort_keys=True)
+
+    assert whole['lines'] == 2100
+    assert whole['logins']['attempts'] == 420
+    assert [row['user'] for row in whole['logins']['top_failed_users']] == ['bob']
+    assert whole['request_latency_ms']['count'] == sum(whole['requests_per_hour'].values()) == 420
+    assert whole['request_latency_ms']['max'] == 37
+    assert whole['error_signatures'][0]['template'].startswith('Login failed for username: <*>')
+    assert {'level': 'ERROR', 'template': 'Entry edit failed - user: <*>, entry_id: <*>', 'count': 42} in \
+        whole['error_signatures']
+    assert len(log_stats.compute_stats(str(log_file), include_rotated=False)['files']) == 1
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Tests for the queued logging pipeline: what each overflow policy keeps when
+the queue is full, that shutdown flushes queued records and reports the
+dropped ones, and that forked workers leave rotation to one process.
+"""
+
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+import pytest
+
+import logging_setup
+
+
+def record(message):
+    return logging.makeLogRecord({'name': 'mood_tracker', 'levelno': logging.INFO,
+                                  'levelname': 'INFO', 'msg': message})
+
+
+def fill(handler, count):
+    for number in range(count):
+        handler.emit(record(f'message {number}'))
+
+
+def queued(log_queue):
+    messages = []
+    while not log_queue.empty():
+        messages.append(log_queue.get_nowait().msg)
+    return messages
+
+
+def test_drop_new_and_drop_oldest():
+    handler = logging_setup.BoundedQueueHandler(queue.Queue(maxsize=3), 'drop_new')
+    fill(handler, 5)
+    assert queued(handler.queue) == ['message 0', 'message 1', 'message 2']
+    assert handler.dropped == 2
+
+    handler = logging_setup.BoundedQueueHandler(queue.Queue(maxsize=3), 'drop_oldest')
+    fill(handler, 5)
+    assert queued(handler.queue) == ['message 2', 'message 3', 'message 4']
+    assert handler.dropped == 2
+
+    with pytest.raises(ValueError):
+        logging_setup.BoundedQueueHandler(queue.Queue(), 'drop_everything')
+
+
+def test_block_waits_for_room():
+    handler = logging_setup.BoundedQueueHandler(queue.Queue(maxsize=2), 'block')
+    fill(handler, 2)
+    writer = threading.Thread(target=fill, args=(handler, 1))
+    writer.start()
+    writer.join(0.2)
+    assert writer.is_alive()  # Blocked on the full queue
+
+    assert handler.queue.get_nowait().msg == 'message 0'
+    writer.join(5)
+    assert not writer.is_alive()
+    assert queued(handler.queue) == ['message 1', 'message 0']
+    assert handler.dropped == 0
+
+
+def test_shutdown_flushes_and_reports_drops(tmp_path):
+    log_dir = tmp_path / 'logs'
+    logging_setup.shutdown_logging()
+    logger = logging_setup.setup_logging(str(log_dir), queue_size=100, console=False)
+    try:
+        for number in range(50):
+            logger.info('queued %d', number)
+        logging_setup._state['handler'].dropped = 7  # As if a burst had overflowed the queue
+    finally:
+        logging_setup.shutdown_logging()
+
+    lines = (log_dir / 'mood_tracker.log').read_text().splitlines()
+    assert sum('queued' in line for line in lines) == 50
+    assert 'Log queue overflow: 7 records dropped' in lines[-1]
+    assert logging_setup.dropped_records() == 0  # Detached
+
+
+def flush():
+    listener = logging_setup._state['listener']
+    listener.stop()
+    listener.start()
+
+
+def file_handlers():
+    return [type(target) for target in logging_setup._state['listener'].handlers]
+
+
+def test_only_the_parent_rotates(tmp_path):
+    log_dir = tmp_path / 'logs'
+    logging_setup.shutdown_logging()
+    logger = logging_setup.setup_logging(str(log_dir), console=False)
+    try:
+        assert file_handlers() == [logging.handlers.RotatingFileHandler] * 2
+        logging_setup._reinit_after_fork()  # As in a worker forked from this process
+        assert file_handlers() == [logging.handlers.WatchedFileHandler] * 2
+
+        logger.info('before rotation')
+        flush()
+        os.rename(log_dir / 'mood_tracker.log', log_dir / 'mood_tracker.log.1')  # By the parent or logrotate
+        logger.info('after rotation')
+    finally:
+        logging_setup.shutdown_logging()
+
+    assert 'before rotation' in (log_dir / 'mood_tracker.log.1').read_text()
+    assert 'after rotation' in (log_dir / 'mood_tracker.log').read_text()
+
+    logging_setup.setup_logging(str(log_dir), console=False, rotation='external')
+    try:
+        assert file_handlers() == [logging.handlers.WatchedFileHandler] * 2
+    finally:
+        logging_setup.shutdown_logging()
+    with pytest.raises(ValueError):
+        logging_setup.setup_logging(str(log_dir), rotation='daily')
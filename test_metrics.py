@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Tests for /metrics: snapshots of several worker processes merge into one
+set of values, exited workers keep their counts, the heatmap and figure
+caches report hits and misses, and every database bind reports its pool.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import jobs
+import metrics
+
+
+def snapshot(metrics_dir, pid, requests, gauge):
+    path = metrics_dir / f'metrics_{pid}.json'
+    path.write_text(json.dumps({
+        'pid': pid,
+        'counters': [['http_requests_total', [['route', 'test']], requests]],
+        'gauges': [['db_pool_checked_out', [['bind', 'test']], gauge],
+                   ['log_records_dropped_total', [], 1]],
+        'histograms': [['http_request_duration_seconds', [['route', 'test']],
+                        {'buckets': [0.1, 1.0], 'counts': [requests, 1, 0], 'sum': requests * 0.05 + 0.5}]],
+    }))
+    return path
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_worker_snapshots_merge_and_exited_workers_are_folded(tmp_path, monkeypatch):
+    metrics_dir = tmp_path / 'metrics'
+    metrics_dir.mkdir()
+    monkeypatch.setitem(metrics._flusher, 'dir', str(metrics_dir))
+    snapshot(metrics_dir, os.getppid(), requests=2, gauge=1)
+    exited = [snapshot(metrics_dir, dead_pid(), requests=3, gauge=5),
+              snapshot(metrics_dir, dead_pid(), requests=100, gauge=7)]
+
+    key = (('route', 'test'),)
+    for _ in range(2):  # Folding exited workers never changes the totals
+        counters, gauges, histograms = metrics.collect()
+        # Counters of exited workers keep counting; their gauges don't.
+        assert counters[('http_requests_total', key)] == 105
+        assert counters[('log_records_dropped_total', ())] == 3
+        assert gauges[('db_pool_checked_out', (('bind', 'test'),))] == 1
+        assert histograms[('http_request_duration_seconds', key)]['counts'] == [105, 3, 0]
+        assert not any(path.exists() for path in exited)
+        assert (metrics_dir / metrics.EXITED_FILE).exists()
+    assert (metrics_dir / f'metrics_{os.getpid()}.json').exists()  # This worker's own snapshot
+
+    snapshot(metrics_dir, dead_pid(), requests=10, gauge=3)
+    assert metrics.collect()[0][('http_requests_total', key)] == 115
+
+    text = metrics.render_prometheus()
+    assert 'mood_tracker_http_requests_total{route="test"} 115' in text
+    assert 'mood_tracker_http_request_duration_seconds_bucket{route="test",le="+Inf"} 119' in text
+
+
+def test_cache_hits_and_pools_of_every_bind(make_app, register, shard_config):
+    app = make_app(**shard_config, ADMIN_USERNAMES=['alice'])
+    client = register(app)
+    client.post('/submit', data={'date': '2024-01-01', 'mood': '5', 'hours_slept': '7', 'anxiety': '3',
+                                 'energy': '6', 'irritability': '2', 'notes': ''})
+
+    def lookups(cache):
+        return [metrics.registry.counters.get(('cache_requests_total', (('cache', cache), ('result', result))), 0)
+                for result in ('hit', 'miss')]
+
+    heatmap_before, figure_before = lookups('heatmap'), lookups('mood_graph')
+    for _ in range(2):
+        client.get('/api/heatmap?metric=mood_level&year=2024')
+    client.get('/visualize')
+    with app.app_context():
+        while jobs.run_next('test-worker'):
+            pass
+    client.get('/visualize')
+    assert [a - b for a, b in zip(lookups('heatmap'), heatmap_before)] == [1, 1]
+    assert [a - b for a, b in zip(lookups('mood_graph'), figure_before)] == [1, 1]
+
+    binds = {dict(labels)['bind'] for name, labels in metrics.registry.histograms
+             if name == 'db_pool_checkout_seconds'}
+    assert {'default', 'shard0', 'shard1'} <= binds
+    assert 'mood_tracker_cache_hit_ratio{cache="heatmap"}' in client.get('/metrics').data.decode()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Tests for the request profiler: only admins can ask for a profile, sampled
+requests are profiled for anyone, summaries carry the render sections and
+SQL statistics, old profiles are pruned, and only one profile runs at a time.
+"""
+
+import os
+
+from flask import Flask, render_template
+from flask_login import LoginManager, UserMixin, login_user
+from jinja2 import DictLoader
+from sqlalchemy import create_engine, text
+
+import profiling
+import request_logging
+
+
+class User(UserMixin):
+    def __init__(self, user_id):
+        self.id = user_id
+        self.username = 'alice' if user_id == 1 else f'user{user_id}'
+
+
+def make_app(tmp_path, **config):
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='test', TESTING=True, PROFILE_DIR=str(tmp_path / 'profiles'), **config)
+    app.jinja_loader = DictLoader({'page.html': '{{ rows|length }} rows'})
+    LoginManager(app).user_loader(lambda user_id: User(int(user_id)))
+    request_logging.init_app(app)
+    profiling.init_app(app, lambda user: user.is_authenticated and user.username == 'alice')
+    engine = create_engine('sqlite://')
+
+    def page():
+        with engine.connect() as connection:
+            rows = connection.execute(text('SELECT 1 UNION ALL SELECT 2')).all()
+        return render_template('page.html', rows=rows)
+
+    def login(user_id):
+        login_user(User(user_id))
+        return 'ok'
+
+    app.add_url_rule('/page', 'page', page)
+    app.add_url_rule('/login/<int:user_id>', 'login', login)
+    return app
+
+
+def logged_in(app, user_id):
+    client = app.test_client()
+    client.get(f'/login/{user_id}')
+    return client
+
+
+def test_requested_profiles_are_admin_only(tmp_path):
+    app = make_app(tmp_path)
+    admin, user = logged_in(app, 1), logged_in(app, 2)
+    assert 'X-Profile-Id' not in user.get('/page', headers={profiling.PROFILE_HEADER: '1'}).headers
+    assert 'X-Profile-Id' not in admin.get('/page').headers
+
+    response = admin.get('/page?_profile=1', headers={request_logging.REQUEST_ID_HEADER: 'abcdef123456'})
+    name = response.headers['X-Profile-Id']
+    assert name.endswith('_page_abcdef12')
+    profile = profiling.load_profile(name)
+    assert profile['reason'] == 'requested' and profile['user'] == 'alice' and profile['status'] == 200
+    assert profile['sql_count'] == 1 and 'render:page.html' in profile['sections_ms']
+    assert profile['functions'] and profile['total_calls'] > 0
+    assert profiling.list_profiles()[0]['name'] == name
+
+    assert profiling.load_profile('../profiling') is None
+    assert profiling.load_profile('missing') is None
+
+
+def test_sampling_and_pruning(tmp_path):
+    client = make_app(tmp_path, PROFILE_SAMPLE_RATE=1.0, PROFILE_MAX_FILES=3).test_client()
+    names = [client.get('/page').headers['X-Profile-Id'] for _ in range(5)]
+    assert profiling.load_profile(names[-1])['reason'] == 'sampled'
+    assert profiling.load_profile(names[-1])['user'] is None
+    assert {profile['name'] for profile in profiling.list_profiles()} == set(names[2:])  # The newest 3
+    assert sorted(os.listdir(tmp_path / 'profiles')) == sorted(f'{name}.{ext}' for name in names[2:]
+                                                               for ext in ('json', 'prof'))
+
+    client = make_app(tmp_path, PROFILE_ENABLED=False, PROFILE_SAMPLE_RATE=1.0).test_client()
+    assert 'X-Profile-Id' not in client.get('/page').headers
+
+
+class BusyProfile:
+    """A profiler that cannot start, as when another one is attached on Python 3.12+."""
+
+    def enable(self):
+        raise ValueError('Another profiling tool is already active')
+
+
+def test_one_profile_at_a_time(tmp_path, monkeypatch):
+    admin = logged_in(make_app(tmp_path), 1)
+    with profiling._active:  # Another request is being profiled
+        response = admin.get('/page?_profile=1')
+    assert response.status_code == 200 and 'X-Profile-Id' not in response.headers
+    assert 'X-Profile-Id' in admin.get('/page?_profile=1').headers
+
+    monkeypatch.setattr(profiling.cProfile, 'Profile', BusyProfile)
+    response = admin.get('/page?_profile=1')
+    assert response.status_code == 200 and 'X-Profile-Id' not in response.headers
+    assert not profiling._active.locked()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Tests for the login and registration rate limits: the sliding-window
+estimate and Retry-After, the bounded memory store, 429s that come before
+any password hashing, failed logins counting per username across
+addresses, client addresses behind a trusted proxy, and the database store
+shared by workers.
+"""
+
+import pytest
+from sqlalchemy import func, select
+
+import ratelimit
+from models import db, RateLimitCount, User
+
+
+def register(client, app, username):
+    return client.post('/register', data={'username': username, 'email': f'{username}@example.com',
+                                          'password': 'password', 'confirm_password': 'password',
+                                          'beta_code': app.config['BETA_CODE']})
+
+
+def login(client, username, password, address='10.0.0.1'):
+    return client.post('/login', data={'username': username, 'password': password},
+                       environ_base={'REMOTE_ADDR': address})
+
+
+def test_sliding_window():
+    store = ratelimit.MemoryStore(size=10)
+    key = b'k' * 16
+    assert [store.attempt(key, 3, 60, now) for now in (0, 10, 20, 30)] == [0, 0, 0, 31]
+    # Refused attempts don't count; at 59s the full window is still the 3 attempts.
+    assert store.retry_after(key, 3, 60, 59) == 2
+    # 30s into the next window half of the previous one still counts: 1.5, then 2.5.
+    assert store.attempt(key, 3, 60, 90) == 0
+    assert store.attempt(key, 3, 60, 91) == 0
+    assert store.attempt(key, 3, 60, 92) == 9  # 3 * (1 - t/60) + 2 drops below 3 once t passes 40s
+    assert store.retry_after(key, 3, 60, 103) == 0
+    # A window with nothing before it allows the full count again.
+    assert store.retry_after(key, 3, 60, 240) == 0
+
+    for number in range(20):
+        store.attempt(bytes([number]) * 16, 3, 60, 300)
+    assert len(store.counts) == 10 and key not in store.counts
+
+
+def test_login_limits_come_before_hashing(make_app, monkeypatch):
+    app = make_app(LOGIN_LIMIT_PER_IP=4, LOGIN_LIMIT_PER_USERNAME=2)
+    client = app.test_client()
+    register(client, app, 'alice')
+    register(client, app, 'bob')
+    hashes = []
+    original = User.check_password
+    monkeypatch.setattr(User, 'check_password', lambda self, password: hashes.append(1) or original(self, password))
+
+    # Failed logins count per username, whatever address they come from.
+    assert login(client, 'alice', 'wrong', '10.0.0.1').status_code == 200
+    assert login(client, 'alice', 'wrong', '10.0.0.2').status_code == 200
+    response = login(client, 'alice', 'password', '10.0.0.3')
+    assert response.status_code == 429 and int(response.headers['Retry-After']) > 0
+    assert b'Too many attempts' in response.data
+    assert len(hashes) == 2
+    # Other usernames aren't affected; successful logins don't count against the username.
+    for _ in range(3):
+        assert login(app.test_client(), 'bob', 'password', '10.0.0.1').status_code == 302
+
+    # Every attempt from an address counts: 10.0.0.1 has used its 4.
+    response = login(client, 'bob', 'password', '10.0.0.1')
+    assert response.status_code == 429 and response.headers['Retry-After']
+    assert len(hashes) == 5
+
+    app.extensions['rate_limit'].counts.clear()
+    assert login(client, 'alice', 'password', '10.0.0.1').status_code == 302
+
+
+def test_register_limit_and_off_switch(make_app):
+    app = make_app(REGISTER_LIMIT_PER_IP=2, LOGIN_LIMIT_PER_IP=0, LOGIN_LIMIT_PER_USERNAME=0)
+    client = app.test_client()
+    assert register(client, app, 'alice').status_code == 302
+    assert register(client, app, 'alice').status_code == 200  # Taken: still an attempt
+    response = register(client, app, 'bob')
+    assert response.status_code == 429 and response.headers['Retry-After']
+    with app.app_context():
+        assert db.session.execute(select(func.count()).select_from(User)).scalar() == 1
+    # Limits set to 0 are off.
+    for _ in range(20):
+        assert login(client, 'alice', 'wrong').status_code == 200
+    assert client.get('/login').status_code == 200
+
+
+def test_client_address_behind_a_proxy(make_app):
+    def attempts(app, forwarded_for):
+        client = app.test_client()
+        return [client.post('/login', data={'username': 'alice', 'password': 'wrong'},
+                            environ_base={'REMOTE_ADDR': '10.0.0.254'},
+                            headers={'X-Forwarded-For': address}).status_code for address in forwarded_for]
+
+    # Without trusted proxies the header is ignored: one address, one count.
+    app = make_app(LOGIN_LIMIT_PER_IP=2, LOGIN_LIMIT_PER_USERNAME=0)
+    assert attempts(app, ['203.0.113.1', '203.0.113.2', '203.0.113.3']) == [200, 200, 429]
+    app = make_app(LOGIN_LIMIT_PER_IP=2, LOGIN_LIMIT_PER_USERNAME=0, TRUSTED_PROXY_HOPS=1)
+    assert attempts(app, ['203.0.113.1', '203.0.113.2', '203.0.113.1', '203.0.113.1']) == [200, 200, 200, 429]
+    # Only the address the trusted proxy added counts, not what the client put before it.
+    assert attempts(app, ['198.51.100.7, 203.0.113.1']) == [429]
+
+
+def test_database_store_is_shared_by_workers(make_app):
+    workers = [make_app(RATE_LIMIT_STORE='database', LOGIN_LIMIT_PER_IP=3) for _ in range(2)]
+    register(workers[0].test_client(), workers[0], 'alice')
+    for number in range(3):
+        assert login(workers[number % 2].test_client(), 'alice', 'wrong').status_code == 200
+    assert login(workers[1].test_client(), 'alice', 'wrong').status_code == 429
+    assert login(workers[0].test_client(), 'alice', 'wrong', '10.0.0.9').status_code == 200
+    with workers[0].app_context():
+        # 10.0.0.1, 10.0.0.9 and alice's failures; the registration from 127.0.0.1.
+        assert db.session.execute(select(func.sum(RateLimitCount.count))).scalar() == 3 + 1 + 4 + 1
+
+    # Memory stores count per worker.
+    workers = [make_app(LOGIN_LIMIT_PER_IP=3) for _ in range(2)]
+    for number in range(4):
+        assert login(workers[number % 2].test_client(), 'nobody', 'wrong').status_code == 200
+
+    with pytest.raises(ValueError):
+        make_app(RATE_LIMIT_STORE='redis')
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Tests for the read replica: read-only routes read from it once it has the
+user's latest write, and fall back to the primary while it is behind,
+stale or unreadable.
+"""
+
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import metrics
+import replica_sync
+from models import db, User
+
+START = date(2024, 1, 1)
+
+
+@pytest.fixture
+def app(tmp_path, make_app):
+    app = make_app(REPLICA_DATABASE_URI=f"sqlite:///{tmp_path / 'replica.db'}", REPLICA_LAG_CHECK_INTERVAL=0)
+    app.tmp_path = tmp_path
+    with app.app_context():
+        for name in ('alice', 'bob'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password('password')
+            db.session.add(user)
+        db.session.commit()
+    return app
+
+
+def form(day, mood=5):
+    return {'date': (START + timedelta(days=day)).isoformat(), 'mood': str(mood), 'hours_slept': '7',
+            'anxiety': '3', 'energy': '6', 'irritability': '2', 'notes': ''}
+
+
+def sync(app):
+    with app.app_context():
+        assert replica_sync.sync_once()
+
+
+def on_replica(app, sql, *params):
+    with sqlite3.connect(app.tmp_path / 'replica.db') as conn:
+        conn.execute(sql, params)
+
+
+def reads(target, reason):
+    return metrics.registry.counters.get(('replica_reads_total', (('reason', reason), ('target', target))), 0)
+
+
+def moods(client, path='/data'):
+    return sorted(entry['mood'] for entry in client.get(path).get_json())
+
+
+def test_reads_wait_for_the_replica_to_catch_up(app, login):
+    client = login(app)
+    client.post('/submit', data=form(0, mood=3))
+    # The replica has never been synced: primary.
+    assert moods(client) == [3]
+    sync(app)
+
+    client.post('/submit', data=form(1, mood=4))
+    behind = reads('primary', 'read_your_writes')
+    # The replica is fresh but lacks this session's write.
+    assert moods(client) == [3, 4]
+    assert reads('primary', 'read_your_writes') == behind + 1
+
+    sync(app)
+    # Marked on the replica only, so the answer shows where it came from.
+    on_replica(app, "UPDATE mood_entry SET mood_level = 9")
+    fresh = reads('replica', 'fresh')
+    assert moods(client) == [9, 9]
+    assert reads('replica', 'fresh') == fresh + 1
+    assert client.get('/manage').status_code == 200
+    assert client.get('/visualize').status_code == 200
+
+    # Another session that hasn't written reads the replica straight away.
+    client.post('/submit', data=form(2, mood=5))
+    assert moods(login(app, 'alice')) == [9, 9]
+    assert moods(client) == [3, 4, 5]
+
+
+def test_stale_or_missing_replica_falls_back_to_primary(app, login):
+    client = login(app)
+    client.post('/submit', data=form(0, mood=3))
+    sync(app)
+    on_replica(app, "UPDATE mood_entry SET mood_level = 9")
+    assert moods(client) == [9]
+
+    old = datetime.utcnow() - timedelta(seconds=app.config['REPLICA_MAX_LAG_SECONDS'] + 5)
+    on_replica(app, "UPDATE replica_heartbeat SET beat_at = ?", old.isoformat(sep=' '))
+    stale = reads('primary', 'stale')
+    assert moods(client) == [3]
+    assert reads('primary', 'stale') == stale + 1
+    assert metrics.registry.gauges[('replica_lag_seconds', ())] > app.config['REPLICA_MAX_LAG_SECONDS']
+
+    on_replica(app, "DROP TABLE replica_heartbeat")
+    unavailable = reads('primary', 'unavailable')
+    assert moods(client) == [3]
+    assert reads('primary', 'unavailable') == unavailable + 1
+
+
+def test_writes_and_other_routes_use_the_primary(app, login):
+    client = login(app)
+    sync(app)
+    client.post('/submit', data=form(0))
+    client.post('/add_medication', data={'medication_name': 'Med A'})
+    with sqlite3.connect(app.tmp_path / 'replica.db') as conn:
+        assert conn.execute("SELECT count(*) FROM mood_entry").fetchone() == (0,)
+    # Sync reads the change log, which isn't replicated.
+    assert len(client.get('/api/sync/snapshot').get_json()['entries']) == 1
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests for the JSON request log: sampled requests, server errors logged
+whatever the sample rate, the request ID header and the per-request SQL
+statistics.
+"""
+
+import json
+import logging
+
+import pytest
+from flask import Flask
+from flask_login import LoginManager, UserMixin, login_user
+from sqlalchemy import create_engine, text
+
+import request_logging
+
+
+class User(UserMixin):
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+def make_app(**config):
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='test', TESTING=True, **config)
+    LoginManager(app).user_loader(lambda user_id: User(int(user_id)))
+    request_logging.init_app(app)
+    engine = create_engine('sqlite://')
+
+    def query():
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+            connection.execute(text('SELECT 2'))
+        return 'ok'
+
+    def login(user_id):
+        login_user(User(user_id))
+        return 'ok'
+
+    app.add_url_rule('/page', 'page', lambda: 'ok')
+    app.add_url_rule('/boom', 'boom', lambda: ('boom', 500))
+    app.add_url_rule('/query', 'query', query)
+    app.add_url_rule('/login/<int:user_id>', 'login', login)
+    return app
+
+
+class Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(json.loads(record.getMessage()))
+
+
+@pytest.fixture
+def lines():
+    """The request log lines written during a test, parsed."""
+    handler = Capture()
+    logger = request_logging.request_logger
+    saved = logger.handlers, logger.propagate, logger.level
+    logger.handlers, logger.propagate = [handler], False
+    logger.setLevel(logging.INFO)
+    yield handler.lines
+    logger.handlers, logger.propagate = saved[:2]
+    logger.setLevel(saved[2])
+
+
+def test_sampling_keeps_server_errors(lines, monkeypatch):
+    draws = iter([0.1, 0.9, 0.4, 0.6] + [0.99] * 10)
+    monkeypatch.setattr(request_logging.random, 'random', lambda: next(draws))
+    client = make_app(REQUEST_LOG_SAMPLE_RATE=0.5).test_client()
+    for _ in range(4):
+        client.get('/page')
+    assert len(lines) == 2  # The draws under 0.5
+    for _ in range(3):
+        client.get('/boom')
+    assert [line['status'] for line in lines[2:]] == [500] * 3
+
+    # A rate of 0 samples nothing but server errors; REQUEST_LOG_ENABLED off logs nothing.
+    del lines[:]
+    client = make_app(REQUEST_LOG_SAMPLE_RATE=0.0).test_client()
+    client.get('/page')
+    client.get('/boom')
+    assert [line['path'] for line in lines] == ['/boom']
+    response = make_app(REQUEST_LOG_ENABLED=False).test_client().get('/boom')
+    assert len(lines) == 1
+    assert response.headers[request_logging.REQUEST_ID_HEADER]  # IDs are kept for the other instrumentation
+
+
+def test_request_line(lines):
+    client = make_app().test_client()
+    client.get('/page')
+    client.get('/login/7')
+    response = client.get('/query', headers={request_logging.REQUEST_ID_HEADER: 'proxy-id-1'})
+    bad = client.get('/page', headers={request_logging.REQUEST_ID_HEADER: 'not valid!'})
+
+    assert lines[0]['user_id'] is None
+    line = lines[2]
+    assert response.headers[request_logging.REQUEST_ID_HEADER] == line['request_id'] == 'proxy-id-1'
+    assert line['endpoint'] == 'query' and line['status'] == 200 and line['user_id'] == 7
+    assert line['sql_count'] == 2 and line['db_time_ms'] >= 0 and line['response_bytes'] == 2
+    assert lines[3]['request_id'] != 'not valid!'
+    assert len(bad.headers[request_logging.REQUEST_ID_HEADER]) == 32
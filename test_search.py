@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Tests for notes search: the FTS5 index follows every write path, results
+are ranked, filtered by date and limited to the user, and keyset pages
+cover every match exactly once.
+"""
+
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import text
+
+import search
+import sharding
+from models import db, MoodEntry, User
+
+START = date(2024, 1, 1)
+
+
+def form(day, notes):
+    return {'date': day.isoformat(), 'mood': '5', 'hours_slept': '7', 'anxiety': '3', 'energy': '6',
+            'irritability': '2', 'notes': notes}
+
+
+def found(client, query, **params):
+    response = client.get('/api/search', query_string=dict(q=query, **params))
+    assert response.status_code == 200, response.get_json()
+    return [result['date'] for result in response.get_json()['results']]
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+def test_index_follows_every_write_path(app, register):
+    alice, bob = register(app, 'alice'), register(app, 'bob')
+    alice.post('/submit', data=form(START, 'Interview for the new job went well'))
+    alice.post('/api/entries/batch', json={'entries': [
+        {'date': (START + timedelta(days=1)).isoformat(), 'mood': 6, 'hours_slept': 7, 'anxiety': 2, 'energy': 5,
+         'irritability': 1, 'notes': 'First day at the new job'},
+        {'date': (START + timedelta(days=2)).isoformat(), 'mood': 6, 'hours_slept': 7, 'anxiety': 2, 'energy': 5,
+         'irritability': 1, 'notes': 'Quiet weekend'}]})
+    bob.post('/submit', data=form(START, 'Looking for a new job'))
+
+    assert found(alice, 'job') == ['2024-01-02', '2024-01-01']
+    assert found(bob, 'job') == ['2024-01-01']
+    snippet = alice.get('/api/search?q=interview').get_json()['results'][0]['snippet']
+    assert snippet == '<mark>Interview</mark> for the new job went well'
+    # Stemming, prefixes and phrases.
+    assert found(alice, 'jobs') == found(alice, 'job')
+    assert found(alice, 'interv*') == ['2024-01-01']
+    assert found(alice, '"new job" first') == ['2024-01-02']
+    assert found(alice, 'job weekend') == []
+
+    with app.app_context():
+        ids = {e.entry_date: e.id for e in MoodEntry.query.join(User).filter(User.username == 'alice')}
+    alice.post(f'/edit/{ids[START]}', data=form(START, 'Rejected <again> & tired'))
+    alice.post(f'/delete/{ids[START + timedelta(days=1)]}')
+    assert found(alice, 'job') == []
+    assert alice.get('/api/search?q=again').get_json()['results'][0]['snippet'] == \
+        'Rejected &lt;<mark>again</mark>&gt; &amp; tired'
+
+    with app.app_context():
+        # The note text in the index matches mood_entry.
+        db.session.execute(text("INSERT INTO mood_entry_fts(mood_entry_fts, rank) VALUES ('integrity-check', 1)"))
+
+
+def test_ranking_dates_and_keyset_pages(app, register):
+    client = register(app, 'alice')
+    for offset in range(25):
+        notes = 'tired ' * (1 + offset % 4) + f'day {offset}'
+        client.post('/submit', data=form(START + timedelta(days=offset), notes))
+    client.post('/submit', data=form(START + timedelta(days=30), 'nothing to report'))
+
+    first = found(client, 'tired', limit=50)
+    # More mentions in a shorter note rank higher.
+    assert first[0] in {(START + timedelta(days=offset)).isoformat() for offset in range(3, 25, 4)}
+    assert found(client, 'tired', **{'from': '2024-01-10', 'to': '2024-01-12'}) == \
+        sorted(['2024-01-10', '2024-01-11', '2024-01-12'], key=first.index)
+
+    pages, cursor = [], None
+    while True:
+        params = {'q': 'tired', 'limit': 7, **({'cursor': cursor} if cursor else {})}
+        body = client.get('/api/search', query_string=params).get_json()
+        pages.append([result['date'] for result in body['results']])
+        ranks = [result['rank'] for result in body['results']]
+        assert ranks == sorted(ranks)
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert [len(page) for page in pages] == [7, 7, 7, 4]
+    assert sum(pages, []) == first
+
+    assert client.get('/api/search?q=').status_code == 400
+    assert client.get('/api/search?q=%22%20*').status_code == 400
+    assert client.get('/api/search?q=tired&cursor=nope').status_code == 400
+    assert client.get('/api/search?q=tired&from=yesterday').status_code == 400
+    assert client.get('/api/search?q=tired&limit=500').status_code == 400
+    # FTS5 operators in the input are searched as words, not parsed.
+    assert client.get('/api/search?q=tired AND (NEAR').status_code == 200
+
+
+def test_index_of_existing_entries_and_sharded_moves(make_app, register, shard_config):
+    app = make_app(**shard_config)
+    client = register(app, 'ann')
+    client.post('/submit', data=form(START, 'Started pottery class'))
+    with app.app_context():
+        user_id = User.query.one().id
+        sharding.move_user(user_id, (user_id + 1) % 2)
+    assert found(client, 'pottery') == ['2024-01-01']
+
+    # An index added to a database that already has entries is filled from them.
+    with app.app_context():
+        engine = db.engines[sharding.bind_key((user_id + 1) % 2)]
+        with engine.begin() as conn:
+            for statement in ('DROP TABLE mood_entry_fts', 'DROP TRIGGER mood_entry_fts_insert'):
+                conn.execute(text(statement))
+        assert search.install(engine)
+        assert not search.install(engine)
+    assert found(client, 'pottery') == ['2024-01-01']
+    client.post('/submit', data=form(START + timedelta(days=1), 'More pottery'))
+    assert found(client, 'pottery') == ['2024-01-02', '2024-01-01']
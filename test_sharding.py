@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Tests for sharded storage: routes read and write the logged-in user's shard
+without knowing about it, the directory holds only users, and moving a user
+between shards while they are writing loses nothing.
+"""
+
+import sqlite3
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+import changelog
+import entry_store
+import sharding
+import shard_tool
+from models import db, MoodEntry, User
+
+SHARDS = 4
+START = date(2024, 1, 1)
+
+
+@pytest.fixture
+def app(tmp_path, make_app, shard_config):
+    app = make_app(**dict(shard_config, SHARD_COUNT=SHARDS))
+    app.tmp_path = tmp_path
+    return app
+
+
+def form(day, mood=5):
+    return {'date': (START + timedelta(days=day)).isoformat(), 'mood': str(mood), 'hours_slept': '7',
+            'anxiety': '3', 'energy': '6', 'irritability': '2', 'notes': ''}
+
+
+def rows(path, sql, *params):
+    with sqlite3.connect(path) as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def shard_file(app, shard):
+    return app.tmp_path / f'shard{shard}.db'
+
+
+def user_id(app, name):
+    with app.app_context():
+        return User.query.filter_by(username=name).one().id
+
+
+def test_routes_use_the_users_shard(app, register):
+    clients = {name: register(app, name) for name in ('ann', 'ben', 'cat', 'dan', 'eve')}
+    for day, client in enumerate(clients.values()):
+        client.post('/submit', data=form(day))
+        client.post('/add_medication', data={'medication_name': f'Med {day}'})
+        client.post('/api/entries/batch', json={'entries': [
+            {'date': (START + timedelta(days=10 + day)).isoformat(), 'mood': 4, 'hours_slept': 8,
+             'anxiety': 1, 'energy': 5, 'irritability': 0}]})
+
+    directory = app.tmp_path / 'directory.db'
+    assert rows(directory, "SELECT name FROM sqlite_master WHERE name = 'mood_entry'") == []
+    for name, client in clients.items():
+        uid = user_id(app, name)
+        shard = uid % SHARDS
+        assert rows(directory, "SELECT shard FROM user_shard WHERE user_id = ?", uid) == [(shard,)]
+        assert len(rows(shard_file(app, shard), "SELECT id FROM mood_entry WHERE user_id = ?", uid)) == 2
+        for other in set(range(SHARDS)) - {shard}:
+            assert rows(shard_file(app, other), "SELECT id FROM mood_entry WHERE user_id = ?", uid) == []
+        assert len(client.get('/data').get_json()) == 2
+        assert len(client.get('/api/sync/snapshot').get_json()['entries']) == 2
+        assert client.get('/manage').status_code == 200
+
+    with app.app_context():
+        with pytest.raises(sharding.NoShardSelected):
+            MoodEntry.query.count()
+
+
+def test_change_log_compaction_covers_every_shard(app, register):
+    names = ('ann', 'ben', 'cat')
+    for name in names:
+        client = register(app, name)
+        client.post('/submit', data=form(0))
+        with app.app_context(), sharding.use_shard(user_id(app, name) % SHARDS):
+            entry_id = MoodEntry.query.one().id
+        for mood in (6, 7):
+            client.post(f'/edit/{entry_id}', data=form(0, mood=mood))
+    shards = {user_id(app, name) % SHARDS for name in names}
+    assert len(shards) == 3
+
+    with app.app_context():
+        # Two superseded rows per user, each on their own shard.
+        assert changelog.compact(retention_days=30) == (6, 0)
+        db.session.commit()
+    for shard in shards:
+        assert rows(shard_file(app, shard), "SELECT op FROM change_log") == [('upsert',)]
+
+
+def test_move_user_keeps_data_and_rejects_stale_writes(app, register):
+    client = register(app, 'ann')
+    for day in range(5):
+        client.post('/submit', data=form(day, mood=day))
+    client.post('/add_medication', data={'medication_name': 'Med A'})
+    cursor = client.get('/api/sync/snapshot').get_json()['cursor']
+    before = client.get('/data').get_json()
+
+    uid = user_id(app, 'ann')
+    source, target = uid % SHARDS, (uid + 1) % SHARDS
+    with app.app_context():
+        assert sharding.move_user(uid, target) == (5, 1, 0)
+
+    assert client.get('/data').get_json() == before
+    assert rows(shard_file(app, source), "SELECT count(*) FROM mood_entry WHERE user_id = ?", uid) == [(0,)]
+    assert rows(shard_file(app, target), "SELECT count(*) FROM mood_entry WHERE user_id = ?", uid) == [(5,)]
+    # Entry ids changed, so sync clients start over.
+    assert client.get(f'/api/sync?cursor={cursor}').status_code == 410
+    client.post('/submit', data=form(20))
+    assert len(client.get('/data').get_json()) == 6
+
+    # A request still routed to the old shard cannot write there.
+    with pytest.raises(sqlite3.IntegrityError, match=sharding.MOVED_MESSAGE):
+        with sqlite3.connect(shard_file(app, source)) as conn:
+            conn.execute("INSERT INTO mood_entry (user_id, entry_date, mood_level, hours_slept, anxiety, "
+                         "energy_level, irritability) VALUES (?, '2024-06-01', 5, 7, 3, 5, 2)", (uid,))
+
+    # Moving back works too.
+    with app.app_context():
+        assert sharding.move_user(uid, source)[0] == 6
+    assert len(client.get('/data').get_json()) == 6
+
+
+def test_move_during_writes_loses_nothing(app, register):
+    register(app, 'ann')
+    uid = user_id(app, 'ann')
+    saved, failed = [], []
+    stop = threading.Event()
+
+    def writer():
+        day = 0
+        while not stop.is_set() and day < 400:
+            with app.app_context():
+                sharding.bind_user(uid)
+                entry_date = START + timedelta(days=day)
+                try:
+                    entry_store.save_entry(uid, entry_date, entry_store.entry_values_from_form(form(day)))
+                    db.session.commit()
+                    saved.append(entry_date)
+                except Exception as e:
+                    db.session.rollback()
+                    failed.append(e)
+            day += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        with app.app_context():
+            for hop in range(1, 4):
+                while len(saved) < 20 * hop:
+                    stop.wait(0.005)
+                sharding.move_user(uid, (uid + hop) % SHARDS)
+    finally:
+        stop.set()
+        thread.join()
+
+    final = (uid + 3) % SHARDS
+    stored = {date.fromisoformat(d) for (d,) in rows(
+        shard_file(app, final), "SELECT entry_date FROM mood_entry WHERE user_id = ?", uid)}
+    assert set(saved) <= stored
+    assert all(sharding.user_moved(e) or 'locked' in str(e) for e in failed)
+
+
+def test_rebalance_plan_evens_out_shards():
+    loads = {0: {1: 300, 2: 250, 3: 100}, 1: {4: 50}, 2: {}, 3: {5: 10}}
+    moves = shard_tool.plan_rebalance(loads)
+    totals = {shard: sum(users.values()) for shard, users in loads.items()}
+    for user_id, source, target in moves:
+        count = loads[source].pop(user_id)
+        loads[target][user_id] = count
+        totals[source] -= count
+        totals[target] += count
+    assert max(totals.values()) <= 300
+    assert len(moves) == 2
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Tests for the slow query recorder: statements that differ only in literals
+or the length of an IN list group together, occurrences keep parameter
+types but not values, and the plan is captured once per statement.
+"""
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+import slow_queries
+
+
+def test_normalize_statement():
+    normalize = slow_queries.normalize_statement
+    assert normalize("SELECT * FROM mood_entry\n  WHERE user_id = 42 AND notes = 'it''s fine'") == \
+        'SELECT * FROM mood_entry WHERE user_id = ? AND notes = ?'
+    assert normalize('SELECT * FROM entry_score WHERE entry_id IN (?, ?, ?)') == \
+        normalize("SELECT * FROM entry_score WHERE entry_id IN (1, 2.5, 'x', 7)") == \
+        'SELECT * FROM entry_score WHERE entry_id IN (?)'
+    assert normalize('SELECT mood_level FROM shard1.mood_entry') == 'SELECT mood_level FROM shard1.mood_entry'
+
+
+def test_redact_parameters():
+    redact = slow_queries.redact_parameters
+    assert redact(None) is None
+    assert redact(('alice', 7, 1.5, None)) == ['<str>', '<int>', '<float>', '<NoneType>']
+    assert redact({'username': 'alice', 'id': 1}) == {'username': '<str>', 'id': '<int>'}
+    assert redact([('alice', 1), ('bob', 2)]) == ['<2 rows>']
+    assert redact('alice') == '<str>'
+
+
+def test_slow_statements_are_grouped_and_redacted(monkeypatch):
+    app = Flask(__name__)
+    app.config.update(SLOW_QUERY_ENABLED=True, SLOW_QUERY_THRESHOLD_MS=0)  # Every statement is slow
+    monkeypatch.setitem(slow_queries._settings, 'threshold', slow_queries._settings['threshold'])
+    slow_queries.init_app(app)
+    slow_queries.reset()
+    engine = create_engine('sqlite://')
+    try:
+        with engine.connect() as connection:
+            connection.execute(text('CREATE TABLE user (id INTEGER PRIMARY KEY, username TEXT)'))
+            for username in ('alice', 'bob', 'carol'):
+                connection.execute(text('SELECT id FROM user WHERE username = :name OR id IN (1, 2)'),
+                                   {'name': username})
+        statements = [row for row in slow_queries.summary(limit=None)
+                      if row['statement'] == 'SELECT id FROM user WHERE username = ? OR id IN (?)']
+        assert len(statements) == 1 and statements[0]['count'] == 3
+        assert any('user' in line for line in statements[0]['plan'])
+
+        occurrences = [row for row in slow_queries.recent(limit=None) if 'username = ' in row['statement']]
+        assert len(occurrences) == 3
+        assert all(row['parameters'] == ['<str>'] for row in occurrences)
+        with engine.connect() as connection:
+            connection.execute(text("SELECT id FROM user WHERE username = 'dave'"))
+        assert slow_queries.recent(limit=1)[0]['statement'] == 'SELECT id FROM user WHERE username = ?'
+        assert 'alice' not in str(slow_queries.export()) and 'dave' not in str(slow_queries.export())
+    finally:
+        slow_queries.reset()
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Cold-start budget: a fresh process must import app, build it and serve its
+first request without loading the charting stack, within the budget in
+benchmarks/bench_startup.py.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+from bench_startup import BUDGET, check_budget, measure_startup
+
+
+def test_cold_start_within_budget():
+    # Best of three keeps a busy machine from failing the build on one slow start.
+    results = [measure_startup() for _ in range(3)]
+    best = min(results, key=lambda r: r['time_to_first_request_ms'])
+    assert check_budget(best) == [], f"startup over budget {BUDGET}: {best}"
+
+
+def test_heavy_modules_are_loaded_lazily():
+    result = measure_startup()
+    assert result['heavy_modules_loaded'] == []
+    # The chart stack still works once it is actually needed.
+    assert result['rss_after_first_chart_mb'] >= result['rss_after_first_request_mb']
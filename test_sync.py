@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Tests for delta sync: every mutating route writes the change log, /api/sync
+returns only what changed after a cursor (paginated), and compaction forces
+clients with old cursors to resync.
+"""
+
+import random
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import changelog
+from app import create_app
+from models import db, ChangeLog, MoodEntry, SyncState, User
+
+START = date(2024, 1, 1)
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(SYNC_PAGE_SIZE=50)
+    with app.app_context():
+        for name in ('alice', 'bob'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password('password')
+            db.session.add(user)
+        db.session.commit()
+    return app
+
+
+def form(day, mood=5, medications=()):
+    return {'date': (START + timedelta(days=day)).isoformat(), 'mood': str(mood), 'hours_slept': '7',
+            'anxiety': '3', 'energy': '6', 'irritability': '2', 'notes': '',
+            'medications_taken': [str(m) for m in medications]}
+
+
+class Mirror:
+    """A client-side copy kept up to date with /api/sync."""
+
+    def __init__(self, client, limit=None):
+        self.client = client
+        self.limit = limit
+        self.cursor = 0
+        self.entries = {}
+        self.medications = {}
+        self.pages = 0
+
+    def pull(self):
+        while True:
+            query = f'/api/sync?cursor={self.cursor}' + (f'&limit={self.limit}' if self.limit else '')
+            response = self.client.get(query)
+            if response.status_code == 410:
+                self.resync()
+                return
+            body = response.get_json()
+            self.pages += 1
+            self.entries.update((e['id'], e) for e in body['entries'])
+            self.medications.update((m['id'], m) for m in body['medications'])
+            for entry_id in body['deleted_entries']:
+                self.entries.pop(entry_id, None)
+            self.cursor = body['cursor']
+            if not body['more']:
+                return
+
+    def resync(self):
+        body = self.client.get('/api/sync/snapshot').get_json()
+        self.entries = {e['id']: e for e in body['entries']}
+        self.medications = {m['id']: m for m in body['medications']}
+        self.cursor = body['cursor']
+
+    def matches_server(self):
+        body = self.client.get('/api/sync/snapshot').get_json()
+        return (self.entries == {e['id']: e for e in body['entries']}
+                and self.medications == {m['id']: m for m in body['medications']})
+
+
+def test_every_mutating_route_is_logged(app, login):
+    client = login(app)
+    client.post('/add_medication', data={'medication_name': 'Med A'})
+    mirror = Mirror(client)
+    mirror.pull()
+    (med_id,) = mirror.medications
+    client.post('/submit', data=form(0, medications=[med_id]))
+    client.post('/submit', data=form(1))
+    client.post('/api/entries/batch', json={'entries': [
+        {'date': (START + timedelta(days=2)).isoformat(), 'mood': 4, 'hours_slept': 8,
+         'anxiety': 1, 'energy': 5, 'irritability': 0}]})
+    cursor = mirror.cursor
+    mirror.pull()
+    assert len(mirror.entries) == 3
+    assert [e['medications'] for e in sorted(mirror.entries.values(), key=lambda e: e['date'])][0] == [med_id]
+
+    first_id, second_id = sorted(mirror.entries)[:2]
+    client.post(f'/edit/{first_id}', data=form(0, mood=9))
+    client.post(f'/delete/{second_id}')
+    client.post(f'/edit_medication/{med_id}', data={'medication_name': 'Med B'})
+    client.post(f'/deactivate_medication/{med_id}')
+    body = client.get(f'/api/sync?cursor={mirror.cursor}').get_json()
+    assert [e['mood'] for e in body['entries']] == [9]
+    assert body['deleted_entries'] == [second_id]
+    assert body['medications'] == [{'id': med_id, 'name': 'Med B', 'active': False}]
+    assert body['cursor'] > mirror.cursor > cursor
+
+    # Nothing new: same cursor back, empty page.
+    again = client.get(f"/api/sync?cursor={body['cursor']}").get_json()
+    assert (again['cursor'], again['entries'], again['deleted_entries'], again['more']) == (body['cursor'], [], [], False)
+
+    # Bob sees none of it.
+    assert login(app, 'bob').get('/api/sync?cursor=0').get_json()['entries'] == []
+
+
+def test_paginated_mirror_matches_server(app, login):
+    client = login(app)
+    for name in ('A', 'B'):
+        client.post('/add_medication', data={'medication_name': f'Med {name}'})
+    rng = random.Random(7)
+    mirror = Mirror(client, limit=3)
+    for step in range(60):
+        day = rng.randrange(20)
+        action = rng.random()
+        if action < 0.6:
+            client.post('/api/entries/batch', json={'entries': [
+                {'date': (START + timedelta(days=day)).isoformat(), 'mood': rng.randrange(11), 'hours_slept': 7,
+                 'anxiety': 2, 'energy': 3, 'irritability': 1, 'medications': [1] if rng.random() < 0.5 else []}]})
+        elif mirror.entries or action < 0.9:
+            client.post('/submit', data=form(day, mood=rng.randrange(11)))
+        if action > 0.8 and mirror.entries:
+            client.post(f'/delete/{rng.choice(sorted(mirror.entries))}')
+        if step % 7 == 0:
+            mirror.pull()
+    mirror.pull()
+    assert mirror.pages > 10
+    assert mirror.matches_server()
+
+    with app.app_context():
+        superseded, _ = changelog.compact(retention_days=30)
+        db.session.commit()
+        assert superseded > 0
+        remaining = ChangeLog.query.count()
+    fresh = Mirror(client, limit=3)
+    fresh.pull()
+    assert fresh.matches_server()
+    assert fresh.pages <= remaining // 3 + 1
+
+
+def test_old_cursor_requires_full_resync(app, login):
+    client = login(app)
+    for day in range(4):
+        client.post('/submit', data=form(day))
+    stale = client.get('/api/sync?cursor=0').get_json()['cursor']
+    client.post('/submit', data=form(10))
+    with app.app_context():
+        # Age every row written so far past the retention period.
+        ChangeLog.query.update({'created_at': datetime.utcnow() - timedelta(days=100)})
+        db.session.commit()
+        client.post('/submit', data=form(11))
+        _, expired = changelog.compact(retention_days=90)
+        db.session.commit()
+        assert expired == 5
+        assert db.session.get(SyncState, 1).pruned_through == 5
+
+    assert client.get(f'/api/sync?cursor={stale}').status_code == 410
+    response = client.get('/api/sync?cursor=2')
+    assert response.status_code == 410
+    assert response.get_json()['full_resync'] is True
+    assert client.get('/api/sync?cursor=999').status_code == 410
+    assert client.get('/api/sync?cursor=5').get_json()['entries'][0]['date'] == '2024-01-12'
+
+    mirror = Mirror(client)
+    mirror.pull()
+    assert len(mirror.entries) == 6
+    assert mirror.matches_server()
+    assert client.get('/api/sync?limit=0').status_code == 400
+
+
+def test_data_from_before_the_change_log_is_backfilled(app, login):
+    with app.app_context():
+        # Written the way the app did before the change log existed.
+        db.session.add(MoodEntry(user_id=1, entry_date=START, mood_level=5, hours_slept=7, anxiety=3,
+                                 energy_level=6, irritability=2))
+        db.session.commit()
+        assert changelog.sync_state(1) == (0, 0)
+
+    restarted = create_app(dict(app.config, TESTING=True))
+    with restarted.app_context():
+        assert changelog.sync_state(1) == (1, 1)
+        assert changelog.sync_state(2) == (0, 0)  # bob has no data
+        assert changelog.backfill() == 0
+    client = login(restarted)
+    assert client.get('/api/sync?cursor=0').status_code == 410
+    mirror = Mirror(client)
+    mirror.pull()
+    assert len(mirror.entries) == 1 and mirror.cursor == 1
@@ -2,139 +2,361 @@
 """
 Log Viewer Utility for Mood Tracker
 This script helps you view and analyze the application logs.
+
+Run without arguments for the interactive menu, or script it, e.g.:
+    python view_logs.py tail -n 100 --follow
+    python view_logs.py search "Login failed"
+    python view_logs.py user alice --no-rotated
 """
 
 import os
 import sys
+import json
+import argparse
 from datetime import datetime, timedelta
 import re
 
-def show_log_stats():
-    """Show statistics about the log files"""
+import log_reader
+import log_stats
+from log_index import LogIndex
+
+MAIN_LOG = 'logs/mood_tracker.log'
+ERROR_LOG = 'logs/errors.log'
+
+# "2025-06-20 20:27:31,552 - mood_tracker - INFO - message"
+LOG_LINE_PATTERN = re.compile(
+    r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - (\S+) - ([A-Z]+) - (.*)$'
+)
+
+def parse_log_line(line):
+    """Split a log line into its fields, decoding structured request records."""
+    match = LOG_LINE_PATTERN.match(line.rstrip('\n'))
+    if not match:
+        return None
+    timestamp, logger_name, level, message = match.groups()
+    parsed = {
+        'timestamp': timestamp,
+        'logger': logger_name,
+        'level': level,
+        'message': message,
+        'request': None
+    }
+    if message.startswith('{'):
+        try:
+            record = json.loads(message)
+        except ValueError:
+            record = None
+        if isinstance(record, dict) and record.get('type') == 'request':
+            parsed['request'] = record
+    return parsed
+
+def format_request(record):
+    """Format a structured request record as a single readable line."""
+    size = record.get('response_bytes')
+    return (f"{record.get('method')} {record.get('path')} -> {record.get('status')} "
+            f"in {record.get('duration_ms')}ms "
+            f"(db {record.get('db_time_ms')}ms, {record.get('sql_count')} queries, "
+            f"{size if size is not None else '?'} bytes) "
+            f"user_id={record.get('user_id')} request_id={record.get('request_id')}")
+
+def format_log_line(line):
+    """Render request records readably; other lines are returned unchanged."""
+    parsed = parse_log_line(line)
+    if parsed and parsed['request']:
+        return f"{parsed['timestamp']} - REQUEST - {format_request(parsed['request'])}"
+    return line.rstrip()
+
+def iter_requests(log_file=MAIN_LOG, include_rotated=True):
+    """Yield the structured request records from a log and its rotated files."""
+    for line in log_reader.iter_lines(log_file, include_rotated):
+        if ' - mood_tracker.requests - ' not in line:
+            continue
+        parsed = parse_log_line(line)
+        if parsed and parsed['request']:
+            yield parsed['request']
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0
+    index = max(0, min(len(values) - 1, int(round(pct / 100 * len(values))) - 1))
+    return values[index]
+
+def show_log_stats(include_rotated=True, report_path=None):
+    """Show statistics about the log files (one parallel pass over each rotation set)"""
     print("=== Log File Statistics ===\n")
     
     log_files = [
-        ('logs/mood_tracker.log', 'Main Application Log'),
-        ('logs/errors.log', 'Error Log')
+        (MAIN_LOG, 'Main Application Log'),
+        (ERROR_LOG, 'Error Log')
     ]
     
+    reports = {}
     for log_file, description in log_files:
-        if os.path.exists(log_file):
-            size = os.path.getsize(log_file)
-            size_mb = size / (1024 * 1024)
-            print(f"{description}:")
-            print(f"  File: {log_file}")
-            print(f"  Size: {size_mb:.2f} MB")
-            
-            # Count lines
-            with open(log_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                print(f"  Lines: {len(lines)}")
-                
-                # Count by log level
-                levels = {'INFO': 0, 'WARNING': 0, 'ERROR': 0, 'DEBUG': 0}
-                for line in lines:
-                    for level in levels:
-                        if f' - {level} - ' in line:
-                            levels[level] += 1
-                            break
-                
-                print(f"  INFO: {levels['INFO']}")
-                print(f"  WARNING: {levels['WARNING']}")
-                print(f"  ERROR: {levels['ERROR']}")
-                print(f"  DEBUG: {levels['DEBUG']}")
-        else:
+        if not log_reader.rotation_set(log_file):
             print(f"{description}: File not found")
+            print()
+            continue
+
+        report = log_stats.compute_stats(log_file, include_rotated)
+        reports[log_file] = report
+        size_mb = report['bytes'] / (1024 * 1024)
+        print(f"{description}:")
+        print(f"  Files: {', '.join(f['path'] for f in report['files'])}")
+        print(f"  Size: {size_mb:.2f} MB (processed in {report['elapsed_seconds']}s)")
+        print(f"  Lines: {report['lines']}")
+        for level in ('INFO', 'WARNING', 'ERROR', 'DEBUG'):
+            print(f"  {level}: {report['levels'].get(level, 0)}")
+
+        logins = report['logins']
+        if logins['attempts']:
+            print(f"  Logins: {logins['attempts']} attempts, {logins['failures']} failed "
+                  f"({logins['failure_rate'] * 100:.1f}%)")
+        if report['requests_per_hour']:
+            busiest = max(report['requests_per_hour'].items(), key=lambda item: item[1])
+            print(f"  Requests: {sum(report['requests_per_hour'].values())} "
+                  f"(busiest hour {busiest[0]}:00 with {busiest[1]})")
+        if report['top_users']:
+            top = ', '.join(f"{u['user']} ({u['lines']})" for u in report['top_users'][:5])
+            print(f"  Most active users: {top}")
+        if report['error_signatures']:
+            print("  Top warnings/errors:")
+            for signature in report['error_signatures'][:5]:
+                print(f"    {signature['count']:>6}  {signature['level']}: {signature['template']}")
+
+        latency = report['request_latency_ms']
+        if latency:
+            print(f"  Latency p50: {latency['p50']}ms, p95: {latency['p95']}ms, "
+                  f"p99: {latency['p99']}ms, max: {latency['max']}ms")
         print()
 
-def view_recent_logs(log_file='logs/mood_tracker.log', lines=50):
+    if report_path:
+        log_stats.write_report(reports, report_path)
+        print(f"JSON report written to {report_path}")
+
+def view_recent_logs(log_file=MAIN_LOG, lines=50, include_rotated=True):
     """View recent log entries"""
-    if not os.path.exists(log_file):
+    if not log_reader.rotation_set(log_file):
         print(f"Log file not found: {log_file}")
         return
     
     print(f"=== Recent Log Entries ({lines} lines) ===\n")
     
-    with open(log_file, 'r', encoding='utf-8') as f:
-        all_lines = f.readlines()
-        recent_lines = all_lines[-lines:] if len(all_lines) > lines else all_lines
-        
-        for line in recent_lines:
-            print(line.rstrip())
+    for line in log_reader.tail(log_file, lines, include_rotated):
+        print(format_log_line(line))
 
-def view_errors(lines=20):
+def view_errors(lines=20, include_rotated=True):
     """View recent error log entries"""
-    error_file = 'logs/errors.log'
-    if not os.path.exists(error_file):
+    if not log_reader.rotation_set(ERROR_LOG):
         print("Error log file not found")
         return
     
     print(f"=== Recent Errors ({lines} lines) ===\n")
     
-    with open(error_file, 'r', encoding='utf-8') as f:
-        all_lines = f.readlines()
-        recent_lines = all_lines[-lines:] if len(all_lines) > lines else all_lines
-        
-        for line in recent_lines:
-            print(line.rstrip())
+    for line in log_reader.tail(ERROR_LOG, lines, include_rotated):
+        print(line.rstrip())
+
+def follow_logs(log_file=MAIN_LOG, lines=10):
+    """Print the last lines of a log, then keep printing new ones (Ctrl+C to stop)"""
+    print(f"=== Following {log_file} (Ctrl+C to stop) ===\n")
+    for line in log_reader.tail(log_file, lines, include_rotated=False):
+        print(format_log_line(line))
+    try:
+        for line in log_reader.follow(log_file):
+            print(format_log_line(line), flush=True)
+    except KeyboardInterrupt:
+        print()
 
-def search_logs(search_term, log_file='logs/mood_tracker.log'):
+def _matching_lines(predicate, log_file, include_rotated):
+    """Yield (file, line number, line) for matching lines across the rotation set."""
+    files = log_reader.rotation_set(log_file) if include_rotated else [log_file]
+    for path in files:
+        if not os.path.exists(path):
+            continue
+        with log_reader.open_log(path) as f:
+            for line_num, line in enumerate(f, 1):
+                if predicate(line):
+                    yield path, line_num, line
+
+def search_logs(search_term, log_file=MAIN_LOG, include_rotated=True):
     """Search logs for specific terms"""
-    if not os.path.exists(log_file):
+    if not log_reader.rotation_set(log_file):
         print(f"Log file not found: {log_file}")
         return
     
     print(f"=== Searching for '{search_term}' ===\n")
     
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f, 1):
-            if search_term.lower() in line.lower():
-                print(f"Line {line_num}: {line.rstrip()}")
-
-def view_user_activity(username, log_file='logs/mood_tracker.log'):
-    """View activity for a specific user"""
-    if not os.path.exists(log_file):
+    term = search_term.lower()
+    for path, line_num, line in _matching_lines(lambda l: term in l.lower(), log_file, include_rotated):
+        print(f"{os.path.basename(path)} line {line_num}: {format_log_line(line)}")
+
+def view_user_activity(username, log_file=MAIN_LOG, include_rotated=True, user_id=None):
+    """View activity for a specific user (uses the log index)"""
+    if not log_reader.rotation_set(log_file):
         print(f"Log file not found: {log_file}")
         return
     
     print(f"=== User Activity for '{username}' ===\n")
     
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if username.lower() in line.lower():
-                print(line.rstrip())
+    with LogIndex(log_file) as index:
+        index.update()
+        for line in index.user_lines(username, user_id, include_rotated):
+            print(format_log_line(line))
 
-def view_today_logs(log_file='logs/mood_tracker.log'):
+def view_today_logs(log_file=MAIN_LOG, include_rotated=True):
     """View logs from today"""
-    if not os.path.exists(log_file):
+    today = datetime.now()
+    tomorrow = today + timedelta(days=1)
+    print(f"=== Today's Logs ({today.strftime('%Y-%m-%d')}) ===\n")
+    view_time_range(today.strftime('%Y-%m-%d'), tomorrow.strftime('%Y-%m-%d'),
+                    log_file, include_rotated, show_header=False)
+
+def view_time_range(start, end, log_file=MAIN_LOG, include_rotated=True, show_header=True):
+    """View log lines with start <= timestamp < end (uses the log index)"""
+    if not log_reader.rotation_set(log_file):
+        print(f"Log file not found: {log_file}")
+        return
+
+    if show_header:
+        print(f"=== Logs from {start} to {end} ===\n")
+
+    with LogIndex(log_file) as index:
+        index.update()
+        for line in index.time_range(start, end, include_rotated):
+            print(format_log_line(line))
+
+def update_log_index(log_file=MAIN_LOG, rebuild=False):
+    """Bring the log index up to date (or rebuild it) and show its size"""
+    if not log_reader.rotation_set(log_file):
         print(f"Log file not found: {log_file}")
         return
-    
-    today = datetime.now().strftime('%Y-%m-%d')
-    print(f"=== Today's Logs ({today}) ===\n")
-    
-    with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if today in line:
-                print(line.rstrip())
 
-def clear_logs():
-    """Clear log files (with confirmation)"""
+    with LogIndex(log_file) as index:
+        indexed = index.rebuild() if rebuild else index.update()
+        stats = index.stats()
+    print(f"Indexed {indexed / (1024 * 1024):.2f} MB of new log data")
+    print(f"Index: {stats['files']} files, {stats['hours']} hour buckets, "
+          f"{stats['user_blocks']} user/block entries, {stats['size_bytes'] / 1024:.0f} KB")
+
+def view_slow_requests(limit=20, log_file=MAIN_LOG, include_rotated=True):
+    """View the slowest logged requests and per-route latency"""
+    if not log_reader.rotation_set(log_file):
+        print(f"Log file not found: {log_file}")
+        return
+
+    print(f"=== Slowest Requests (top {limit}) ===\n")
+
+    requests = list(iter_requests(log_file, include_rotated))
+    if not requests:
+        print("No structured request records found")
+        return
+
+    for record in sorted(requests, key=lambda r: r.get('duration_ms', 0), reverse=True)[:limit]:
+        print(f"{record.get('ts')} {format_request(record)}")
+
+    print("\n=== Latency by Route ===\n")
+    by_route = {}
+    for record in requests:
+        by_route.setdefault(record.get('endpoint') or record.get('path'), []).append(record)
+    for route, records in sorted(by_route.items(), key=lambda item: str(item[0])):
+        durations = sorted(r.get('duration_ms', 0) for r in records)
+        avg_sql = sum(r.get('sql_count', 0) for r in records) / len(records)
+        print(f"{route}: {len(records)} requests, p50 {percentile(durations, 50)}ms, "
+              f"p95 {percentile(durations, 95)}ms, avg {avg_sql:.1f} queries")
+
+def clear_logs(assume_yes=False):
+    """Clear log files, including rotated ones (with confirmation)"""
     print("=== Clear Log Files ===\n")
     print("WARNING: This will delete all log files!")
-    confirm = input("Are you sure you want to clear all logs? (yes/no): ").lower()
+    if assume_yes:
+        confirm = 'yes'
+    else:
+        confirm = input("Are you sure you want to clear all logs? (yes/no): ").lower()
     
     if confirm == 'yes':
-        log_files = ['logs/mood_tracker.log', 'logs/errors.log']
-        for log_file in log_files:
-            if os.path.exists(log_file):
-                os.remove(log_file)
-                print(f"Deleted: {log_file}")
+        for log_file in (MAIN_LOG, ERROR_LOG):
+            for path in log_reader.rotation_set(log_file):
+                os.remove(path)
+                print(f"Deleted: {path}")
         print("All logs cleared!")
     else:
         print("Operation cancelled.")
 
+def build_parser():
+    """Command line interface for non-interactive use"""
+    parser = argparse.ArgumentParser(description="View and analyze the Mood Tracker logs. "
+                                                 "Run without a command for the interactive menu.")
+    parser.add_argument('--no-rotated', action='store_true',
+                        help="only read the active log file, not its rotated backups")
+    commands = parser.add_subparsers(dest='command')
+
+    stats_parser = commands.add_parser('stats', help="show log file statistics")
+    stats_parser.add_argument('--json', dest='report_path', help="also write the full report to this file")
+
+    tail_parser = commands.add_parser('tail', help="show the most recent log lines")
+    tail_parser.add_argument('-n', '--lines', type=int, default=50)
+    tail_parser.add_argument('-f', '--follow', action='store_true', help="keep printing new lines")
+    tail_parser.add_argument('--file', default=MAIN_LOG)
+
+    errors_parser = commands.add_parser('errors', help="show the most recent errors")
+    errors_parser.add_argument('-n', '--lines', type=int, default=20)
+
+    search_parser = commands.add_parser('search', help="search the logs for a term")
+    search_parser.add_argument('term')
+
+    user_parser = commands.add_parser('user', help="show activity for a user")
+    user_parser.add_argument('username')
+    user_parser.add_argument('--id', type=int, dest='user_id', help="also match this user_id")
+
+    commands.add_parser('today', help="show today's log lines")
+
+    range_parser = commands.add_parser('range', help="show log lines in a time range")
+    range_parser.add_argument('start', help="e.g. '2025-06-20' or '2025-06-20 14:00'")
+    range_parser.add_argument('end', help="exclusive, same format as start")
+
+    index_parser = commands.add_parser('index', help="update the log index")
+    index_parser.add_argument('--rebuild', action='store_true', help="re-index everything")
+
+    requests_parser = commands.add_parser('requests', help="show the slowest requests")
+    requests_parser.add_argument('-n', '--limit', type=int, default=20)
+
+    clear_parser = commands.add_parser('clear', help="delete all log files")
+    clear_parser.add_argument('--yes', action='store_true', help="do not ask for confirmation")
+    return parser
+
+def run_command(args):
+    """Run a single command given on the command line"""
+    include_rotated = not args.no_rotated
+    if args.command == 'stats':
+        show_log_stats(include_rotated=include_rotated, report_path=args.report_path)
+    elif args.command == 'tail':
+        if args.follow:
+            follow_logs(args.file, lines=args.lines)
+        else:
+            view_recent_logs(args.file, lines=args.lines, include_rotated=include_rotated)
+    elif args.command == 'errors':
+        view_errors(lines=args.lines, include_rotated=include_rotated)
+    elif args.command == 'search':
+        search_logs(args.term, include_rotated=include_rotated)
+    elif args.command == 'user':
+        view_user_activity(args.username, include_rotated=include_rotated, user_id=args.user_id)
+    elif args.command == 'today':
+        view_today_logs(include_rotated=include_rotated)
+    elif args.command == 'range':
+        view_time_range(args.start, args.end, include_rotated=include_rotated)
+    elif args.command == 'index':
+        update_log_index(rebuild=args.rebuild)
+    elif args.command == 'requests':
+        view_slow_requests(limit=args.limit, include_rotated=include_rotated)
+    elif args.command == 'clear':
+        clear_logs(assume_yes=args.yes)
+
 def main():
+    args = build_parser().parse_args()
+    if args.command:
+        run_command(args)
+        return
+
     print("=== Mood Tracker Log Viewer ===\n")
     
     while True:
@@ -144,10 +366,11 @@ def main():
         print("4. Search logs")
         print("5. View user activity")
         print("6. View today's logs")
-        print("7. Clear all logs")
-        print("8. Exit")
+        print("7. View slowest requests")
+        print("8. Clear all logs")
+        print("9. Exit")
         
-        choice = input("\nEnter your choice (1-8): ").strip()
+        choice = input("\nEnter your choice (1-9): ").strip()
         
         if choice == '1':
             show_log_stats()
@@ -174,8 +397,12 @@ def main():
         elif choice == '6':
             view_today_logs()
         elif choice == '7':
-            clear_logs()
+            lines = input("Number of requests to show (default 20): ").strip()
+            lines = int(lines) if lines.isdigit() else 20
+            view_slow_requests(limit=lines)
         elif choice == '8':
+            clear_logs()
+        elif choice == '9':
             print("Goodbye!")
             break
         else:
@@ -0,0 +1,16 @@
+"""
+WSGI entry point for Mood Tracker.
+
+    gunicorn --preload --workers 4 --threads 8 wsgi:app
+
+With --preload the app is built once in the master process. Each forked worker
+drops the inherited database connection pool and restarts its own log writer
+and metrics flusher (see the register_at_fork hooks in app.py,
+logging_setup.py and metrics.py), so no SQLite connection or log handler is
+shared between workers. Workers never rotate the log files (see LOG_ROTATION
+in config.py).
+"""
+
+from app import create_app
+
+app = create_app()